@@ -14,15 +14,18 @@ if os.path.exists(env_path):
 else:
     load_dotenv()
 
-from flask import Flask, send_from_directory, request, jsonify, redirect, g, abort
+# Logging goes through a queue to a writer thread (see utils/logging_setup.py)
+import logging
+from utils.logging_setup import setup_logging
+setup_logging()
+logger = logging.getLogger(__name__)
+
+from flask import Flask, request, jsonify, redirect, current_app
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, decode_token
 from limiter_instance import limiter
 from urllib.parse import unquote
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-from config import get_db_conn
-
 
 from routes.auth_routes import auth_routes
 from routes.bill_routes import bill_routes
@@ -35,54 +38,57 @@ from payment_webhook import payment_webhook  # Register payment webhook blueprin
 from payment_link import payment_link  # Register payment link blueprint
 from bank_routes import bank_routes
 from utils.ingest_emails import bp_ingest
+from utils.static_assets import get_static_manifest, serve_asset
+from utils.metrics import init_metrics
+from utils.db_instrumentation import init_query_tracking
+from utils.session_registry import CachingJWTManager, init_session_registry
+from utils.json_response import init_json
+from utils.compression import init_compression
+from utils.services import services
 
 from datetime import datetime
-import pytz
 from datetime import timedelta
 
-app = Flask(__name__, static_folder='build', static_url_path='/')
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-
 # Allowed origins for CORS and CSP
 allowed_origins = []
 if os.getenv('ALLOWED_ORIGINS'):
     prod_domains = [origin.strip() for origin in os.getenv('ALLOWED_ORIGINS').split(',') if origin.strip()]
     allowed_origins.extend(prod_domains)
 
-CORS(app, origins=allowed_origins, supports_credentials=True)
-
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)  # 1 hour access token
-app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=7)  # 7 days refresh token
-
-app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'your-secret-key')
-app.config['JWT_TOKEN_LOCATION'] = ['cookies']
-app.config['JWT_ACCESS_COOKIE_PATH'] = '/'
-app.config['JWT_REFRESH_COOKIE_PATH'] = '/api/refresh'
-app.config['JWT_COOKIE_SECURE'] = True
-app.config['JWT_COOKIE_SAMESITE'] = 'None'  # Allow cross-site cookies
-app.config['JWT_COOKIE_DOMAIN'] = 'iqstrade.onrender.com'  # Set to exact domain for browser compatibility
-app.config['JWT_COOKIE_HTTPONLY'] = True
-app.config['JWT_COOKIE_CSRF_PROTECT'] = True  # Enable CSRF protection for production
-app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB
-
-jwt = JWTManager(app)
-limiter.init_app(app)
-
-# Register all route blueprints
-
-app.register_blueprint(auth_routes, url_prefix='/api')
-app.register_blueprint(bill_routes, url_prefix='/api')
-app.register_blueprint(stats_routes, url_prefix='/api')
-app.register_blueprint(misc_routes, url_prefix='/api')
-app.register_blueprint(admin_routes)
-app.register_blueprint(management_routes, url_prefix='/api')
-app.register_blueprint(payment_webhook, url_prefix='/api/webhook')
-app.register_blueprint(payment_link, url_prefix='/api')
-app.register_blueprint(bank_routes)
-app.register_blueprint(bp_ingest)
-app.register_blueprint(email_routes, url_prefix='/admin/email')
-
-print('[DEBUG] Migration: Removed UPLOAD_FOLDER, switching to Cloudinary for all file storage')
+
+def configure_app(app):
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)  # 1 hour access token
+    app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=7)  # 7 days refresh token
+
+    app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'your-secret-key')
+    app.config['JWT_TOKEN_LOCATION'] = ['cookies']
+    app.config['JWT_ACCESS_COOKIE_PATH'] = '/'
+    app.config['JWT_REFRESH_COOKIE_PATH'] = '/api/refresh'
+    app.config['JWT_COOKIE_SECURE'] = True
+    app.config['JWT_COOKIE_SAMESITE'] = 'None'  # Allow cross-site cookies
+    # Exact domain for browser compatibility; JWT_COOKIE_DOMAIN= (empty) makes them host-only (local runs, load tests)
+    app.config['JWT_COOKIE_DOMAIN'] = os.getenv('JWT_COOKIE_DOMAIN', 'iqstrade.onrender.com') or None
+    app.config['JWT_COOKIE_HTTPONLY'] = True
+    app.config['JWT_COOKIE_CSRF_PROTECT'] = True  # Enable CSRF protection for production
+    app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB
+
+    # RATELIMIT_ENABLED=0 turns Flask-Limiter off (load tests drive every virtual user from 127.0.0.1)
+    app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', '1') == '1'
+
+
+def register_blueprints(app):
+    app.register_blueprint(auth_routes, url_prefix='/api')
+    app.register_blueprint(bill_routes, url_prefix='/api')
+    app.register_blueprint(stats_routes, url_prefix='/api')
+    app.register_blueprint(misc_routes, url_prefix='/api')
+    app.register_blueprint(admin_routes)
+    app.register_blueprint(management_routes, url_prefix='/api')
+    app.register_blueprint(payment_webhook, url_prefix='/api/webhook')
+    app.register_blueprint(payment_link, url_prefix='/api')
+    app.register_blueprint(bank_routes)
+    app.register_blueprint(bp_ingest)
+    app.register_blueprint(email_routes, url_prefix='/admin/email')
+
 
 def set_csp_header(response):
     csp = (
@@ -99,56 +105,6 @@ def set_csp_header(response):
     return response
     # [DEBUG] Migration: /uploads/ route removed. All files now served via Cloudinary URLs.
 
-# --- SESSION MANAGEMENT ---
-active_sessions = set()
-MAX_CONCURRENT_USERS = 100
-
-@app.before_request
-def limit_concurrent_users():
-    # Only enforce for authenticated endpoints
-    if request.endpoint and request.endpoint not in ['login', 'register', 'static', 'ping', 'health_check']:
-        token = request.cookies.get('access_token_cookie')
-        if token:
-            try:
-                identity = decode_token(token)['sub']
-                if identity not in active_sessions:
-                    if len(active_sessions) >= MAX_CONCURRENT_USERS:
-                        abort(429, description='Maximum concurrent users reached. Please try again later.')
-                    active_sessions.add(identity)
-                g.current_identity = identity
-            except Exception:
-                pass
-
-@app.after_request
-def cleanup_sessions(response):
-    # Remove session if user logs out or token is invalid
-    if request.endpoint == 'logout':
-        token = request.cookies.get('access_token_cookie')
-        if token:
-            try:
-                identity = decode_token(token)['sub']
-                if identity in active_sessions:
-                    active_sessions.remove(identity)
-            except Exception:
-                pass
-    return response
-
-# --- ENHANCED AUDIT LOGGING ---
-def log_sensitive_operation(user_id, operation, details):
-    try:
-        conn = get_db_conn()
-        cur = conn.cursor()
-        hk_now = datetime.now(pytz.timezone('Asia/Hong_Kong'))
-        cur.execute(
-            'INSERT INTO audit_logs (user_id, operation, details, timestamp, ip_address) VALUES (%s, %s, %s, %s, %s)',
-            (user_id, operation, details, hk_now, request.remote_addr)
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
-    except Exception as e:
-        pass
-
 # --- FILE UPLOAD VIRUS SCAN (stub) ---
 def scan_file_for_viruses(file_path):
     # Placeholder for virus scan integration (e.g., ClamAV)
@@ -175,117 +131,56 @@ def is_valid_phone(phone):
 # if not is_valid_phone(customer_phone):
 #     return jsonify({'error': 'Invalid phone number'}), 400
 
-# --- ENFORCE HTTPS IN PRODUCTION ---
-@app.before_request
-def enforce_https():
-    if not app.debug and not request.is_secure and 'render' in request.host:
-        url = request.url.replace("http://", "https://", 1)
-        return redirect(url, code=301)
-
-@app.errorhandler(413)
-def request_entity_too_large(error):
-    return jsonify({'error': 'File too large. Maximum size is 10MB.'}), 413
-
-@app.errorhandler(404)
-def not_found(error):
-    print(f"[DEBUG] 404 error handler called for: {request.path}")
-    print(f"[DEBUG] Request method: {request.method}")
-    
-    # If it's an API route, return JSON 404
-    if request.path.startswith('/api/') or request.path.startswith('/admin/'):
-        return jsonify({'error': 'API endpoint not found'}), 404
-    
-    # Handle static file requests that might have wrong paths
-    if request.path.startswith('/reset-password/static/') or request.path.startswith('/static/'):
-        # Extract the actual static file path
-        static_path = request.path.replace('/reset-password/static/', '/static/')
-        if static_path.startswith('/static/'):
-            build_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build')
-            static_file = static_path.replace('/static/', '')
-            static_file_path = os.path.join(build_dir, 'static', static_file)
-            
-            if os.path.exists(static_file_path):
-                print(f"[DEBUG] Serving static file: {static_file_path}")
-                return send_from_directory(os.path.join(build_dir, 'static'), static_file)
-            else:
-                print(f"[ERROR] Static file not found: {static_file_path}")
-    
-    # For all other routes, try to serve index.html
-    build_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build')
-    index_path = os.path.join(build_dir, 'index.html')
-    
-    if os.path.exists(index_path):
-        print(f"[DEBUG] Serving index.html for 404 path: {request.path}")
-        return send_from_directory(build_dir, 'index.html')
-    else:
-        print(f"[ERROR] index.html not found at: {index_path}")
-        return jsonify({'error': 'Frontend not found'}), 404
-
-# Test route to verify Flask is working
-@app.route('/test')
-def test_route():
-    return jsonify({'message': 'Flask app is working', 'timestamp': datetime.now().isoformat()})
-
-@app.route('/static/<path:filename>')
-def serve_static(filename):
-    build_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build')
-    static_path = os.path.join(build_dir, 'static', filename)
-    print(f"[DEBUG] Serving static file: {static_path}")
-    if not os.path.exists(static_path):
-        print(f"[ERROR] File not found: {static_path}")
-    return send_from_directory(os.path.join(build_dir, 'static'), filename)
-
-
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve_react(path):
-    print(f"[DEBUG] serve_react called with path: '{path}'")
-    build_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build')
-    print(f"[DEBUG] Build directory: {build_dir}")
-    
-    # Check if build directory exists
-    if not os.path.exists(build_dir):
-        print(f"[ERROR] Build directory not found: {build_dir}")
-        return jsonify({'error': 'Frontend not built', 'build_dir': build_dir}), 500
-    
-    # Check if index.html exists
-    index_path = os.path.join(build_dir, 'index.html')
-    if not os.path.exists(index_path):
-        print(f"[ERROR] index.html not found: {index_path}")
-        return jsonify({'error': 'Frontend index.html not found', 'index_path': index_path}), 500
-
-    # For API routes, return 404 instead of serving index.html
-    if path.startswith('api/') or path.startswith('admin/'):
-        print(f"[DEBUG] API route detected, returning 404 for: {path}")
-        return jsonify({'error': 'API endpoint not found'}), 404
-    
-    # Handle static file requests that might have wrong paths
-    if path.startswith('reset-password/static/') or path.startswith('static/'):
-        # Extract the actual static file path
-        static_path = path.replace('reset-password/static/', 'static/')
-        if static_path.startswith('static/'):
-            static_file = static_path.replace('static/', '')
-            static_file_path = os.path.join(build_dir, 'static', static_file)
-            
-            if os.path.exists(static_file_path):
-                print(f"[DEBUG] Serving static file from catch-all: {static_file_path}")
-                return send_from_directory(os.path.join(build_dir, 'static'), static_file)
-            else:
-                print(f"[ERROR] Static file not found in catch-all: {static_file_path}")
-    
-    # For static files, serve them directly
-    full_path = os.path.join(build_dir, path)
-    if path != "" and os.path.exists(full_path):
-        print(f"[DEBUG] Serving static file: {full_path}")
-        return send_from_directory(build_dir, path)
-    
+def serve_frontend(path):
+    """Serve a build/ file or, for client-side routes, index.html - all from the in-memory manifest."""
+    static_manifest = current_app.extensions['static_manifest']
+    asset = static_manifest.resolve(path)
+    if asset is not None:
+        return serve_asset(asset)
+    # A missing bundle must not get index.html back (the browser would try to run HTML as JS)
+    if '/static/' in '/' + path.lstrip('/'):
+        return jsonify({'error': 'Static file not found'}), 404
+    if static_manifest.index is None:
+        return jsonify({'error': 'Frontend not built', 'build_dir': static_manifest.build_dir}), 500
     # For all other routes (including /reset-password/:token), serve index.html
-    print(f"[DEBUG] Serving index.html for path: {path}")
-    try:
-        return send_from_directory(build_dir, 'index.html')
-    except Exception as e:
-        print(f"[ERROR] Failed to serve index.html: {e}")
-        return jsonify({'error': f'Failed to serve index.html: {str(e)}'}), 500
+    return serve_asset(static_manifest.index)
+
+
+def register_app_routes(app):
+    # --- ENFORCE HTTPS IN PRODUCTION ---
+    @app.before_request
+    def enforce_https():
+        if not app.debug and not request.is_secure and 'render' in request.host:
+            url = request.url.replace("http://", "https://", 1)
+            return redirect(url, code=301)
+
+    @app.errorhandler(413)
+    def request_entity_too_large(error):
+        return jsonify({'error': 'File too large. Maximum size is 10MB.'}), 413
+
+    @app.errorhandler(404)
+    def not_found(error):
+        # If it's an API route, return JSON 404
+        if request.path.startswith('/api/') or request.path.startswith('/admin/'):
+            return jsonify({'error': 'API endpoint not found'}), 404
+        return serve_frontend(request.path)
+
+    # Test route to verify Flask is working
+    @app.route('/test')
+    def test_route():
+        return jsonify({'message': 'Flask app is working', 'timestamp': datetime.now().isoformat()})
+
+    @app.route('/static/<path:filename>')
+    def serve_static(filename):
+        return serve_frontend('static/' + filename)
+
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def serve_react(path):
+        # For API routes, return 404 instead of serving index.html
+        if path.startswith('api/') or path.startswith('admin/'):
+            return jsonify({'error': 'API endpoint not found'}), 404
+        return serve_frontend(path)
 
 
 # @app.route('/', defaults={'path': ''})
@@ -296,22 +191,71 @@ def serve_react(path):
 #     else:
 #         return send_from_directory('build', 'index.html')
 
-print(f"[DEBUG] FLASK_ENV: {os.getenv('FLASK_ENV')}")
-print(f"[DEBUG] ALLOWED_ORIGINS: {allowed_origins}")
-print(f"[DEBUG] JWT_COOKIE_DOMAIN: {app.config['JWT_COOKIE_DOMAIN']}")
-print(f"[DEBUG] JWT_COOKIE_SAMESITE: {app.config['JWT_COOKIE_SAMESITE']}")
-print(f"[DEBUG] JWT_COOKIE_SECURE: {app.config['JWT_COOKIE_SECURE']}")
-print(f"[DEBUG] JWT_COOKIE_HTTPONLY: {app.config['JWT_COOKIE_HTTPONLY']}")
-print(f"[DEBUG] JWT_COOKIE_CSRF_PROTECT: {app.config['JWT_COOKIE_CSRF_PROTECT']}")
-
-# Debug build directory
-build_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build')
-print(f"[DEBUG] Build directory path: {build_dir}")
-print(f"[DEBUG] Build directory exists: {os.path.exists(build_dir)}")
-if os.path.exists(build_dir):
-    print(f"[DEBUG] Build directory contents: {os.listdir(build_dir)}")
-    index_path = os.path.join(build_dir, 'index.html')
-    print(f"[DEBUG] index.html exists: {os.path.exists(index_path)}")
+
+# --- PER-WORKER INIT ---
+def register_worker_init(app, hook):
+    """Run hook() once in each server worker after it has forked and loaded the app (see gunicorn.conf.py)."""
+    app.extensions.setdefault('worker_init', []).append(hook)
+
+
+def run_worker_init(app):
+    for hook in app.extensions.get('worker_init', []):
+        try:
+            hook()
+        except Exception as e:
+            logger.error(f"Worker init hook {getattr(hook, '__name__', hook)} failed: {e}")
+
+
+def _warm_services():
+    # Build the SDK clients listed in WARM_SERVICES (e.g. "openai,vision,cloudinary") now instead of on the
+    # first request; each worker gets its own, since connection pools must not cross a fork
+    names = [name.strip() for name in os.getenv('WARM_SERVICES', '').split(',') if name.strip()]
+    services.reset()
+    for name in names:
+        services.get(name)
+
+
+def create_app():
+    """Build the Flask app. gunicorn (gunicorn.conf.py) and run_local.py use the module-level `app` below."""
+    # build/ is served by serve_static/serve_react from an in-memory manifest, not Flask's static route
+    app = Flask(__name__, static_folder=None)
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+    CORS(app, origins=allowed_origins, supports_credentials=True, expose_headers=['Server-Timing'])
+    configure_app(app)
+    # orjson provider and ?fields= projection (see utils/json_response.py)
+    init_json(app)
+
+    # Verifies each JWT once per request (shared by the session registry and @jwt_required)
+    CachingJWTManager(app)
+    # Registered first so the timing covers the other before_request hooks (including the limiter's)
+    init_metrics(app)
+    limiter.init_app(app)
+    init_query_tracking(app)
+    # MAX_CONCURRENT_USERS across all workers (see utils/session_registry.py)
+    init_session_registry(app)
+    # gzip/brotli for large API responses; after init_metrics so it is timed in Server-Timing
+    init_compression(app)
+
+    # Indexed once at startup (in the master under --preload); files are loaded on first request
+    app.extensions['static_manifest'] = get_static_manifest()
+
+    # Register all route blueprints
+    register_blueprints(app)
+    register_app_routes(app)
+    register_worker_init(app, _warm_services)
+
+    logger.debug(f"FLASK_ENV: {os.getenv('FLASK_ENV')}")
+    logger.debug(f"ALLOWED_ORIGINS: {allowed_origins}")
+    logger.debug(f"JWT_COOKIE_DOMAIN: {app.config['JWT_COOKIE_DOMAIN']}")
+    logger.debug(f"JWT_COOKIE_SAMESITE: {app.config['JWT_COOKIE_SAMESITE']}")
+    logger.debug(f"JWT_COOKIE_SECURE: {app.config['JWT_COOKIE_SECURE']}")
+    logger.debug(f"JWT_COOKIE_HTTPONLY: {app.config['JWT_COOKIE_HTTPONLY']}")
+    logger.debug(f"JWT_COOKIE_CSRF_PROTECT: {app.config['JWT_COOKIE_CSRF_PROTECT']}")
+    logger.debug(f"Static assets: {app.extensions['static_manifest'].stats()}")
+    return app
+
+
+app = create_app()
 
 if __name__ == '__main__':
     from config import CURRENT_ENV
@@ -320,11 +264,11 @@ if __name__ == '__main__':
         # Local development - use port 8000
         port = int(os.environ.get('PORT', 8000))
         debug = True
-        print(f"[LOCAL] Starting Flask app on port {port} with debug=True")
+        logger.info(f"[LOCAL] Starting Flask app on port {port} with debug=True")
     else:
         # Production - use environment port
         port = int(os.environ.get('PORT', 5000))
         debug = False
-        print(f"[PRODUCTION] Starting Flask app on port {port} with debug=False")
+        logger.info(f"[PRODUCTION] Starting Flask app on port {port} with debug=False")
     
     app.run(host='0.0.0.0', port=port, debug=debug)
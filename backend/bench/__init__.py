@@ -0,0 +1,4 @@
+"""
+Offline extraction benchmark for IQSTrade.
+See bench/README.md for how to generate the corpus, record cassettes and run the benchmark.
+"""
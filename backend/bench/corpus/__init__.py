@@ -0,0 +1 @@
+"""Golden corpus for the extraction benchmark (see manifest.json)."""
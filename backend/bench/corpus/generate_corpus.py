@@ -0,0 +1,177 @@
+"""
+Generates the benchmark corpus PDFs listed in manifest.json.
+
+The documents are synthetic: every name, number and address is fictitious, so the corpus
+can be shared freely. Layouts follow the label/value structure of real carrier BLs and AWBs.
+'scanned' documents are rendered to an image-only PDF (no text layer) so they exercise OCR.
+Output is byte-for-byte reproducible, so recorded cassettes stay valid after regeneration.
+
+Usage (from backend/):
+    python -m bench.corpus.generate_corpus [--force]
+"""
+
+import os
+import io
+import sys
+import json
+import argparse
+
+import fitz  # PyMuPDF
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+CORPUS_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_PATH = os.path.join(CORPUS_DIR, 'manifest.json')
+SCAN_DPI = 200
+
+TERMS = (
+    "TERMS AND CONDITIONS OF CARRIAGE. The Carrier shall not be liable for loss or damage "
+    "arising from insufficiency of packing, inherent vice, or act of God. Received in apparent "
+    "good order and condition unless otherwise stated. Particulars furnished by the shipper."
+)
+
+
+def bol_lines(fields):
+    lines = [
+        "BILL OF LADING",
+        f"B/L No.: {fields['bl_number']}",
+        "Shipper",
+        fields['shipper'],
+        "UNIT 8, 21/F, SAMPLE INDUSTRIAL BUILDING",
+        "Consignee",
+        fields['consignee'],
+        "100 EXAMPLE AVENUE",
+        "Notify Party",
+        "SAME AS CONSIGNEE",
+        "Vessel / Voyage",
+        fields['flight_or_vessel'],
+        "Port of Loading",
+        f"{fields['port_of_loading']}, CHINA",
+        "Port of Discharge",
+        f"{fields['port_of_discharge']}, DESTINATION",
+        "Container No. / Seal No.",
+    ]
+    lines += [c.strip() for c in fields['container_numbers'].split(',')]
+    lines += [
+        "Description of Goods",
+        fields['product_description'],
+        "GROSS WEIGHT 12,480.00 KGS  MEASUREMENT 58.200 CBM",
+        "FREIGHT COLLECT",
+    ]
+    return lines
+
+
+def awb_lines(fields):
+    return [
+        "AIR WAYBILL",
+        fields['bl_number'],
+        "Shipper's Name and Address",
+        fields['shipper'],
+        "18 SAMPLE ROAD, KOWLOON",
+        "Consignee's Name and Address",
+        fields['consignee'],
+        "5 EXAMPLE STREET",
+        "Issuing Carrier's Agent",
+        "SAMPLE FORWARDING LTD",
+        "Airport of Departure",
+        fields['port_of_loading'],
+        "Airport of Destination",
+        fields['port_of_discharge'],
+        "Requested Flight/Date",
+        f"{fields['flight_or_vessel']}101/15",
+        "No. of Pieces",
+        f"{fields['container_numbers']} PCS",
+        "Nature and Quantity of Goods",
+        fields['product_description'],
+    ]
+
+
+def draw_lines(c, lines):
+    width, height = A4
+    y = height - 60
+    for line in lines:
+        c.drawString(50, y, line)
+        y -= 18
+
+
+def draw_terms_page(c, page_no):
+    width, height = A4
+    text = c.beginText(50, height - 60)
+    text.textLine(f"PAGE {page_no}")
+    words = (TERMS + ' ') * 12
+    line = ''
+    for word in words.split():
+        if len(line) + len(word) > 90:
+            text.textLine(line)
+            line = ''
+        line += word + ' '
+    text.textLine(line)
+    c.drawText(text)
+
+
+def build_text_pdf(doc) -> bytes:
+    out = io.BytesIO()
+    # invariant=1 drops timestamps/ids so output is reproducible
+    c = canvas.Canvas(out, pagesize=A4, invariant=1)
+    c.setFont('Helvetica', 11)
+    lines = bol_lines(doc['expected']) if doc['kind'] == 'bol' else awb_lines(doc['expected'])
+    draw_lines(c, lines)
+    c.showPage()
+    for extra in range(doc.get('extra_pages', 0)):
+        c.setFont('Helvetica', 9)
+        draw_terms_page(c, extra + 2)
+        c.showPage()
+    c.save()
+    return out.getvalue()
+
+
+def rasterize_pdf(pdf_bytes: bytes) -> bytes:
+    """Image-only copy of a PDF, like a scanner would produce."""
+    src = fitz.open(stream=pdf_bytes, filetype='pdf')
+    dst = fitz.open()
+    for page in src:
+        pix = page.get_pixmap(dpi=SCAN_DPI, colorspace=fitz.csGRAY)
+        new_page = dst.new_page(width=page.rect.width, height=page.rect.height)
+        new_page.insert_image(new_page.rect, stream=pix.tobytes('png'))
+    dst.set_metadata({})
+    data = dst.tobytes(garbage=4, deflate=True, no_new_id=True)
+    src.close()
+    dst.close()
+    return data
+
+
+def load_manifest(path: str = MANIFEST_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def generate(force: bool = False, manifest_path: str = MANIFEST_PATH):
+    manifest = load_manifest(manifest_path)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    written = 0
+    for doc in manifest['documents']:
+        path = os.path.join(base_dir, doc['file'])
+        if os.path.exists(path) and not force:
+            continue
+        data = build_text_pdf(doc)
+        if doc.get('scanned'):
+            data = rasterize_pdf(data)
+        with open(path, 'wb') as f:
+            f.write(data)
+        written += 1
+        print(f"[corpus] wrote {doc['file']} ({len(data)} bytes)")
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the extraction benchmark corpus")
+    parser.add_argument('--force', action='store_true', help="regenerate files that already exist")
+    parser.add_argument('--manifest', default=MANIFEST_PATH)
+    args = parser.parse_args(argv)
+    written = generate(force=args.force, manifest_path=args.manifest)
+    print(f"[corpus] {written} file(s) written")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""
+Record/replay layer for the external services used by extraction:
+OpenAI chat completions, Google Vision and Cloudinary uploads.
+
+Modes:
+- live:   call the real services, record nothing
+- record: call the real services and save every response to the cassette files
+- replay: never touch the network; serve saved responses and fail on a miss
+
+Requests are keyed by a hash of their content, so a replayed run is deterministic
+as long as the pipeline sends the same bytes (same PDF, same render settings, same prompt).
+"""
+
+import os
+import json
+import hashlib
+import threading
+import logging
+from contextlib import ExitStack, contextmanager
+from types import SimpleNamespace
+
+from utils.services import services
+
+logger = logging.getLogger(__name__)
+
+MODES = ('live', 'record', 'replay')
+DEFAULT_CASSETTE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cassettes')
+
+
+class CassetteMiss(Exception):
+    """Raised in replay mode when a request has no recorded response."""
+
+
+class Cassette:
+    """One JSON file of {request_hash: response} for one service."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        else:
+            self._entries = {}
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value):
+        with self._lock:
+            self._entries[key] = value
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, indent=1, sort_keys=True, default=str)
+            self._dirty = False
+
+
+def request_key(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray)):
+            digest.update(part)
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+def _namespace(value):
+    """Recursive attribute access for replayed OpenAI responses when the SDK types are unavailable."""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: _namespace(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_namespace(v) for v in value]
+    return value
+
+
+# --- OpenAI ---------------------------------------------------------------
+
+class _ReplayCompletions:
+    def __init__(self, recorder):
+        self._recorder = recorder
+
+    def create(self, **kwargs):
+        return self._recorder.openai_create(**kwargs)
+
+
+class _ReplayChat:
+    def __init__(self, recorder):
+        self.completions = _ReplayCompletions(recorder)
+
+
+class _ReplayOpenAIClient:
+    """Stands in for openai.OpenAI (only chat.completions.create)."""
+
+    def __init__(self, recorder):
+        self.chat = _ReplayChat(recorder)
+
+
+class _ReplayCloudinaryUploader:
+    """Stands in for cloudinary.uploader (only upload)."""
+
+    def __init__(self, recorder):
+        self.upload = recorder.cloudinary_upload
+
+
+# --- Google Vision ----------------------------------------------------------
+
+class _RecordingVisionClient:
+    """Stands in for vision.ImageAnnotatorClient (only the batch methods extraction uses)."""
+
+    def __init__(self, recorder):
+        self._recorder = recorder
+
+    def _real_client(self):
+        return self._recorder.real('vision')
+
+    def batch_annotate_images(self, requests, **kwargs):
+        from google.cloud import vision
+        return self._recorder.vision_call(
+            'batch_annotate_images', requests, vision.AnnotateImageRequest,
+            vision.BatchAnnotateImagesResponse,
+            lambda: self._real_client().batch_annotate_images(requests=requests, **kwargs)
+        )
+
+    def batch_annotate_files(self, requests, **kwargs):
+        from google.cloud import vision
+        return self._recorder.vision_call(
+            'batch_annotate_files', requests, vision.AnnotateFileRequest,
+            vision.BatchAnnotateFilesResponse,
+            lambda: self._real_client().batch_annotate_files(requests=requests, **kwargs)
+        )
+
+
+class Recorder:
+    """Patches the service clients for the duration of `with recorder.active():`."""
+
+    def __init__(self, mode: str = 'replay', cassette_dir: str = None):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+        self.mode = mode
+        cassette_dir = cassette_dir or DEFAULT_CASSETTE_DIR
+        self.cassettes = {
+            name: Cassette(os.path.join(cassette_dir, f'{name}.json'))
+            for name in ('openai', 'vision', 'cloudinary')
+        }
+        self._real = {}
+
+    def real(self, name: str):
+        """The real client for a service (only used when recording)."""
+        if name not in self._real:
+            self._real[name] = services.get(name)
+        return self._real[name]
+
+    def _lookup(self, service: str, key: str, call, encode, decode):
+        cassette = self.cassettes[service]
+        if self.mode == 'replay':
+            recorded = cassette.get(key)
+            if recorded is None:
+                raise CassetteMiss(f"No recorded {service} response for request {key[:12]} "
+                                   f"(run with --mode record and credentials to capture it)")
+            return decode(recorded)
+        response = call()
+        if self.mode == 'record':
+            cassette.put(key, encode(response))
+        return response
+
+    def openai_create(self, **kwargs):
+        key = request_key('openai', {k: v for k, v in kwargs.items() if k != 'timeout'})
+
+        def decode(data):
+            try:
+                from openai.types.chat import ChatCompletion
+                return ChatCompletion.model_validate(data)
+            except Exception:
+                return _namespace(data)
+
+        return self._lookup(
+            'openai', key,
+            lambda: self.real('openai').chat.completions.create(**kwargs),
+            lambda response: response.model_dump() if hasattr(response, 'model_dump') else response,
+            decode,
+        )
+
+    def vision_call(self, method, requests, request_type, response_type, call):
+        key = request_key('vision', method, *[request_type.serialize(r) for r in requests])
+        return self._lookup(
+            'vision', key, call,
+            lambda response: response_type.to_json(response),
+            lambda data: response_type.from_json(data, ignore_unknown_fields=True),
+        )
+
+    def cloudinary_upload(self, file, **options):
+        if hasattr(file, 'read'):
+            content = file.read()
+            file.seek(0)
+        else:
+            with open(file, 'rb') as f:
+                content = f.read()
+        key = request_key('cloudinary', content, options)
+        return self._lookup(
+            'cloudinary', key,
+            lambda: self.real('cloudinary').upload(file, **options),
+            lambda response: json.loads(json.dumps(response, default=str)),
+            lambda data: data,
+        )
+
+    @contextmanager
+    def active(self):
+        """Swap the OpenAI, Vision and Cloudinary clients in the service registry; save cassettes on exit."""
+        if self.mode == 'live':
+            yield self
+            return
+
+        if self.mode == 'record':
+            # Build the real clients before the registry starts serving the stand-ins
+            for name in ('openai', 'vision', 'cloudinary'):
+                self.real(name)
+        with ExitStack() as stack:
+            stack.enter_context(services.override('openai', _ReplayOpenAIClient(self)))
+            stack.enter_context(services.override('vision', _RecordingVisionClient(self)))
+            stack.enter_context(services.override('cloudinary', _ReplayCloudinaryUploader(self)))
+            try:
+                yield self
+            finally:
+                if self.mode == 'record':
+                    for cassette in self.cassettes.values():
+                        cassette.save()
+
+    def stats(self):
+        return {name: {'hits': c.hits, 'misses': c.misses} for name, c in self.cassettes.items()}
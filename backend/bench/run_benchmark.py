@@ -0,0 +1,255 @@
+"""
+Offline extraction benchmark.
+
+Runs the golden corpus through one or more extraction pipelines with recorded provider
+responses and reports, per pipeline:
+- per-stage latency (pymupdf_parse, rasterize, vision_call, openai_call, parse_heuristics, ...)
+- field accuracy against manifest.json
+- OpenAI tokens and bytes sent to Vision / OpenAI
+
+Documents whose provider responses are not in the cassettes are reported as skipped (not errors)
+in replay mode, so a checkout without recordings still measures the local stages; --strict turns
+them into errors.
+
+Usage (from backend/):
+    python -m bench.run_benchmark                         # replay, all pipelines
+    python -m bench.run_benchmark --mode record           # needs real credentials
+    python -m bench.run_benchmark --pipelines openai_vision --dpi 200 --image-format png
+    python -m bench.run_benchmark --json results.json
+
+Pipelines:
+    tiered         extract_fields.extract_fields (text layer, then Vision for pages without one)
+    openai         ocr_processor.extract_fields_openai
+    openai_vision  ocr_processor.call_openai_vision_fallback only (use with the render options)
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from collections import Counter, defaultdict
+
+# Make backend/ importable when run as a script
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from bench.recorder import CassetteMiss, Recorder, MODES, DEFAULT_CASSETTE_DIR
+from bench.corpus.generate_corpus import MANIFEST_PATH, load_manifest, generate
+from utils.timing import collect
+
+PIPELINES = ('tiered', 'openai', 'openai_vision')
+
+
+def _run_tiered(path, render_settings):
+    from extract_fields import extract_fields
+    return extract_fields(path)
+
+
+def _run_openai(path, render_settings):
+    from ocr_processor import extract_fields_openai
+    return extract_fields_openai(path)
+
+
+def _run_openai_vision(path, render_settings):
+    import fitz
+    from ocr_processor import call_openai_vision_fallback
+    with fitz.open(path) as pdf:
+        return call_openai_vision_fallback(pdf, '', render_settings)
+
+
+RUNNERS = {
+    'tiered': _run_tiered,
+    'openai': _run_openai,
+    'openai_vision': _run_openai_vision,
+}
+
+
+def normalize(field: str, value) -> str:
+    if value is None:
+        return ''
+    text = str(value).upper()
+    if field == 'container_numbers':
+        return ','.join(sorted(t for t in re.split(r'[\s,;/]+', text) if t))
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip(' .,:;')
+
+
+def score_fields(expected: dict, actual: dict, fields):
+    return {f: normalize(f, expected.get(f)) == normalize(f, (actual or {}).get(f)) for f in fields if f in expected}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def _misses(recorder):
+    return sum(c.misses for c in recorder.cassettes.values())
+
+
+def run_pipeline(name, documents, corpus_dir, fields, render_settings, repeat, recorder, strict=False):
+    runner = RUNNERS[name]
+    results = []
+    for doc in documents:
+        path = os.path.join(corpus_dir, doc['file'])
+        for _ in range(repeat):
+            error = skipped = None
+            misses_before = _misses(recorder)
+            with collect() as timings:
+                start = time.perf_counter()
+                try:
+                    actual = runner(path, render_settings)
+                except CassetteMiss as e:
+                    actual, skipped = {}, str(e)
+                except Exception as e:
+                    actual, error = {}, f"{type(e).__name__}: {e}"
+                total = time.perf_counter() - start
+            # The extractors swallow their own exceptions, so a replay miss shows up here instead
+            if error is None and skipped is None and _misses(recorder) > misses_before:
+                skipped = "cassette miss (record this document with --mode record)"
+            if skipped and strict:
+                error, skipped = skipped, None
+            summary = timings.summary()
+            results.append({
+                'file': doc['file'],
+                'total_seconds': total,
+                'stages': {stage: sum(values) for stage, values in summary['stages'].items()},
+                'counts': summary['counts'],
+                'tier': (actual or {}).get('extraction_tier'),
+                'fields': score_fields(doc['expected'], actual, fields),
+                'error': error,
+                'skipped': skipped,
+            })
+    return results
+
+
+def aggregate(results, fields):
+    stage_values = defaultdict(list)
+    counts = Counter()
+    field_hits = Counter()
+    field_totals = Counter()
+    skipped = sum(1 for r in results if r['skipped'])
+    # A skipped run has no provider response behind it: its timings and fields say nothing
+    results = [r for r in results if not r['skipped']]
+    for r in results:
+        for stage, seconds in r['stages'].items():
+            stage_values[stage].append(seconds)
+        counts.update(r['counts'])
+        for field, ok in r['fields'].items():
+            field_totals[field] += 1
+            field_hits[field] += int(ok)
+    totals = [r['total_seconds'] for r in results]
+    n = len(results) or 1
+    return {
+        'runs': len(results),
+        'errors': sum(1 for r in results if r['error']),
+        'skipped': skipped,
+        'latency': {'p50': percentile(totals, 50), 'p95': percentile(totals, 95), 'max': max(totals) if totals else None},
+        'stages': {
+            stage: {'p50': percentile(v, 50), 'p95': percentile(v, 95), 'mean': sum(v) / len(v)}
+            for stage, v in sorted(stage_values.items())
+        },
+        'accuracy': {
+            'overall': (sum(field_hits.values()) / sum(field_totals.values())) if field_totals else None,
+            'per_field': {f: field_hits[f] / field_totals[f] for f in fields if field_totals[f]},
+        },
+        'per_document': {k: v / n for k, v in sorted(counts.items())},
+        'tiers': dict(Counter(r['tier'] for r in results if r['tier'])),
+    }
+
+
+def _ms(seconds):
+    return '-' if seconds is None else f"{seconds * 1000:8.1f}"
+
+
+def print_report(name, agg):
+    print(f"\n=== {name} ({agg['runs']} run(s), {agg['errors']} error(s), {agg['skipped']} skipped) ===")
+    if agg['skipped'] and not agg['runs']:
+        print("no recorded provider responses for this pipeline (record them with --mode record)")
+        return
+    lat = agg['latency']
+    print(f"total latency ms   p50 {_ms(lat['p50'])}  p95 {_ms(lat['p95'])}  max {_ms(lat['max'])}")
+    for stage, s in agg['stages'].items():
+        print(f"  {stage:<20} p50 {_ms(s['p50'])}  p95 {_ms(s['p95'])}")
+    acc = agg['accuracy']
+    if acc['overall'] is not None:
+        print(f"field accuracy     {acc['overall'] * 100:5.1f}%")
+        for field, value in acc['per_field'].items():
+            print(f"  {field:<20} {value * 100:5.1f}%")
+    if agg['per_document']:
+        print("per document (mean)")
+        for key, value in agg['per_document'].items():
+            print(f"  {key:<26} {value:,.1f}")
+    if agg['tiers']:
+        print(f"tiers              {agg['tiers']}")
+
+
+def build_render_settings(args):
+    from utils.pdf_render import RenderSettings
+    grayscale = None if args.grayscale is None else args.grayscale == 'on'
+    return RenderSettings(
+        dpi=args.dpi, grayscale=grayscale, image_format=args.image_format,
+        jpeg_quality=args.jpeg_quality, crop=None if not args.no_crop else False,
+        max_pages=args.max_pages, max_dimension=args.max_dimension,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline extraction benchmark")
+    parser.add_argument('--mode', choices=MODES, default='replay')
+    parser.add_argument('--pipelines', default=','.join(PIPELINES),
+                        help=f"comma-separated subset of {', '.join(PIPELINES)}")
+    parser.add_argument('--manifest', default=MANIFEST_PATH)
+    parser.add_argument('--cassettes', default=DEFAULT_CASSETTE_DIR)
+    parser.add_argument('--repeat', type=int, default=1, help="runs per document (latency percentiles)")
+    parser.add_argument('--json', help="write the full results to this file")
+    parser.add_argument('--strict', action='store_true', help="treat documents missing from the cassettes as errors")
+    render = parser.add_argument_group('render options (Vision fallback payload)')
+    render.add_argument('--dpi', type=int)
+    render.add_argument('--grayscale', choices=('on', 'off'))
+    render.add_argument('--image-format', choices=('jpeg', 'png'))
+    render.add_argument('--jpeg-quality', type=int)
+    render.add_argument('--no-crop', action='store_true')
+    render.add_argument('--max-pages', type=int)
+    render.add_argument('--max-dimension', type=int)
+    args = parser.parse_args(argv)
+
+    pipelines = [p.strip() for p in args.pipelines.split(',') if p.strip()]
+    unknown = [p for p in pipelines if p not in RUNNERS]
+    if unknown:
+        parser.error(f"unknown pipeline(s): {', '.join(unknown)}")
+
+    generate(manifest_path=args.manifest)
+    manifest = load_manifest(args.manifest)
+    corpus_dir = os.path.dirname(os.path.abspath(args.manifest))
+    fields = manifest['fields']
+    render_settings = build_render_settings(args)
+
+    recorder = Recorder(args.mode, args.cassettes)
+    report = {'mode': args.mode, 'render_settings': render_settings.as_dict(), 'pipelines': {}}
+    with recorder.active():
+        for name in pipelines:
+            results = run_pipeline(name, manifest['documents'], corpus_dir, fields, render_settings, args.repeat,
+                                   recorder, strict=args.strict)
+            agg = aggregate(results, fields)
+            report['pipelines'][name] = {'summary': agg, 'results': results}
+            print_report(name, agg)
+    report['cassettes'] = recorder.stats()
+    print(f"\ncassettes: {report['cassettes']}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"results written to {args.json}")
+    errors = sum(p['summary']['errors'] for p in report['pipelines'].values())
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
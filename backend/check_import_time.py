@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Cold-start import profiler for the Flask app.
+
+Imports the app in a fresh interpreter with `python -X importtime`, prints the slowest
+imports, and exits non-zero when:
+- the total import time is over budget, or
+- a heavy SDK that must load lazily (see utils/services.py) was imported at start-up.
+
+Usage (from backend/, e.g. as a CI step):
+    python check_import_time.py                    # budget from IMPORT_TIME_BUDGET_MS (default 2000)
+    python check_import_time.py --budget-ms 1500 --runs 5 --top 25
+"""
+
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Must not be imported when the app starts; they are loaded on first use
+LAZY_MODULES = ['google.cloud.vision', 'openai', 'fitz', 'reportlab', 'cloudinary', 'PIL']
+
+_LINE_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+
+def profile_once(module: str):
+    """Return a list of (self_us, cumulative_us, depth, name) in import order."""
+    env = dict(os.environ)
+    env.setdefault('PYTHONDONTWRITEBYTECODE', '0')
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr[-4000:])
+        raise SystemExit(f"[import-time] 'import {module}' failed with exit code {proc.returncode}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((int(self_us), int(cumulative_us), len(indent) // 2, name))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fail when app cold-start import time is over budget")
+    parser.add_argument('--module', default='app', help="module to import (default: app)")
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('IMPORT_TIME_BUDGET_MS', 2000)))
+    parser.add_argument('--runs', type=int, default=3, help="profile this many times and keep the fastest")
+    parser.add_argument('--top', type=int, default=20, help="how many of the slowest imports to print")
+    parser.add_argument('--allow', action='append', default=[],
+                        help="a lazy module that may be imported at start-up (repeatable)")
+    args = parser.parse_args(argv)
+
+    best = None
+    for _ in range(max(1, args.runs)):
+        rows = profile_once(args.module)
+        total_us = next((cum for _, cum, depth, name in rows if name == args.module and depth == 0), None)
+        if total_us is None:
+            total_us = sum(cum for _, cum, depth, _ in rows if depth == 0)
+        if best is None or total_us < best[0]:
+            best = (total_us, rows)
+    total_us, rows = best
+    total_ms = total_us / 1000.0
+
+    print(f"[import-time] import {args.module}: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms, best of {args.runs})")
+    print(f"[import-time] slowest imports (cumulative):")
+    for self_us, cum_us, depth, name in sorted(rows, key=lambda r: r[1], reverse=True)[:args.top]:
+        print(f"  {cum_us / 1000.0:9.1f} ms  self {self_us / 1000.0:8.1f} ms  {'  ' * depth}{name}")
+
+    failed = False
+    imported = {name for _, _, _, name in rows}
+    eager = [
+        mod for mod in LAZY_MODULES
+        if mod not in args.allow and any(name == mod or name.startswith(mod + '.') for name in imported)
+    ]
+    if eager:
+        failed = True
+        print(f"[import-time] FAIL: imported at start-up but should load lazily: {', '.join(eager)}")
+    if total_ms > args.budget_ms:
+        failed = True
+        print(f"[import-time] FAIL: {total_ms:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+    if not failed:
+        print("[import-time] OK")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,17 @@
-import cloudinary
-import cloudinary.uploader
 import os
+import logging
+from utils.services import get_cloudinary_uploader
+from utils.timing import stage
 
-# Configure Cloudinary (replace with your credentials)
-cloudinary.config(
-    cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME', 'your_cloud_name'),
-    api_key=os.getenv('CLOUDINARY_API_KEY', 'your_api_key'),
-    api_secret=os.getenv('CLOUDINARY_API_SECRET', 'your_api_secret'),
-    secure=True
-)
+# Cloudinary is imported and configured from the environment on first upload (see utils/services.py)
+
+logger = logging.getLogger(__name__)
 
 def upload_filelike_to_cloudinary(file_obj, folder=None):
     """
     Uploads a file-like object to Cloudinary and returns the secure_url.
     """
-    print(f"[DEBUG] cloudinary_utils: Uploading file to Cloudinary, folder={folder}")
+    logger.debug("Uploading file to Cloudinary, folder=%s", folder)
     # Always upload PDFs as resource_type='raw' for direct access
     filename = getattr(file_obj, 'filename', None)
     ext = ''
@@ -35,15 +32,22 @@ def upload_filelike_to_cloudinary(file_obj, folder=None):
         import uuid
         base_id = str(uuid.uuid4()).replace('-', '')[:20]
         public_id = f"{folder}/{base_id}"
-    result = cloudinary.uploader.upload(file_obj, folder=None, public_id=public_id, resource_type='raw', type='upload')
-    print(f"[DEBUG] cloudinary_utils: Cloudinary upload result: {result}")
+    with stage('cloudinary_upload'):
+        result = get_cloudinary_uploader().upload(file_obj, folder=None, public_id=public_id, resource_type='raw', type='upload')
+    _log_upload_result(result)
     return result.get('secure_url')
 
 def upload_filepath_to_cloudinary(filepath, folder=None):
     """
     Uploads a file from disk to Cloudinary and returns the secure_url.
     """
-    print(f"[DEBUG] cloudinary_utils: Uploading file from path to Cloudinary: {filepath}, folder={folder}")
-    result = cloudinary.uploader.upload(filepath, folder=folder)
-    print(f"[DEBUG] cloudinary_utils: Cloudinary upload result: {result}")
+    logger.debug("Uploading file from path to Cloudinary: %s, folder=%s", filepath, folder)
+    with stage('cloudinary_upload'):
+        result = get_cloudinary_uploader().upload(filepath, folder=folder)
+    _log_upload_result(result)
     return result.get('secure_url')
+
+def _log_upload_result(result):
+    # The full result dict (signature, api_key, ...) is not logged
+    logger.debug("Cloudinary upload done: public_id=%s bytes=%s url=%s",
+                 result.get('public_id'), result.get('bytes'), result.get('secure_url'))
@@ -2,7 +2,10 @@ print("CONFIG.PY LOADED")
 import os
 import psycopg2
 import time
+import tempfile
 from datetime import timedelta
+from utils.timing import stage
+from utils.db_instrumentation import TimedCursor
 
 # Environment Detection
 def get_environment():
@@ -59,7 +62,203 @@ class CloudinaryConfig:
 
 # OCR Configuration
 class OCRConfig:
-    pass  # No longer needed, but kept for compatibility
+    # Pages whose PyMuPDF text layer has fewer alphanumeric characters than this are sent to Vision
+    TEXT_LAYER_MIN_CHARS = int(os.getenv('OCR_TEXT_LAYER_MIN_CHARS', 80))
+    # Resolution used when rasterizing pages without a usable text layer
+    RASTER_DPI = int(os.getenv('OCR_RASTER_DPI', 200))
+    # Images larger than this (longest side, pixels) are downscaled before upload to Vision
+    VISION_MAX_DIMENSION = int(os.getenv('VISION_MAX_DIMENSION', 2560))
+    # Images per batch_annotate_images call (Vision allows 16) and total bytes per call
+    VISION_BATCH_SIZE = int(os.getenv('VISION_BATCH_SIZE', 16))
+    VISION_BATCH_MAX_BYTES = int(os.getenv('VISION_BATCH_MAX_BYTES', 8 * 1024 * 1024))
+    # Batches sent concurrently
+    VISION_MAX_WORKERS = int(os.getenv('VISION_MAX_WORKERS', 4))
+
+# Vision Fallback Rendering (how PDF pages are turned into the image sent to OpenAI Vision)
+class RenderConfig:
+    DPI = int(os.getenv('VISION_RENDER_DPI', 150))
+    GRAYSCALE = os.getenv('VISION_RENDER_GRAYSCALE', '1') == '1'
+    # 'jpeg' or 'png'
+    IMAGE_FORMAT = os.getenv('VISION_RENDER_FORMAT', 'jpeg').lower()
+    JPEG_QUALITY = int(os.getenv('VISION_RENDER_JPEG_QUALITY', 80))
+    CROP_TO_CONTENT = os.getenv('VISION_RENDER_CROP', '1') == '1'
+    # Pages chosen by the page-selection heuristic and tiled into one image. One by default: OpenAI
+    # fits the whole image into ~2048px, so every extra page costs the others resolution
+    MAX_PAGES = int(os.getenv('VISION_RENDER_MAX_PAGES', 1))
+    # Longest side of each rendered page (not of the tiled sheet)
+    MAX_DIMENSION = int(os.getenv('VISION_RENDER_MAX_DIMENSION', 2048))
+
+# Prompt Configuration (OpenAI prompt size controls)
+class PromptConfig:
+    CANNED_RESPONSES_PATH = os.getenv(
+        'CANNED_RESPONSES_PATH',
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'canned_responses.json')
+    )
+    CANNED_RESPONSES_TOP_K = int(os.getenv('CANNED_RESPONSES_TOP_K', 3))
+    PDF_PROMPT_TOKEN_BUDGET = int(os.getenv('PDF_PROMPT_TOKEN_BUDGET', 2500))
+
+# Extraction Router Configuration (which provider extracts bill fields, and how patiently)
+class ExtractionConfig:
+    # Comma-separated provider chain used when no policy entry matches: 'vision' (Google Vision) or 'openai'
+    DEFAULT_PROVIDERS = os.getenv('EXTRACTION_PROVIDERS', 'vision')
+    # JSON object mapping username -> provider chain, e.g. {"ray40": "openai,vision"}
+    USER_POLICY = os.getenv('EXTRACTION_USER_POLICY', '{"ray40": "openai,vision"}')
+    OPENAI_TIMEOUT = float(os.getenv('EXTRACTION_OPENAI_TIMEOUT', 20))
+    VISION_TIMEOUT = float(os.getenv('EXTRACTION_VISION_TIMEOUT', 15))
+    RETRIES = int(os.getenv('EXTRACTION_RETRIES', 1))
+    # Whole-request budget, kept under the gunicorn worker timeout (30s)
+    TOTAL_BUDGET = float(os.getenv('EXTRACTION_TOTAL_BUDGET', 25))
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv('EXTRACTION_BREAKER_FAILURES', 5))
+    BREAKER_RESET_SECONDS = float(os.getenv('EXTRACTION_BREAKER_RESET_SECONDS', 60))
+    # Fire the next provider in the chain once the current one runs past its p95 latency
+    HEDGE_ENABLED = os.getenv('EXTRACTION_HEDGE', '0') == '1'
+    HEDGE_MIN_SAMPLES = int(os.getenv('EXTRACTION_HEDGE_MIN_SAMPLES', 20))
+    MAX_WORKERS = int(os.getenv('EXTRACTION_MAX_WORKERS', 4))
+    # Timed-out calls a provider may leave running on the pool (threads cannot be cancelled); at the
+    # limit the provider is skipped until they finish. The pool gets this many extra threads per provider
+    MAX_ABANDONED_CALLS = int(os.getenv('EXTRACTION_MAX_ABANDONED_CALLS', 2))
+
+# Logging (see utils/logging_setup.py)
+class LoggingConfig:
+    LEVEL = os.getenv('LOG_LEVEL', 'INFO' if CURRENT_ENV == 'production' else 'DEBUG').upper()
+    # 'json' (one object per line, for the log collector) or 'text'
+    FORMAT = os.getenv('LOG_FORMAT', 'json' if CURRENT_ENV == 'production' else 'text').lower()
+    # Debug records are dropped in production unless this is set, whatever LOG_LEVEL says
+    DEBUG_IN_PRODUCTION = os.getenv('LOG_DEBUG_IN_PRODUCTION', '0') == '1'
+    # Keep only a fraction of DEBUG/INFO records per logger prefix, e.g. "bank_routes=0.1,utils.ingest_emails=0.25"
+    SAMPLING = os.getenv('LOG_SAMPLING', '')
+    # Records waiting for the writer thread; when full, DEBUG/INFO are dropped instead of blocking the request
+    QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    # Seconds a WARNING/ERROR waits for room in a full queue before it is dropped too (0: never waits)
+    OVERFLOW_WAIT = float(os.getenv('LOG_OVERFLOW_WAIT', 1.0))
+
+# Per-request/per-job SQL statement counts (see utils/db_instrumentation.py)
+class QueryTrackingConfig:
+    ENABLED = os.getenv('QUERY_TRACKING', '1') == '1'
+    # Warn when one statement fingerprint runs more than this many times in one request or job
+    REPEAT_WARN_THRESHOLD = int(os.getenv('QUERY_REPEAT_WARN_THRESHOLD', 10))
+
+# Request/stage metrics (see utils/metrics.py)
+class MetricsConfig:
+    ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+    # Each worker process writes its counters here; /metrics merges all files (shared by all workers)
+    DIR = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'iqstrade-metrics'))
+    FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+    # /metrics requires "Authorization: Bearer <token>"; it answers 403 while this is unset
+    TOKEN = os.getenv('METRICS_TOKEN')
+    SERVER_TIMING = os.getenv('SERVER_TIMING', '1') == '1'
+
+# Password hashing pool (see utils/password_hashing.py)
+class PasswordHashingConfig:
+    # Cost every stored hash converges to (rehashed on the next successful login)
+    BCRYPT_ROUNDS = int(os.getenv('PASSWORD_BCRYPT_ROUNDS', 12))
+    # Hashes computed at once per worker process; bcrypt releases the GIL, so this can match the CPU count
+    WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+    # Further requests that may wait for a hashing slot before /login answers 503
+    QUEUE_SIZE = int(os.getenv('PASSWORD_HASH_QUEUE', 8))
+    # Longest a request waits for its hash before giving up with 503 (seconds)
+    TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+
+# Buffered audit_logs writes (see utils/audit_log.py)
+class AuditConfig:
+    # Write as soon as this many events are queued...
+    BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', 200))
+    # ...or at least this often (seconds)
+    FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', 1))
+    # Events beyond this go straight to the spill file instead of waiting in memory
+    QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', 10000))
+    # JSON lines written while the database is unavailable, replayed after the next successful write
+    SPILL_PATH = os.getenv('AUDIT_SPILL_PATH', os.path.join(tempfile.gettempdir(), 'iqstrade-audit-spill.jsonl'))
+
+# Flask-Limiter storage (see utils/limiter_storage.py and limiter_instance.py)
+class LimiterConfig:
+    # memory:// (per worker), iqs+postgres:// (shared, batched) or iqs+shm:///dev/shm/<file> (shared on one machine)
+    STORAGE_URI = os.getenv('RATELIMIT_STORAGE_URI', 'iqs+postgres://' if CURRENT_ENV == 'production' else 'memory://')
+    # Seconds between batched counter writes for iqs+postgres://
+    FLUSH_INTERVAL = float(os.getenv('RATELIMIT_FLUSH_INTERVAL', 2))
+    # Default file for iqs+shm:// when the URI has no path
+    SHM_PATH = os.getenv('RATELIMIT_SHM_PATH', os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                                                          'iqstrade-ratelimit.sqlite3'))
+    # Extra comma-separated endpoint names that skip rate limiting (probes and static files always do)
+    EXEMPT_ENDPOINTS = os.getenv('RATELIMIT_EXEMPT_ENDPOINTS', '')
+
+# Concurrent-user limit (see utils/session_registry.py)
+class SessionConfig:
+    # 'postgres' (shared by all workers, needs migrations/20250801_create_active_sessions.sql) or 'memory' (per process)
+    BACKEND = os.getenv('SESSION_BACKEND', 'postgres').lower()
+    MAX_CONCURRENT_USERS = int(os.getenv('MAX_CONCURRENT_USERS', 100))
+    # An identity stops counting once it has made no request for this long
+    TTL = float(os.getenv('SESSION_TTL', 30 * 60))
+    # Each worker refreshes an active identity's last_seen at most this often
+    TOUCH_INTERVAL = float(os.getenv('SESSION_TOUCH_INTERVAL', 60))
+
+# Archive tier for settled bills (see utils/bill_archive.py)
+class ArchiveConfig:
+    # Bills settled ('Paid and CTN Valid', reserve not outstanding) longer ago than this leave bill_of_lading
+    AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 90))
+    # Rows moved per transaction, and the pause between transactions so live traffic keeps its locks short
+    BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 500))
+    BATCH_PAUSE = float(os.getenv('ARCHIVE_BATCH_PAUSE', 0.2))
+    # Archive partitions older than this many months are dropped (0 keeps everything); 7 years by default
+    RETENTION_MONTHS = int(os.getenv('ARCHIVE_RETENTION_MONTHS', 84))
+
+# API response compression (see utils/compression.py)
+class CompressionConfig:
+    ENABLED = os.getenv('COMPRESS_RESPONSES', '1') == '1'
+    # Smaller bodies are sent as-is: a packet or two either way, not worth the CPU
+    MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+    # Dynamic responses are compressed on every request, so these are lower than the static-asset levels
+    GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 5))
+    BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+
+# Outbound email queue (see utils/email_outbox.py)
+class OutboxConfig:
+    # Messages sent per drain transaction
+    BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+    # A message still failing after this many attempts is marked 'failed' and left for a human
+    MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+    # Retry delay after the n-th failure: RETRY_BASE_SECONDS * 2^(n-1)
+    RETRY_BASE_SECONDS = int(os.getenv('OUTBOX_RETRY_BASE_SECONDS', 60))
+
+# Payment reconciliation (see utils/reconciliation.py)
+class ReconciliationConfig:
+    # A payment within this much of a combination of receivables matches it
+    TOLERANCE = float(os.getenv('RECONCILE_TOLERANCE', 2.0))
+    # Proposals at or above this confidence are applied; lower ones are only reported for review
+    AUTO_APPLY_CONFIDENCE = float(os.getenv('RECONCILE_AUTO_APPLY_CONFIDENCE', 0.9))
+    # Bills searched per payment (the referenced ones first, then the customer's closest amounts);
+    # the search enumerates about 3^(MAX_BILLS/2) sums per half
+    MAX_BILLS = int(os.getenv('RECONCILE_MAX_BILLS', 12))
+    # Most receivables one payment is allocated to
+    MAX_ITEMS = int(os.getenv('RECONCILE_MAX_ITEMS', 6))
+    # Allinpay first instalment; the rest is held as reserve until the final payment
+    DEPOSIT_RATE = float(os.getenv('RECONCILE_DEPOSIT_RATE', 0.85))
+
+# Fuzzy BL / container matching for OCR'd references (see utils/bl_matcher.py)
+class BLMatchConfig:
+    ENABLED = os.getenv('BL_FUZZY_MATCH', '1') == '1'
+    # Candidates differing from the reference by more edits than this (after folding O/0, I/1, ...) are dropped
+    MAX_DISTANCE = int(os.getenv('BL_MATCH_MAX_DISTANCE', 2))
+    # pg_trgm similarity a candidate key needs to be fetched at all
+    TRGM_THRESHOLD = float(os.getenv('BL_MATCH_TRGM_THRESHOLD', 0.3))
+    # A fuzzy match is acted on only at this score (the default allows confusable characters but not a
+    # real typo), and only if the next bill scores MARGIN lower
+    MIN_SCORE = float(os.getenv('BL_MATCH_MIN_SCORE', 0.85))
+    MARGIN = float(os.getenv('BL_MATCH_MARGIN', 0.1))
+
+# Frontend static assets (React build/ served from an in-memory manifest)
+class StaticConfig:
+    BUILD_DIR = os.getenv('STATIC_BUILD_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build'))
+    # Text assets (js/css/html/json/svg) up to this size are held in memory with their gzip/brotli variants
+    # once first requested
+    INLINE_MAX_BYTES = int(os.getenv('STATIC_INLINE_MAX_BYTES', 4 * 1024 * 1024))
+    # Already-compressed assets (images, fonts) above this size are streamed from disk instead
+    INLINE_BINARY_MAX_BYTES = int(os.getenv('STATIC_INLINE_BINARY_MAX_BYTES', 512 * 1024))
+    # Used only when build/ has no pre-generated .gz/.br files (see utils/static_assets.py precompress)
+    GZIP_LEVEL = int(os.getenv('STATIC_GZIP_LEVEL', 6))
+    BROTLI_QUALITY = int(os.getenv('STATIC_BROTLI_QUALITY', 5))
+    # Max-age for files without a content hash in their name (favicon, images, manifest.json)
+    DEFAULT_MAX_AGE = int(os.getenv('STATIC_DEFAULT_MAX_AGE', 3600))
 
 # File Paths
 class PathConfig:
@@ -79,15 +278,18 @@ class JWTConfig:
 def get_db_conn(max_retries=3, retry_delay=2):
     for attempt in range(max_retries):
         try:
-            conn = psycopg2.connect(
-                dbname=DatabaseConfig.dbname(),
-                user=DatabaseConfig.user(),
-                password=DatabaseConfig.password(),
-                host=DatabaseConfig.host(),
-                port=DatabaseConfig.port(),
-                connect_timeout=10,  # 10 second connection timeout
-                options='-c statement_timeout=30000'  # 30 second query timeout
-            )
+            # Every statement is timed into the request's Server-Timing / metrics (utils/db_instrumentation.py)
+            with stage('db_connect'):
+                conn = psycopg2.connect(
+                    dbname=DatabaseConfig.dbname(),
+                    user=DatabaseConfig.user(),
+                    password=DatabaseConfig.password(),
+                    host=DatabaseConfig.host(),
+                    port=DatabaseConfig.port(),
+                    connect_timeout=10,  # 10 second connection timeout
+                    options='-c statement_timeout=30000',  # 30 second query timeout
+                    cursor_factory=TimedCursor
+                )
             return conn
         except Exception as e:
             if attempt < max_retries - 1:
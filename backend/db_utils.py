@@ -1,5 +1,7 @@
+import json
 import psycopg2
 from config import get_db_conn
+from utils.bill_store import insert_bill, save_extraction
 
 def insert_bill_of_lading(
     customer_name, customer_email, customer_phone, pdf_filename, ocr_text,
@@ -10,19 +12,23 @@ def insert_bill_of_lading(
         raise Exception("Failed to connect to database")
     
     cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO bill_of_lading (
-            customer_name, customer_email, customer_phone, pdf_filename, ocr_text,
-            shipper, consignee, port_of_loading, port_of_discharge, bl_number, container_numbers
-        )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """,
-        (
-            customer_name, customer_email, customer_phone, pdf_filename, ocr_text,
-            shipper, consignee, port_of_loading, port_of_discharge, bl_number, container_numbers
-        )
-    )
+    bill = insert_bill(cur, {
+        'customer_name': customer_name, 'customer_email': customer_email, 'customer_phone': customer_phone,
+        'pdf_filename': pdf_filename, 'shipper': shipper, 'consignee': consignee,
+        'port_of_loading': port_of_loading, 'port_of_discharge': port_of_discharge,
+        'bl_number': bl_number, 'container_numbers': container_numbers
+    }, decrypt=False)
+    # The extraction result (dict or JSON string) is kept in bill_extractions, not on the bill row;
+    # anything that is not an object is kept as {'raw_text': ...}
+    payload = ocr_text
+    if isinstance(payload, str):
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            pass
+    if payload and not isinstance(payload, dict):
+        payload = {'raw_text': ocr_text if isinstance(ocr_text, str) else json.dumps(ocr_text)}
+    save_extraction(cur, bill['id'], payload)
     conn.commit()
     cur.close()
     conn.close()
\ No newline at end of file
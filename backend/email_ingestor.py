@@ -8,13 +8,10 @@ Email Ingestor for IQSTrade
 - Logs all actions
 """
 import os
-import imaplib
 import email
 from email.header import decode_header
 import logging
-from ocr_processor import process_pdf
 from dotenv import load_dotenv
-import openai
 from config import CloudinaryConfig
 import json
 import re
@@ -23,9 +20,12 @@ import datetime
 from utils.unified_response_handler import get_response_handler
 from utils.confidence_scorer import confidence_scorer
 from invoice_utils import find_invoice_info, find_ctn_info
+from utils.prompt_builder import build_canned_responses_context, NO_CANNED_RESPONSES
+from utils.llm_client import llm_client, object_schema
+from utils.services import get_openai_client
+from utils.mail_clients import TimedIMAP4_SSL
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+# Setup logging (handlers are installed by utils/logging_setup.py)
 logger = logging.getLogger(__name__)
 
 # Load env from .env
@@ -35,16 +35,33 @@ IMAP_SERVER = os.getenv('EMAIL_HOST')
 EMAIL_USER = os.getenv('EMAIL_USERNAME')
 EMAIL_PASS = os.getenv('EMAIL_PASSWORD')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-openai.api_key = OPENAI_API_KEY
 
 PDF_SAVE_DIR = 'downloads'
+
+# Structured-output schema for handle_email_via_openai (paid_amount is a string, e.g. "$400")
+EMAIL_ACTION_SCHEMA = object_schema({
+    'classification': {
+        'type': 'string',
+        'enum': ["invoice_request", "payment_receipt", "general_enquiry", "ctn_request"],
+    },
+    'info_needed': object_schema({
+        'BL_numbers': {'type': 'array', 'items': {'type': 'string'}},
+        'paid_amount': {'type': 'string'},
+    }),
+    'reply': {'type': 'string'},
+})
 os.makedirs(PDF_SAVE_DIR, exist_ok=True)
 
 # Initialize unified response handler
 response_handler = get_response_handler(get_db_conn)
 
+def process_pdf(pdf_path, dry_run=False):
+    # ocr_processor pulls in PyMuPDF and Pillow, so it is only imported when a PDF needs processing
+    from ocr_processor import process_pdf as _process_pdf
+    return _process_pdf(pdf_path, dry_run=dry_run)
+
 def connect_imap():
-    return imaplib.IMAP4_SSL(IMAP_SERVER)
+    return TimedIMAP4_SSL(IMAP_SERVER)
 
 def handle_email_via_openai(subject, body, attachments, from_addr):
     # --- Extract payment amount from PDF raw_text and email body as fallback ---
@@ -125,7 +142,7 @@ def handle_email_via_openai(subject, body, attachments, from_addr):
         """
         try:
             translation_prompt = f"Translate the following {source_lang} text to {target_lang}. Only return the translated text, no explanation.\n\n{text}"
-            response = openai.chat.completions.create(
+            response = get_openai_client().chat.completions.create(
                 model="gpt-4o",
                 messages=[
                     {"role": "system", "content": "You are a professional translator."},
@@ -191,16 +208,9 @@ def handle_email_via_openai(subject, body, attachments, from_addr):
     2. Customizes the reply with real data (invoice links, fees).
     3. Saves the final, customized draft reply ONCE.
     """
-    # Load canned responses to provide as context to OpenAI
-    try:
-        with open('canned_responses.json', 'r') as f:
-            canned_responses = json.load(f)
-        canned_responses_text = "\n\n".join([f"Q: {r['title']}\nA: {r['body']}" for r in canned_responses])
-    except Exception as e:
-        logger.error(f"[OpenAI Email] Could not load canned_responses.json: {e}")
-        canned_responses_text = "No canned responses available."
-
     full_text = f"Subject: {subject}\n\n{translated_body}"
+    # Only the canned responses relevant to this email are provided as context to OpenAI
+    canned_responses_text = build_canned_responses_context(full_text)
     # Add attachment info to the prompt only if attachments exist
     if attachments:
         attachment_info = f"\n\nThe customer has attached {len(attachments)} file(s) to this email. Please mention the receipt of attachments in your reply."
@@ -216,31 +226,25 @@ CANNED RESPONSES:
 EMAIL:
 {full_text}{attachment_info}
 
-Return a valid JSON object with keys: "classification", "info_needed", and "reply".
+Return a JSON object with keys: "classification", "info_needed", and "reply".
 - "classification" must be one of ["invoice_request", "payment_receipt", "general_enquiry", "ctn_request"].
 - "info_needed" must be a dictionary containing a list of all BL numbers under the key "BL_numbers" and the numeric payment amount under "paid_amount".
 - For example, for an email about "payment for 001-123 and NYC220", the "BL_numbers" key must be ["001-123", "NYC220"].
 """
     
     # 1. Get base reply from OpenAI
-    response = openai.chat.completions.create(
-        model="gpt-4o",
+    action = llm_client.complete_json(
+        "email_action",
+        EMAIL_ACTION_SCHEMA,
         messages=[
             {"role": "system", "content": "You're a shipping email agent."},
             {"role": "user", "content": prompt},
         ],
         temperature=0,
     )
-    content = response.choices[0].message.content
-    try:
-        action = json.loads(content)
-    except Exception:
-        match = re.search(r'\{.*\}', content, re.DOTALL)
-        if match:
-            action = json.loads(match.group(0))
-        else:
-            logger.error(f"[OpenAI Email] Could not parse JSON from response.\nPrompt: {prompt}\nResponse: {content}")
-            action = {"classification": "unknown", "reply": "Could not process email.", "info_needed": {}}
+    if action is None:
+        logger.error(f"[OpenAI Email] Could not parse JSON from response.\nPrompt: {prompt}")
+        action = {"classification": "unknown", "reply": "Could not process email.", "info_needed": {}}
     
     if not action:
         return {"classification": "error", "reply": "Could not process email."}
@@ -407,7 +411,7 @@ Return a valid JSON object with keys: "classification", "info_needed", and "repl
         reply_is_chinese = is_chinese(custom_reply)
 
     # Canned responses: warn if only English available for Chinese email
-    if reply_is_chinese and 'No canned responses available.' in canned_responses_text:
+    if reply_is_chinese and NO_CANNED_RESPONSES in canned_responses_text:
         logger.warning('[OpenAI Email] No Chinese canned responses available for Chinese email.')
 
     # Add standard polite closing for Chinese replies if missing
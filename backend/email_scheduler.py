@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 Email Scheduler for IQSTrade
-Runs email ingestor continuously in the background.
+Runs email ingestor continuously in the background, drains the outbound email queue, and runs the
+daily bill archive job.
 """
 
 import time
@@ -11,33 +12,51 @@ import os
 import sys
 from datetime import datetime
 from email_ingestor import process_inbox
+from utils.logging_setup import setup_logging
+from utils.db_instrumentation import track_queries
+from utils.bill_archive import run_archive_job
+from utils.email_outbox import drain_outbox
 
 # Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('email_scheduler.log'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging(log_file='email_scheduler.log')
 logger = logging.getLogger(__name__)
 
 def run_email_ingestion():
     """Run email ingestion process."""
     try:
         logger.info("🔄 Starting email ingestion process...")
-        process_inbox()
+        with track_queries('job:email_ingestion'):
+            process_inbox()
         logger.info("✅ Email ingestion completed successfully")
     except Exception as e:
         logger.error(f"❌ Email ingestion failed: {e}")
 
+def run_bill_archive():
+    """Move settled bills to the archive and drop partitions beyond retention (utils/bill_archive.py)."""
+    try:
+        with track_queries('job:bill_archive'):
+            run_archive_job()
+    except Exception as e:
+        logger.error(f"❌ Bill archive failed: {e}")
+
+def run_outbox_drain():
+    """Send queued outbound emails (utils/email_outbox.py)."""
+    try:
+        with track_queries('job:email_outbox'):
+            drain_outbox()
+    except Exception as e:
+        logger.error(f"❌ Email outbox drain failed: {e}")
+
 def main():
     """Main scheduler function."""
     logger.info("🚀 Starting Email Scheduler for IQSTrade")
     
     # Schedule email processing every 5 minutes
     schedule.every(5).minutes.do(run_email_ingestion)
+    # Picks up what request-triggered drains missed and retries failed sends
+    schedule.every(1).minutes.do(run_outbox_drain)
+    # Quiet hours: the first run after deploying the archive moves the whole backlog
+    schedule.every().day.at("03:30").do(run_bill_archive)
     
     # Also run immediately on startup
     logger.info("🔄 Running initial email ingestion...")
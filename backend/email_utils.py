@@ -1,13 +1,14 @@
 
-import smtplib
 from email.message import EmailMessage
 from email.utils import formataddr
 import os
+import logging
 
 from config import EmailConfig
+from utils.mail_clients import TimedSMTP
 from invoice_utils import send_invoice_email
 
-print("Loaded email_utils.py")
+logger = logging.getLogger(__name__)
 
 # Send invoice email with PDF attachment using SMTP
 # def send_invoice_email(to_email, subject, body, pdf_path):
@@ -64,11 +65,11 @@ def send_email(to, subject, body):
     msg['To'] = to
     msg.set_content(body)
 
-    with smtplib.SMTP(str(EmailConfig.SMTP_SERVER), int(EmailConfig.SMTP_PORT)) as server:
+    with TimedSMTP(str(EmailConfig.SMTP_SERVER), int(EmailConfig.SMTP_PORT)) as server:
         server.starttls()
         server.login(str(EmailConfig.SMTP_USERNAME), str(EmailConfig.SMTP_PASSWORD))
         server.send_message(msg)
-        print(f"[DEBUG] ✅ Email sent to {to}")
+        logger.info(f"Email sent to {to}")
 
 def send_email_with_attachment(to, subject, body, attachments):
     if not all([
@@ -93,11 +94,11 @@ def send_email_with_attachment(to, subject, body, attachments):
         if file_name.lower().endswith('.pdf'):
             subtype = 'pdf'
         msg.add_attachment(file_data, maintype=maintype, subtype=subtype, filename=file_name)
-    with smtplib.SMTP(str(EmailConfig.SMTP_SERVER), int(EmailConfig.SMTP_PORT)) as server:
+    with TimedSMTP(str(EmailConfig.SMTP_SERVER), int(EmailConfig.SMTP_PORT)) as server:
         server.starttls()
         server.login(str(EmailConfig.SMTP_USERNAME), str(EmailConfig.SMTP_PASSWORD))
         server.send_message(msg)
-        print(f"[DEBUG] ✅ Email with attachment sent to {to}")
+        logger.info(f"Email with attachment sent to {to}")
 
 # Send unique number email using SMTP (plain text)
 def send_unique_number_email(to_email, subject, body):
@@ -117,13 +118,13 @@ def send_unique_number_email(to_email, subject, body):
         msg['To'] = to_email
         msg.set_content(body)
 
-        with smtplib.SMTP(str(EmailConfig.SMTP_SERVER), int(EmailConfig.SMTP_PORT)) as server:
+        with TimedSMTP(str(EmailConfig.SMTP_SERVER), int(EmailConfig.SMTP_PORT)) as server:
             server.starttls()
             server.login(str(EmailConfig.SMTP_USERNAME), str(EmailConfig.SMTP_PASSWORD))
             server.send_message(msg)
         return True
     except Exception as e:
-        print(f"Failed to send unique number email: {str(e)}")
+        logger.error(f"Failed to send unique number email: {str(e)}")
         return False
 
 def send_contact_email(name, from_email, message):
@@ -148,15 +149,15 @@ def send_contact_email(name, from_email, message):
     msg.set_content(body)
 
     try:
-        print(f"Attempting to send contact email to: {to_email}")
-        with smtplib.SMTP(str(EmailConfig.SMTP_SERVER), int(EmailConfig.SMTP_PORT)) as server:
+        logger.debug(f"Attempting to send contact email to: {to_email}")
+        with TimedSMTP(str(EmailConfig.SMTP_SERVER), int(EmailConfig.SMTP_PORT)) as server:
             server.starttls()
             server.login(str(EmailConfig.SMTP_USERNAME), str(EmailConfig.SMTP_PASSWORD))
             server.send_message(msg)
-        print("Contact email sent successfully.")
+        logger.info("Contact email sent successfully.")
         return True
     except Exception as e:
-        print(f"Failed to send contact email: {str(e)}")
+        logger.error(f"Failed to send contact email: {str(e)}")
         return False
 
 # Send a simple plain text email to a customer (for registration approval, upload confirmation, etc.)
@@ -177,17 +178,17 @@ def send_simple_email(to_email, subject, body):
         msg['To'] = to_email
         msg.set_content(body)
         
-        with smtplib.SMTP(str(EmailConfig.SMTP_SERVER), int(EmailConfig.SMTP_PORT)) as server:
+        with TimedSMTP(str(EmailConfig.SMTP_SERVER), int(EmailConfig.SMTP_PORT)) as server:
             server.starttls()
             server.login(str(EmailConfig.SMTP_USERNAME), str(EmailConfig.SMTP_PASSWORD))
             server.send_message(msg)
-        print("Simple email sent successfully.")
+        logger.info("Simple email sent successfully.")
         return True
     except Exception as e:
-        print("Failed to send simple email:", e)
+        logger.error(f"Failed to send simple email: {e}")
         return False
 
 def send_payment_confirmation_email(to_email, customer_name, bl_number):
     subject = "Payment Received - Thank You!"
     body = f"Dear {customer_name},\n\nWe have received your payment for Bill of Lading {bl_number}. Your CTN Number is now valid.\n\nThank you for your business!"
-    send_simple_email(to_email, subject, body)
+    return send_simple_email(to_email, subject, body)
@@ -2,13 +2,16 @@ import re
 import io
 import os
 import logging
+import fitz  # PyMuPDF
 from google.cloud import vision
 from dotenv import load_dotenv
 from typing import List, Dict, Tuple
+from config import OCRConfig
+from vision_utils import get_vision_client, ocr_images
+from utils.timing import stage, add_count
 
-logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 load_dotenv()
-client = vision.ImageAnnotatorClient()
 
 def extract_text_from_pdf(pdf_path: str) -> vision.AnnotateFileResponse:
     if not os.path.exists(pdf_path):
@@ -20,7 +23,9 @@ def extract_text_from_pdf(pdf_path: str) -> vision.AnnotateFileResponse:
     input_doc = vision.InputConfig(content=content, mime_type='application/pdf')
     feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
     request = vision.AnnotateFileRequest(input_config=input_doc, features=[feature])
-    response = client.batch_annotate_files(requests=[request])
+    add_count('vision_bytes', len(content))
+    with stage('vision_call'):
+        response = get_vision_client().batch_annotate_files(requests=[request])
     if not response.responses:
         raise ValueError("No response received from Vision API")
     return response.responses[0]
@@ -170,25 +175,84 @@ def parse_air_waybill_fields(ocr_text: str, page_response: vision.AnnotateFileRe
         'raw_text': ocr_text
     }
 
+def page_text_is_usable(text: str) -> bool:
+    """A text layer is usable if it has enough real characters and is not mostly garbage glyphs."""
+    if not text:
+        return False
+    stripped = ''.join(text.split())
+    if not stripped:
+        return False
+    alnum = sum(1 for c in stripped if c.isalnum())
+    garbage = stripped.count('\ufffd')
+    return alnum >= OCRConfig.TEXT_LAYER_MIN_CHARS and garbage / len(stripped) < 0.05
+
+def rasterize_page(page, dpi: int = None) -> bytes:
+    pix = page.get_pixmap(dpi=dpi or OCRConfig.RASTER_DPI)
+    return pix.tobytes("png")
+
+def read_text_layer(file_path: str) -> Tuple[List[str], List[int], List[bytes]]:
+    """
+    PyMuPDF text layer for every page (no network), plus the pages without a usable one, rasterized.
+    Returns (page_texts, missing page indexes, their PNG images).
+    """
+    with fitz.open(file_path) as pdf:
+        with stage('pymupdf_parse'):
+            page_texts = [page.get_text() for page in pdf]
+            missing = [i for i, text in enumerate(page_texts) if not page_text_is_usable(text)]
+        if not missing:
+            return page_texts, [], []
+        with stage('rasterize'):
+            images = [rasterize_page(pdf[i]) for i in missing]
+    return page_texts, missing, images
+
+def ocr_missing_pages(page_texts: List[str], missing: List[int], images: List[bytes]) -> Tuple[List[str], str]:
+    """Fill in the pages read_text_layer could not read with one batched Vision OCR; returns (page_texts, tier)."""
+    if not missing:
+        return page_texts, 'text_layer'
+    texts = ocr_images(images, feature_type=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+    for i, text in zip(missing, texts):
+        page_texts[i] = text
+    tier = 'vision' if len(missing) == len(page_texts) else 'mixed'
+    return page_texts, tier
+
+def extract_page_texts(file_path: str) -> Tuple[List[str], str]:
+    """
+    Tiered text extraction:
+    1. PyMuPDF text layer for every page (no network).
+    2. Only pages without a usable text layer are rasterized and sent to Vision.
+    Returns (page_texts, tier) where tier is 'text_layer', 'mixed' or 'vision'.
+    """
+    page_texts, missing, images = read_text_layer(file_path)
+    return ocr_missing_pages(page_texts, missing, images)
+
 def extract_fields(file_path: str) -> Dict:
-    print('=== extract_fields function called ===')
     try:
-        response = extract_text_from_pdf(file_path)
-        all_text = ""
-        for page_response in response.responses:
-            all_text += page_response.full_text_annotation.text + "\n"
-
-        if 'AIR WAYBILL' in all_text.upper():
-            fields = parse_air_waybill_fields(all_text, response.responses[0])
+        try:
+            text_layer = read_text_layer(file_path)
+        except Exception as e:
+            # PyMuPDF could not read the file; let Vision handle the whole PDF as before
+            logger.warning(f"Text layer extraction failed ({e}), sending whole PDF to Vision.")
+            response = extract_text_from_pdf(file_path)
+            page_texts = [r.full_text_annotation.text for r in response.responses]
+            tier = 'vision_pdf'
         else:
-            fields = parse_bol_fields(all_text, response.responses[0])
+            # A Vision failure here is reported once below, not retried with the whole PDF
+            page_texts, tier = ocr_missing_pages(*text_layer)
+        all_text = "\n".join(page_texts) + "\n"
+
+        # page_response is unused by the parsers; the text is all they need
+        with stage('parse_heuristics'):
+            if 'AIR WAYBILL' in all_text.upper():
+                fields = parse_air_waybill_fields(all_text, None)
+            else:
+                fields = parse_bol_fields(all_text, None)
+        fields['extraction_tier'] = tier
 
-        print("flight_or_vessel:", fields.get("flight_or_vessel", ""))
-        print("product_description:", fields.get("product_description", ""))
+        logger.debug(f"extract_fields served by tier: {tier} ({len(page_texts)} page(s))")
 
         return fields
     except Exception as e:
-        logging.error(f"Vision API failed: {e}.")
+        logger.error(f"Vision API failed: {e}.")
         return {'error': str(e)}
 
 if __name__ == "__main__":
@@ -675,7 +739,7 @@ if __name__ == "__main__":
 #         input_doc = vision.InputConfig(content=content, mime_type='application/pdf')
 #         feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
 #         request = vision.AnnotateFileRequest(input_config=input_doc, features=[feature])
-#         response = client.batch_annotate_files(requests=[request])
+#         response = get_vision_client().batch_annotate_files(requests=[request])
 #         if not response.responses:
 #             raise ValueError("No response received from Vision API")
 #         return response.responses[0]
@@ -0,0 +1,67 @@
+"""
+gunicorn configuration for IQSTrade (Procfile: gunicorn -c gunicorn.conf.py app:app)
+
+Most request time is spent waiting on Postgres, OpenAI, Vision, Cloudinary and SMTP, so the
+profiles trade memory for concurrency in different ways. Pick one with GUNICORN_PROFILE:
+
+    legacy   1 worker x 2 threads (the previous Procfile)
+    sync     one request per process; (2 x cores) + 1 workers
+    gthread  cores + 1 workers x GUNICORN_THREADS (default 8) threads      [default]
+    gevent   cooperative greenlets: cores workers x GUNICORN_WORKER_CONNECTIONS (default 100),
+             with psycopg2 made green by psycogreen (needs gevent and psycogreen installed)
+
+GUNICORN_WORKERS / GUNICORN_THREADS override the computed numbers. GUNICORN_MAX_WORKERS (default 4)
+caps the worker count, because containers often report the host's cores but not its memory.
+Compare the profiles with the load test: python -m loadtest.run run --profile <name>
+"""
+
+import os
+import multiprocessing
+
+PROFILE = os.getenv('GUNICORN_PROFILE', 'gthread').lower()
+CORES = multiprocessing.cpu_count()
+MAX_WORKERS = int(os.getenv('GUNICORN_MAX_WORKERS', 4))
+
+PROFILES = {
+    'legacy': {'worker_class': 'gthread', 'workers': 1, 'threads': 2},
+    'sync': {'worker_class': 'sync', 'workers': 2 * CORES + 1, 'threads': 1},
+    'gthread': {'worker_class': 'gthread', 'workers': CORES + 1, 'threads': 8},
+    'gevent': {'worker_class': 'gevent', 'workers': CORES, 'threads': 1},
+}
+if PROFILE not in PROFILES:
+    raise RuntimeError(f"Unknown GUNICORN_PROFILE '{PROFILE}' (choose from {', '.join(PROFILES)})")
+
+if PROFILE == 'gevent':
+    # Before anything imports socket/threading/psycopg2; the app is then loaded in each worker
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+_profile = PROFILES[PROFILE]
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = _profile['worker_class']
+workers = min(int(os.getenv('GUNICORN_WORKERS', _profile['workers'])), MAX_WORKERS)
+threads = int(os.getenv('GUNICORN_THREADS', _profile['threads']))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 100))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 20))
+keepalive = 5
+max_requests = 1000
+max_requests_jitter = 100
+# Load the app once in the master and fork it (smaller memory, faster restarts). gevent workers load
+# it themselves so monkey-patched modules are not shared across the fork.
+preload_app = PROFILE != 'gevent'
+
+
+def when_ready(server):
+    server.log.info(f"Profile {PROFILE}: {workers} x {worker_class} workers, {threads} threads"
+                    f"{f', {worker_connections} connections' if worker_class == 'gevent' else ''} ({CORES} cores)")
+
+
+def post_worker_init(worker):
+    # Per-worker setup registered by create_app() (SDK clients are built after the fork, not in the master)
+    from app import run_worker_init
+    run_worker_init(worker.wsgi)
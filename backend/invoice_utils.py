@@ -1,18 +1,22 @@
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
 import os
+import logging
 from config import get_db_conn, EmailConfig
-import smtplib
+from utils.mail_clients import TimedSMTP
+from utils.bill_identifiers import find_bills
+from utils.bl_matcher import resolve_bills
 from email.message import EmailMessage
 from email.utils import formataddr
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
+
+logger = logging.getLogger(__name__)
 
 def generate_invoice_pdf(customer, bill, service_fee, ctn_fee=None, payment_link=None, output_path=None):
-    print(f"[DEBUG] generate_invoice_pdf: customer={customer}, bill_id={bill.get('id')}, service_fee={service_fee}, ctn_fee={ctn_fee}, payment_link={payment_link}, output_path={output_path}")
+    logger.debug("generate_invoice_pdf: bill_id=%s, service_fee=%s, ctn_fee=%s, output_path=%s",
+                 bill.get('id'), service_fee, ctn_fee, output_path)
     if output_path is None:
         raise ValueError("output_path must be provided for Cloudinary workflow")
+    # reportlab is imported on first use to keep app start-up fast
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
     c = canvas.Canvas(output_path, pagesize=A4)
     c.setFont("Helvetica", 12)
     y = 800
@@ -48,17 +52,15 @@ def generate_invoice_pdf(customer, bill, service_fee, ctn_fee=None, payment_link
         y -= 30
     c.drawString(50, y, "Thank you for your business!")
     c.save()
-    print(f"[DEBUG] generate_invoice_pdf: PDF saved to {output_path}")
+    logger.debug("generate_invoice_pdf: PDF saved to %s", output_path)
     return output_path
 
 def send_invoice_email(to_email, subject, body, pdf_path):
     import tempfile
     import requests
-    print(f"[DEBUG] send_invoice_email: pdf_path={pdf_path} (type={type(pdf_path)})")
+    logger.debug("send_invoice_email: to=%s, pdf_path=%s, smtp=%s:%s",
+                 to_email, pdf_path, EmailConfig.SMTP_SERVER, EmailConfig.SMTP_PORT)
     try:
-        print(f"Attempting to send email to: {to_email}")
-        print(f"SMTP server: {EmailConfig.SMTP_SERVER}:{EmailConfig.SMTP_PORT}")
-        print(f"From email: {EmailConfig.FROM_EMAIL}")
         msg = EmailMessage()
         msg['Subject'] = subject
         msg['From'] = formataddr(('Logistics Company', EmailConfig.FROM_EMAIL))
@@ -67,13 +69,12 @@ def send_invoice_email(to_email, subject, body, pdf_path):
 
         # Download PDF if pdf_path is a URL
         if pdf_path.startswith('http://') or pdf_path.startswith('https://'):
-            print(f"[DEBUG] Downloading PDF from Cloudinary URL: {pdf_path}")
             response = requests.get(pdf_path)
             response.raise_for_status()
             with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
                 tmp.write(response.content)
                 local_pdf_path = tmp.name
-            print(f"[DEBUG] PDF downloaded to temp file: {local_pdf_path}")
+            logger.debug("Invoice PDF downloaded from %s to %s", pdf_path, local_pdf_path)
         else:
             local_pdf_path = pdf_path
 
@@ -93,36 +94,34 @@ def send_invoice_email(to_email, subject, body, pdf_path):
                 bl_number = m.group(1)
         attachment_filename = f"invoice_{bl_number}.pdf" if bl_number else "invoice.pdf"
 
-        print(f"Attaching PDF from: {local_pdf_path} as {attachment_filename}")
         with open(local_pdf_path, 'rb') as f:
             pdf_data = f.read()
             msg.add_attachment(pdf_data, maintype='application', subtype='pdf', filename=attachment_filename)
 
-        with smtplib.SMTP(EmailConfig.SMTP_SERVER, EmailConfig.SMTP_PORT) as server:
-            print("Starting TLS...")
+        with TimedSMTP(EmailConfig.SMTP_SERVER, EmailConfig.SMTP_PORT) as server:
             server.starttls()
-            print("Logging in...")
             server.login(EmailConfig.SMTP_USERNAME, EmailConfig.SMTP_PASSWORD)
-            print("Sending message...")
             server.send_message(msg)
-        print("Email sent successfully")
+        logger.info("Invoice email sent to %s (%s)", to_email, attachment_filename)
         # Clean up temp file if downloaded
         if pdf_path.startswith('http://') or pdf_path.startswith('https://'):
             try:
                 os.remove(local_pdf_path)
-                print(f"[DEBUG] Deleted temp file: {local_pdf_path}")
             except Exception as e:
-                print(f"[DEBUG] Failed to delete temp file: {str(e)}")
+                logger.debug("Failed to delete temp file %s: %s", local_pdf_path, e)
         return True
     except Exception as e:
-        print(f"Failed to send invoice email: {str(e)}")
-        print(f"Email config: {EmailConfig.SMTP_SERVER}, {EmailConfig.SMTP_PORT}, {EmailConfig.SMTP_USERNAME}, {EmailConfig.SMTP_PASSWORD}")
+        logger.error("Failed to send invoice email to %s via %s:%s as %s: %s",
+                     to_email, EmailConfig.SMTP_SERVER, EmailConfig.SMTP_PORT, EmailConfig.SMTP_USERNAME, e)
         return False
 
 def generate_pdf_from_text(text_content, filename):
     """
     Generates a PDF from a simple text string.
     """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph
+    from reportlab.lib.styles import getSampleStyleSheet
     pdf = SimpleDocTemplate(filename, pagesize=letter)
     styles = getSampleStyleSheet()
     p = Paragraph(text_content, styles["Normal"])
@@ -144,22 +143,17 @@ def find_ctn_info(bl_numbers):
     try:
         conn = get_db_conn()
         cur = conn.cursor()
+        bills_by_reference = find_bills(cur, bl_numbers, columns=('bl_number', 'unique_number'),
+                                        include_archive=True)
         for bl in bl_numbers:
-            cur.execute("""
-                SELECT bl_number, unique_number
-                FROM bill_of_lading
-                WHERE bl_number = %s
-                ORDER BY id DESC
-                LIMIT 1
-            """, (bl,))
-            row = cur.fetchone()
-            if row:
+            if bl in bills_by_reference:
+                bill = bills_by_reference[bl][0]
                 results.append({
-                    "bl_number": row[0],
-                    "ctn_number": row[1]
+                    "bl_number": bill['bl_number'],
+                    "ctn_number": bill['unique_number']
                 })
     except Exception as e:
-        print(f"[ERROR] Database error in find_ctn_info: {e}")
+        logger.error("Database error in find_ctn_info: %s", e)
     finally:
         if conn:
             cur.close()
@@ -178,34 +172,21 @@ def find_invoice_info(bl_numbers):
 
     conn = None
     results = []
-    print(f"[DEBUG] Looking up invoices for BLs: {bl_numbers}")
+    logger.debug("Looking up invoices for BLs: %s", bl_numbers)
     try:
         conn = get_db_conn()
         cur = conn.cursor()
+        columns = ('bl_number', 'invoice_filename', 'customer_name', 'service_fee', 'ctn_fee', 'payment_link')
+        bills_by_reference = resolve_bills(cur, bl_numbers, columns=columns, include_archive=True)
         for bl in bl_numbers:
-            bl_clean = bl.strip()
-            cur.execute("""
-                SELECT bl_number, invoice_filename, customer_name, service_fee, ctn_fee, payment_link
-                FROM bill_of_lading
-                WHERE bl_number = %s
-                ORDER BY id DESC
-                LIMIT 1
-            """, (bl_clean,))
-            row = cur.fetchone()
-            if row:
-                print(f"[DEBUG] Found invoice for BL {bl_clean}: {row[1]}")
-                results.append({
-                    "bl_number": row[0],
-                    "invoice_filename": row[1],
-                    "customer_name": row[2],
-                    "service_fee": row[3],
-                    "ctn_fee": row[4],
-                    "payment_link": row[5]
-                })
+            if bl in bills_by_reference:
+                bill = bills_by_reference[bl][0]
+                logger.debug("Found invoice for BL %s: %s", bl, bill['invoice_filename'])
+                results.append({column: bill[column] for column in columns})
             else:
-                print(f"[DEBUG] No invoice found for BL {bl_clean} in database.")
+                logger.debug("No invoice found for BL %s in database.", bl)
     except Exception as e:
-        print(f"[ERROR] Database error in find_invoice_info: {e}")
+        logger.error("Database error in find_invoice_info: %s", e)
     finally:
         if conn:
             cur.close()
@@ -1,7 +1,39 @@
+from flask import request
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
-limiter = Limiter(
+from config import LimiterConfig
+from utils.timing import stage
+import utils.limiter_storage  # registers the iqs+postgres:// and iqs+shm:// storage schemes
+
+# Endpoints (without the blueprint prefix) that skip rate limiting entirely: probes, static files, metrics
+EXEMPT_ENDPOINTS = {'ping', 'health', 'health_check', 'static', 'serve_static', 'serve_react', 'metrics'}
+EXEMPT_ENDPOINTS.update(name.strip() for name in LimiterConfig.EXEMPT_ENDPOINTS.split(',') if name.strip())
+
+
+def exempt_endpoint(*names):
+    """Add endpoints to the exemption registry (checked before any limiter bookkeeping)."""
+    EXEMPT_ENDPOINTS.update(names)
+
+
+def is_exempt_request() -> bool:
+    endpoint = request.endpoint
+    return endpoint is not None and endpoint.rsplit('.', 1)[-1] in EXEMPT_ENDPOINTS
+
+
+class TimedLimiter(Limiter):
+    """Limiter that skips exempt endpoints up front and times its checks as the 'limiter' stage."""
+
+    def _check_request_limit(self, callable_name=None, in_middleware=True):
+        if is_exempt_request():
+            return None
+        with stage('limiter'):
+            return super()._check_request_limit(callable_name=callable_name, in_middleware=in_middleware)
+
+
+limiter = TimedLimiter(
     key_func=get_remote_address,
-    default_limits=["1000 per day", "100 per hour"]
+    default_limits=["1000 per day", "100 per hour"],
+    storage_uri=LimiterConfig.STORAGE_URI
 )
+limiter.request_filter(is_exempt_request)
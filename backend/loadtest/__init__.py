@@ -0,0 +1,4 @@
+"""
+Load-test harness for IQSTrade.
+See loadtest/README.md for how to seed the database, start the stubs, run the scenarios and compare runs.
+"""
@@ -0,0 +1,300 @@
+"""
+Load-test scenarios. Each virtual user is a thread with its own HTTP session that logs in
+through /api/login like the React app does and then loops over the scenario's steps with
+seeded think times until the run ends.
+
+    dashboard     staff polling the bills list, stats and management overview
+    bulk_upload   staff uploading a batch of BL PDFs (Cloudinary + extraction through the stubs)
+    month_end     accounting pulling monthly and daily settlement exports
+    email_burst   the admin dropping a burst of customer emails into the stub inbox and ingesting it
+"""
+
+import os
+import re
+import time
+import base64
+import random
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import requests
+
+from loadtest.seed import bl_number, staff_username
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench', 'corpus')
+SERVER_TIMING_DB = re.compile(r'db;desc="(\d+) queries";dur=([\d.]+)')
+
+
+class Recorder:
+    """Samples of one run; only samples that start inside the measurement window are kept."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples: List[Dict] = []
+        self.measure_from = 0.0
+        self.measure_until = float('inf')
+
+    def record(self, sample: Dict):
+        if self.measure_from <= sample['start'] < self.measure_until:
+            with self.lock:
+                self.samples.append(sample)
+
+
+class RunContext:
+    def __init__(self, base_url: str, recorder: Recorder, stop: threading.Event, bills: int,
+                 stub_url: Optional[str] = None, password: str = 'loadtest', think_scale: float = 1.0,
+                 burst_size: int = 50, seed: int = 42):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.stop = stop
+        self.bills = bills
+        self.stub_url = stub_url.rstrip('/') if stub_url else None
+        self.password = password
+        self.think_scale = think_scale
+        self.burst_size = burst_size
+        self.seed = seed
+
+
+class VirtualUser:
+    def __init__(self, ctx: RunContext, scenario: str, username: str, rng: random.Random):
+        self.ctx = ctx
+        self.scenario = scenario
+        self.username = username
+        self.rng = rng
+        self.session = requests.Session()
+        self.session.trust_env = False
+        self.cookies: Dict[str, str] = {}
+
+    def login(self):
+        payload = {'username': self.username, 'password': self.ctx.password,
+                   'lot_number': 'loadtest', 'captcha_output': 'loadtest', 'pass_token': 'loadtest'}
+        response = self.request('login', 'POST', '/api/login', json=payload, authenticated=False)
+        for _ in range(5):
+            # 503: the app's password-hashing pool shed the login; retry as the browser would
+            if response is None or response.status_code != 503 or self.ctx.stop.is_set():
+                break
+            self.ctx.stop.wait(float(response.headers.get('Retry-After', 2)) * self.rng.uniform(0.5, 1.5))
+            response = self.request('login', 'POST', '/api/login', json=payload, authenticated=False)
+        if response is None or response.status_code != 200:
+            raise RuntimeError(f"login failed for {self.username}: "
+                               f"{response.status_code if response is not None else 'no response'}")
+        # The app scopes its cookies to the production domain, so they are sent by hand
+        self.cookies = {cookie.name: cookie.value for cookie in response.cookies}
+
+    def _headers(self, method: str, authenticated: bool) -> Dict[str, str]:
+        # Behind Render's proxy every request arrives as https
+        headers = {'X-Forwarded-Proto': 'https', 'Accept-Encoding': 'gzip, br'}
+        if authenticated and self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+            if method not in ('GET', 'HEAD', 'OPTIONS') and 'csrf_access_token' in self.cookies:
+                headers['X-CSRF-TOKEN'] = self.cookies['csrf_access_token']
+        return headers
+
+    def request(self, step: str, method: str, path: str, authenticated: bool = True, items: int = 1,
+                retry_auth: bool = True, **kwargs) -> Optional[requests.Response]:
+        start = time.perf_counter()
+        response = None
+        error = None
+        try:
+            response = self.session.request(method, self.ctx.base_url + path, timeout=120,
+                                            headers=self._headers(method, authenticated), **kwargs)
+            body_size = len(response.content)
+        except requests.RequestException as e:
+            error = type(e).__name__
+            body_size = 0
+        latency = time.perf_counter() - start
+        if response is not None and response.status_code == 401 and authenticated and retry_auth:
+            # Access tokens expire after an hour
+            self.login()
+            return self.request(step, method, path, authenticated, items, retry_auth=False, **kwargs)
+        sample = {
+            'scenario': self.scenario, 'step': step, 'start': start, 'latency': latency,
+            'status': response.status_code if response is not None else 0, 'bytes': body_size,
+            'items': items, 'error': error,
+        }
+        timing = SERVER_TIMING_DB.search(response.headers.get('Server-Timing', '')) if response is not None else None
+        if timing:
+            sample['db_queries'] = int(timing.group(1))
+            sample['db_ms'] = float(timing.group(2))
+        self.ctx.recorder.record(sample)
+        return response
+
+    def think(self, low: float, high: float):
+        self.ctx.stop.wait(self.rng.uniform(low, high) * self.ctx.think_scale)
+
+
+class Scenario:
+    name = ''
+    default_users = 1
+
+    def usernames(self, count: int) -> List[str]:
+        return [staff_username(i + 1) for i in range(count)]
+
+    def setup(self, ctx: RunContext):
+        pass
+
+    def iteration(self, user: VirtualUser):
+        raise NotImplementedError
+
+
+class DashboardPolling(Scenario):
+    """What a staff member's open dashboard tabs do all day."""
+    name = 'dashboard'
+    default_users = 20
+
+    def iteration(self, user: VirtualUser):
+        rng = user.rng
+        user.request('bills_page', 'GET', f'/api/bills?page={rng.choice((1, 1, 1, 2, 3))}&page_size=50')
+        user.request('stats_summary', 'GET', '/api/stats/summary')
+        user.request('outstanding_bills', 'GET', '/api/stats/outstanding_bills')
+        user.request('awaiting_bank_in', 'GET', '/api/bills/awaiting_bank_in')
+        if rng.random() < 0.25:
+            bl = bl_number(rng.randint(1, max(1, user.ctx.bills)))
+            user.request('search_bl', 'GET', f'/api/bills?bl_number={bl[:-3]}')
+        if rng.random() < 0.15:
+            user.request('bill_detail', 'GET', f'/api/bill/{rng.randint(1, max(1, user.ctx.bills))}')
+        if rng.random() < 0.1:
+            user.request('management_overview', 'GET', '/api/management/overview')
+        user.think(1.0, 3.0)
+
+
+def minimal_pdf(lines: List[str]) -> bytes:
+    """A valid one-page PDF with a text layer (used when bench/corpus has not been generated)."""
+    text = ' '.join(f'({line.replace("(", "").replace(")", "")}) Tj 0 -16 Td' for line in lines)
+    stream = f'BT /F1 11 Tf 50 780 Td {text} ET'.encode('latin-1', errors='replace')
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R '
+        b'/Resources << /Font << /F1 5 0 R >> >> >>',
+        b'<< /Length ' + str(len(stream)).encode() + b' >>\nstream\n' + stream + b'\nendstream',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    out = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    out += b''.join(f'{offset:010d} 00000 n \n'.encode() for offset in offsets)
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    return out
+
+
+def sample_pdfs(count: int, rng: random.Random, bills: int) -> List[bytes]:
+    corpus = sorted(os.path.join(CORPUS_DIR, name) for name in os.listdir(CORPUS_DIR)
+                    if name.endswith('.pdf')) if os.path.isdir(CORPUS_DIR) else []
+    pdfs = []
+    for i in range(count):
+        if corpus:
+            with open(corpus[i % len(corpus)], 'rb') as f:
+                pdfs.append(f.read())
+        else:
+            bl = bl_number(rng.randint(1, max(1, bills)))
+            pdfs.append(minimal_pdf([
+                'BILL OF LADING', f'B/L No.: {bl}', 'SHIPPER: GOLDEN HARBOUR EXPORT CO., LTD.',
+                'CONSIGNEE: PACIFIC RIM LOGISTICS LIMITED', 'PORT OF LOADING: SHANGHAI',
+                'PORT OF DISCHARGE: HONG KONG', f'CONTAINER NO.: MSCU{rng.randint(1000000, 9999999)}',
+            ]))
+    return pdfs
+
+
+class BulkUpload(Scenario):
+    """Staff uploading a customer's batch of BL PDFs."""
+    name = 'bulk_upload'
+    default_users = 4
+    files_per_upload = 5
+
+    def iteration(self, user: VirtualUser):
+        pdfs = sample_pdfs(self.files_per_upload, user.rng, user.ctx.bills)
+        files = [('bill_pdf', (f'bl_{i}.pdf', data, 'application/pdf')) for i, data in enumerate(pdfs)]
+        form = {'name': 'Load Test Customer', 'email': 'cust1@loadtest.invalid', 'phone': '+85260000001'}
+        user.request('upload_batch', 'POST', '/api/upload', data=form, files=files, items=len(pdfs))
+        user.think(3.0, 8.0)
+
+
+class MonthEndExport(Scenario):
+    """Accounting closing the month: monthly settlement report plus a few daily views."""
+    name = 'month_end'
+    default_users = 3
+
+    def iteration(self, user: VirtualUser):
+        rng = user.rng
+        month_start = datetime.now().replace(day=1) - timedelta(days=rng.randint(0, 2) * 28)
+        user.request('account_bills_monthly', 'GET', f'/api/account_bills_monthly?completed_month={month_start:%Y-%m}')
+        day = month_start + timedelta(days=rng.randint(0, 27))
+        user.request('account_bills_daily', 'GET', f'/api/account_bills?completed_at={day:%Y-%m-%d}')
+        user.request('payments_by_date', 'GET', '/api/stats/payments_by_date')
+        user.think(2.0, 5.0)
+
+
+class EmailBurst(Scenario):
+    """A burst of customer emails (receipts with PDFs, invoice requests, enquiries) ingested by the admin."""
+    name = 'email_burst'
+    default_users = 1
+
+    def usernames(self, count: int) -> List[str]:
+        return ['ray40'] * count
+
+    def setup(self, ctx: RunContext):
+        if not ctx.stub_url:
+            raise RuntimeError("email_burst needs the stub control URL (--stub-url)")
+
+    def _messages(self, user: VirtualUser) -> List[Dict]:
+        rng = user.rng
+        receipt_pdf = base64.b64encode(minimal_pdf(['BANK TRANSFER RECEIPT', 'HKD 400.00'])).decode()
+        messages = []
+        for _ in range(user.ctx.burst_size):
+            bl = bl_number(rng.randint(1, max(1, user.ctx.bills)))
+            kind = rng.random()
+            if kind < 0.45:
+                amount = rng.randint(1, 8) * 200
+                messages.append({'subject': f'Payment receipt for {bl}',
+                                 'body': f'Dear team,\n\nPlease find attached the bank slip for {bl}. '
+                                         f'Amount paid: HKD {amount:.2f}.\n\nRegards',
+                                 'attachments': [{'filename': f'receipt_{bl}.pdf', 'content_b64': receipt_pdf}]})
+            elif kind < 0.7:
+                messages.append({'subject': f'Invoice request {bl}',
+                                 'body': f'Hi,\n\nCould you send the invoice for {bl}?\n\nThanks'})
+            else:
+                messages.append({'subject': 'Container arrival time',
+                                 'body': f'Hello,\n\nWhen will the containers on {bl} be released?\n\nBest regards'})
+            messages[-1]['from'] = f'cust{rng.randint(1, 5000)}@loadtest.invalid'
+            messages[-1]['message_id'] = f'<burst-{user.ctx.seed}-{rng.getrandbits(48):012x}@loadtest.invalid>'
+        return messages
+
+    def iteration(self, user: VirtualUser):
+        requests.post(f'{user.ctx.stub_url}/_control/mailbox', json={'messages': self._messages(user)}, timeout=30)
+        user.request('ingest_burst', 'POST', '/admin/ingest-emails', items=user.ctx.burst_size)
+        user.think(5.0, 10.0)
+
+
+SCENARIOS = {cls.name: cls for cls in (DashboardPolling, BulkUpload, MonthEndExport, EmailBurst)}
+
+
+def run_user(scenario: Scenario, user: VirtualUser):
+    try:
+        user.login()
+    except Exception as e:
+        user.ctx.recorder.record({'scenario': user.scenario, 'step': 'login', 'start': time.perf_counter(),
+                                  'latency': 0.0, 'status': 0, 'bytes': 0, 'items': 1, 'error': str(e)})
+        return
+    # Spread the first iterations so users do not march in lockstep
+    user.think(0.0, 1.0)
+    while not user.ctx.stop.is_set():
+        scenario.iteration(user)
+
+
+def start_scenario(name: str, users: int, ctx: RunContext) -> List[threading.Thread]:
+    scenario = SCENARIOS[name]()
+    scenario.setup(ctx)
+    threads = []
+    for i, username in enumerate(scenario.usernames(users)):
+        rng = random.Random(f'{ctx.seed}-{name}-{i}')
+        user = VirtualUser(ctx, name, username, rng)
+        thread = threading.Thread(target=run_user, args=(scenario, user), name=f'{name}-{i}', daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
@@ -0,0 +1,21 @@
+-- Columns and tables the application uses that no file in setup_local_db.sql or migrations/ creates.
+-- Applied by loadtest/seed.py after those files, so a fresh load-test database matches production.
+
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS flight_or_vessel TEXT;
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS product_description TEXT;
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS payment_method VARCHAR(50);
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS payment_status VARCHAR(50);
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS reserve_status VARCHAR(50);
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS reserve_amount NUMERIC(12, 2);
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS allinpay_85_received_at TIMESTAMPTZ;
+
+ALTER TABLE customer_emails ADD COLUMN IF NOT EXISTS processed_for_payments BOOLEAN DEFAULT FALSE;
+
+CREATE TABLE IF NOT EXISTS email_ingest_errors (
+    id SERIAL PRIMARY KEY,
+    filename TEXT,
+    reason TEXT,
+    raw_text TEXT,
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
@@ -0,0 +1,340 @@
+"""
+Seed a load-test database with realistic volumes.
+
+Rows are generated deterministically from --seed and streamed into Postgres with COPY, so
+1M bills take a couple of minutes and two runs with the same arguments produce the same data
+(and comparable load-test results).
+
+Usage (from backend/, DB_* environment variables point at the load-test database):
+    python -m loadtest.seed --init-schema --reset
+    python -m loadtest.seed --bills 1000000 --customers 5000 --staff 40 --emails 200000
+
+Accounts (password for all: --password, default 'loadtest'):
+    ray40                  admin (the admin routes are gated on this username)
+    lt_staff_0001 ...      staff
+    lt_cust_000001 ...     approved customers; bills are spread over them
+BL numbers are bl_number(i) for i in 1..--bills, so scenarios can reference real rows.
+"""
+
+import io
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from config import get_db_conn, DatabaseConfig
+
+LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+SEEDED_TABLES = ('customer_email_replies', 'customer_emails', 'bill_of_lading', 'bill_of_lading_archive',
+                 'bill_archive_stats', 'bill_extractions', 'bill_identifiers', 'audit_logs',
+                 'password_reset_tokens', 'users')
+
+PORTS_OF_LOADING = ['SHANGHAI', 'NINGBO', 'SHENZHEN', 'QINGDAO', 'BUSAN', 'SINGAPORE', 'KAOHSIUNG', 'XIAMEN']
+PORTS_OF_DISCHARGE = ['HONG KONG', 'KWAI CHUNG', 'TSING YI', 'LOS ANGELES', 'ROTTERDAM', 'HAMBURG']
+VESSELS = ['EVER GIVEN', 'MSC OSCAR', 'COSCO SHIPPING ARIES', 'OOCL HONG KONG', 'MAERSK ESSEN', 'CMA CGM MARCO POLO']
+PRODUCTS = ['FURNITURE', 'ELECTRONIC PARTS', 'GARMENTS', 'TOYS', 'MACHINERY PARTS', 'FROZEN SEAFOOD', 'PLASTIC RESIN']
+COMPANIES = ['Golden Harbour Trading', 'Pacific Rim Logistics', 'Dragon Gate Imports', 'Lotus Supply Chain',
+             'Jade River Exports', 'Kowloon Freight Partners', 'Silverline Merchants', 'Eastwind Wholesale']
+OWNER_CODES = ['MSCU', 'MAEU', 'OOLU', 'CMAU', 'COSU', 'EGLV', 'HLXU', 'TGHU']
+
+# Status mix of a mature system: most bills are paid and completed, a working set is open
+STATUS_WEIGHTS = [('Paid and CTN Valid', 78), ('Pending', 9), ('Invoice Sent', 8), ('Awaiting Bank In', 5)]
+EMAIL_KINDS = [('payment_receipt', 45), ('invoice_request', 25), ('general_enquiry', 30)]
+
+
+def bl_number(i: int) -> str:
+    """BL number of the i-th seeded bill (1-based)."""
+    return f"LTBL{i:09d}"
+
+
+def staff_username(i: int) -> str:
+    return f"lt_staff_{i:04d}"
+
+
+def customer_username(i: int) -> str:
+    return f"lt_cust_{i:06d}"
+
+
+def _weighted(rng, weights):
+    total = sum(w for _, w in weights)
+    pick = rng.uniform(0, total)
+    for value, weight in weights:
+        pick -= weight
+        if pick <= 0:
+            return value
+    return weights[-1][0]
+
+
+def _copy_value(value) -> str:
+    """One field in COPY text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        # text[] literal, then escaped like any other text
+        elements = (str(v).replace('\\', '\\\\').replace('"', '\\"') for v in value)
+        value = '{' + ','.join(f'"{e}"' for e in elements) + '}'
+    text = str(value)
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class RowStream(io.RawIOBase):
+    """File-like object that renders rows to COPY text on demand (nothing is held in memory)."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while len(self._buffer) < len(target):
+            chunk = []
+            for row in self._rows:
+                chunk.append('\t'.join(_copy_value(v) for v in row))
+                if len(chunk) >= 1000:
+                    break
+            if not chunk:
+                break
+            self._buffer += ('\n'.join(chunk) + '\n').encode('utf-8')
+        n = min(len(target), len(self._buffer))
+        target[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def copy_rows(cur, table: str, columns, rows):
+    started = time.perf_counter()
+    stream = io.BufferedReader(RowStream(rows), buffer_size=1 << 20)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", stream)
+    print(f"[seed] {table}: {cur.rowcount} rows in {time.perf_counter() - started:.1f}s")
+
+
+# --- Row generators ---
+
+USER_COLUMNS = ('username', 'password_hash', 'role', 'approved', 'customer_name', 'customer_email',
+                'customer_phone', 'created_at')
+
+
+def user_rows(args, password_hash, now):
+    yield ('ray40', password_hash, 'admin', True, 'Load Test Admin', 'ray40@loadtest.invalid', '+85290000000', now)
+    for i in range(1, args.staff + 1):
+        yield (staff_username(i), password_hash, 'staff', True, f'Staff {i}', f'staff{i}@loadtest.invalid',
+               f'+8529{i:07d}', now)
+    rng = random.Random(args.seed)
+    for i in range(1, args.customers + 1):
+        company = f"{rng.choice(COMPANIES)} {i}"
+        yield (customer_username(i), password_hash, 'customer', True, company, f'cust{i}@loadtest.invalid',
+               f'+8526{i:07d}', now - timedelta(days=rng.randint(0, 900)))
+
+
+BILL_COLUMNS = (
+    'customer_name', 'customer_email', 'customer_phone', 'pdf_filename', 'shipper', 'consignee',
+    'port_of_loading', 'port_of_discharge', 'bl_number', 'container_numbers', 'flight_or_vessel',
+    'product_description', 'service_fee', 'ctn_fee', 'payment_link', 'receipt_filename', 'status',
+    'invoice_filename', 'unique_number', 'created_at', 'updated_at', 'receipt_uploaded_at', 'completed_at',
+    'customer_username', 'payment_method', 'payment_status', 'reserve_status', 'reserve_amount',
+    'allinpay_85_received_at',
+)
+
+
+def bill_rows(args, now):
+    rng = random.Random(args.seed + 1)
+    span_days = args.history_days
+    for i in range(1, args.bills + 1):
+        cust = rng.randint(1, args.customers)
+        company = f"{COMPANIES[cust % len(COMPANIES)]} {cust}"
+        # Skewed towards recent months, like a growing business
+        age_days = span_days * (rng.random() ** 1.6)
+        created = now - timedelta(days=age_days, seconds=rng.randint(0, 86399))
+        containers = [f"{rng.choice(OWNER_CODES)}{rng.randint(1000000, 9999999)}" for _ in range(rng.choice((1, 1, 1, 2, 2, 3, 4)))]
+        fee = 100 * len(containers)
+        status = _weighted(rng, STATUS_WEIGHTS)
+        # Old bills are settled; only recent ones are still open
+        if age_days > 45:
+            status = 'Paid and CTN Valid'
+        bl = bl_number(i)
+        unique_number = None
+        payment_link = invoice = receipt = receipt_at = completed_at = None
+        payment_method = payment_status = reserve_status = reserve_amount = allinpay_at = None
+        if status != 'Pending':
+            unique_number = f"{''.join(rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ') for _ in range(3))}{i:06d}"
+            payment_link = f"https://pay.example.com/{i}?ctn={fee}&svc={fee}&uniquenum={unique_number}"
+            invoice = f"https://res.cloudinary.com/loadtest/raw/upload/invoices/{bl}.pdf"
+        if status in ('Awaiting Bank In', 'Paid and CTN Valid'):
+            receipt_at = min(now, created + timedelta(days=rng.uniform(0.5, 10)))
+            receipt = f"https://res.cloudinary.com/loadtest/raw/upload/receipts/{bl}.pdf"
+        if status == 'Paid and CTN Valid':
+            completed_at = min(now, receipt_at + timedelta(days=rng.uniform(0.1, 5)))
+            if rng.random() < 0.4:
+                # Allinpay: 85% up front, the 15% reserve settles later (recent ones often still open)
+                payment_method = 'Allinpay'
+                allinpay_at = completed_at
+                reserve_amount = round(fee * 2 * 0.15, 2)
+                if age_days < 60 and rng.random() < 0.5:
+                    payment_status, reserve_status = 'Paid 85%', 'Unsettled'
+                else:
+                    payment_status, reserve_status = 'Paid 100%', 'Reserve Settled'
+            else:
+                payment_method = 'Bank Transfer'
+                payment_status = 'Paid 100%'
+        yield (
+            company, f'cust{cust}@loadtest.invalid', f'+8526{cust:07d}',
+            f"https://res.cloudinary.com/loadtest/raw/upload/bill/{bl}.pdf",
+            f"{rng.choice(COMPANIES)} Export Co., Ltd.", company,
+            rng.choice(PORTS_OF_LOADING), rng.choice(PORTS_OF_DISCHARGE), bl, ', '.join(containers),
+            f"{rng.choice(VESSELS)} V.{rng.randint(100, 999)}{rng.choice('NSEW')}", rng.choice(PRODUCTS),
+            fee, fee, payment_link, receipt, status, invoice, unique_number,
+            created, completed_at or receipt_at or created, receipt_at, completed_at,
+            customer_username(cust), payment_method, payment_status, reserve_status, reserve_amount, allinpay_at,
+        )
+
+
+EMAIL_COLUMNS = ('sender', 'subject', 'body', 'attachments', 'bl_numbers', 'created_at', 'processed_at',
+                 'classification', 'openai_processed', 'processed_for_payments', 'message_id')
+
+
+def email_rows(args, now):
+    rng = random.Random(args.seed + 2)
+    for i in range(1, args.emails + 1):
+        cust = rng.randint(1, args.customers)
+        kind = _weighted(rng, EMAIL_KINDS)
+        bls = [bl_number(rng.randint(1, args.bills)) for _ in range(rng.choice((0, 1, 1, 1, 2)))] if args.bills else []
+        created = now - timedelta(days=args.history_days * (rng.random() ** 1.6), seconds=rng.randint(0, 86399))
+        if kind == 'payment_receipt':
+            subject = f"Payment receipt for {', '.join(bls) or 'our shipment'}"
+            body = (f"Dear team,\n\nPlease find attached the bank slip for {', '.join(bls) or 'our bills'}. "
+                    f"Amount paid: HKD {rng.randint(1, 8) * 200:.2f}.\n\nRegards,\n{COMPANIES[cust % len(COMPANIES)]}")
+            attachments = [f"receipt_{i}.pdf"]
+        elif kind == 'invoice_request':
+            subject = f"Invoice request {' '.join(bls)}".strip()
+            body = f"Hi,\n\nCould you send the invoice for {', '.join(bls) or 'our latest shipment'}?\n\nThanks"
+            attachments = []
+        else:
+            subject = rng.choice(['Container arrival time', 'Documents needed for customs', 'Change of consignee',
+                                  'Storage charges question', 'Delivery appointment'])
+            body = f"Hello,\n\n{subject}: could you advise on {', '.join(bls) or 'our booking'}?\n\nBest regards"
+            attachments = []
+        yield (f'cust{cust}@loadtest.invalid', subject, body, attachments, bls, created,
+               created + timedelta(minutes=rng.randint(1, 30)), kind, True, True, f'<lt-{args.seed}-{i}@loadtest.invalid>')
+
+
+REPLY_COLUMNS = ('customer_email_id', 'sender', 'body', 'created_at', 'is_draft', 'sent_at', 'sent_via',
+                 'confidence_score', 'auto_send_recommended', 'auto_sent')
+
+
+def reply_rows(args, now, first_email_id):
+    rng = random.Random(args.seed + 3)
+    for i in range(args.emails):
+        if rng.random() > args.reply_ratio:
+            continue
+        created = now - timedelta(days=args.history_days * (rng.random() ** 1.6))
+        sent = rng.random() < 0.8
+        confidence = round(rng.uniform(0.3, 0.99), 2)
+        yield (first_email_id + i, 'openai_draft', 'Dear customer,\n\nThank you for your email. '
+               'We have received your request and will get back to you shortly.\n\nBest regards,\nIQSTrade',
+               created, not sent, created + timedelta(minutes=5) if sent else None, 'email' if sent else None,
+               confidence, confidence >= 0.85, sent and confidence >= 0.85)
+
+
+# --- Schema and orchestration ---
+
+def apply_schema(conn):
+    """setup_local_db.sql, then every migration in name order, then schema_extras.sql (each file on its own)."""
+    migrations_dir = os.path.join(BACKEND_DIR, 'migrations')
+    files = [os.path.join(BACKEND_DIR, 'setup_local_db.sql')]
+    files += [os.path.join(migrations_dir, name) for name in sorted(os.listdir(migrations_dir)) if name.endswith('.sql')]
+    files.append(os.path.join(LOADTEST_DIR, 'schema_extras.sql'))
+    for path in files:
+        with open(path, 'r', encoding='utf-8') as f:
+            sql = f.read()
+        cur = conn.cursor()
+        try:
+            cur.execute(sql)
+            conn.commit()
+            print(f"[seed] applied {os.path.relpath(path, BACKEND_DIR)}")
+        except Exception as e:
+            # Older migrations are not idempotent; on an existing schema they fail harmlessly
+            conn.rollback()
+            print(f"[seed] skipped {os.path.relpath(path, BACKEND_DIR)}: {str(e).strip().splitlines()[0]}")
+        finally:
+            cur.close()
+
+
+def reset_tables(conn):
+    cur = conn.cursor()
+    cur.execute(f"TRUNCATE {', '.join(SEEDED_TABLES)} RESTART IDENTITY CASCADE")
+    conn.commit()
+    cur.close()
+    print(f"[seed] truncated {', '.join(SEEDED_TABLES)}")
+
+
+def seed(args):
+    from utils.password_hashing import hash_password
+
+    conn = get_db_conn()
+    if conn is None:
+        raise SystemExit("[seed] could not connect to the database (check DB_* environment variables)")
+    if args.init_schema:
+        apply_schema(conn)
+    if args.reset:
+        reset_tables(conn)
+
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    # Same scheme and cost as the app, so the first logins do not trigger rehashes
+    password_hash = hash_password(args.password)
+    cur = conn.cursor()
+    # get_db_conn() sets a 30s statement_timeout; a 1M-row COPY takes longer
+    cur.execute("SET statement_timeout = 0")
+    started = time.perf_counter()
+    copy_rows(cur, 'users', USER_COLUMNS, user_rows(args, password_hash, now))
+    copy_rows(cur, 'bill_of_lading', BILL_COLUMNS, bill_rows(args, now))
+    copy_rows(cur, 'customer_emails', EMAIL_COLUMNS, email_rows(args, now))
+    # One COPY takes consecutive ids, so replies can address emails by offset
+    cur.execute("SELECT id FROM customer_emails WHERE message_id = %s", (f'<lt-{args.seed}-1@loadtest.invalid>',))
+    row = cur.fetchone()
+    first_email_id = row[0] if row else 0
+    copy_rows(cur, 'customer_email_replies', REPLY_COLUMNS, reply_rows(args, now, first_email_id))
+    conn.commit()
+    for table in ('users', 'bill_of_lading', 'customer_emails', 'customer_email_replies'):
+        cur.execute(f"ANALYZE {table}")
+    conn.commit()
+    cur.close()
+    conn.close()
+    print(f"[seed] done in {time.perf_counter() - started:.1f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed the load-test database")
+    parser.add_argument('--bills', type=int, default=1_000_000)
+    parser.add_argument('--customers', type=int, default=5_000)
+    parser.add_argument('--staff', type=int, default=40)
+    parser.add_argument('--emails', type=int, default=200_000)
+    parser.add_argument('--reply-ratio', type=float, default=0.6, help="fraction of emails with a reply row")
+    parser.add_argument('--history-days', type=int, default=730, help="bills and emails are spread over this many days")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--password', default='loadtest')
+    parser.add_argument('--init-schema', action='store_true', help="apply setup_local_db.sql, migrations and schema_extras.sql first")
+    parser.add_argument('--reset', action='store_true', help="TRUNCATE the seeded tables first")
+    parser.add_argument('--force', action='store_true', help="allow --reset on a database whose name does not contain 'loadtest'")
+    args = parser.parse_args(argv)
+
+    if args.reset and 'loadtest' not in DatabaseConfig.dbname() and not args.force:
+        raise SystemExit(f"[seed] refusing to truncate database '{DatabaseConfig.dbname()}' "
+                         f"(name does not contain 'loadtest'; pass --force if you mean it)")
+    seed(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,515 @@
+"""
+Stub servers for the external services the app talks to, so a load test measures the app and
+not somebody else's API (and costs nothing):
+
+    HTTP   OpenAI chat completions   POST /v1/chat/completions   (answers follow the request's json_schema)
+           Google Vision (REST)      POST /v1/images:annotate, /v1/files:annotate
+           Cloudinary uploads        POST /v1_1/<cloud>/<resource_type>/upload
+           control                   GET /_control/stats, POST /_control/mailbox, POST /_control/reset
+    SMTP   STARTTLS + AUTH, messages are counted and dropped
+    IMAPS  one shared inbox, filled through /_control/mailbox
+
+Each service answers after a configurable latency (lognormal jitter around the median, seeded),
+so the app sees realistic provider delays. Usage (from backend/):
+
+    python -m loadtest.stubs --http-port 8089 --smtp-port 2525 --imap-port 1993 \
+        --latency openai=0.9,vision=0.4,cloudinary=0.25,smtp=0.08,imap=0.005
+
+loadtest/run.py starts this module itself and points the app at it (see app_environment()).
+"""
+
+import os
+import re
+import ssl
+import sys
+import json
+import time
+import math
+import base64
+import random
+import argparse
+import threading
+import socketserver
+import subprocess
+from email.message import EmailMessage
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+DEFAULT_LATENCY = {'openai': 0.9, 'vision': 0.4, 'cloudinary': 0.25, 'smtp': 0.08, 'imap': 0.005}
+BL_PATTERN = re.compile(r'\b[A-Z]{4}\d{6,10}\b')
+AMOUNT_PATTERN = re.compile(r'(?:HKD|USD|\$)\s*([\d,]+(?:\.\d+)?)')
+
+
+def parse_latency(spec: str) -> Dict[str, float]:
+    """'openai=0.9,vision=0.4' -> {'openai': 0.9, 'vision': 0.4, ...defaults for the rest}"""
+    latency = dict(DEFAULT_LATENCY)
+    for part in (spec or '').split(','):
+        name, _, value = part.partition('=')
+        if name.strip() and value.strip():
+            latency[name.strip()] = float(value)
+    return latency
+
+
+class StubState:
+    """Counters, latency model and the shared IMAP inbox. Thread-safe."""
+
+    def __init__(self, latency: Dict[str, float], jitter: float = 0.35, seed: int = 7):
+        self.latency = latency
+        self.jitter = jitter
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.calls: Dict[str, int] = {}
+        self.bytes_in: Dict[str, int] = {}
+        self.mailbox: List[Dict] = []
+
+    def delay(self, service: str):
+        median = self.latency.get(service, 0)
+        if median <= 0:
+            return
+        with self.lock:
+            factor = math.exp(self.rng.gauss(0, self.jitter))
+        time.sleep(median * factor)
+
+    def count(self, service: str, nbytes: int = 0):
+        with self.lock:
+            self.calls[service] = self.calls.get(service, 0) + 1
+            self.bytes_in[service] = self.bytes_in.get(service, 0) + nbytes
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'calls': dict(self.calls),
+                'bytes_in': dict(self.bytes_in),
+                'mailbox': len(self.mailbox),
+                'mailbox_unseen': sum(1 for m in self.mailbox if not m['seen']),
+                'latency': self.latency,
+            }
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.bytes_in.clear()
+            self.mailbox.clear()
+
+    def add_messages(self, specs: List[Dict]) -> int:
+        raw = [build_message(spec) for spec in specs]
+        with self.lock:
+            self.mailbox.extend({'raw': data, 'seen': False} for data in raw)
+            return len(self.mailbox)
+
+    def purge_seen(self):
+        with self.lock:
+            self.mailbox = [m for m in self.mailbox if not m['seen']]
+
+
+def build_message(spec: Dict) -> bytes:
+    """{'from', 'to', 'subject', 'body', 'message_id', 'attachments': [{'filename', 'content_b64'}]} -> RFC822 bytes"""
+    msg = EmailMessage()
+    msg['From'] = spec.get('from', 'customer@loadtest.invalid')
+    msg['To'] = spec.get('to', 'inbox@loadtest.invalid')
+    msg['Subject'] = spec.get('subject', '')
+    msg['Message-ID'] = spec.get('message_id') or f"<stub-{time.time_ns()}@loadtest.invalid>"
+    msg.set_content(spec.get('body', ''))
+    for attachment in spec.get('attachments', []):
+        msg.add_attachment(base64.b64decode(attachment['content_b64']), maintype='application',
+                           subtype='pdf', filename=attachment['filename'])
+    return msg.as_bytes()
+
+
+# --- OpenAI ---
+
+def _prompt_text(messages) -> str:
+    parts = []
+    for message in messages or []:
+        content = message.get('content')
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(item.get('text', '') for item in content if isinstance(item, dict))
+    return '\n'.join(parts)
+
+
+def fake_value(name: str, schema: Dict, text: str):
+    """A plausible value for `schema`, using what the prompt says (BL numbers, amounts, keywords)."""
+    kind = schema.get('type')
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != 'null'), 'null')
+    lowered = text.lower()
+    if 'enum' in schema:
+        for option in schema['enum']:
+            if option is not None and str(option).replace('_', ' ').split(' ')[-1] in lowered:
+                return option
+        return schema['enum'][0]
+    if kind == 'object':
+        return {key: fake_value(key, sub, text) for key, sub in schema.get('properties', {}).items()}
+    if kind == 'array':
+        if 'bl' in name.lower():
+            return list(dict.fromkeys(BL_PATTERN.findall(text)))[:5]
+        return []
+    if kind in ('number', 'integer'):
+        match = AMOUNT_PATTERN.search(text)
+        value = float(match.group(1).replace(',', '')) if match else 0
+        return int(value) if kind == 'integer' else value
+    if kind == 'boolean':
+        return False
+    if kind == 'string':
+        key = name.lower()
+        if 'bl' in key:
+            found = BL_PATTERN.findall(text)
+            return found[0] if found else ''
+        if any(word in key for word in ('reply', 'draft', 'body', 'response')):
+            return ("Dear customer,\n\nThank you for your email. We have received your request and "
+                    "will get back to you shortly.\n\nBest regards,\nIQSTrade")
+        return ''
+    return None
+
+
+def openai_response(payload: Dict) -> Dict:
+    text = _prompt_text(payload.get('messages'))
+    response_format = payload.get('response_format') or {}
+    if response_format.get('type') == 'json_schema':
+        schema = response_format.get('json_schema', {}).get('schema', {})
+        content = json.dumps(fake_value('', schema, text))
+    elif response_format.get('type') == 'json_object':
+        content = '{}'
+    else:
+        content = "Dear customer,\n\nThank you for your email. We will get back to you shortly.\n\nBest regards"
+    prompt_tokens = max(1, len(text) // 4)
+    completion_tokens = max(1, len(content) // 4)
+    return {
+        'id': f'chatcmpl-stub-{time.time_ns()}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': payload.get('model', 'gpt-4o'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens},
+    }
+
+
+# --- Google Vision ---
+
+def vision_text(rng: random.Random) -> str:
+    bl = f"LTBL{rng.randint(1, 999999):09d}"
+    return (f"BILL OF LADING\nB/L No.: {bl}\nSHIPPER: GOLDEN HARBOUR EXPORT CO., LTD.\n"
+            f"CONSIGNEE: PACIFIC RIM LOGISTICS LIMITED\nPORT OF LOADING: SHANGHAI\n"
+            f"PORT OF DISCHARGE: HONG KONG\nVESSEL: OOCL HONG KONG V.{rng.randint(100, 999)}N\n"
+            f"CONTAINER NO.: MSCU{rng.randint(1000000, 9999999)}\nDESCRIPTION OF GOODS: FURNITURE\n")
+
+
+def vision_response(path: str, payload: Dict, rng: random.Random) -> Dict:
+    def page():
+        text = vision_text(rng)
+        return {'fullTextAnnotation': {'text': text}, 'textAnnotations': [{'description': text}]}
+
+    if path.endswith('files:annotate'):
+        return {'responses': [{'responses': [page()], 'totalPages': 1} for _ in payload.get('requests', [])]}
+    return {'responses': [page() for _ in payload.get('requests', [])]}
+
+
+# --- Cloudinary ---
+
+def cloudinary_response(path: str, body: bytes, rng: random.Random) -> Dict:
+    parts = path.strip('/').split('/')
+    cloud = parts[1] if len(parts) > 1 else 'loadtest'
+    resource_type = parts[2] if len(parts) > 2 else 'raw'
+    match = re.search(rb'name="public_id"\r\n\r\n([^\r]*)\r\n', body)
+    public_id = match.group(1).decode() if match else f"loadtest/{rng.getrandbits(64):016x}"
+    url = f"https://res.cloudinary.com/{cloud}/{resource_type}/upload/v1/{public_id}"
+    return {
+        'public_id': public_id, 'version': 1, 'resource_type': resource_type, 'type': 'upload',
+        'bytes': len(body), 'url': url.replace('https://', 'http://'), 'secure_url': url,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+
+class StubHTTPHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state: StubState = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_GET(self):
+        if self.path.startswith('/_control/stats'):
+            return self._send_json(self.state.stats())
+        if self.path.startswith('/_control/health'):
+            return self._send_json({'ok': True})
+        self._send_json({'error': f'unknown path {self.path}'}, 404)
+
+    def do_POST(self):
+        body = self._read_body()
+        path = self.path.split('?', 1)[0]
+        state = self.state
+        if path == '/_control/mailbox':
+            total = state.add_messages(json.loads(body or b'{}').get('messages', []))
+            return self._send_json({'mailbox': total})
+        if path == '/_control/reset':
+            state.reset()
+            return self._send_json({'ok': True})
+        if path.endswith('/chat/completions'):
+            state.count('openai', len(body))
+            state.delay('openai')
+            return self._send_json(openai_response(json.loads(body or b'{}')))
+        if path.endswith('images:annotate') or path.endswith('files:annotate'):
+            state.count('vision', len(body))
+            state.delay('vision')
+            return self._send_json(vision_response(path, json.loads(body or b'{}'), state.rng))
+        if path.startswith('/v1_1/') and path.endswith('/upload'):
+            state.count('cloudinary', len(body))
+            state.delay('cloudinary')
+            return self._send_json(cloudinary_response(path, body, state.rng))
+        self._send_json({'error': f'unknown path {path}'}, 404)
+
+
+# --- SMTP ---
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    state: StubState = None
+    tls_context: ssl.SSLContext = None
+
+    def _reply(self, *lines):
+        self.wfile.write(''.join(f'{line}\r\n' for line in lines).encode('ascii'))
+        self.wfile.flush()
+
+    def _readline(self) -> Optional[str]:
+        data = self.rfile.readline(65537)
+        if not data:
+            return None
+        return data.decode('utf-8', errors='replace').rstrip('\r\n')
+
+    def handle(self):
+        tls = False
+        self._reply('220 loadtest-stub ESMTP')
+        while True:
+            line = self._readline()
+            if line is None:
+                break
+            verb = line.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                extensions = ['AUTH PLAIN LOGIN', 'SIZE 52428800'] + ([] if tls else ['STARTTLS'])
+                self._reply('250-loadtest-stub', *[f'250-{e}' for e in extensions[:-1]], f'250 {extensions[-1]}')
+            elif verb == 'HELO':
+                self._reply('250 loadtest-stub')
+            elif verb == 'STARTTLS':
+                self._reply('220 Ready to start TLS')
+                self.connection = self.tls_context.wrap_socket(self.connection, server_side=True)
+                self.rfile = self.connection.makefile('rb')
+                self.wfile = self.connection.makefile('wb')
+                tls = True
+            elif verb == 'AUTH':
+                args = line.split()[1:]
+                if args and args[0].upper() == 'LOGIN':
+                    self._reply('334 VXNlcm5hbWU6')
+                    self._readline()
+                    self._reply('334 UGFzc3dvcmQ6')
+                    self._readline()
+                elif len(args) == 1:
+                    self._reply('334 ')
+                    self._readline()
+                self._reply('235 2.7.0 Authentication successful')
+            elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self._reply('250 OK')
+            elif verb == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                while True:
+                    data = self.rfile.readline(1 << 20)
+                    if not data or data in (b'.\r\n', b'.\n'):
+                        break
+                    size += len(data)
+                self.state.count('smtp', size)
+                self.state.delay('smtp')
+                self._reply('250 OK queued')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                break
+            else:
+                self._reply('502 Command not implemented')
+
+
+# --- IMAP ---
+
+def _sequence_set(spec: str, size: int) -> List[int]:
+    numbers = []
+    for part in spec.split(','):
+        if ':' in part:
+            start, end = part.split(':', 1)
+            start = int(start) if start != '*' else size
+            end = int(end) if end != '*' else size
+            numbers.extend(range(min(start, end), max(start, end) + 1))
+        elif part:
+            numbers.append(size if part == '*' else int(part))
+    return [n for n in numbers if 1 <= n <= size]
+
+
+class IMAPHandler(socketserver.StreamRequestHandler):
+    state: StubState = None
+    tls_context: ssl.SSLContext = None
+
+    def setup(self):
+        self.request = self.tls_context.wrap_socket(self.request, server_side=True)
+        super().setup()
+
+    def _send(self, data: bytes):
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def _line(self, text: str):
+        self._send(text.encode('utf-8') + b'\r\n')
+
+    def _read_command(self) -> Optional[str]:
+        line = self.rfile.readline(65537)
+        if not line:
+            return None
+        text = line.decode('utf-8', errors='replace').rstrip('\r\n')
+        # Literals ({n}) are only used for odd passwords; read and inline them
+        while True:
+            match = re.search(r'\{(\d+)\}$', text)
+            if not match:
+                return text
+            self._line('+ go ahead')
+            literal = self.rfile.read(int(match.group(1))).decode('utf-8', errors='replace')
+            rest = self.rfile.readline(65537).decode('utf-8', errors='replace').rstrip('\r\n')
+            text = text[:match.start()] + json.dumps(literal) + rest
+
+    def handle(self):
+        state = self.state
+        view: List[Dict] = []
+        self._line('* OK [CAPABILITY IMAP4rev1 AUTH=PLAIN] loadtest stub ready')
+        while True:
+            command = self._read_command()
+            if command is None:
+                break
+            tag, _, rest = command.partition(' ')
+            verb, _, args = rest.partition(' ')
+            verb = verb.upper()
+            state.delay('imap')
+            state.count('imap')
+            if verb == 'CAPABILITY':
+                self._line('* CAPABILITY IMAP4rev1 AUTH=PLAIN')
+                self._line(f'{tag} OK CAPABILITY completed')
+            elif verb == 'LOGIN':
+                self._line(f'{tag} OK LOGIN completed')
+            elif verb in ('SELECT', 'EXAMINE'):
+                with state.lock:
+                    view = list(state.mailbox)
+                self._line(f'* {len(view)} EXISTS')
+                self._line('* 0 RECENT')
+                self._line(f'{tag} OK [READ-WRITE] {verb} completed')
+            elif verb == 'SEARCH':
+                unseen = 'UNSEEN' in args.upper()
+                numbers = [str(i) for i, m in enumerate(view, 1) if not (unseen and m['seen'])]
+                self._line('* SEARCH' + ''.join(f' {n}' for n in numbers))
+                self._line(f'{tag} OK SEARCH completed')
+            elif verb == 'FETCH':
+                spec, _, items = args.partition(' ')
+                peek = 'PEEK' in items.upper()
+                for seq in _sequence_set(spec, len(view)):
+                    message = view[seq - 1]
+                    if not peek:
+                        message['seen'] = True
+                    raw = message['raw']
+                    self._send(f'* {seq} FETCH (RFC822 {{{len(raw)}}}\r\n'.encode('ascii') + raw + b')\r\n')
+                self._line(f'{tag} OK FETCH completed')
+            elif verb == 'STORE':
+                spec, _, flags = args.partition(' ')
+                for seq in _sequence_set(spec, len(view)):
+                    if '\\SEEN' in flags.upper():
+                        view[seq - 1]['seen'] = not flags.startswith('-')
+                    self._line(f'* {seq} FETCH (FLAGS (\\Seen))')
+                self._line(f'{tag} OK STORE completed')
+            elif verb == 'LOGOUT':
+                self._line('* BYE loadtest stub logging out')
+                self._line(f'{tag} OK LOGOUT completed')
+                break
+            elif verb in ('NOOP', 'CLOSE', 'EXPUNGE', 'CHECK'):
+                self._line(f'{tag} OK {verb} completed')
+            else:
+                self._line(f'{tag} BAD unsupported command')
+        state.purge_seen()
+
+
+# --- Servers ---
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def ensure_certificate(directory: str):
+    """Self-signed certificate for STARTTLS/IMAPS (clients in the app do not verify it)."""
+    os.makedirs(directory, exist_ok=True)
+    certfile = os.path.join(directory, 'stub-cert.pem')
+    keyfile = os.path.join(directory, 'stub-key.pem')
+    if not (os.path.exists(certfile) and os.path.exists(keyfile)):
+        subprocess.run(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '30',
+             '-subj', '/CN=localhost', '-keyout', keyfile, '-out', certfile],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+    return certfile, keyfile
+
+
+def start_stubs(state: StubState, host: str, http_port: int, smtp_port: int, imap_port: int,
+                certfile: str, keyfile: str) -> Dict[str, object]:
+    """Start all servers on daemon threads; returns {name: server}."""
+    tls_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    tls_context.load_cert_chain(certfile, keyfile)
+
+    http_handler = type('HTTPHandler', (StubHTTPHandler,), {'state': state})
+    smtp_handler = type('BoundSMTPHandler', (SMTPHandler,), {'state': state, 'tls_context': tls_context})
+    imap_handler = type('BoundIMAPHandler', (IMAPHandler,), {'state': state, 'tls_context': tls_context})
+
+    http_server = ThreadingHTTPServer((host, http_port), http_handler)
+    http_server.daemon_threads = True
+    servers = {
+        'http': http_server,
+        'smtp': _ThreadingTCPServer((host, smtp_port), smtp_handler),
+        'imap': _ThreadingTCPServer((host, imap_port), imap_handler),
+    }
+    for name, server in servers.items():
+        threading.Thread(target=server.serve_forever, name=f'stub-{name}', daemon=True).start()
+    return servers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stub OpenAI / Vision / Cloudinary / SMTP / IMAP servers")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--http-port', type=int, default=8089)
+    parser.add_argument('--smtp-port', type=int, default=2525)
+    parser.add_argument('--imap-port', type=int, default=1993)
+    parser.add_argument('--latency', default='', help="median seconds per service, e.g. openai=0.9,vision=0.4")
+    parser.add_argument('--jitter', type=float, default=0.35, help="sigma of the lognormal latency factor")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--cert-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', '.certs'))
+    args = parser.parse_args(argv)
+
+    state = StubState(parse_latency(args.latency), jitter=args.jitter, seed=args.seed)
+    certfile, keyfile = ensure_certificate(args.cert_dir)
+    servers = start_stubs(state, args.host, args.http_port, args.smtp_port, args.imap_port, certfile, keyfile)
+    ports = {name: server.server_address[1] for name, server in servers.items()}
+    # run.py waits for this line
+    print(json.dumps({'stubs': ports, 'latency': state.latency}), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
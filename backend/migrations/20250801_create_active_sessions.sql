@@ -0,0 +1,7 @@
+-- Migration: Shared session registry for the concurrent-user limit (utils/session_registry.py)
+-- UNLOGGED: no WAL writes on every touch; the table is emptied after a crash, which only resets who counts as active
+CREATE UNLOGGED TABLE IF NOT EXISTS active_sessions (
+    identity TEXT PRIMARY KEY,
+    last_seen TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_active_sessions_last_seen ON active_sessions (last_seen);
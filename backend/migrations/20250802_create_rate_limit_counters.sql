@@ -0,0 +1,8 @@
+-- Migration: Shared Flask-Limiter counters for RATELIMIT_STORAGE_URI=iqs+postgres:// (utils/limiter_storage.py)
+-- UNLOGGED: counters are rewritten every few seconds and losing them in a crash only resets the windows
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_counters (
+    key TEXT PRIMARY KEY,
+    count BIGINT NOT NULL DEFAULT 0,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rate_limit_counters_expires_at ON rate_limit_counters (expires_at);
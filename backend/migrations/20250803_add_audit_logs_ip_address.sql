@@ -0,0 +1,3 @@
+-- Migration: Client IP on audit_logs (written by utils/audit_log.py)
+ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS ip_address VARCHAR(45);
+CREATE INDEX IF NOT EXISTS idx_audit_logs_timestamp ON audit_logs (timestamp);
@@ -0,0 +1,44 @@
+-- Migration: Extraction payloads move from bill_of_lading.ocr_text to bill_extractions (utils/bill_store.py)
+-- bill_of_lading keeps only the parsed columns (shipper, consignee, bl_number, ...); the full provider
+-- result, including the raw_text of every page, is read only when someone asks for it.
+CREATE TABLE IF NOT EXISTS bill_extractions (
+    bill_id INTEGER PRIMARY KEY REFERENCES bill_of_lading(id) ON DELETE CASCADE,
+    provider TEXT,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Backfill from ocr_text (skipped when the column is already gone). Text that is not a JSON object is
+-- kept as {"raw_text": ...}.
+CREATE OR REPLACE FUNCTION pg_temp.try_jsonb(value TEXT) RETURNS JSONB AS $$
+BEGIN
+    RETURN value::jsonb;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'bill_of_lading' AND column_name = 'ocr_text') THEN
+        EXECUTE $sql$
+            INSERT INTO bill_extractions (bill_id, provider, payload, created_at)
+            SELECT id, payload->>'extraction_provider', payload, COALESCE(created_at, NOW())
+            FROM (
+                SELECT id, created_at,
+                       CASE WHEN jsonb_typeof(pg_temp.try_jsonb(ocr_text)) = 'object' THEN pg_temp.try_jsonb(ocr_text)
+                            ELSE jsonb_build_object('raw_text', ocr_text) END AS payload
+                FROM bill_of_lading
+                WHERE ocr_text IS NOT NULL AND btrim(ocr_text) NOT IN ('', '{}')
+            ) b
+            ON CONFLICT (bill_id) DO NOTHING
+        $sql$;
+        ALTER TABLE bill_of_lading DROP COLUMN ocr_text;
+    END IF;
+END
+$$;
+
+-- DROP COLUMN does not rewrite the table: old row versions and their TOAST chunks stay until each row is
+-- next updated. To reclaim the space at once (takes an exclusive lock, run in a quiet period):
+--   VACUUM FULL bill_of_lading;
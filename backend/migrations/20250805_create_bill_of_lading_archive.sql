@@ -0,0 +1,113 @@
+-- Migration: Archive tier for settled bills (utils/bill_archive.py)
+-- bill_of_lading keeps open and recently settled bills; settled bills older than ARCHIVE_AFTER_DAYS are
+-- moved in batches to bill_of_lading_archive, range-partitioned by month of settled_at (the latest of
+-- created_at, completed_at and allinpay_85_received_at). Every timestamp of an archived bill is
+-- <= settled_at, so "created_at/completed_at >= X" queries can add "settled_at >= X" and skip all
+-- older partitions.
+
+-- Columns the archive copies; production has them, setup_local_db.sql does not
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS flight_or_vessel TEXT;
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS product_description TEXT;
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS payment_method VARCHAR(50);
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS payment_status VARCHAR(50);
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS reserve_status VARCHAR(50);
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS reserve_amount NUMERIC(12, 2);
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS allinpay_85_received_at TIMESTAMPTZ;
+
+CREATE TABLE IF NOT EXISTS bill_of_lading_archive (
+    id INTEGER NOT NULL,
+    customer_name VARCHAR(255) NOT NULL,
+    customer_email TEXT,
+    customer_phone TEXT,
+    pdf_filename VARCHAR(255),
+    shipper TEXT,
+    consignee TEXT,
+    port_of_loading VARCHAR(255),
+    port_of_discharge VARCHAR(255),
+    bl_number VARCHAR(255),
+    container_numbers TEXT,
+    flight_or_vessel TEXT,
+    product_description TEXT,
+    service_fee DECIMAL(10,2),
+    ctn_fee DECIMAL(10,2),
+    payment_link TEXT,
+    receipt_filename VARCHAR(255),
+    status VARCHAR(100),
+    invoice_filename VARCHAR(255),
+    unique_number VARCHAR(255),
+    created_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ,
+    receipt_uploaded_at TIMESTAMPTZ,
+    completed_at TIMESTAMPTZ,
+    customer_username VARCHAR(255),
+    customer_invoice VARCHAR(255),
+    customer_packing_list VARCHAR(255),
+    payment_method VARCHAR(50),
+    payment_status VARCHAR(50),
+    reserve_status VARCHAR(50),
+    reserve_amount NUMERIC(12, 2),
+    allinpay_85_received_at TIMESTAMPTZ,
+    settled_at TIMESTAMPTZ NOT NULL,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, settled_at)
+) PARTITION BY RANGE (settled_at);
+
+-- Created on each partition
+CREATE INDEX IF NOT EXISTS idx_bill_archive_id ON bill_of_lading_archive (id);
+CREATE INDEX IF NOT EXISTS idx_bill_archive_bl_number ON bill_of_lading_archive (bl_number);
+CREATE INDEX IF NOT EXISTS idx_bill_archive_unique_number ON bill_of_lading_archive (unique_number);
+CREATE INDEX IF NOT EXISTS idx_bill_archive_created_at ON bill_of_lading_archive (created_at);
+CREATE INDEX IF NOT EXISTS idx_bill_archive_completed_at ON bill_of_lading_archive (completed_at);
+CREATE INDEX IF NOT EXISTS idx_bill_archive_customer_username ON bill_of_lading_archive (customer_username);
+
+-- One partition per Hong Kong calendar month, created by the archiver before it moves rows into it
+CREATE OR REPLACE FUNCTION ensure_bill_archive_partition(month_start DATE) RETURNS TEXT AS $$
+DECLARE
+    first_day DATE := date_trunc('month', month_start)::date;
+    partition_name TEXT := 'bill_of_lading_archive_' || to_char(first_day, 'YYYYMM');
+BEGIN
+    IF to_regclass(partition_name) IS NULL THEN
+        EXECUTE format('CREATE TABLE %I PARTITION OF bill_of_lading_archive FOR VALUES FROM (%L) TO (%L)',
+                       partition_name,
+                       first_day::timestamp AT TIME ZONE 'Asia/Hong_Kong',
+                       (first_day + INTERVAL '1 month')::timestamp AT TIME ZONE 'Asia/Hong_Kong');
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Totals of everything ever archived, per settled month (kept when old partitions are dropped), so
+-- all-time statistics read the hot table plus one small row per month
+CREATE TABLE IF NOT EXISTS bill_archive_stats (
+    month DATE PRIMARY KEY,
+    bills INTEGER NOT NULL DEFAULT 0,
+    ctn_fee NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    service_fee NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    -- SUM(ctn_fee + service_fee): bills missing either fee count as 0, like /stats/summary
+    invoice_amount NUMERIC(14, 2) NOT NULL DEFAULT 0,
+    payment_received NUMERIC(14, 2) NOT NULL DEFAULT 0
+);
+
+-- Hot and archived bills together, for history queries (search, accounting exports, per-day stats)
+CREATE OR REPLACE VIEW bill_of_lading_all AS
+    SELECT id, customer_name, customer_email, customer_phone, pdf_filename, shipper, consignee,
+           port_of_loading, port_of_discharge, bl_number, container_numbers, flight_or_vessel,
+           product_description, service_fee, ctn_fee, payment_link, receipt_filename, status,
+           invoice_filename, unique_number, created_at, updated_at, receipt_uploaded_at, completed_at,
+           customer_username, customer_invoice, customer_packing_list, payment_method, payment_status,
+           reserve_status, reserve_amount, allinpay_85_received_at,
+           GREATEST(created_at, completed_at, allinpay_85_received_at) AS settled_at
+    FROM bill_of_lading
+    UNION ALL
+    SELECT id, customer_name, customer_email, customer_phone, pdf_filename, shipper, consignee,
+           port_of_loading, port_of_discharge, bl_number, container_numbers, flight_or_vessel,
+           product_description, service_fee, ctn_fee, payment_link, receipt_filename, status,
+           invoice_filename, unique_number, created_at, updated_at, receipt_uploaded_at, completed_at,
+           customer_username, customer_invoice, customer_packing_list, payment_method, payment_status,
+           reserve_status, reserve_amount, allinpay_85_received_at,
+           settled_at
+    FROM bill_of_lading_archive;
+
+-- Extraction payloads stay when their bill moves to the archive; the archiver and DELETE /bill/<id>
+-- remove them explicitly
+ALTER TABLE bill_extractions DROP CONSTRAINT IF EXISTS bill_extractions_bill_id_fkey;
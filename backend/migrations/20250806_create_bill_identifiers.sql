@@ -0,0 +1,85 @@
+-- Migration: Normalized bill identifiers (utils/bill_identifiers.py)
+-- bl_number is stored as the extractor read it and container_numbers is a comma-joined string, so
+-- 'NYC 22062889' never equalled 'NYC22062889' and a container could only be found with ILIKE.
+-- bill_identifiers keeps one row per lookup key of each bill: the normalized BL number ('bl'), its
+-- alternate forms ('bl_alt') and every container number ('container'). Triggers on bill_of_lading keep
+-- it current; the payment matchers (email, bank statement, webhook) resolve references through it.
+-- Keys are upper-case letters and digits only. The Python side (normalize_key / alternate_keys /
+-- container_keys) must produce the same keys as the functions below.
+
+CREATE OR REPLACE FUNCTION normalize_bill_key(value TEXT) RETURNS TEXT AS $$
+    SELECT NULLIF(regexp_replace(upper(value), '[^A-Z0-9]', '', 'g'), '')
+$$ LANGUAGE sql IMMUTABLE;
+
+-- (kind, key) rows for a bill:
+--   bl         normalized bl_number
+--   bl_alt     'BL12345' -> '12345'; carrier prefix dropped, 'NYC22062889' -> '22062889'
+--   container  ISO 6346 numbers (ABCU1234567) in each comma/semicolon/slash/newline separated part,
+--              or the whole normalized part when it holds none
+CREATE OR REPLACE FUNCTION bill_identifier_keys(bl_number TEXT, container_numbers TEXT)
+RETURNS TABLE (kind TEXT, key TEXT) AS $$
+    WITH bl AS (SELECT normalize_bill_key($1) AS key)
+    SELECT 'bl', key FROM bl WHERE key IS NOT NULL
+    UNION
+    SELECT 'bl_alt', substring(key FROM '^BL([0-9]{4,})$') FROM bl WHERE key ~ '^BL[0-9]{4,}$'
+    UNION
+    SELECT 'bl_alt', substring(key FROM '^[A-Z]{2,4}([0-9]{6,})$') FROM bl WHERE key ~ '^[A-Z]{2,4}[0-9]{6,}$'
+    UNION
+    SELECT 'container', COALESCE(iso.number, part.key)
+    FROM regexp_split_to_table(upper(COALESCE($2, '')), '[,;/\n]+') AS raw(part)
+    CROSS JOIN LATERAL (SELECT regexp_replace(raw.part, '[^A-Z0-9]', '', 'g') AS key) part
+    LEFT JOIN LATERAL (
+        SELECT (regexp_matches(part.key, '[A-Z]{4}[0-9]{7}', 'g'))[1] AS number
+    ) iso ON TRUE
+    WHERE COALESCE(iso.number, part.key) <> ''
+$$ LANGUAGE sql IMMUTABLE;
+
+-- No foreign key: rows follow their bill through the triggers below, and a bill moved to
+-- bill_of_lading_archive (utils/bill_archive.py) drops out of payment matching with them
+CREATE TABLE IF NOT EXISTS bill_identifiers (
+    key TEXT NOT NULL,
+    kind TEXT NOT NULL CHECK (kind IN ('bl', 'bl_alt', 'container')),
+    bill_id INTEGER NOT NULL,
+    PRIMARY KEY (key, kind, bill_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_bill_identifiers_bill_id ON bill_identifiers (bill_id);
+
+CREATE OR REPLACE FUNCTION sync_bill_identifiers() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        DELETE FROM bill_identifiers WHERE bill_id = OLD.id;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO bill_identifiers (key, kind, bill_id)
+        SELECT k.key, k.kind, NEW.id FROM bill_identifier_keys(NEW.bl_number, NEW.container_numbers) k
+        ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS bill_identifiers_insert ON bill_of_lading;
+CREATE TRIGGER bill_identifiers_insert
+    AFTER INSERT ON bill_of_lading
+    FOR EACH ROW EXECUTE FUNCTION sync_bill_identifiers();
+
+-- update_bill writes every column; only a real change of either field rewrites the keys
+DROP TRIGGER IF EXISTS bill_identifiers_update ON bill_of_lading;
+CREATE TRIGGER bill_identifiers_update
+    AFTER UPDATE OF bl_number, container_numbers ON bill_of_lading
+    FOR EACH ROW
+    WHEN (OLD.bl_number IS DISTINCT FROM NEW.bl_number OR OLD.container_numbers IS DISTINCT FROM NEW.container_numbers)
+    EXECUTE FUNCTION sync_bill_identifiers();
+
+DROP TRIGGER IF EXISTS bill_identifiers_delete ON bill_of_lading;
+CREATE TRIGGER bill_identifiers_delete
+    AFTER DELETE ON bill_of_lading
+    FOR EACH ROW EXECUTE FUNCTION sync_bill_identifiers();
+
+-- Backfill existing bills
+INSERT INTO bill_identifiers (key, kind, bill_id)
+SELECT k.key, k.kind, b.id
+FROM bill_of_lading b
+CROSS JOIN LATERAL bill_identifier_keys(b.bl_number, b.container_numbers) k
+ON CONFLICT DO NOTHING;
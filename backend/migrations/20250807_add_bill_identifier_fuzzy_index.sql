@@ -0,0 +1,13 @@
+-- Migration: Fuzzy lookup of bill identifiers (utils/bl_matcher.py)
+-- OCR and regex-extracted references confuse O/0, I/1, S/5 and the like, so an exact key misses.
+-- Candidates are found on a canonical form of the key (confusable letters folded onto digits), either
+-- equal or trigram-similar, and then ranked by bounded edit distance in Python.
+-- bill_key_canonical() must match CONFUSABLES in utils/bl_matcher.py.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE OR REPLACE FUNCTION bill_key_canonical(key TEXT) RETURNS TEXT AS $$
+    SELECT translate(key, 'OQILSZB', '0011528')
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+CREATE INDEX IF NOT EXISTS idx_bill_identifiers_canonical_trgm
+    ON bill_identifiers USING gin (bill_key_canonical(key) gin_trgm_ops);
@@ -0,0 +1,23 @@
+-- Migration: Outbound email queue (utils/email_outbox.py) and the bank import's payment reference
+-- Requests that send mail (the bank statement import first) add a row here inside their own
+-- transaction instead of talking SMTP inline; the drainer sends pending rows and retries failures
+-- with backoff. A rolled-back import therefore sends nothing, and a slow SMTP server slows nobody.
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    -- Key into utils/email_outbox.py TEMPLATES
+    template TEXT NOT NULL,
+    -- As stored on the source row (customer_email may be encrypted); decrypted when sent
+    recipient TEXT NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    sent_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_pending ON email_outbox (next_attempt_at) WHERE status = 'pending';
+
+-- Written by the bank statement import (description of the matching statement line); production has it
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS payment_reference TEXT;
@@ -0,0 +1,25 @@
+-- Migration: Archived payments under the management overview's rule (utils/bill_archive.py)
+-- bill_archive_stats.payment_received follows /stats/summary (payment_method compared case-sensitively,
+-- NULL methods not counted). The management overview counts a bill as paid unless its method is
+-- Allinpay in any case, NULL included, and counts 85% of an unsettled Allinpay bill; it now adds this
+-- column instead, so its paid total no longer drops as bills are archived.
+ALTER TABLE bill_archive_stats ADD COLUMN IF NOT EXISTS overview_paid_amount NUMERIC(14, 2) NOT NULL DEFAULT 0;
+
+-- Backfill from the partitions still kept; months whose partitions were already dropped stay at 0
+UPDATE bill_archive_stats s
+SET overview_paid_amount = a.paid
+FROM (
+    SELECT date_trunc('month', settled_at AT TIME ZONE 'Asia/Hong_Kong')::date AS month,
+           COALESCE(SUM(CASE
+               WHEN LOWER(TRIM(COALESCE(payment_method, ''))) <> 'allinpay' AND status = 'Paid and CTN Valid'
+                    THEN COALESCE(ctn_fee, 0) + COALESCE(service_fee, 0)
+               WHEN LOWER(TRIM(COALESCE(reserve_status, ''))) = 'reserve settled' AND status = 'Paid and CTN Valid'
+                    THEN COALESCE(ctn_fee, 0) + COALESCE(service_fee, 0)
+               WHEN LOWER(TRIM(COALESCE(reserve_status, ''))) = 'unsettled' AND status = 'Paid and CTN Valid'
+                    THEN (COALESCE(ctn_fee, 0) + COALESCE(service_fee, 0)) * 0.85
+               ELSE 0
+           END), 0) AS paid
+    FROM bill_of_lading_archive
+    GROUP BY 1
+) a
+WHERE s.month = a.month;
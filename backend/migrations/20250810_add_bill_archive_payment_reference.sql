@@ -0,0 +1,28 @@
+-- Migration: Keep payment_reference on archived bills (utils/bill_archive.py)
+-- The bank import writes the reference that paid a bill to bill_of_lading.payment_reference; the archive
+-- table and the bill_of_lading_all view did not have the column, so the mover dropped it. The mover now
+-- copies every bill_of_lading column the archive has and refuses to run while one is missing.
+ALTER TABLE bill_of_lading ADD COLUMN IF NOT EXISTS payment_reference TEXT;
+ALTER TABLE bill_of_lading_archive ADD COLUMN IF NOT EXISTS payment_reference TEXT;
+
+-- New columns can only be appended to a view, so payment_reference comes after settled_at
+CREATE OR REPLACE VIEW bill_of_lading_all AS
+    SELECT id, customer_name, customer_email, customer_phone, pdf_filename, shipper, consignee,
+           port_of_loading, port_of_discharge, bl_number, container_numbers, flight_or_vessel,
+           product_description, service_fee, ctn_fee, payment_link, receipt_filename, status,
+           invoice_filename, unique_number, created_at, updated_at, receipt_uploaded_at, completed_at,
+           customer_username, customer_invoice, customer_packing_list, payment_method, payment_status,
+           reserve_status, reserve_amount, allinpay_85_received_at,
+           GREATEST(created_at, completed_at, allinpay_85_received_at) AS settled_at,
+           payment_reference
+    FROM bill_of_lading
+    UNION ALL
+    SELECT id, customer_name, customer_email, customer_phone, pdf_filename, shipper, consignee,
+           port_of_loading, port_of_discharge, bl_number, container_numbers, flight_or_vessel,
+           product_description, service_fee, ctn_fee, payment_link, receipt_filename, status,
+           invoice_filename, unique_number, created_at, updated_at, receipt_uploaded_at, completed_at,
+           customer_username, customer_invoice, customer_packing_list, payment_method, payment_status,
+           reserve_status, reserve_amount, allinpay_85_received_at,
+           settled_at,
+           payment_reference
+    FROM bill_of_lading_archive;
@@ -0,0 +1,6 @@
+-- Migration: Normalized BL lookups on archived bills (utils/bill_identifiers.py)
+-- bill_identifiers only covers bill_of_lading, so archived bills are looked up by BL number directly.
+-- Comparing the raw column missed 'NYC 22062889' for the reference 'NYC22062889'; lookups now compare
+-- normalize_bill_key(bl_number) (migrations/20250806_create_bill_identifiers.sql), indexed here on
+-- every archive partition.
+CREATE INDEX IF NOT EXISTS idx_bill_archive_bl_key ON bill_of_lading_archive (normalize_bill_key(bl_number));
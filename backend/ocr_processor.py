@@ -1,25 +1,30 @@
 import sys
 import os
 import fitz  # PyMuPDF
-import openai
-import json
 from dotenv import load_dotenv
 import logging
 import base64
+from utils.prompt_builder import select_pdf_sections
+from utils.llm_client import llm_client, object_schema
+from utils.pdf_render import render_for_vision
+from utils.timing import stage
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+# Setup logging (handlers are installed by utils/logging_setup.py)
 logger = logging.getLogger(__name__)
 
 # Load env from .env
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
-openai.api_key = os.getenv('OPENAI_API_KEY')
 
 BILL_FIELDS = [
     'document_type', 'bl_number', 'shipper', 'consignee', 'port_of_loading',
     'port_of_discharge', 'container_numbers', 'flight_or_vessel', 'product_description', 'paid_amount', 'raw_text'
 ]
 
+# Structured-output schema for the fields OpenAI fills in (raw_text is set locally)
+BILL_FIELDS_SCHEMA = object_schema({
+    field: {'type': 'string'} for field in BILL_FIELDS if field != 'raw_text'
+})
+
 def get_first_line(value):
     if not value:
         return value
@@ -31,20 +36,23 @@ def get_first_line(value):
         return value.split(',')[0].strip()
     return value.strip()
 
-def call_openai_vision_fallback(pdf, all_text):
-    import base64
-    page = pdf[0]
-    pix = page.get_pixmap()
-    img_bytes = pix.tobytes("png")
+def call_openai_vision_fallback(pdf, all_text, render_settings=None):
+    # DPI, colour mode, crop, page selection and tiling come from RenderConfig (or render_settings)
+    img_bytes, mime_type, render_stats = render_for_vision(pdf, render_settings)
+    logger.debug(f"[OpenAI] Vision payload: {render_stats}")
     img_b64 = base64.b64encode(img_bytes).decode("utf-8")
     vision_prompt = (
-        "Extract the following fields from this shipping document image: "
+        "Extract the following fields from this shipping document image "
+        "(several pages may be stacked top to bottom): "
         "document_type, bl_number, shipper, consignee, port_of_loading, "
         "port_of_discharge, container_numbers, flight_or_vessel, product_description, paid_amount. "
         "The paid_amount is the payment amount shown on the document (e.g., $420, 420 USD, Amount: 420, etc). "
-        "Return a valid JSON object with these fields. If a field is missing, use an empty string."
+        "Return a JSON object with these fields. If a field is missing, use an empty string."
     )
-    vision_response = openai.chat.completions.create(
+    llm_client.record('vision_fallbacks')
+    vision_data = llm_client.complete_json(
+        "bill_fields",
+        BILL_FIELDS_SCHEMA,
         model="gpt-4o",  # Updated to gpt-4o as vision-preview is deprecated
         messages=[
             {"role": "system", "content": "You're an expert shipping document parser."},
@@ -52,27 +60,14 @@ def call_openai_vision_fallback(pdf, all_text):
                 "role": "user",
                 "content": [
                     {"type": "text", "text": vision_prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_b64}"}}
+                    {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{img_b64}"}}
                 ]
             }
         ],
         max_tokens=1024,
     )
-    vision_content = vision_response.choices[0].message.content
-    try:
-        vision_data = json.loads(vision_content)
-    except Exception:
-        import re
-        match = re.search(r'\{.*\}', vision_content, re.DOTALL)
-        if match:
-            try:
-                vision_data = json.loads(match.group(0))
-            except Exception:
-                logger.error(f"[OpenAI Vision] Could not parse JSON from response: {vision_content}")
-                vision_data = {field: '' for field in BILL_FIELDS}
-        else:
-            logger.error(f"[OpenAI Vision] Could not parse JSON from response: {vision_content}")
-            vision_data = {field: '' for field in BILL_FIELDS}
+    if not vision_data:
+        vision_data = {field: '' for field in BILL_FIELDS}
     vision_data['raw_text'] = '[OpenAI Vision fallback used]'
     for field in BILL_FIELDS:
         if field not in vision_data:
@@ -80,22 +75,28 @@ def call_openai_vision_fallback(pdf, all_text):
     # Post-process shipper and consignee to only keep the first line or first part before comma
     vision_data['shipper'] = get_first_line(vision_data.get('shipper', ''))
     vision_data['consignee'] = get_first_line(vision_data.get('consignee', ''))
-    print(f"[DEBUG] [OpenAI] extract_fields_openai returning Vision data: {vision_data}")
-    logger.info(f"[OpenAI Vision] Extracted fields: {vision_data}")
+    logger.info(f"[OpenAI Vision] Extracted fields: {filled_fields(vision_data)}")
     return vision_data
 
+def filled_fields(data):
+    # Field names only: values (and raw_text) are customer data and stay out of the logs
+    return [field for field in BILL_FIELDS if data.get(field)]
+
 def extract_fields_openai(pdf_path):
-    print(f"[DEBUG] [OpenAI] extract_fields_openai called with pdf_path: {pdf_path}")
     logger.info(f"[OpenAI OCR] Extracting fields from: {pdf_path}")
     try:
-        pdf = fitz.open(pdf_path)
-        all_text = "\n".join(page.get_text() for page in pdf)
+        with stage('pymupdf_parse'):
+            pdf = fitz.open(pdf_path)
+            pages = [page.get_text() for page in pdf]
+            all_text = "\n".join(pages)
         
         # If text is empty, go straight to Vision
         if not all_text.strip():
-            print("[DEBUG] [OpenAI] No text extracted from PDF, falling back to Vision API directly.")
+            logger.debug("[OpenAI] No text extracted from PDF, falling back to Vision API directly.")
             return call_openai_vision_fallback(pdf, all_text)
 
+        # Only send the first page and labelled blocks from later pages, within the token budget
+        prompt_text = select_pdf_sections(pages)
         prompt = f"""
 You are an expert in logistics document processing. Given the following text from a shipping document, extract:
 - document_type: (BOL or AWB)
@@ -109,46 +110,35 @@ You are an expert in logistics document processing. Given the following text fro
 - product_description
 - paid_amount: the payment amount shown on the document (e.g., $420, 420 USD, Amount: 420, etc)
 
-TEXT:\n{all_text}
+TEXT:\n{prompt_text}
 
-Return a valid JSON object with these fields. If a field is missing, use an empty string.
+Return a JSON object with these fields. If a field is missing, use an empty string.
 """
-        print("[DEBUG] [OpenAI] Calling openai.ChatCompletion.create for OCR...")
-        response = openai.chat.completions.create(
-            model="gpt-4o",
+        data = llm_client.complete_json(
+            "bill_fields",
+            BILL_FIELDS_SCHEMA,
             messages=[
                 {"role": "system", "content": "You're an expert shipping document parser."},
                 {"role": "user", "content": prompt},
             ],
             temperature=0.0,
         )
-        print("[DEBUG] [OpenAI] openai.ChatCompletion.create response received.")
-        content = response.choices[0].message.content
-        try:
-            data = json.loads(content)
-        except Exception:
-            import re
-            match = re.search(r'\{.*\}', content, re.DOTALL)
-            if match:
-                try:
-                    data = json.loads(match.group(0))
-                except Exception:
-                    print("[DEBUG] [OpenAI] Regex fallback failed, falling back to Vision API...")
-                    return call_openai_vision_fallback(pdf, all_text)
-            else:
-                print("[DEBUG] [OpenAI] No JSON found in response, falling back to Vision API...")
-                return call_openai_vision_fallback(pdf, all_text)
+        if data is None:
+            # A refusal or unparseable reply is not fixed by sending the page image as well
+            logger.warning("[OpenAI] No JSON in the text extraction response; returning empty fields.")
+            data = {field: '' for field in BILL_FIELDS}
+            data['raw_text'] = all_text
+            return data
 
         data['raw_text'] = all_text
         for field in BILL_FIELDS:
             if field not in data:
                 data[field] = ''
         if all(data.get(field, '') == '' for field in BILL_FIELDS if field != 'raw_text'):
-            print("[DEBUG] [OpenAI] Text extraction returned all empty, falling back to Vision API...")
+            logger.debug("[OpenAI] Text extraction returned all empty, falling back to Vision API...")
             return call_openai_vision_fallback(pdf, all_text)
 
-        print(f"[DEBUG] [OpenAI] extract_fields_openai returning data: {data}")
-        logger.info(f"[OpenAI OCR] Extracted fields: {data}")
+        logger.info(f"[OpenAI OCR] Extracted fields: {filled_fields(data)}")
         return data
     except Exception as e:
         logger.error(f"[OpenAI OCR] Error: {e}")
@@ -1,6 +1,3 @@
-print("[DEBUG] payment_link.py imported and blueprint registered!")
-
-
 from flask import Blueprint, request, jsonify
 from config import get_db_conn
 import logging
@@ -74,7 +71,7 @@ def generate_payment_link(bill_id):
             'timestamp': hk_now.strftime('%Y%m%d%H%M%S')
         }
         dummy_link = f"https://pay.dummy.com/link/{bill_id}?{urlencode(query_params)}"
-        print(f"[DEBUG] Saving payment link to DB: {dummy_link}")
+        logger.debug(f"Saving payment link to DB: {dummy_link}")
         logger.info(f"[DEBUG] Saving payment link to DB: {dummy_link}")
 
         # Update the database with the dummy payment link
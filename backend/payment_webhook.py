@@ -1,5 +1,4 @@
 from flask import Blueprint, request, jsonify
-from email_utils import send_unique_number_email  # Replaced send_simple_email with send_unique_number_email
 import logging
 import hmac
 import hashlib
@@ -7,6 +6,9 @@ import json
 from datetime import datetime
 import re
 from config import EmailConfig, get_db_conn
+from utils.bill_identifiers import find_bills, normalize_key
+from utils.email_outbox import drain_in_background, enqueue_many
+from utils.reconciliation import DEPOSIT, ReceivablesIndex, accepted, apply_allocations, describe, reconcile
 import pytz
 
 payment_webhook = Blueprint('payment_webhook', __name__)
@@ -17,6 +19,13 @@ logger = logging.getLogger(__name__)
 # Secret key for signature verification (set by your bank)
 SECRET_KEY = "your_secret_key_here"  # Move to .env or config
 
+# Open bills of the same customer as bill %s (by username, else name)
+CUSTOMER_BILLS_SQL = """
+    COALESCE(NULLIF(TRIM(b.customer_username), ''), b.customer_name) = (
+        SELECT COALESCE(NULLIF(TRIM(customer_username), ''), customer_name)
+        FROM bill_of_lading WHERE id = %s)
+"""
+
 def verify_signature(payload, signature):
     """Verify the HMAC signature of the webhook payload."""
     computed_signature = hmac.new(
@@ -54,20 +63,24 @@ def handle_payment_webhook():
         # Log the payment details
         logger.info(f"Received payment: ID={transaction_id}, Amount={amount} {currency}, Status={status}")
 
-        # Validate transaction_id as potential B/L number
-        if not re.match(r'^\w{3}\d{6,}$|^\d{9,}$', transaction_id):
+        # Validate transaction_id as potential B/L number ('NYC 22062889' is accepted as NYC22062889)
+        if not re.match(r'^\w{3}\d{6,}$|^\d{9,}$', normalize_key(transaction_id)):
             logger.warning(f"Transaction ID {transaction_id} does not resemble a B/L number")
             return jsonify({"error": "Invalid transaction ID format"}), 400
 
-        # Fetch bill details from database
+        # Fetch bill details from database: by unique number, else by BL / container number
         conn = get_db_conn()
         cur = conn.cursor()
         cur.execute("""
-            SELECT ctn_fee, service_fee, unique_number
-            FROM bill_of_lading
+            SELECT id FROM bill_of_lading
             WHERE unique_number = %s
         """, (transaction_id,))
         bill = cur.fetchone()
+        if not bill:
+            bills = find_bills(cur, [transaction_id], columns=('id',))
+            if len(bills.get(transaction_id, ())) == 1:
+                bill = (bills[transaction_id][0]['id'],)
+                logger.info(f"Transaction ID {transaction_id} matched bill {bill[0]} by BL / container number")
 
         if not bill:
             logger.error(f"No bill found for unique_number {transaction_id}")
@@ -75,63 +88,48 @@ def handle_payment_webhook():
             conn.close()
             return jsonify({"error": "Bill not found"}), 404
 
-        ctn_fee, service_fee, unique_number = bill
-        ctn_fee = float(ctn_fee or 0)
-        service_fee = float(service_fee or 0)
-        invoice_total = ctn_fee + service_fee
-
-        # Determine payment phase
-        received_85 = abs(amount - (invoice_total * 0.85)) < 0.01
-        received_15 = abs(amount - (invoice_total * 0.15)) < 0.01
-        is_initial = payment_phase == 'initial' or received_85
-        is_final = payment_phase == 'final' or received_15
+        bill_id = bill[0]
 
-        # Update database
+        # Allocate the payment (utils/reconciliation.py) over this bill and the customer's other open
+        # bills: the full invoice, the 85% deposit, the 15% final or several bills paid together
+        receivables = ReceivablesIndex.load(cur, where=CUSTOMER_BILLS_SQL, params=(bill_id,))
+        proposals = reconcile(receivables, amount, [bill_id], emails=[customer_email], phase=payment_phase,
+                              allinpay=True)
+        best = accepted(proposals)
         hk_now = datetime.now(pytz.timezone('Asia/Hong_Kong'))
-        update_query = """
-            UPDATE bill_of_lading
-            SET payment_method = %s,
-                status = %s
-        """
-        params = ['Allinpay', 'Paid and CTN Valid']
-
-        if is_initial:
-            reserve_amount = invoice_total - (invoice_total * 0.85)
-            update_query += ", reserve_status = %s, reserve_amount = %s, payment_status = %s, allinpay_85_received_at = %s"
-            params.extend(['Unsettled', reserve_amount, 'Paid 85%', hk_now])
-            # Send email only for 85% payment with CTN number
-            subject = "Payment Confirmation - 85% Received"
-            body = f"""
-Dear Customer,
-
-Thank you for your payment!
-
-Transaction Details:
-- Transaction ID: {transaction_id}
-- Your CTN Number: {unique_number}  <!-- Highlighted as the most important -->
-- Total Invoice Amount: {invoice_total} {currency}
-
-If you have any questions, please contact support.
-
-Best regards,
-Terry Ray Logistics
-"""
-            send_unique_number_email(customer_email, subject, body)
-            logger.info(f"Email sent to {customer_email} with 85% confirmation and CTN {unique_number}")
-        elif is_final:
-            update_query += ", reserve_status = %s, payment_status = %s, completed_at = %s"
-            params.extend(['Reserve Settled', 'Paid 100%', hk_now])
-
-        update_query += " WHERE unique_number = %s"
-        params.append(transaction_id)
 
-        cur.execute(update_query, tuple(params))
-        logger.info(f"Updated bill for unique_number {transaction_id} with payment_status {params[5] if is_initial else params[4]}")
+        if not best:
+            reason = f"No confident allocation for bill {bill_id}"
+            if proposals:
+                reason += f"; proposed: {describe(proposals[0])}"
+            cur.execute("""
+                INSERT INTO bank_unmatched_records (date, description, amount, reason)
+                VALUES (%s, %s, %s, %s)
+            """, (hk_now.strftime('%Y-%m-%d'), f"Allinpay webhook {transaction_id}", amount, reason))
+            conn.commit()
+            cur.close()
+            conn.close()
+            logger.warning(f"Transaction {transaction_id} ({amount} {currency}) left for review: {reason}")
+            return jsonify({"status": "needs_review", "proposals": [describe(p) for p in proposals]}), 202
+
+        updated = apply_allocations(cur, [(item['bill_id'], item['kind'], transaction_id)
+                                          for item in best['allocations']], hk_now, method='Allinpay')
+        # Send email only for 85% payment with CTN number
+        enqueue_many(cur, (
+            ('allinpay_deposit_confirmation', customer_email,
+             {'transaction_id': transaction_id, 'unique_number': paid['unique_number'],
+              'invoice_total': float(paid['invoice_total']), 'currency': currency})
+            for paid in updated if paid['kind'] == DEPOSIT
+        ))
         conn.commit()
         cur.close()
         conn.close()
+        drain_in_background()
+        logger.info(f"Transaction {transaction_id} allocated: {describe(best)}")
 
-        return jsonify({"status": "success"}), 200
+        return jsonify({"status": "success",
+                        "allocations": [{"bill_id": paid['id'], "allocation": paid['kind']} for paid in updated],
+                        "confidence": best['confidence']}), 200
 
     except Exception as e:
         logger.error(f"Webhook processing failed: {str(e)}")
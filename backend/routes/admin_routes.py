@@ -2,24 +2,22 @@
 
 from flask import Blueprint, request, jsonify, send_from_directory
 import json
+import logging
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from utils.security import decrypt_sensitive_data
 from config import get_db_conn  # Updated import
 from utils.ingest_emails import ingest_emails
 
 admin_routes = Blueprint('admin_routes', __name__)
+logger = logging.getLogger(__name__)
 
 @admin_routes.route('/admin/ingest-emails', methods=['POST'])
 @jwt_required()
 def admin_ingest_emails():
-    print('[DEBUG] /admin/ingest-emails called')
-    print('[DEBUG] get_jwt_identity:', get_jwt_identity())
-    from flask import request
-    print('[DEBUG] request headers:', dict(request.headers))
     user = json.loads(get_jwt_identity())
     if user.get('username') != 'ray40':
         return jsonify({'error': 'Admins only!'}), 403
-    print('[DEBUG] Manual ingestion triggered by admin - IMAP ingestion will run now.')
+    logger.info('Manual ingestion triggered by admin - IMAP ingestion will run now.')
     result = ingest_emails()
     return jsonify({'result': result})
 
@@ -29,7 +27,6 @@ def get_email_ingest_errors():
     user = json.loads(get_jwt_identity())
     if user.get('username') != 'ray40':
         return jsonify({'error': 'Admins only!'}), 403
-    print('[DEBUG] Returning email ingestion errors')
     conn = get_db_conn()
     cur = conn.cursor()
     cur.execute("SELECT id, filename, reason, raw_text, created_at FROM email_ingest_errors ORDER BY created_at DESC")
@@ -52,7 +49,6 @@ def get_unmatched_receipts():
     user = json.loads(get_jwt_identity())
     if user.get('username') != 'ray40':
         return jsonify({'error': 'Admins only!'}), 403
-    print('[DEBUG] Returning unmatched receipts')
     conn = get_db_conn()
     cur = conn.cursor()
     cur.execute("SELECT id, date, description, amount, reason, created_at, raw_text FROM unmatched_receipts ORDER BY created_at DESC")
@@ -141,3 +137,30 @@ def get_canned_responses():
         return send_from_directory('.', 'canned_responses.json')
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+@admin_routes.route('/admin/llm-stats', methods=['GET'])
+@jwt_required()
+def get_llm_stats_route():
+    user = json.loads(get_jwt_identity())
+    if user.get('username') != 'ray40':
+        return jsonify({'error': 'Admins only!'}), 403
+    from utils.llm_client import get_llm_stats
+    return jsonify(get_llm_stats())
+
+@admin_routes.route('/admin/extraction-stats', methods=['GET'])
+@jwt_required()
+def get_extraction_stats():
+    user = json.loads(get_jwt_identity())
+    if user.get('username') != 'ray40':
+        return jsonify({'error': 'Admins only!'}), 403
+    from utils.extraction_router import get_extraction_router
+    return jsonify(get_extraction_router().stats())
+
+@admin_routes.route('/admin/logging-stats', methods=['GET'])
+@jwt_required()
+def get_logging_stats_route():
+    user = json.loads(get_jwt_identity())
+    if user.get('username') != 'ray40':
+        return jsonify({'error': 'Admins only!'}), 403
+    from utils.logging_setup import get_logging_stats
+    return jsonify(get_logging_stats())
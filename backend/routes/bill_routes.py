@@ -3,33 +3,29 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from utils.security import encrypt_sensitive_data, decrypt_sensitive_data, validate_password
 from config import get_db_conn
 from utils.helpers import get_hk_date_range
+from utils.json_response import project, requested_fields
+from utils.bill_store import BILL_SELECT, fetch_bill, insert_bill, save_extraction
+from utils.bill_archive import ARCHIVED_STATUS, archive_totals
 import os
-import cloudinary
-import cloudinary.uploader
 from cloudinary_utils import upload_filelike_to_cloudinary, upload_filepath_to_cloudinary
 import json
+import logging
 import pytz
 from datetime import datetime
 from email_utils import send_unique_number_email, send_invoice_email, send_simple_email
 from invoice_utils import generate_invoice_pdf
 import tempfile
-from ocr_processor import extract_fields_openai
-from extract_fields import extract_fields as extract_fields_legacy
+from utils.extraction_router import extract_bill_fields
 
 bill_routes = Blueprint('bill_routes', __name__)
-print('[DEBUG] Migration: Removed UPLOAD_FOLDER, switching to Cloudinary for all file storage')
+logger = logging.getLogger(__name__)
 
 # Bill and file-related endpoints
 # /bills, /bill/<id>, /uploads/<filename>, /upload, /bill/<id>/upload_receipt, /bill/<id>/unique_number, /send_unique_number_email, /send_invoice_email, /bill/<id>/delete, /generate_payment_link/<id>, /bills/status/<status>, /bills/awaiting_bank_in
 
 # --- AUTO-INVOICE GENERATION FUNCTION ---
-def auto_generate_invoice_for_bill(bill):
-    print(f"Checking OCR completeness for BL id {bill['id']}")
-    try:
-        ocr_fields = json.loads(bill.get('ocr_text') or '{}')
-    except Exception as e:
-        print(f"[ERROR] Could not parse ocr_text for BL id {bill['id']}: {e}")
-        return False
+def auto_generate_invoice_for_bill(bill, ocr_fields):
+    logger.debug(f"Checking OCR completeness for BL id {bill['id']}")
 
     required = [
         'shipper', 'consignee', 'port_of_loading', 'port_of_discharge',
@@ -37,10 +33,10 @@ def auto_generate_invoice_for_bill(bill):
     ]
     missing = [field for field in required if not ocr_fields.get(field)]
     if missing:
-        print(f"OCR incomplete for BL id {bill['id']}, missing: {missing}. Skipping automation.")
+        logger.debug(f"OCR incomplete for BL id {bill['id']}, missing: {missing}. Skipping automation.")
         return False
 
-    print(f"OCR complete, proceeding with auto-invoice for BL id {bill['id']}")
+    logger.debug(f"OCR complete, proceeding with auto-invoice for BL id {bill['id']}")
     conn = get_db_conn()
     cur = conn.cursor()
 
@@ -57,26 +53,26 @@ def auto_generate_invoice_for_bill(bill):
     import string
     unique_number = bill.get('unique_number')
     if not unique_number:
-        print(f"[DEBUG] Generating new Unique Number for BL id {bill['id']}")
+        logger.debug(f"Generating new Unique Number for BL id {bill['id']}")
         letters = ''.join(random.choices(string.ascii_uppercase, k=3))
         numbers = ''.join(random.choices(string.digits, k=6))
         unique_number = letters + numbers
-        print(f"[DEBUG] Generated new Unique Number for BL id {bill['id']}: {unique_number}")
+        logger.debug(f"Generated new Unique Number for BL id {bill['id']}: {unique_number}")
         # Update DB
         cur.execute("""
             UPDATE bill_of_lading SET unique_number = %s WHERE id = %s
         """, (unique_number, bill['id']))
         conn.commit()
-        print(f"[DEBUG] DB updated with new Unique Number for BL id {bill['id']}")
+        logger.debug(f"DB updated with new Unique Number for BL id {bill['id']}")
 
     # Generate payment link (after fees and unique_number are set)
     payment_link = bill.get('payment_link')
     if not payment_link:
-        print("[DEBUG] Generating payment link for BL id {}".format(bill['id']))
+        logger.debug(f"Generating payment link for BL id {bill['id']}")
         payment_link = f"https://pay.example.com/{bill['id']}?ctn={ctn_fee}&svc={service_fee}&uniquenum={unique_number}"
 
     # Generate invoice PDF
-    print("Generating invoice PDF for BL id {}".format(bill['id']))
+    logger.debug(f"Generating invoice PDF for BL id {bill['id']}")
     customer = {
         'name': bill.get('customer_name', ''),
         'email': bill.get('customer_email', ''),
@@ -87,11 +83,11 @@ def auto_generate_invoice_for_bill(bill):
         invoice_local_path = tmp.name
 
     generate_invoice_pdf(customer, bill, service_fee, ctn_fee, payment_link, output_path=invoice_local_path)
-    print(f"Invoice generated at: {invoice_local_path}")
+    logger.debug(f"Invoice generated at: {invoice_local_path}")
 
-    print("Uploading to Cloudinary for BL id {}".format(bill['id']))
+    logger.debug(f"Uploading to Cloudinary for BL id {bill['id']}")
     cloud_url = upload_filepath_to_cloudinary(invoice_local_path, folder="invoices")
-    print(f"Invoice uploaded to Cloudinary: {cloud_url}")
+    logger.debug(f"Invoice uploaded to Cloudinary: {cloud_url}")
 
     # Update DB
     cur.execute("""
@@ -100,7 +96,7 @@ def auto_generate_invoice_for_bill(bill):
         WHERE id=%s
     """, (ctn_fee, service_fee, payment_link, cloud_url, bill['id']))
     conn.commit()
-    print("DB updated with invoice_filename and payment_link for BL id {}".format(bill['id']))
+    logger.info(f"DB updated with invoice_filename and payment_link for BL id {bill['id']}")
 
     cur.close()
     conn.close()
@@ -114,10 +110,30 @@ def auto_generate_invoice_for_bill(bill):
 
 
 
+# Columns returned by /bills (and selectable with ?fields=)
+BILL_LIST_COLUMNS = [
+    'id', 'customer_name', 'customer_email', 'customer_phone', 'pdf_filename', 'shipper', 'consignee',
+    'port_of_loading', 'port_of_discharge', 'bl_number', 'container_numbers', 'flight_or_vessel',
+    'product_description', 'service_fee', 'ctn_fee', 'payment_link', 'receipt_filename', 'status',
+    'invoice_filename', 'unique_number', 'created_at', 'receipt_uploaded_at', 'customer_username',
+    'customer_invoice', 'customer_packing_list'
+]
+
+# Columns behind /account_bills and /account_bills_monthly, and the keys those endpoints add to each row
+ACCOUNT_BILL_FIELDS = [
+    'id', 'customer_name', 'customer_email', 'customer_phone', 'pdf_filename', 'shipper', 'consignee',
+    'port_of_loading', 'port_of_discharge', 'bl_number', 'container_numbers', 'service_fee', 'ctn_fee',
+    'payment_link', 'receipt_filename', 'status', 'invoice_filename', 'unique_number', 'created_at',
+    'receipt_uploaded_at', 'completed_at', 'allinpay_85_received_at', 'customer_username',
+    'customer_invoice', 'customer_packing_list', 'payment_method', 'payment_status', 'reserve_status',
+    'display_ctn_fee', 'display_service_fee', 'split_type'
+]
+
 @bill_routes.route('/bills', methods=['GET'])
 @jwt_required()
 def get_all_bills():
     user = json.loads(get_jwt_identity())
+    fields = requested_fields(BILL_LIST_COLUMNS)
     page = int(request.args.get('page', 1))
     page_size = int(request.args.get('page_size', 50))
     offset = (page - 1) * page_size
@@ -128,6 +144,10 @@ def get_all_bills():
     if conn is None:
         return jsonify({'error': 'Database connection failed'}), 500
     cur = conn.cursor()
+    # Settled bills moved to the archive (utils/bill_archive.py) are only listed when they can match:
+    # every one of them is ARCHIVED_STATUS, and plain page loads stay on the hot table
+    include_archive = (not status or status == ARCHIVED_STATUS) and bool(
+        status or bl_number or date or request.args.get('include_archive') == '1')
     where_clauses = []
     params = []
     if bl_number:
@@ -140,16 +160,25 @@ def get_all_bills():
         start_date, end_date = get_hk_date_range(date)
         where_clauses.append('created_at >= %s AND created_at < %s')
         params.extend([start_date, end_date])
+        if include_archive:
+            # Lets Postgres skip archive partitions settled before the day
+            where_clauses.append('settled_at >= %s')
+            params.append(start_date)
     where_sql = ' AND '.join(where_clauses)
     if where_sql:
         where_sql = 'WHERE ' + where_sql
-    count_query = f'SELECT COUNT(*) FROM bill_of_lading {where_sql}'
-    cur.execute(count_query, tuple(params))
-    total_count = cur.fetchone()[0]
+    source = 'bill_of_lading_all' if include_archive else 'bill_of_lading'
+    if include_archive and not (bl_number or date):
+        # Every archived bill matches: add the rollup's count instead of counting the partitions
+        cur.execute(f'SELECT COUNT(*) FROM bill_of_lading {where_sql}', tuple(params))
+        total_count = cur.fetchone()[0] + archive_totals(cur)['bills']
+    else:
+        cur.execute(f'SELECT COUNT(*) FROM {source} {where_sql}', tuple(params))
+        total_count = cur.fetchone()[0]
+    # Only the columns named in ?fields= (validated against BILL_LIST_COLUMNS, so safe to interpolate)
     query = f'''
-        SELECT id, customer_name, customer_email, customer_phone, pdf_filename, shipper, consignee, port_of_loading, port_of_discharge, bl_number, container_numbers,
-               flight_or_vessel, product_description, service_fee, ctn_fee, payment_link, receipt_filename, status, invoice_filename, unique_number, created_at, receipt_uploaded_at, customer_username, customer_invoice, customer_packing_list
-        FROM bill_of_lading
+        SELECT {', '.join(fields or BILL_LIST_COLUMNS)}
+        FROM {source}
         {where_sql}
         ORDER BY id DESC
         LIMIT %s OFFSET %s
@@ -180,18 +209,11 @@ def get_bill(id):
     user = json.loads(get_jwt_identity())
     conn = get_db_conn()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM bill_of_lading WHERE id=%s", (id,))
-    bill_row = cur.fetchone()
-    if not bill_row:
+    bill = fetch_bill(cur, id, include_archive=True)
+    if not bill:
         cur.close()
         conn.close()
         return jsonify({'error': 'Bill not found'}), 404
-    columns = [desc[0] for desc in cur.description]
-    bill = dict(zip(columns, bill_row))
-    if bill.get('customer_email') is not None:
-        bill['customer_email'] = decrypt_sensitive_data(bill['customer_email'])
-    if bill.get('customer_phone') is not None:
-        bill['customer_phone'] = decrypt_sensitive_data(bill['customer_phone'])
     cur.close()
     conn.close()
       # --- AUTO-INVOICE GENERATION ---
@@ -223,13 +245,12 @@ def get_bill(id):
 @bill_routes.route('/upload', methods=['POST'])
 @jwt_required()
 def upload_file():
-    from extract_fields import extract_fields
     from email_utils import send_simple_email
     from config import EmailConfig
     # [DEBUG] Migration: No local upload dir, using Cloudinary
     user = json.loads(get_jwt_identity())
     username = user['username']
-    print(f"[DEBUG] Upload triggered by username: {username}")
+    logger.debug(f"Upload triggered by username: {username}")
     try:
         name = request.form.get('name')
         email = request.form.get('email')
@@ -279,51 +300,38 @@ def upload_file():
                 fields = {}
                 if bill_pdf:
                     try:
-                        if username == 'ray40':
-                            print('[DEBUG] Using OpenAI extraction for user ray40')
-                            fields = extract_fields_openai(local_path)
-                        else:
-                            print(f'[DEBUG] Using legacy extraction for user {username}')
-                            fields = extract_fields_legacy(local_path)
+                        # Provider chain, timeouts and fallbacks come from ExtractionConfig
+                        fields = extract_bill_fields(local_path, username)
                     except Exception as e:
-                        print(f'[DEBUG] Extraction error: {e}')
+                        logger.warning(f'Extraction error: {e}')
                         fields = {}
-                fields_json = json.dumps(fields)
                 hk_now = datetime.now(pytz.timezone('Asia/Hong_Kong')).isoformat()
                 conn = get_db_conn()
                 cur = conn.cursor()
-                cur.execute("""
-                    INSERT INTO bill_of_lading (
-                        customer_name, customer_email, customer_phone, pdf_filename, ocr_text,
-                        shipper, consignee, port_of_loading, port_of_discharge, bl_number, container_numbers,
-                        flight_or_vessel, product_description, status,
-                        customer_username, created_at, customer_invoice, customer_packing_list
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    name, str(email), str(phone), pdf_url, fields_json,
-                    str(fields.get('shipper', '')),
-                    str(fields.get('consignee', '')),
-                    str(fields.get('port_of_loading', '')),
-                    str(fields.get('port_of_discharge', '')),
-                    str(fields.get('bl_number', '')),
-                    str(fields.get('container_numbers', '')),
-                    str(fields.get('flight_or_vessel', '')),
-                    str(fields.get('product_description', '')),
-                    "Pending",
-                    username,
-                    hk_now,
-                    customer_invoice,
-                    customer_packing_list
-                ))
+                # The new row comes back from the INSERT; the full extraction result goes to bill_extractions
+                bill = insert_bill(cur, {
+                    'customer_name': name,
+                    'customer_email': str(email),
+                    'customer_phone': str(phone),
+                    'pdf_filename': pdf_url,
+                    'shipper': str(fields.get('shipper', '')),
+                    'consignee': str(fields.get('consignee', '')),
+                    'port_of_loading': str(fields.get('port_of_loading', '')),
+                    'port_of_discharge': str(fields.get('port_of_discharge', '')),
+                    'bl_number': str(fields.get('bl_number', '')),
+                    'container_numbers': str(fields.get('container_numbers', '')),
+                    'flight_or_vessel': str(fields.get('flight_or_vessel', '')),
+                    'product_description': str(fields.get('product_description', '')),
+                    'status': "Pending",
+                    'customer_username': username,
+                    'created_at': hk_now,
+                    'customer_invoice': customer_invoice,
+                    'customer_packing_list': customer_packing_list
+                }, decrypt=False)
+                save_extraction(cur, bill['id'], fields)
                 conn.commit()
-                # Fetch newly inserted BOL row
-                cur.execute("SELECT * FROM bill_of_lading WHERE id = (SELECT MAX(id) FROM bill_of_lading)")
-                bill_row = cur.fetchone()
-                columns = [desc[0] for desc in cur.description]
-                bill = dict(zip(columns, bill_row)) if bill_row else None
-                if bill:
-                    if username == 'ray40':
-                        auto_generate_invoice_for_bill(bill)
+                if username == 'ray40':
+                    auto_generate_invoice_for_bill(bill, fields)
                 cur.close()
                 conn.close()
                 uploaded_count += 1
@@ -338,12 +346,12 @@ def upload_file():
             cur = conn.cursor()
             cur.execute("""
                 INSERT INTO bill_of_lading (
-                    customer_name, customer_email, customer_phone, pdf_filename, ocr_text,
+                    customer_name, customer_email, customer_phone, pdf_filename,
                     shipper, consignee, port_of_loading, port_of_discharge, bl_number, container_numbers, status,
                     customer_username, created_at, customer_invoice, customer_packing_list
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """, (
-                name, str(email), str(phone), None, None,
+                name, str(email), str(phone), None,
                 '', '', '', '', '', '',
                 "Pending",
                 username,
@@ -362,7 +370,7 @@ def upload_file():
                 body = f"Dear {name},\n\nWe have received your documents. Our team will be in touch with you within 24 hours.\n\nThank you!"
                 send_simple_email(email, subject, body)
         except Exception as e:
-            print(f"Failed to send confirmation email: {str(e)}")
+            logger.warning(f"Failed to send confirmation email: {str(e)}")
         return jsonify({'message': f'Upload successful! {uploaded_count} bill(s) uploaded.'})
     except Exception as e:
         return jsonify({'error': f'Error processing upload: {str(e)}'}), 400
@@ -376,9 +384,9 @@ def upload_receipt(id):
         receipt = request.files.get('receipt')
         if not receipt:
             return jsonify({'error': 'Receipt PDF file is required'}), 400
-        print(f"[DEBUG] Uploading receipt to Cloudinary: {receipt.filename}")
+        logger.debug(f"Uploading receipt to Cloudinary: {receipt.filename}")
         cloud_url = upload_filelike_to_cloudinary(receipt, folder="receipts")
-        print(f"[DEBUG] Cloudinary result for receipt: {cloud_url}")
+        logger.debug(f"Cloudinary result for receipt: {cloud_url}")
         hk_now = datetime.now(pytz.timezone('Asia/Hong_Kong')).isoformat()
         conn = get_db_conn()
         cur = conn.cursor()
@@ -387,7 +395,7 @@ def upload_receipt(id):
             SET receipt_filename = %s, status = %s, receipt_uploaded_at = %s
             WHERE id = %s
         """, (cloud_url, 'Awaiting Bank In', hk_now, id))
-        print(f"[DEBUG] Saving secure Cloudinary URL to DB: {cloud_url}")
+        logger.debug(f"Saving secure Cloudinary URL to DB: {cloud_url}")
         conn.commit()
         cur.close()
         conn.close()
@@ -433,18 +441,13 @@ def send_unique_number_email():
             return jsonify({'error': 'Missing required fields'}), 400
         conn = get_db_conn()
         cur = conn.cursor()
-        cur.execute("SELECT * FROM bill_of_lading WHERE id=%s", (bill_id,))
+        # Only checks that the bill exists
+        cur.execute("SELECT 1 FROM bill_of_lading WHERE id=%s", (bill_id,))
         bill_row = cur.fetchone()
         if not bill_row:
             cur.close()
             conn.close()
             return jsonify({'error': 'Bill not found'}), 404
-        columns = [desc[0] for desc in cur.description]
-        bill = dict(zip(columns, bill_row))
-        if bill.get('customer_email') is not None:
-            bill['customer_email'] = decrypt_sensitive_data(bill['customer_email'])
-        if bill.get('customer_phone') is not None:
-            bill['customer_phone'] = decrypt_sensitive_data(bill['customer_phone'])
         cur.close()
         conn.close()
         from email_utils import send_unique_number_email as send_unique_number_email_util
@@ -465,25 +468,18 @@ def send_invoice_email():
             return jsonify({'error': 'ID is required'}), 400
         conn = get_db_conn()
         cur = conn.cursor()
-        cur.execute("SELECT * FROM bill_of_lading WHERE id=%s", (bill_id,))
-        bill_row = cur.fetchone()
-        if not bill_row:
+        bill = fetch_bill(cur, bill_id, columns=('id', 'customer_email'), include_archive=True)
+        if not bill:
             cur.close()
             conn.close()
             return jsonify({'error': 'Bill not found'}), 404
-        columns = [desc[0] for desc in cur.description]
-        bill = dict(zip(columns, bill_row))
-        if bill.get('customer_email') is not None:
-            bill['customer_email'] = decrypt_sensitive_data(bill['customer_email'])
-        if bill.get('customer_phone') is not None:
-            bill['customer_phone'] = decrypt_sensitive_data(bill['customer_phone'])
         # Use custom email fields if provided, else fallback to defaults
         to_email = data.get('to_email', bill['customer_email'])
         subject = data.get('subject', 'Your Invoice')
         body = data.get('body', 'Please find your invoice attached.')
         pdf_url = data.get('pdf_url')
         # Use Cloudinary URL directly
-        print(f"[DEBUG] Sending invoice email with Cloudinary URL: {pdf_url}")
+        logger.debug(f"Sending invoice email with Cloudinary URL: {pdf_url}")
         from email_utils import send_invoice_email as send_invoice_email_util
         success = send_invoice_email_util(to_email, subject, body, pdf_url)
         if success:
@@ -504,6 +500,8 @@ def delete_bill(id):
         conn = get_db_conn()
         cur = conn.cursor()
         cur.execute("DELETE FROM bill_of_lading WHERE id=%s", (id,))
+        cur.execute("DELETE FROM bill_of_lading_archive WHERE id=%s", (id,))
+        cur.execute("DELETE FROM bill_extractions WHERE bill_id=%s", (id,))
         conn.commit()
         cur.close()
         conn.close()
@@ -519,12 +517,14 @@ def get_bills_by_status(status):
     page = int(request.args.get('page', 1))
     page_size = int(request.args.get('page_size', 50))
     offset = (page - 1) * page_size
+    # Archived bills are all ARCHIVED_STATUS; any other status (the dashboard polls) reads the hot table only
+    include_archive = status == ARCHIVED_STATUS or request.args.get('include_archive') == '1'
     conn = get_db_conn()
     cur = conn.cursor()
     query = f'''
         SELECT id, customer_name, customer_email, customer_phone, pdf_filename, shipper, consignee, port_of_loading, port_of_discharge, bl_number, container_numbers,
                flight_or_vessel, product_description, service_fee, ctn_fee, payment_link, receipt_filename, status, invoice_filename, unique_number, created_at, receipt_uploaded_at, customer_username, customer_invoice, customer_packing_list
-        FROM bill_of_lading
+        FROM {'bill_of_lading_all' if include_archive else 'bill_of_lading'}
         WHERE status = %s
         ORDER BY id DESC
         LIMIT %s OFFSET %s
@@ -577,7 +577,7 @@ def get_awaiting_bank_in_bills():
 
         where_sql = " AND ".join(where_clauses)
         query = (
-            "SELECT * FROM bill_of_lading "
+            f"SELECT {BILL_SELECT} FROM bill_of_lading "
             "WHERE " + where_sql + " "
             "ORDER BY id DESC"
         )
@@ -600,7 +600,7 @@ def get_awaiting_bank_in_bills():
 
         return jsonify({'bills': bills, 'total': len(bills)})
     except Exception as e:
-        print("❌ ERROR in awaiting_bank_in:", str(e))
+        logger.exception(f"Error in awaiting_bank_in: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': 'Internal server error'}), 500
@@ -619,12 +619,12 @@ def update_bill(id):
         data = request.get_json()
         conn = get_db_conn()
         cur = conn.cursor()
-        cur.execute("SELECT * FROM bill_of_lading WHERE id=%s", (id,))
-        bill_row = cur.fetchone()
-        if not bill_row:
+        cur.execute("SELECT 1 FROM bill_of_lading WHERE id=%s", (id,))
+        if not cur.fetchone():
+            cur.execute("SELECT 1 FROM bill_of_lading_archive WHERE id=%s", (id,))
+            if cur.fetchone():
+                return jsonify({'error': 'Bill is archived (settled) and can no longer be edited'}), 409
             return jsonify({'error': 'Bill not found'}), 404
-        columns = [desc[0] for desc in cur.description]
-        bill = dict(zip(columns, bill_row))
         updatable_fields = [
             'customer_name', 'customer_email', 'customer_phone', 'bl_number',
             'shipper', 'consignee', 'port_of_loading', 'port_of_discharge',
@@ -654,14 +654,7 @@ def update_bill(id):
             """
             cur.execute(update_query, tuple(update_values))
             conn.commit()
-        cur.execute("SELECT * FROM bill_of_lading WHERE id=%s", (id,))
-        bill_row = cur.fetchone()
-        columns = [desc[0] for desc in cur.description]
-        bill = dict(zip(columns, bill_row))
-        if bill.get('customer_email') is not None:
-            bill['customer_email'] = decrypt_sensitive_data(bill['customer_email'])
-        if bill.get('customer_phone') is not None:
-            bill['customer_phone'] = decrypt_sensitive_data(bill['customer_phone'])
+        bill = fetch_bill(cur, id)
         import tempfile
         try:
             customer = {
@@ -669,14 +662,14 @@ def update_bill(id):
                 'email': bill['customer_email'],
                 'phone': bill['customer_phone']
             }
-            print(f"[DEBUG] Generating invoice PDF for bill {id}")
+            logger.debug(f"Generating invoice PDF for bill {id}")
             with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
                 invoice_local_path = tmp.name
             # Pass the temp file path to generate_invoice_pdf so it writes to the correct location
             generate_invoice_pdf(customer, bill, bill.get('service_fee'), bill.get('ctn_fee'), bill.get('payment_link'), output_path=invoice_local_path)
-            print(f"[DEBUG] Invoice generated at: {invoice_local_path}")
+            logger.debug(f"Invoice generated at: {invoice_local_path}")
             cloud_url = upload_filepath_to_cloudinary(invoice_local_path, folder="invoices")
-            print(f"[DEBUG] Invoice uploaded to Cloudinary: {cloud_url}")
+            logger.debug(f"Invoice uploaded to Cloudinary: {cloud_url}")
             bill['invoice_filename'] = cloud_url
             # Save Cloudinary URL to DB
             cur.execute("UPDATE bill_of_lading SET invoice_filename=%s WHERE id=%s", (cloud_url, id))
@@ -684,9 +677,9 @@ def update_bill(id):
             # Delete local file
             if os.path.exists(invoice_local_path):
                 os.remove(invoice_local_path)
-                print(f"[DEBUG] Deleted local file after Cloudinary upload: {invoice_local_path}")
+                logger.debug(f"Deleted local file after Cloudinary upload: {invoice_local_path}")
         except Exception as e:
-            print(f"[DEBUG] Error generating/uploading invoice PDF: {str(e)}")
+            logger.error(f"Error generating/uploading invoice PDF: {str(e)}")
             import traceback
             traceback.print_exc()
         cur.close()
@@ -756,7 +749,7 @@ def search_bills():
     cur = conn.cursor()
     query = '''
         SELECT id, customer_name, customer_email, customer_phone, pdf_filename, shipper, consignee, port_of_loading, port_of_discharge, bl_number, container_numbers, service_fee, ctn_fee, payment_link, receipt_filename, status, invoice_filename, unique_number, created_at, receipt_uploaded_at, customer_username, customer_invoice, customer_packing_list
-        FROM bill_of_lading
+        FROM bill_of_lading_all
         WHERE 1=1
     '''
     params = []
@@ -773,8 +766,9 @@ def search_bills():
             params.append(f'%{customer_id}%')
     if created_at:
         start_date, end_date = get_hk_date_range(created_at)
-        query += ' AND created_at >= %s AND created_at < %s'
-        params.extend([start_date, end_date])
+        # settled_at >= created_at: skips archive partitions settled before that day
+        query += ' AND created_at >= %s AND created_at < %s AND settled_at >= %s'
+        params.extend([start_date, end_date, start_date])
     if bl_number:
         query += ' AND bl_number ILIKE %s'
         params.append(f'%{bl_number}%')
@@ -804,6 +798,7 @@ def search_bills():
 @jwt_required()
 def account_bills():
     from dateutil import parser
+    fields = requested_fields(ACCOUNT_BILL_FIELDS)
     completed_at = request.args.get('completed_at')
     bl_number = request.args.get('bl_number')
 
@@ -819,7 +814,7 @@ def account_bills():
                completed_at, allinpay_85_received_at,
                customer_username, customer_invoice, customer_packing_list,
                payment_method, payment_status, reserve_status
-        FROM bill_of_lading
+        FROM bill_of_lading_all
         WHERE status = 'Paid and CTN Valid'
     '''
 
@@ -828,13 +823,16 @@ def account_bills():
 
     if completed_at:
         start_date, end_date = get_hk_date_range(completed_at)
-        print("DEBUG: start_date", start_date, "end_date", end_date)
+        logger.debug(f"start_date {start_date} end_date {end_date}")
         where_clauses.append(
             "((payment_method = 'Allinpay' AND allinpay_85_received_at >= %s AND allinpay_85_received_at < %s) "
             "OR (payment_method = 'Allinpay' AND completed_at >= %s AND completed_at < %s) "
             "OR (payment_method != 'Allinpay' AND completed_at >= %s AND completed_at < %s))"
         )
         params.extend([start_date, end_date, start_date, end_date, start_date, end_date])
+        # Implied by the dates above; lets Postgres skip archive partitions settled before the period
+        where_clauses.append("settled_at >= %s")
+        params.append(start_date)
     if bl_number:
         where_clauses.append("bl_number ILIKE %s")
         params.append(f'%{bl_number}%')
@@ -938,7 +936,7 @@ def account_bills():
     cur.close()
     conn.close()
 
-    return jsonify({'bills': bills, 'summary': summary})
+    return jsonify({'bills': project(bills, fields), 'summary': summary})
 
 
 @bill_routes.route('/extract_fields', methods=['POST'])
@@ -947,7 +945,7 @@ def extract_fields_endpoint():
     """
     Expects a PDF file upload as 'pdf' in form-data.
     Returns extracted fields as JSON.
-    Uses OpenAI for user 'ray40', Google Vision for others.
+    The extraction provider is chosen by the extraction router (see ExtractionConfig).
     """
     if 'pdf' not in request.files:
         return jsonify({'error': 'No PDF file uploaded'}), 400
@@ -959,10 +957,7 @@ def extract_fields_endpoint():
         pdf_path = tmp.name
         pdf_file.save(pdf_path)
     try:
-        if username == 'ray40':
-            fields = extract_fields_openai(pdf_path)
-        else:
-            fields = extract_fields_legacy(pdf_path)
+        fields = extract_bill_fields(pdf_path, username)
         return jsonify({'fields': fields})
     finally:
         try:
@@ -974,6 +969,7 @@ def extract_fields_endpoint():
 @bill_routes.route('/account_bills_monthly', methods=['GET'])
 @jwt_required()
 def account_bills_monthly():
+    fields = requested_fields(ACCOUNT_BILL_FIELDS)
     completed_month = request.args.get('completed_month')
     bl_number = request.args.get('bl_number')
     conn = get_db_conn()
@@ -986,7 +982,7 @@ def account_bills_monthly():
                completed_at, allinpay_85_received_at,
                customer_username, customer_invoice, customer_packing_list,
                payment_method, payment_status, reserve_status
-        FROM bill_of_lading
+        FROM bill_of_lading_all
         WHERE status = 'Paid and CTN Valid'
     '''
     where_clauses = []
@@ -1011,6 +1007,9 @@ def account_bills_monthly():
             "OR (payment_method != 'Allinpay' AND completed_at >= %s AND completed_at < %s))"
         )
         params.extend([start_date, end_date, start_date, end_date, start_date, end_date])
+        # Implied by the dates above; lets Postgres skip archive partitions settled before the period
+        where_clauses.append("settled_at >= %s")
+        params.append(start_date)
     if bl_number:
         where_clauses.append("bl_number ILIKE %s")
         params.append(f'%{bl_number}%')
@@ -1152,4 +1151,4 @@ def account_bills_monthly():
     }
     cur.close()
     conn.close()
-    return jsonify({'bills': bills, 'summary': summary})
\ No newline at end of file
+    return jsonify({'bills': project(bills, fields), 'summary': summary})
\ No newline at end of file
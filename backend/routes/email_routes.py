@@ -1,33 +1,31 @@
 import os
 import json
 import datetime
+import logging
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 from config import get_db_conn
+from utils.json_response import requested_fields
 from email_utils import send_email
 from email_utils import send_email_with_attachment
 import requests
 
 email_routes = Blueprint('email_routes', __name__)
+logger = logging.getLogger(__name__)
+
+# Columns returned by /inbox (and selectable with ?fields=)
+INBOX_FIELDS = ['id', 'sender', 'subject', 'created_at', 'bl_numbers']
 
 @email_routes.route('/inbox', methods=['GET'])
 @jwt_required()
 def get_customer_emails():
-    print('[DEBUG] /admin/email/inbox called - fetching emails from database only (no IMAP ingestion triggered). To fetch new emails, run the ingestion process manually or via admin endpoint.')
-    print("[DEBUG] Fetching all customer emails")
+    logger.debug("Fetching all customer emails")
+    # Only the columns named in ?fields= (validated against INBOX_FIELDS, so safe to interpolate)
+    fields = requested_fields(INBOX_FIELDS) or INBOX_FIELDS
     conn = get_db_conn()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, sender, subject, created_at, bl_numbers FROM customer_emails ORDER BY created_at DESC")
-    rows = cursor.fetchall()
-    emails = [
-        {
-            'id': row[0],
-            'sender': row[1],
-            'subject': row[2],
-            'created_at': row[3],
-            'bl_numbers': row[4]
-        } for row in rows
-    ]
+    cursor.execute(f"SELECT {', '.join(fields)} FROM customer_emails ORDER BY created_at DESC")
+    emails = [dict(zip(fields, row)) for row in cursor.fetchall()]
     cursor.close()
     conn.close()
     return jsonify(emails)
@@ -35,7 +33,7 @@ def get_customer_emails():
 @email_routes.route('/<int:email_id>', methods=['GET'])
 @jwt_required()
 def get_email_detail(email_id):
-    print(f"[DEBUG] Fetching detail for email_id={email_id}")
+    logger.debug(f"Fetching detail for email_id={email_id}")
     conn = get_db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT id, sender, subject, body, attachments, bl_numbers, created_at FROM customer_emails WHERE id = %s", (email_id,))
@@ -72,7 +70,7 @@ def get_email_detail(email_id):
 def reply_to_customer(email_id):
     data = request.json
     reply_body = data.get('body')
-    print(f"[DEBUG] Replying to email_id={email_id}")
+    logger.debug(f"Replying to email_id={email_id}")
     conn = get_db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT sender, subject FROM customer_emails WHERE id = %s", (email_id,))
@@ -84,14 +82,14 @@ def reply_to_customer(email_id):
     to_email = row[0]
     subject = f"Re: {row[1]}"
     send_email(to_email, subject, reply_body)
-    print(f"[DEBUG] Sent reply to {to_email}")
+    logger.info(f"Sent reply to {to_email}")
     from config import EmailConfig
     try:
         cursor.execute("INSERT INTO customer_email_replies (customer_email_id, sender, body, created_at) VALUES (%s, %s, %s, %s)", (email_id, EmailConfig.FROM_EMAIL, reply_body, datetime.datetime.now()))
         conn.commit()
-        print(f"[DEBUG] Saved reply to DB for email_id={email_id}")
+        logger.debug(f"Saved reply to DB for email_id={email_id}")
     except Exception as e:
-        print(f"[ERROR] Failed to send reply: {e}")
+        logger.error(f"Failed to send reply: {e}")
         cursor.close()
         conn.close()
         return jsonify({'error': 'Failed to send reply'}), 500
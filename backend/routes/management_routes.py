@@ -3,21 +3,34 @@ from flask_jwt_extended import jwt_required
 from config import get_db_conn
 from utils.ocr_checker import check_missing_fields
 from utils.email_ingest import ingest_emails
+from utils.json_response import project, requested_fields
+from utils.bill_archive import archive_totals
 from datetime import datetime, timezone
+import logging
 import pytz
 
 management_routes = Blueprint('management_routes', __name__)
+logger = logging.getLogger(__name__)
+
+# Keys of each overview bill (selectable with ?fields=). ocr_text is not sent: the dashboard never
+# shows it and it was most of the payload.
+OVERVIEW_BILL_FIELDS = [
+    'id', 'customer_name', 'bl_number', 'status', 'created_at', 'invoice_filename', 'receipt_filename',
+    'ctn_fee', 'service_fee', 'shipper', 'consignee', 'port_of_loading', 'port_of_discharge',
+    'flight_or_vessel', 'container_numbers', 'is_new', 'is_overdue', 'total_invoice_amount'
+]
 
 @management_routes.route('/management/overview', methods=['GET'])
 @jwt_required()
 def management_overview():
+    fields = requested_fields(OVERVIEW_BILL_FIELDS)
     try:
         conn = get_db_conn()
         cur = conn.cursor()
-        print("[DEBUG] Fetching B/L records...")
+        logger.debug("Fetching B/L records...")
         cur.execute("""
             SELECT id, customer_name, bl_number, status, created_at,
-                   invoice_filename, receipt_filename, ocr_text, ctn_fee, service_fee,
+                   invoice_filename, receipt_filename, ctn_fee, service_fee,
                    shipper, consignee, port_of_loading, port_of_discharge, flight_or_vessel, container_numbers
             FROM bill_of_lading
             ORDER BY created_at DESC
@@ -26,7 +39,7 @@ def management_overview():
         columns = [desc[0] for desc in cur.description]
         bills = []
         now = datetime.now(pytz.timezone('Asia/Hong_Kong'))
-        print("[DEBUG] Processing bills...")
+        logger.debug("Processing bills...")
         for row in rows:
             bill = dict(zip(columns, row))
             created_at = bill.get("created_at")
@@ -53,10 +66,10 @@ def management_overview():
             bill["total_invoice_amount"] = total_invoice_amount
             bills.append(bill)
 
-        print(f"[DEBUG] Processed {len(bills)} bills.")
+        logger.debug(f"Processed {len(bills)} bills.")
 
         # --- Begin: StaffStats.js/stats_summary logic copy ---
-        print("[DEBUG] Calculating metrics (copied from stats_summary logic)...")
+        logger.debug("Calculating metrics (copied from stats_summary logic)...")
         total_bills = len(bills)
         pending_bills = sum(1 for b in bills if b.get("status") in ("Pending", "Invoice Sent", "Awaiting Bank In"))
         awaiting_bank_in = sum(1 for b in bills if b.get("status") == "Awaiting Bank In")
@@ -87,6 +100,13 @@ def management_overview():
             elif payment_method == 'allinpay' and reserve_status == 'unsettled':
                 sum_outstanding_amount += (ctn_fee * 0.15) + (service_fee * 0.15)
 
+        # Settled bills moved to the archive (utils/bill_archive.py) count through the monthly rollup
+        archived = archive_totals(cur)
+        total_bills += archived['bills']
+        completed_bills += archived['bills']
+        sum_invoice_amount = float(sum_invoice_amount) + archived['ctn_fee'] + archived['service_fee']
+        sum_paid_amount += archived['overview_paid_amount']
+
         metrics = {
             "total_bills": total_bills,
             "pending_bills": pending_bills,
@@ -97,11 +117,11 @@ def management_overview():
             "sum_paid_amount": round(sum_paid_amount, 2),
             "sum_outstanding_amount": round(sum_outstanding_amount, 2)
         }
-        print(f"[DEBUG] Metrics: {metrics}")
+        logger.debug(f"Metrics: {metrics}")
         # --- End: StaffStats.js/stats_summary logic copy ---
 
         flagged_ocr = []
-        print("[DEBUG] Checking missing required fields from DB columns...")
+        logger.debug("Checking missing required fields from DB columns...")
         required_fields = [
             "shipper", "consignee", "port_of_loading", "port_of_discharge", "bl_number", "flight_or_vessel", "container_numbers"
         ]
@@ -111,7 +131,7 @@ def management_overview():
             if missing and len(missing) > 0:
                 flagged_ocr.append({"id": b["id"], "bl_number": b["bl_number"], "missing": missing})
 
-        print("[DEBUG] Ingesting unmatched receipts...")
+        logger.debug("Ingesting unmatched receipts...")
         unmatched_receipts_raw = ingest_emails()
         unmatched_receipts = []
         # Try to extract BL number from filename or add as None if not found
@@ -128,9 +148,9 @@ def management_overview():
             receipt["bl_number"] = bl_number
             unmatched_receipts.append(receipt)
 
-        print("[DEBUG] Returning overview response...")
+        logger.debug("Returning overview response...")
         return jsonify({
-            "bills": bills,
+            "bills": project(bills, fields),
             "flags": {
                 "ocr_missing": flagged_ocr,
                 "unmatched_receipts": unmatched_receipts
@@ -139,5 +159,5 @@ def management_overview():
         })
 
     except Exception as e:
-        print("[ERROR] Management dashboard error:", e)
+        logger.exception(f"Management dashboard error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -3,6 +3,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from utils.security import decrypt_sensitive_data
 from config import get_db_conn  # Updated import
 from utils.helpers import get_hk_date_range
+from utils.bill_archive import archive_totals
 import pytz
 from datetime import datetime
 import json
@@ -21,7 +22,8 @@ def files_by_date():
         return jsonify({'error': 'Database connection failed'}), 500
     cur = conn.cursor()
     start_date, end_date = get_hk_date_range(query_date)
-    cur.execute("SELECT COUNT(*) FROM bill_of_lading WHERE created_at >= %s AND created_at < %s", (start_date, end_date))
+    cur.execute("SELECT COUNT(*) FROM bill_of_lading_all WHERE created_at >= %s AND created_at < %s AND settled_at >= %s",
+                (start_date, end_date, start_date))
     count = cur.fetchone()[0]
     cur.close()
     conn.close()
@@ -58,7 +60,8 @@ def payments_by_date():
         return jsonify({'error': 'Database connection failed'}), 500
     cur = conn.cursor()
     start_date, end_date = get_hk_date_range(query_date)
-    cur.execute("SELECT SUM(service_fee) FROM bill_of_lading WHERE created_at >= %s AND created_at < %s", (start_date, end_date))
+    cur.execute("SELECT SUM(service_fee) FROM bill_of_lading_all WHERE created_at >= %s AND created_at < %s AND settled_at >= %s",
+                (start_date, end_date, start_date))
     total = cur.fetchone()[0] or 0
     cur.close()
     conn.close()
@@ -81,9 +84,9 @@ def bills_by_date():
             COUNT(*) as total_entries,
             COALESCE(SUM(ctn_fee), 0) as total_ctn_fee,
             COALESCE(SUM(service_fee), 0) as total_service_fee
-        FROM bill_of_lading 
-        WHERE created_at >= %s AND created_at < %s
-    """, (start_date, end_date))
+        FROM bill_of_lading_all
+        WHERE created_at >= %s AND created_at < %s AND settled_at >= %s
+    """, (start_date, end_date, start_date))
     summary = cur.fetchone()
     cur.execute("""
         SELECT 
@@ -91,10 +94,10 @@ def bills_by_date():
             ctn_fee, service_fee, 
             COALESCE(ctn_fee + service_fee, 0) as total,
             created_at
-        FROM bill_of_lading 
-        WHERE created_at >= %s AND created_at < %s
+        FROM bill_of_lading_all
+        WHERE created_at >= %s AND created_at < %s AND settled_at >= %s
         ORDER BY created_at DESC
-    """, (start_date, end_date))
+    """, (start_date, end_date, start_date))
     entries = [dict(zip([desc[0] for desc in cur.description], row)) for row in cur.fetchall()]
     cur.close()
     conn.close()
@@ -153,6 +156,12 @@ def stats_summary():
     cur.execute("SELECT COALESCE(SUM(reserve_amount), 0) FROM bill_of_lading WHERE LOWER(TRIM(reserve_status)) = 'unsettled'")
     unsettled_reserve = float(cur.fetchone()[0] or 0)
     total_payment_outstanding = awaiting_payment + unsettled_reserve
+    # Archived bills are all settled ('Paid and CTN Valid'); their totals come from the monthly rollup
+    archived = archive_totals(cur)
+    total_bills += archived['bills']
+    completed_bills += archived['bills']
+    total_invoice_amount += archived['invoice_amount']
+    total_payment_received += archived['payment_received']
     cur.close()
     conn.close()
     return jsonify({
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Query budgets for the bill list endpoints (see utils/db_instrumentation.py).
+A list endpoint runs a fixed number of statements whatever the page size; a query per bill (N+1)
+fails these tests. Needs the database from .env.local, like the other test_*.py scripts:
+    python -m pytest test_query_budget.py
+"""
+
+import sys
+import os
+import json
+sys.path.append(os.path.dirname(__file__))
+
+import pytest
+
+from config import get_db_conn
+
+
+@pytest.fixture(scope='module')
+def client():
+    conn = get_db_conn()
+    if conn is None:
+        pytest.skip("database not available")
+    conn.close()
+
+    # The postgres session registry admits a new identity with its own statements (and again after
+    # SESSION_TTL); the per-process registry keeps them out of the endpoints' budgets
+    from config import SessionConfig
+    from utils import session_registry
+    SessionConfig.BACKEND = 'memory'
+    session_registry._registry = None
+
+    from flask_jwt_extended import create_access_token
+    from app import app
+
+    app.config['TESTING'] = True
+    client = app.test_client()
+    with app.app_context():
+        token = create_access_token(identity=json.dumps({'id': 0, 'role': 'staff', 'username': 'query-budget'}))
+    client.set_cookie('access_token_cookie', token)
+    return client
+
+
+def test_bill_list_query_budget(client):
+    from utils.db_instrumentation import assert_endpoint_max_queries
+
+    # COUNT + page; never one statement per bill
+    response = assert_endpoint_max_queries(client, 'GET', '/api/bills?page_size=100', 2, max_per_statement=1)
+    assert response.status_code == 200
+
+
+def test_bills_by_status_query_budget(client):
+    from utils.db_instrumentation import assert_endpoint_max_queries
+
+    # The page alone; the total is the page's length
+    response = assert_endpoint_max_queries(client, 'GET', '/api/bills/status/Awaiting%20Bank%20In?page_size=100', 1,
+                                           max_per_statement=1)
+    assert response.status_code == 200
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-q']))
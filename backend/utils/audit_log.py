@@ -0,0 +1,221 @@
+"""
+Audit Log Writer for IQSTrade
+Buffered writes to audit_logs so logins and sensitive actions never wait for the database:
+- record() only appends the event to an in-memory queue
+- A background thread writes the queue with one multi-row INSERT when AUDIT_BATCH_SIZE events
+  are waiting or AUDIT_FLUSH_INTERVAL seconds have passed, over a single connection per batch
+- If the database is unavailable the batch is appended to a local JSON-lines spill file
+  (AUDIT_SPILL_PATH) and replayed after the next successful write; a full queue spills too
+- Pending events are flushed at interpreter exit (gunicorn worker shutdown, scheduler stop)
+"""
+
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import pytz
+
+from config import AuditConfig, get_db_conn
+
+logger = logging.getLogger(__name__)
+
+HK_TZ = pytz.timezone('Asia/Hong_Kong')
+
+# user_id, operation, details, timestamp (ISO 8601), ip_address
+AuditEvent = Tuple[Optional[int], str, Optional[str], str, Optional[str]]
+
+# Events whose user has since been deleted keep their row with user_id NULL instead of failing the batch
+INSERT_SQL = """
+    INSERT INTO audit_logs (user_id, operation, details, timestamp, ip_address)
+    SELECT CASE WHEN EXISTS (SELECT 1 FROM users u WHERE u.id = v.user_id) THEN v.user_id END,
+           v.operation, v.details, v.ts, v.ip_address
+    FROM (VALUES %s) AS v (user_id, operation, details, ts, ip_address)
+"""
+INSERT_TEMPLATE = '(%s::integer, %s, %s, %s::timestamptz, %s)'
+
+
+class AuditWriter:
+    def __init__(self, batch_size: int, flush_interval: float, queue_size: int, spill_path: str):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.spill_path = spill_path
+        self._init_process_state()
+
+    def _init_process_state(self):
+        self._queue: deque = deque()
+        self._cond = threading.Condition()
+        # Serializes flushes (writer thread, atexit, explicit flush())
+        self._flush_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._thread = None
+        # After a failed replay the spill file is left alone for a while
+        self._replay_after = 0.0
+        self.written = 0
+        self.spilled = 0
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def record(self, user_id, operation: str, details=None, ip_address: Optional[str] = None):
+        event = (user_id, operation, details, datetime.now(HK_TZ).isoformat(), ip_address)
+        with self._cond:
+            self._ensure_thread()
+            if len(self._queue) >= self.queue_size:
+                overflow = True
+            else:
+                overflow = False
+                self._queue.append(event)
+                if len(self._queue) >= self.batch_size:
+                    self._cond.notify()
+        if overflow:
+            # Never block the request: the event goes straight to the spill file
+            self._spill([event])
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Audit writer: flush failed: {e}")
+
+    def _take(self) -> List[AuditEvent]:
+        with self._cond:
+            batch = []
+            while self._queue and len(batch) < self.batch_size:
+                batch.append(self._queue.popleft())
+            return batch
+
+    def flush(self):
+        """Write everything queued so far (spilling what cannot be written), then replay the spill file."""
+        with self._flush_lock:
+            wrote = False
+            batch = self._take()
+            while batch:
+                if self._write(batch):
+                    wrote = True
+                else:
+                    self._spill(batch)
+                    # The database is down: spill the rest without trying again per batch
+                    rest = self._take()
+                    while rest:
+                        self._spill(rest)
+                        rest = self._take()
+                    return
+                batch = self._take()
+            if wrote:
+                # The database is back: do not wait out the replay back-off
+                self._replay_after = 0.0
+            self._replay_spill()
+
+    def _write(self, batch: List[AuditEvent]) -> bool:
+        from psycopg2.extras import execute_values
+
+        conn = get_db_conn(max_retries=1)
+        if conn is None:
+            return False
+        try:
+            cur = conn.cursor()
+            execute_values(cur, INSERT_SQL, batch, template=INSERT_TEMPLATE, page_size=max(len(batch), 1))
+            conn.commit()
+            cur.close()
+            self.written += len(batch)
+            return True
+        except Exception as e:
+            conn.rollback()
+            logger.warning(f"Audit writer: could not write {len(batch)} events: {e}")
+            return False
+        finally:
+            conn.close()
+
+    def _spill(self, events: List[AuditEvent]):
+        with self._spill_lock:
+            try:
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    for event in events:
+                        f.write(json.dumps(event, default=str) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.spilled += len(events)
+            except OSError as e:
+                logger.error(f"Audit writer: lost {len(events)} events, spill file {self.spill_path} not writable: {e}")
+
+    def _replay_spill(self):
+        if time.monotonic() < self._replay_after or not os.path.exists(self.spill_path):
+            return
+        # Claim the file first so concurrent spills start a new one
+        replaying = f'{self.spill_path}.{os.getpid()}.replay'
+        with self._spill_lock:
+            try:
+                os.replace(self.spill_path, replaying)
+            except OSError:
+                return
+        with open(replaying, encoding='utf-8') as f:
+            events = [tuple(json.loads(line)) for line in f if line.strip()]
+        remaining = []
+        for start in range(0, len(events), self.batch_size):
+            batch = events[start:start + self.batch_size]
+            if not self._write(batch):
+                remaining = events[start:]
+                break
+        os.remove(replaying)
+        if remaining:
+            self._spill(remaining)
+            self._replay_after = time.monotonic() + 30
+        else:
+            logger.info(f"Audit writer: replayed {len(events)} spilled events")
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_audit_writer() -> AuditWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = AuditWriter(AuditConfig.BATCH_SIZE, AuditConfig.FLUSH_INTERVAL,
+                                      AuditConfig.QUEUE_SIZE, AuditConfig.SPILL_PATH)
+                atexit.register(_writer.flush)
+    return _writer
+
+
+def record_audit_event(user_id, operation: str, details=None, ip_address: Optional[str] = None):
+    """Queue an audit_logs row; the client IP is taken from the current request when not given."""
+    if ip_address is None:
+        try:
+            from flask import has_request_context, request
+            if has_request_context():
+                ip_address = request.remote_addr
+        except ImportError:
+            pass
+    try:
+        get_audit_writer().record(user_id, operation, details, ip_address)
+    except Exception as e:
+        logger.error(f"Audit writer: could not queue {operation}: {e}")
+
+
+def _reset_in_child():
+    # A forked worker starts with an empty queue, fresh locks and its own writer thread
+    if _writer is not None:
+        _writer._init_process_state()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_child)
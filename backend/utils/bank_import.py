@@ -0,0 +1,261 @@
+"""
+Bank Statement Import for IQSTrade
+Set-based import of a bank statement CSV (POST /admin/import-bank-statement):
+- The upload is decoded and parsed as a stream; statement lines and their BL / container reference
+  keys (utils/bill_identifiers.py) are spooled and COPY'd into temp staging tables
+- One join of the staging keys with bill_identifiers and open bills matches every line's references,
+  with the same rules as find_bills; references left over get one fuzzy pass (utils/bl_matcher.py)
+- Each line's amount is then allocated by the reconciliation engine (utils/reconciliation.py) over
+  the bills it references and, failing that, the same customer's other open bills, so combined
+  payments match; lines it is not confident about, and Allinpay 85% / 15% instalments, are written
+  to bank_unmatched_records with the best proposal in the reason
+- Bill updates, bank_unmatched_records and payment confirmations (queued in utils/email_outbox.py)
+  are written by a handful of statements in a single transaction, so a failed import changes nothing
+"""
+
+import io
+import csv
+import math
+import codecs
+import logging
+import itertools
+import tempfile
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+
+import pytz
+
+from config import BLMatchConfig
+from utils.bill_identifiers import alternate_keys, find_references, normalize_key
+from utils.bl_matcher import confident_match, match_candidates
+from utils.email_outbox import enqueue_many
+from utils.reconciliation import (
+    FINAL, FULL, OPEN_RECEIVABLE_SQL, ReceivablesIndex, accepted, apply_allocations, describe, reconcile,
+)
+
+logger = logging.getLogger(__name__)
+
+HK_TZ = pytz.timezone('Asia/Hong_Kong')
+
+# Statements spool in memory up to this size, then to a temp file
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+STAGING_SQL = """
+    CREATE TEMP TABLE bank_import_lines (
+        line INTEGER PRIMARY KEY,
+        date TEXT,
+        description TEXT,
+        amount NUMERIC(14, 2)
+    ) ON COMMIT DROP;
+    CREATE TEMP TABLE bank_import_keys (
+        line INTEGER NOT NULL,
+        reference TEXT NOT NULL,
+        key TEXT NOT NULL,
+        alternate BOOLEAN NOT NULL
+    ) ON COMMIT DROP;
+    CREATE TEMP TABLE bank_import_matches (
+        line INTEGER NOT NULL,
+        reference TEXT NOT NULL,
+        bill_id INTEGER NOT NULL
+    ) ON COMMIT DROP;
+"""
+
+# Per (line, reference): the newest bill matching the reference itself (its BL or a container), or
+# else the one bill reached through alternate keys when there is exactly one (as find_bills)
+MATCH_SQL = f"""
+    INSERT INTO bank_import_matches (line, reference, bill_id)
+    SELECT line, reference, bill_id
+    FROM (
+        SELECT line, reference, bill_id, exact,
+               COUNT(*) OVER w AS bills,
+               row_number() OVER (PARTITION BY line, reference ORDER BY exact DESC, bill_id DESC) AS rank
+        FROM (
+            SELECT k.line, k.reference, b.id AS bill_id, bool_or(NOT k.alternate AND i.kind <> 'bl_alt') AS exact
+            FROM bank_import_keys k
+            JOIN bill_identifiers i ON i.key = k.key
+            JOIN bill_of_lading b ON b.id = i.bill_id
+            WHERE {OPEN_RECEIVABLE_SQL}
+            GROUP BY k.line, k.reference, b.id
+        ) hits
+        WINDOW w AS (PARTITION BY line, reference)
+    ) ranked
+    WHERE rank = 1 AND (exact OR bills = 1)
+"""
+
+UNRESOLVED_SQL = """
+    SELECT DISTINCT k.reference FROM bank_import_keys k
+    WHERE NOT EXISTS (SELECT 1 FROM bank_import_matches m WHERE m.line = k.line AND m.reference = k.reference)
+"""
+
+FUZZY_MATCH_SQL = """
+    INSERT INTO bank_import_matches (line, reference, bill_id)
+    SELECT DISTINCT k.line, k.reference, f.bill_id
+    FROM bank_import_keys k
+    JOIN unnest(%s::text[], %s::integer[]) AS f(reference, bill_id) ON f.reference = k.reference
+    WHERE NOT EXISTS (SELECT 1 FROM bank_import_matches m WHERE m.line = k.line AND m.reference = k.reference)
+"""
+
+# Each statement line with its references and the bill each one matched (NULL when none)
+LINES_SQL = """
+    SELECT l.line, l.date, l.description, l.amount,
+           COALESCE(array_agg(r.reference ORDER BY r.reference) FILTER (WHERE r.reference IS NOT NULL), '{}'),
+           COALESCE(array_agg(r.bill_id ORDER BY r.reference) FILTER (WHERE r.reference IS NOT NULL), '{}')
+    FROM bank_import_lines l
+    LEFT JOIN (
+        SELECT DISTINCT k.line, k.reference, m.bill_id
+        FROM bank_import_keys k
+        LEFT JOIN bank_import_matches m ON m.line = k.line AND m.reference = k.reference
+    ) r ON r.line = l.line
+    GROUP BY l.line
+    ORDER BY l.line
+"""
+
+
+def read_statement(stream) -> Iterator[Tuple[int, str, str, str, List[str]]]:
+    """(line, date, description, amount, references) for every row with a valid amount, as the upload streams in."""
+    text = codecs.getreader('utf-8-sig')(stream)
+    sample = text.read(1024)
+    sample += text.readline()
+    lines = itertools.chain(io.StringIO(sample, newline=''), text)
+    try:
+        dialect = csv.Sniffer().sniff(sample[:1024])
+        reader = csv.DictReader(lines, dialect=dialect)
+        logger.debug(f"Detected CSV delimiter: {dialect.delimiter}")
+    except Exception as e:
+        logger.debug(f"CSV sniffing failed ({e}). Falling back to default comma delimiter.")
+        reader = csv.DictReader(lines)
+    for row in reader:
+        amount_str = (row.get('Amount') or '').replace('$', '').replace(',', '').strip()
+        try:
+            amount = float(amount_str)
+        except ValueError:
+            amount = math.nan
+        if not math.isfinite(amount):
+            logger.debug(f"Invalid amount in row: {row}")
+            continue
+        description = row.get('Description') or ''
+        yield reader.line_num, row.get('Date') or '', description, repr(amount), find_references(description)
+
+
+def stage_statement(cur, stream) -> int:
+    """Parse the upload into the staging tables with two COPYs. Returns the number of statement lines."""
+    count = 0
+    with tempfile.SpooledTemporaryFile(SPOOL_MAX_BYTES, mode='w+', newline='') as lines_file, \
+            tempfile.SpooledTemporaryFile(SPOOL_MAX_BYTES, mode='w+', newline='') as keys_file:
+        lines_out, keys_out = csv.writer(lines_file), csv.writer(keys_file)
+        for line, date, description, amount, references in read_statement(stream):
+            count += 1
+            lines_out.writerow((line, date, description, amount))
+            for reference in references:
+                key = normalize_key(reference)
+                keys_out.writerow((line, reference, key, 'f'))
+                for alternate in alternate_keys(key):
+                    keys_out.writerow((line, reference, alternate, 't'))
+        lines_file.seek(0)
+        keys_file.seek(0)
+        cur.copy_expert("COPY bank_import_lines (line, date, description, amount) FROM STDIN "
+                        "WITH (FORMAT csv, FORCE_NOT_NULL (date, description))", lines_file)
+        cur.copy_expert("COPY bank_import_keys (line, reference, key, alternate) FROM STDIN WITH (FORMAT csv)",
+                        keys_file)
+    return count
+
+
+def match_fuzzy(cur) -> int:
+    """Fuzzy pass over references the join left unmatched; returns how many got a bill."""
+    cur.execute(UNRESOLVED_SQL)
+    unresolved = [reference for (reference,) in cur.fetchall()]
+    if not unresolved or not BLMatchConfig.ENABLED:
+        return 0
+    resolved = {}
+    for reference, candidates in match_candidates(cur, unresolved, where=OPEN_RECEIVABLE_SQL).items():
+        best = confident_match(candidates)
+        if best:
+            resolved[reference] = best['bill']['id']
+            logger.info(f"Bank statement reference {reference} fuzzy-matched {best['key']} (score {best['score']})")
+    if resolved:
+        cur.execute(FUZZY_MATCH_SQL, (list(resolved), list(resolved.values())))
+    return len(resolved)
+
+
+def reconcile_lines(cur, receivables: ReceivablesIndex) -> Tuple[List[Dict], List[Tuple], List[Tuple]]:
+    """
+    Allocate every statement line (utils/reconciliation.py), in statement order.
+    Returns (results, allocations to apply, bank_unmatched_records rows).
+    """
+    results, allocations, unmatched = [], [], []
+    cur.execute(LINES_SQL)
+    for line, date, description, amount, references, bill_ids in cur.fetchall():
+        amount = float(amount)
+        if not references:
+            unmatched.append((date, description, amount, 'No BL number detected'))
+            results.append({"status": "Unmatched", "description": description, "amount": amount,
+                            "reason": "No BL number detected"})
+            continue
+        proposals = reconcile(receivables, amount, [bill_id for bill_id in bill_ids if bill_id])
+        # Instalments (85% / 15%) are proposed for review, never applied from a statement line
+        best = accepted(proposals, kinds=(FULL,))
+        paid = {}
+        if best:
+            receivables.settle(best['bill_ids'])
+            paid = {item['bill_id']: item for item in best['allocations']}
+            allocations += [(item['bill_id'], item['kind'], description) for item in best['allocations']]
+        reported = set()
+        for reference, bill_id in zip(references, bill_ids):
+            # A line naming a bill twice (its BL and a container) reports that bill once
+            if bill_id is not None:
+                if bill_id in reported:
+                    continue
+                reported.add(bill_id)
+            if bill_id in paid:
+                results.append({"bl_number": reference, "status": "Matched and marked Paid",
+                                "allocation": paid[bill_id]['kind'], "confidence": best['confidence']})
+                continue
+            if bill_id is None:
+                reason = f'No unpaid record for BL {reference}'
+            else:
+                reason = f'Amount mismatch for BL {reference}'
+            if proposals and not best:
+                reason += f'; proposed: {describe(proposals[0])}'
+            unmatched.append((date, description, amount, reason))
+            results.append({"bl_number": reference, "status": "Unmatched", "description": description,
+                            "amount": amount, "reason": reason})
+        # Bills of the same customer the payment also covers without naming them
+        for bill_id, item in paid.items():
+            if bill_id in reported:
+                continue
+            results.append({"bl_number": item['bl_number'], "status": "Matched and marked Paid",
+                            "allocation": item['kind'], "confidence": best['confidence']})
+    return results, allocations, unmatched
+
+
+def import_statement(conn, stream) -> List[Dict]:
+    """Import one statement in a single transaction; returns the per-line results for the response."""
+    from psycopg2.extras import execute_values
+
+    cur = conn.cursor()
+    try:
+        cur.execute(STAGING_SQL)
+        lines = stage_statement(cur, stream)
+        cur.execute(MATCH_SQL)
+        match_fuzzy(cur)
+
+        results, allocations, unmatched = reconcile_lines(cur, ReceivablesIndex.load(cur))
+        paid = apply_allocations(cur, allocations, datetime.now(HK_TZ))
+        # A final instalment completes a bill the customer was already told about
+        enqueue_many(cur, (
+            ('payment_confirmation', bill['customer_email'],
+             {'bill_id': bill['id'], 'customer_name': bill['customer_name'], 'bl_number': bill['bl_number']})
+            for bill in paid if bill['kind'] != FINAL
+        ))
+        if unmatched:
+            execute_values(cur, "INSERT INTO bank_unmatched_records (date, description, amount, reason) VALUES %s",
+                           unmatched)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    logger.info(f"Bank statement imported: {lines} lines, {len(paid)} bills updated, "
+                f"{len(unmatched)} unmatched records")
+    return results
@@ -0,0 +1,313 @@
+"""
+Bill Archive for IQSTrade
+Keeps bill_of_lading down to current work (migrations/20250805_create_bill_of_lading_archive.sql):
+- Settled bills ('Paid and CTN Valid', no outstanding Allinpay reserve) completed more than
+  ARCHIVE_AFTER_DAYS ago are moved to bill_of_lading_archive, partitioned by month of settled_at.
+  Each batch locks its rows with FOR UPDATE SKIP LOCKED, moves them with one DELETE ... RETURNING /
+  INSERT statement and commits, so the move runs online next to normal traffic. The statement copies
+  every bill_of_lading column (read from information_schema), and the mover refuses to run while the
+  archive lacks one, so a column added to the hot table is never dropped on the way.
+- The same statement adds the batch to bill_archive_stats, so all-time totals (/stats/summary, the
+  management overview) read the hot table plus one row per month instead of every archived bill.
+  The two count payments differently, so the rollup keeps a paid total for each.
+- Archive partitions older than ARCHIVE_RETENTION_MONTHS are dropped with their extraction payloads;
+  their bill_archive_stats rows stay.
+History queries read the bill_of_lading_all view and add "settled_at >= <start>" next to their
+created_at/completed_at lower bound so Postgres skips older partitions. Lookups of one bill by BL
+number (customer verification, invoice / CTN enquiries) read the view or fall back to the archive, so
+an archived bill stays reachable everywhere except the edit paths. The /bills listings read the hot
+table alone unless the archive can match (status 'Paid and CTN Valid', a BL or date filter, or
+?include_archive=1).
+
+Run from the scheduler (email_scheduler.py, daily) or by hand:
+    python -m utils.bill_archive move [--after-days N] [--batch-size N] [--max-batches N]
+    python -m utils.bill_archive purge [--retention-months N]
+    python -m utils.bill_archive status
+"""
+
+import re
+import sys
+import time
+import logging
+import argparse
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+import pytz
+
+from config import ArchiveConfig, get_db_conn
+
+logger = logging.getLogger(__name__)
+
+HK_TZ = pytz.timezone('Asia/Hong_Kong')
+
+# The only status an archived bill can have
+ARCHIVED_STATUS = 'Paid and CTN Valid'
+
+# Settled for good: nothing left to collect, nothing the payment matchers still look for
+ARCHIVABLE_SQL = f"""
+    status = '{ARCHIVED_STATUS}'
+    AND completed_at < %s
+    AND COALESCE(LOWER(TRIM(reserve_status)), '') <> 'unsettled'
+    AND COALESCE(payment_status, '') <> 'Paid 85%%'
+"""
+
+SETTLED_AT_SQL = 'GREATEST(created_at, completed_at, allinpay_85_received_at)'
+
+# The management overview's paid amount of a bill (routes/management_routes.py): any method other
+# than Allinpay in any case, NULL included, is paid in full; Allinpay once the reserve is settled
+OVERVIEW_PAID_SQL = """
+    CASE
+        WHEN LOWER(TRIM(COALESCE(payment_method, ''))) <> 'allinpay' AND status = 'Paid and CTN Valid'
+             THEN COALESCE(ctn_fee, 0) + COALESCE(service_fee, 0)
+        WHEN LOWER(TRIM(COALESCE(reserve_status, ''))) = 'reserve settled' AND status = 'Paid and CTN Valid'
+             THEN COALESCE(ctn_fee, 0) + COALESCE(service_fee, 0)
+        WHEN LOWER(TRIM(COALESCE(reserve_status, ''))) = 'unsettled' AND status = 'Paid and CTN Valid'
+             THEN (COALESCE(ctn_fee, 0) + COALESCE(service_fee, 0)) * 0.85
+        ELSE 0
+    END
+"""
+
+# Columns the mover does not copy from bill_of_lading: the archive computes or stamps them itself
+ARCHIVE_OWN_COLUMNS = ('settled_at', 'archived_at')
+
+# {columns} is filled in per run from archive_columns()
+MOVE_SQL = f"""
+    WITH moved AS (
+        DELETE FROM bill_of_lading WHERE id = ANY(%s) RETURNING {{columns}}
+    ), archived AS (
+        INSERT INTO bill_of_lading_archive ({{columns}}, settled_at)
+        SELECT {{columns}}, {SETTLED_AT_SQL} FROM moved
+        RETURNING settled_at, ctn_fee, service_fee, payment_method, status, reserve_status
+    )
+    INSERT INTO bill_archive_stats AS s (month, bills, ctn_fee, service_fee, invoice_amount, payment_received,
+                                         overview_paid_amount)
+    SELECT date_trunc('month', settled_at AT TIME ZONE 'Asia/Hong_Kong')::date, COUNT(*),
+           COALESCE(SUM(ctn_fee), 0), COALESCE(SUM(service_fee), 0), COALESCE(SUM(ctn_fee + service_fee), 0),
+           -- Same rule as /stats/summary's total_payment_received
+           COALESCE(SUM(CASE
+               WHEN payment_method != 'Allinpay' AND status = 'Paid and CTN Valid' THEN ctn_fee + service_fee
+               WHEN payment_method = 'Allinpay' AND status = 'Paid and CTN Valid'
+                    AND reserve_status = 'Reserve Settled' THEN ctn_fee + service_fee
+               ELSE 0
+           END), 0),
+           COALESCE(SUM({OVERVIEW_PAID_SQL}), 0)
+    FROM archived
+    GROUP BY 1
+    ON CONFLICT (month) DO UPDATE SET
+        bills = s.bills + EXCLUDED.bills,
+        ctn_fee = s.ctn_fee + EXCLUDED.ctn_fee,
+        service_fee = s.service_fee + EXCLUDED.service_fee,
+        invoice_amount = s.invoice_amount + EXCLUDED.invoice_amount,
+        payment_received = s.payment_received + EXCLUDED.payment_received,
+        overview_paid_amount = s.overview_paid_amount + EXCLUDED.overview_paid_amount
+"""
+
+_PARTITION_RE = re.compile(r'^bill_of_lading_archive_(\d{4})(\d{2})$')
+
+
+def archive_cutoff(after_days: Optional[int] = None) -> datetime:
+    return datetime.now(HK_TZ) - timedelta(days=ArchiveConfig.AFTER_DAYS if after_days is None else after_days)
+
+
+def archive_columns(cur) -> List[str]:
+    """Every bill_of_lading column, read from the catalog so a newly added column is moved too.
+
+    Raises RuntimeError while the archive lacks one of them: moving would silently drop its values.
+    """
+    cur.execute("""
+        SELECT table_name, column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name IN ('bill_of_lading', 'bill_of_lading_archive')
+        ORDER BY ordinal_position
+    """)
+    hot, archive = [], set()
+    for table, column in cur.fetchall():
+        if table == 'bill_of_lading':
+            hot.append(column)
+        else:
+            archive.add(column)
+    missing = [column for column in hot if column not in archive]
+    if missing:
+        raise RuntimeError(f"bill_of_lading_archive lacks {', '.join(missing)}; add them to the archive "
+                           f"table and the bill_of_lading_all view before archiving")
+    return [column for column in hot if column not in ARCHIVE_OWN_COLUMNS]
+
+
+def archive_batch(conn, cutoff: datetime, batch_size: int, columns: Optional[List[str]] = None) -> int:
+    """Move up to batch_size archivable bills in one transaction; returns how many moved."""
+    cur = conn.cursor()
+    try:
+        if columns is None:
+            columns = archive_columns(cur)
+        # Rows being edited right now are skipped and picked up by a later run
+        cur.execute(f"""
+            SELECT id, date_trunc('month', {SETTLED_AT_SQL} AT TIME ZONE 'Asia/Hong_Kong')::date
+            FROM bill_of_lading
+            WHERE {ARCHIVABLE_SQL}
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (cutoff, batch_size))
+        rows = cur.fetchall()
+        if not rows:
+            conn.rollback()
+            return 0
+        # A no-op for existing months; a new month briefly locks the archive parent until commit
+        for month in sorted({month for _, month in rows}):
+            cur.execute("SELECT ensure_bill_archive_partition(%s)", (month,))
+        cur.execute(MOVE_SQL.format(columns=', '.join(columns)), ([bill_id for bill_id, _ in rows],))
+        conn.commit()
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def archive_settled_bills(after_days: Optional[int] = None, batch_size: Optional[int] = None,
+                          pause: Optional[float] = None, max_batches: Optional[int] = None) -> int:
+    """Move every archivable bill, batch by batch. Returns the number of bills moved."""
+    batch_size = batch_size or ArchiveConfig.BATCH_SIZE
+    pause = ArchiveConfig.BATCH_PAUSE if pause is None else pause
+    cutoff = archive_cutoff(after_days)
+    conn = get_db_conn()
+    if conn is None:
+        logger.error("Bill archive: database unavailable")
+        return 0
+    moved = batches = 0
+    started = time.monotonic()
+    try:
+        cur = conn.cursor()
+        columns = archive_columns(cur)
+        cur.close()
+        conn.rollback()
+        while max_batches is None or batches < max_batches:
+            count = archive_batch(conn, cutoff, batch_size, columns)
+            if not count:
+                break
+            moved += count
+            batches += 1
+            if count < batch_size:
+                break
+            time.sleep(pause)
+    finally:
+        conn.close()
+    logger.info(f"Bill archive: moved {moved} bills completed before {cutoff:%Y-%m-%d} "
+                f"in {batches} batches ({time.monotonic() - started:.1f}s)")
+    return moved
+
+
+def list_partitions(cur) -> Dict[str, date]:
+    """Archive partition name -> first day of its month."""
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'bill_of_lading_archive'::regclass
+    """)
+    partitions = {}
+    for (name,) in cur.fetchall():
+        match = _PARTITION_RE.match(name)
+        if match:
+            partitions[name] = date(int(match.group(1)), int(match.group(2)), 1)
+    return partitions
+
+
+def drop_expired_partitions(retention_months: Optional[int] = None) -> List[str]:
+    """Drop archive partitions whose whole month lies beyond the retention period."""
+    from psycopg2 import sql
+
+    retention_months = ArchiveConfig.RETENTION_MONTHS if retention_months is None else retention_months
+    if retention_months <= 0:
+        return []
+    today = datetime.now(HK_TZ).date()
+    months = today.year * 12 + today.month - 1 - retention_months
+    oldest_kept = date(months // 12, months % 12 + 1, 1)
+    conn = get_db_conn()
+    if conn is None:
+        logger.error("Bill archive: database unavailable")
+        return []
+    dropped = []
+    try:
+        cur = conn.cursor()
+        for name, month in sorted(list_partitions(cur).items(), key=lambda item: item[1]):
+            if month >= oldest_kept:
+                continue
+            partition = sql.Identifier(name)
+            cur.execute(sql.SQL("DELETE FROM bill_extractions WHERE bill_id IN (SELECT id FROM {})").format(partition))
+            cur.execute(sql.SQL("DROP TABLE {}").format(partition))
+            conn.commit()
+            dropped.append(name)
+            logger.info(f"Bill archive: dropped {name} (older than {retention_months} months)")
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return dropped
+
+
+def run_archive_job():
+    """Daily job: archive settled bills, then apply retention."""
+    archive_settled_bills()
+    drop_expired_partitions()
+
+
+def archive_totals(cur) -> Dict:
+    """All-time totals of archived bills (every one of them is 'Paid and CTN Valid')."""
+    cur.execute("""
+        SELECT COALESCE(SUM(bills), 0), COALESCE(SUM(ctn_fee), 0), COALESCE(SUM(service_fee), 0),
+               COALESCE(SUM(invoice_amount), 0), COALESCE(SUM(payment_received), 0),
+               COALESCE(SUM(overview_paid_amount), 0)
+        FROM bill_archive_stats
+    """)
+    bills, ctn_fee, service_fee, invoice_amount, payment_received, overview_paid_amount = cur.fetchone()
+    return {
+        'bills': int(bills),
+        'ctn_fee': float(ctn_fee),
+        'service_fee': float(service_fee),
+        'invoice_amount': float(invoice_amount),
+        'payment_received': float(payment_received),
+        'overview_paid_amount': float(overview_paid_amount),
+    }
+
+
+def print_status():
+    conn = get_db_conn()
+    if conn is None:
+        raise SystemExit("database unavailable")
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT COUNT(*) FROM bill_of_lading WHERE {ARCHIVABLE_SQL}", (archive_cutoff(),))
+        print(f"hot bills ready to archive: {cur.fetchone()[0]}")
+        for name, month in sorted(list_partitions(cur).items(), key=lambda item: item[1]):
+            cur.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", (name,))
+            print(f"{name}  ~{max(cur.fetchone()[0], 0)} rows")
+        print(f"archived totals: {archive_totals(cur)}")
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m utils.bill_archive', description=__doc__.split('\n')[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+    move = commands.add_parser('move', help='move settled bills to the archive')
+    move.add_argument('--after-days', type=int, default=None)
+    move.add_argument('--batch-size', type=int, default=None)
+    move.add_argument('--max-batches', type=int, default=None)
+    purge = commands.add_parser('purge', help='drop archive partitions beyond the retention period')
+    purge.add_argument('--retention-months', type=int, default=None)
+    commands.add_parser('status', help='show what is waiting and what is archived')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.command == 'move':
+        archive_settled_bills(args.after_days, args.batch_size, max_batches=args.max_batches)
+    elif args.command == 'purge':
+        print(f"dropped: {', '.join(drop_expired_partitions(args.retention_months)) or 'nothing'}")
+    else:
+        print_status()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
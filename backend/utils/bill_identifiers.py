@@ -0,0 +1,155 @@
+"""
+Bill Identifiers for IQSTrade
+Resolves BL and container references to bills through bill_identifiers
+(migrations/20250806_create_bill_identifiers.sql):
+- Keys are upper-case letters and digits only, so 'NYC 22062889', 'nyc-22062889' and 'NYC22062889'
+  are one key; normalize_key/alternate_keys/container_keys mirror the SQL functions that the
+  bill_of_lading triggers use to maintain the table
+- Alternate keys ('BL12345' -> '12345', 'NYC22062889' -> '22062889') are generated on both sides, so
+  a payment quoting only the digits still finds its bill; such loose matches count only when they
+  point at a single bill
+- find_bills resolves every reference of an email, bank statement or webhook call with one indexed
+  "key = ANY(...)" query; bill_identifiers only covers bill_of_lading, so lookups that must also find
+  settled bills moved to the archive (utils/bill_archive.py) pass include_archive
+"""
+
+import re
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# References as they appear in free text (payment emails, bank statement descriptions). The digits
+# may include letters OCR confuses with digits (NYC22O62889, BL-12S45), which the fuzzy matcher
+# (utils/bl_matcher.py) resolves; at most MAX_CONFUSED_DIGITS of them, and fewer than the real digits
+REFERENCE_PATTERNS = (
+    re.compile(r'\b[A-Z]{3}[ -]?(?P<digits>[0-9OQILSZB]{6,})\b'),            # NYC22062889, NYC 22062889
+    re.compile(r'\bBL[ -]?(?P<digits>[0-9OQILSZB]{4,})\b', re.IGNORECASE),  # BL12345, BL-12345
+    re.compile(r'\b[A-Z]{4}[ -]?(?P<digits>[0-9OQILSZB]{7})\b'),              # container numbers (ISO 6346)
+)
+MAX_CONFUSED_DIGITS = 2
+
+_NON_KEY_RE = re.compile(r'[^A-Z0-9]')
+_BL_PREFIX_RE = re.compile(r'^BL([0-9]{4,})$')
+_CARRIER_PREFIX_RE = re.compile(r'^[A-Z]{2,4}([0-9]{6,})$')
+_CONTAINER_RE = re.compile(r'[A-Z]{4}[0-9]{7}')
+_CONTAINER_SPLIT_RE = re.compile(r'[,;/\n]+')
+
+
+def normalize_key(value) -> str:
+    """Upper-case letters and digits only ('' for None)."""
+    if value is None:
+        return ''
+    return _NON_KEY_RE.sub('', str(value).upper())
+
+
+def alternate_keys(key: str) -> List[str]:
+    """Looser forms of a normalized BL key: without a 'BL' prefix, without a carrier prefix."""
+    alternates = []
+    for pattern in (_BL_PREFIX_RE, _CARRIER_PREFIX_RE):
+        match = pattern.match(key)
+        if match and match.group(1) not in alternates:
+            alternates.append(match.group(1))
+    return alternates
+
+
+def container_keys(container_numbers: Optional[str]) -> List[str]:
+    """One key per container in a comma-joined container_numbers value."""
+    keys = []
+    for part in _CONTAINER_SPLIT_RE.split((container_numbers or '').upper()):
+        part = normalize_key(part)
+        for key in _CONTAINER_RE.findall(part) or ([part] if part else []):
+            if key not in keys:
+                keys.append(key)
+    return keys
+
+
+def find_references(text: str) -> List[str]:
+    """BL and container references in free text, one per normalized key, in order of appearance."""
+    found = {}
+    for pattern in REFERENCE_PATTERNS:
+        for match in pattern.finditer(text or ''):
+            digits = match.group('digits')
+            confused = sum(1 for char in digits if not char.isdigit())
+            if confused > MAX_CONFUSED_DIGITS or confused >= len(digits) - confused:
+                continue
+            found.setdefault(normalize_key(match.group(0)), (match.start(), match.group(0)))
+    return [reference for _, reference in sorted(found.values())]
+
+
+def _distinct(bills: Iterable[Dict]) -> List[Dict]:
+    seen, unique = set(), []
+    for bill in bills:
+        if bill['id'] not in seen:
+            seen.add(bill['id'])
+            unique.append(bill)
+    return unique
+
+
+def find_bills(cur, references: Iterable[str], columns: Sequence[str] = ('id',),
+               where: str = '', params: Sequence = (), include_archive: bool = False) -> Dict[str, List[Dict]]:
+    """
+    Resolve references (BL numbers, container numbers) to bills in one query.
+    Returns {reference: [bill, ...]} with bills as dicts of columns, newest first; references
+    without a match are left out. A reference's own key matching a BL or container number wins;
+    otherwise a match through alternate keys is used only when it is a single bill.
+    columns are bill_of_lading columns (id is always fetched); where is an extra condition on
+    bill_of_lading aliased as b, with its params. With include_archive, references still unmatched
+    are looked up by normalized BL number in bill_of_lading_archive.
+    """
+    candidates = {}
+    for reference in references:
+        key = normalize_key(reference)
+        if key and reference not in candidates:
+            candidates[reference] = [key] + alternate_keys(key)
+    if not candidates:
+        return {}
+    columns = tuple(columns) if 'id' in columns else ('id',) + tuple(columns)
+    keys = sorted({key for keys in candidates.values() for key in keys})
+    cur.execute(f"""
+        SELECT i.key, i.kind, {', '.join('b.' + column for column in columns)}
+        FROM bill_identifiers i
+        JOIN bill_of_lading b ON b.id = i.bill_id
+        WHERE i.key = ANY(%s){' AND (' + where + ')' if where else ''}
+        ORDER BY b.id DESC
+    """, (keys, *params))
+    by_key: Dict[str, List] = {}
+    for row in cur.fetchall():
+        by_key.setdefault(row[0], []).append((row[1], dict(zip(columns, row[2:]))))
+
+    matches = {}
+    for reference, keys in candidates.items():
+        exact = _distinct(bill for kind, bill in by_key.get(keys[0], ()) if kind != 'bl_alt')
+        if exact:
+            matches[reference] = exact
+            continue
+        loose = _distinct(bill for key in keys for _, bill in by_key.get(key, ()))
+        if len(loose) == 1:
+            matches[reference] = loose
+        elif loose:
+            logger.info(f"Reference {reference} matches {len(loose)} bills only loosely; not matched")
+    missing = [reference for reference in candidates if reference not in matches]
+    if include_archive and missing:
+        matches.update(_find_archived(cur, missing, columns, where, params))
+    return matches
+
+
+def _find_archived(cur, references: List[str], columns: Sequence[str], where: str,
+                   params: Sequence) -> Dict[str, List[Dict]]:
+    """Archived bills whose normalized BL number is a reference's key (expression index on the archive)."""
+    keys = sorted({normalize_key(reference) for reference in references})
+    cur.execute(f"""
+        SELECT b.bl_number, {', '.join('b.' + column for column in columns)}
+        FROM bill_of_lading_archive b
+        WHERE normalize_bill_key(b.bl_number) = ANY(%s){' AND (' + where + ')' if where else ''}
+        ORDER BY b.id DESC
+    """, (keys, *params))
+    by_key: Dict[str, List[Dict]] = {}
+    for row in cur.fetchall():
+        by_key.setdefault(normalize_key(row[0]), []).append(dict(zip(columns, row[1:])))
+    matches = {}
+    for reference in references:
+        bills = by_key.get(normalize_key(reference))
+        if bills:
+            matches[reference] = bills
+    return matches
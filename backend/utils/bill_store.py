@@ -0,0 +1,78 @@
+"""
+Bill Store for IQSTrade
+Explicit-column reads and writes for bill_of_lading and its extraction payloads:
+- BILL_COLUMNS is the full bill row as the API returns it; nothing selects * any more, so adding a
+  wide column to the table does not silently make every bill read heavier
+- Settled bills are moved to bill_of_lading_archive after a while (utils/bill_archive.py); reads
+  by id can fall back to it
+- Extraction results (the provider's fields plus raw_text of every page) live in bill_extractions
+  as JSONB, one row per bill, and are read only by code that needs them
+  (migrations/20250804_create_bill_extractions.sql)
+Functions take an open cursor so callers keep their own connection and transaction.
+"""
+
+import logging
+from typing import Dict, Optional, Sequence
+
+from utils.security import decrypt_sensitive_data
+
+logger = logging.getLogger(__name__)
+
+BILL_COLUMNS = (
+    'id', 'customer_name', 'customer_email', 'customer_phone', 'pdf_filename', 'shipper', 'consignee',
+    'port_of_loading', 'port_of_discharge', 'bl_number', 'container_numbers', 'flight_or_vessel',
+    'product_description', 'service_fee', 'ctn_fee', 'payment_link', 'receipt_filename', 'status',
+    'invoice_filename', 'unique_number', 'created_at', 'updated_at', 'receipt_uploaded_at', 'completed_at',
+    'customer_username', 'customer_invoice', 'customer_packing_list', 'payment_method', 'payment_status',
+    'reserve_status', 'reserve_amount', 'allinpay_85_received_at', 'payment_reference',
+)
+BILL_SELECT = ', '.join(BILL_COLUMNS)
+
+
+def decrypt_contact(bill: Dict) -> Dict:
+    """Decrypt customer_email/customer_phone in place."""
+    if bill.get('customer_email') is not None:
+        bill['customer_email'] = decrypt_sensitive_data(bill['customer_email'])
+    if bill.get('customer_phone') is not None:
+        bill['customer_phone'] = decrypt_sensitive_data(bill['customer_phone'])
+    return bill
+
+
+def fetch_bill(cur, bill_id: int, columns: Sequence[str] = BILL_COLUMNS, decrypt: bool = True,
+               include_archive: bool = False) -> Optional[Dict]:
+    """One bill by id; with include_archive, settled bills moved to bill_of_lading_archive are found too."""
+    select = BILL_SELECT if columns is BILL_COLUMNS else ', '.join(columns)
+    cur.execute(f"SELECT {select} FROM bill_of_lading WHERE id = %s", (bill_id,))
+    row = cur.fetchone()
+    if row is None and include_archive:
+        cur.execute(f"SELECT {select} FROM bill_of_lading_archive WHERE id = %s", (bill_id,))
+        row = cur.fetchone()
+    if row is None:
+        return None
+    bill = dict(zip(columns, row))
+    return decrypt_contact(bill) if decrypt else bill
+
+
+def insert_bill(cur, values: Dict, decrypt: bool = True) -> Dict:
+    """INSERT one bill and return the stored row (defaults included) without reading it back."""
+    names = list(values)
+    cur.execute(
+        f"INSERT INTO bill_of_lading ({', '.join(names)}) VALUES ({', '.join(['%s'] * len(names))}) "
+        f"RETURNING {BILL_SELECT}",
+        tuple(values[name] for name in names)
+    )
+    bill = dict(zip(BILL_COLUMNS, cur.fetchone()))
+    return decrypt_contact(bill) if decrypt else bill
+
+
+def save_extraction(cur, bill_id: int, payload: Dict):
+    """Store (or replace) the extraction result of a bill. Empty results are not stored."""
+    if not payload:
+        return
+    from psycopg2.extras import Json
+
+    cur.execute("""
+        INSERT INTO bill_extractions (bill_id, provider, payload) VALUES (%s, %s, %s)
+        ON CONFLICT (bill_id) DO UPDATE SET provider = EXCLUDED.provider, payload = EXCLUDED.payload,
+                                            created_at = NOW()
+    """, (bill_id, payload.get('extraction_provider'), Json(payload)))
@@ -0,0 +1,148 @@
+"""
+BL Matcher for IQSTrade
+Fuzzy resolution of BL / container references that OCR or a regex got slightly wrong
+(migrations/20250807_add_bill_identifier_fuzzy_index.sql):
+- canonical_key folds confusable characters onto digits (O/Q->0, I/L->1, S->5, Z->2, B->8), so
+  'NYC22O6Z889' and 'NYC22062889' share one canonical key; bill_key_canonical() in SQL does the same
+- Candidates come from bill_identifiers in one query: canonical keys that are equal or pg_trgm-similar
+  to the reference's, through a GIN trigram index
+- Candidates are ranked by bounded edit distance: a difference that is only confusable characters
+  costs little, any other edit costs a lot, and more than MAX_DISTANCE edits drops the candidate
+resolve_bills() is find_bills() (utils/bill_identifiers.py) with this as the fallback for references
+that have no exact match; a fuzzy match is used only when it scores MIN_SCORE and no other bill
+comes within MARGIN of it.
+"""
+
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from config import BLMatchConfig
+from utils.bill_identifiers import find_bills, normalize_key
+
+logger = logging.getLogger(__name__)
+
+CONFUSABLES = str.maketrans('OQILSZB', '0011528')
+
+# Candidates fetched per reference before ranking
+CANDIDATE_LIMIT = 20
+
+# Score = 1 - CANONICAL_EDIT_COST * real edits - CONFUSABLE_EDIT_COST * confusable-only edits
+CANONICAL_EDIT_COST = 0.2
+CONFUSABLE_EDIT_COST = 0.03
+# Alternate keys ('22062889' for NYC22062889) are weaker evidence than the BL or container itself
+ALTERNATE_KEY_COST = 0.05
+
+
+def canonical_key(value) -> str:
+    """Normalized key with confusable letters folded onto digits."""
+    return normalize_key(value).translate(CONFUSABLES)
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Levenshtein distance, or max_distance + 1 as soon as it is certain to exceed max_distance."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1)
+
+
+def score_candidate(reference_key: str, key: str, kind: str, max_distance: int) -> Optional[float]:
+    """Score of key as a reading of reference_key (both normalized); None beyond max_distance."""
+    canonical_distance = edit_distance(reference_key.translate(CONFUSABLES), key.translate(CONFUSABLES),
+                                       max_distance)
+    if canonical_distance > max_distance:
+        return None
+    raw_distance = edit_distance(reference_key, key, max_distance + len(key))
+    score = (1.0 - CANONICAL_EDIT_COST * canonical_distance
+             - CONFUSABLE_EDIT_COST * max(raw_distance - canonical_distance, 0)
+             - (ALTERNATE_KEY_COST if kind == 'bl_alt' else 0.0))
+    return round(max(score, 0.0), 3)
+
+
+def match_candidates(cur, references: Iterable[str], columns: Sequence[str] = ('id',), where: str = '',
+                     params: Sequence = (), max_distance: Optional[int] = None) -> Dict[str, List[Dict]]:
+    """
+    Ranked fuzzy candidates for each reference, in one query.
+    Returns {reference: [{'bill', 'key', 'kind', 'distance', 'score'}, ...]} best first, one entry per
+    bill; references without candidates are left out. columns/where/params as in find_bills.
+    """
+    max_distance = BLMatchConfig.MAX_DISTANCE if max_distance is None else max_distance
+    by_canonical: Dict[str, List[str]] = {}
+    for reference in references:
+        canonical = canonical_key(reference)
+        if canonical and reference not in by_canonical.setdefault(canonical, []):
+            by_canonical[canonical].append(reference)
+    if not by_canonical:
+        return {}
+    columns = tuple(columns) if 'id' in columns else ('id',) + tuple(columns)
+    cur.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, true)",
+                (str(BLMatchConfig.TRGM_THRESHOLD),))
+    cur.execute(f"""
+        SELECT r.canonical, c.key, c.kind, {', '.join('b.' + column for column in columns)}
+        FROM unnest(%s::text[]) AS r(canonical)
+        CROSS JOIN LATERAL (
+            SELECT i.key, i.kind, i.bill_id
+            FROM bill_identifiers i
+            WHERE bill_key_canonical(i.key) %% r.canonical
+            ORDER BY similarity(bill_key_canonical(i.key), r.canonical) DESC
+            LIMIT %s
+        ) c
+        JOIN bill_of_lading b ON b.id = c.bill_id
+        {'WHERE (' + where + ')' if where else ''}
+    """, (sorted(by_canonical), CANDIDATE_LIMIT, *params))
+    rows = cur.fetchall()
+
+    candidates: Dict[str, Dict[int, Dict]] = {}
+    for canonical, key, kind, *values in rows:
+        bill = dict(zip(columns, values))
+        for reference in by_canonical[canonical]:
+            score = score_candidate(normalize_key(reference), key, kind, max_distance)
+            if score is None:
+                continue
+            best = candidates.setdefault(reference, {})
+            if bill['id'] not in best or score > best[bill['id']]['score']:
+                best[bill['id']] = {
+                    'bill': bill, 'key': key, 'kind': kind, 'score': score,
+                    'distance': edit_distance(canonical, key.translate(CONFUSABLES), max_distance),
+                }
+    return {
+        reference: sorted(found.values(), key=lambda c: (-c['score'], -c['bill']['id']))
+        for reference, found in candidates.items()
+    }
+
+
+def confident_match(candidates: List[Dict]) -> Optional[Dict]:
+    """The top candidate if it scores MIN_SCORE and leads the next bill by MARGIN, else None."""
+    if not candidates or candidates[0]['score'] < BLMatchConfig.MIN_SCORE:
+        return None
+    if len(candidates) > 1 and candidates[0]['score'] - candidates[1]['score'] < BLMatchConfig.MARGIN:
+        return None
+    return candidates[0]
+
+
+def resolve_bills(cur, references: Iterable[str], columns: Sequence[str] = ('id',), where: str = '',
+                  params: Sequence = (), include_archive: bool = False) -> Dict[str, List[Dict]]:
+    """find_bills, falling back to a confident fuzzy match for references without an exact one."""
+    references = list(references)
+    matches = find_bills(cur, references, columns=columns, where=where, params=params,
+                         include_archive=include_archive)
+    unresolved = [reference for reference in references if reference not in matches]
+    if not unresolved or not BLMatchConfig.ENABLED:
+        return matches
+    for reference, candidates in match_candidates(cur, unresolved, columns, where, params).items():
+        best = confident_match(candidates)
+        if best:
+            logger.info(f"Reference {reference} fuzzy-matched {best['kind']} {best['key']} "
+                        f"(bill {best['bill']['id']}, score {best['score']})")
+            matches[reference] = [best['bill']]
+        else:
+            logger.info(f"Reference {reference} has no confident match; best candidates: "
+                        f"{[(c['key'], c['score']) for c in candidates[:3]]}")
+    return matches
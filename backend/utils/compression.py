@@ -0,0 +1,76 @@
+"""
+Response Compression for IQSTrade
+gzip/brotli for API responses (the bill, account and inbox listings run to hundreds of KB of JSON):
+- JSON and text bodies of at least COMPRESS_MIN_BYTES are compressed after the view returns
+- The encoding is negotiated from Accept-Encoding: brotli when the client accepts it and Brotli is
+  installed, otherwise gzip; clients that accept neither get the plain body
+- Static files are left to utils/static_assets.py (precomputed variants); streamed responses and
+  responses that already carry a Content-Encoding are left alone
+The time spent is recorded as the 'compress' stage (metrics histogram and Server-Timing).
+"""
+
+import logging
+from typing import Optional
+
+from flask import request
+
+from config import CompressionConfig
+from utils.static_assets import brotli, compress, is_compressible, parse_accept_encoding
+from utils.timing import stage
+
+logger = logging.getLogger(__name__)
+
+# Server preference order when the client accepts both equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# Served by utils/static_assets.py with their own variants and ETags
+SKIP_ENDPOINTS = {'serve_static', 'serve_react', 'static'}
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    accepted = parse_accept_encoding(accept_encoding)
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed or request.method == 'HEAD'
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or not is_compressible(response.mimetype or '')):
+        return response
+    endpoint = request.endpoint
+    if endpoint is not None and endpoint.rsplit('.', 1)[-1] in SKIP_ENDPOINTS:
+        return response
+    # Whether the body is compressed depends on the request header, so caches must key on it
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < CompressionConfig.MIN_BYTES:
+        return response
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    level = CompressionConfig.BROTLI_QUALITY if encoding == 'br' else CompressionConfig.GZIP_LEVEL
+    with stage('compress'):
+        data = compress(body, encoding, level=level)
+    if data is None or len(data) >= len(body):
+        return response
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # Same content, different bytes
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    """Install the after_request hook. Call after init_metrics: after_request hooks run in reverse
+    order, so compression then happens before Server-Timing is written and shows up in it."""
+    if not CompressionConfig.ENABLED:
+        return
+    app.after_request(compress_response)
@@ -0,0 +1,237 @@
+"""
+Database Instrumentation for IQSTrade
+psycopg2 cursor that reports every statement to utils/timing:
+- stage 'db' (time in execute, which includes fetching the result for client-side cursors)
+- counter 'db_queries'
+get_db_conn() opens every connection with this cursor_factory and times the connect as 'db_connect'.
+
+Statements are also fingerprinted (parameters and literals replaced by ?) and counted per unit
+of work — a request, a scheduler job, or any block wrapped in track_queries(). When one
+fingerprint runs more than QUERY_REPEAT_WARN_THRESHOLD times in a unit, a warning names it:
+that is almost always a query in a loop (N+1). assert_max_queries() turns the same counts into
+a test failure.
+"""
+
+import re
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import psycopg2.extensions
+
+from utils.timing import stage, add_count
+
+# This module is imported by config.py, so config is only read lazily inside functions
+
+logger = logging.getLogger(__name__)
+
+_tracker = contextvars.ContextVar('iqs_query_tracker', default=None)
+
+_COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDERS = re.compile(r'%\(\w+\)s|%s')
+_NUMBERS = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_IN_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_VALUES_ROWS = re.compile(r'(\(\?(?:, \?)*\))(?:\s*,\s*\(\?(?:, \?)*\))+')
+_SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql: str) -> str:
+    """
+    Normalized statement text: parameters and literals become ?, IN lists and multi-row VALUES
+    collapse, whitespace is squeezed. 'WHERE id = %s' and 'WHERE id = 42' fingerprint the same.
+    """
+    text = _COMMENTS.sub(' ', sql)
+    text = _STRINGS.sub('?', text)
+    text = _PLACEHOLDERS.sub('?', text)
+    text = _NUMBERS.sub('?', text)
+    text = _SPACES.sub(' ', text).strip().rstrip(';').strip()
+    text = re.sub(r'\s*,\s*', ', ', text)
+    text = _VALUES_ROWS.sub(r'\1, ...', text)
+    text = _IN_LISTS.sub('(?+)', text)
+    return text
+
+
+def _query_text(query) -> str:
+    if isinstance(query, str):
+        return query
+    if isinstance(query, bytes):
+        return query.decode('utf-8', errors='replace')
+    return str(query)  # psycopg2.sql.Composed
+
+
+class QueryTracker:
+    """Executions and time per statement fingerprint for one unit of work. Thread-safe."""
+
+    def __init__(self, name: str, parent: Optional['QueryTracker'] = None):
+        self.name = name
+        self.parent = parent
+        self._lock = threading.Lock()
+        # fingerprint -> [executions, seconds]
+        self.stats: Dict[str, List[float]] = {}
+
+    def record(self, fp: str, seconds: float):
+        with self._lock:
+            entry = self.stats.setdefault(fp, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+        if self.parent is not None:
+            self.parent.record(fp, seconds)
+
+    @property
+    def total_queries(self) -> int:
+        with self._lock:
+            return int(sum(entry[0] for entry in self.stats.values()))
+
+    @property
+    def total_seconds(self) -> float:
+        with self._lock:
+            return sum(entry[1] for entry in self.stats.values())
+
+    def top(self, limit: int = 10) -> List[Tuple[str, int, float]]:
+        """(fingerprint, executions, seconds), most executed first."""
+        with self._lock:
+            rows = [(fp, int(count), seconds) for fp, (count, seconds) in self.stats.items()]
+        rows.sort(key=lambda row: (-row[1], -row[2]))
+        return rows[:limit]
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int, float]]:
+        return [row for row in self.top(limit=len(self.stats)) if row[1] > threshold]
+
+    def report(self, threshold: int):
+        for fp, count, seconds in self.repeated(threshold):
+            logger.warning(
+                f"Repeated query in {self.name}: {count} executions, {seconds * 1000:.1f} ms total "
+                f"(possible N+1): {fp[:300]}"
+            )
+
+
+def current_tracker() -> Optional[QueryTracker]:
+    return _tracker.get()
+
+
+def _tracking_config():
+    from config import QueryTrackingConfig
+    return QueryTrackingConfig
+
+
+def open_tracker(name: str):
+    """Start tracking for the current context; returns (tracker, token) for close_tracker."""
+    tracker = QueryTracker(name, parent=_tracker.get())
+    return tracker, _tracker.set(tracker)
+
+
+def close_tracker(tracker: QueryTracker, token):
+    """Stop tracking and warn about repeated fingerprints (only the outermost unit reports)."""
+    _tracker.reset(token)
+    if tracker.parent is None:
+        tracker.report(_tracking_config().REPEAT_WARN_THRESHOLD)
+
+
+@contextmanager
+def track_queries(name: str):
+    """Treat the enclosed block (or decorated function) as one unit of work."""
+    if not _tracking_config().ENABLED:
+        yield None
+        return
+    tracker, token = open_tracker(name)
+    try:
+        yield tracker
+    finally:
+        close_tracker(tracker, token)
+
+
+@contextmanager
+def _timed_statement(query):
+    add_count('db_queries')
+    tracker = _tracker.get()
+    start = time.perf_counter()
+    try:
+        with stage('db'):
+            yield
+    finally:
+        if tracker is not None:
+            tracker.record(fingerprint(_query_text(query)), time.perf_counter() - start)
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Drop-in cursor; costs two perf_counter calls per statement when nothing is listening."""
+
+    def execute(self, query, vars=None):
+        with _timed_statement(query):
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        with _timed_statement(query):
+            return super().executemany(query, vars_list)
+
+    def callproc(self, procname, parameters=None):
+        with _timed_statement(f'CALL {procname}'):
+            return super().callproc(procname, parameters)
+
+    def copy_expert(self, sql, file, size=8192):
+        with _timed_statement(sql):
+            return super().copy_expert(sql, file, size)
+
+
+def init_query_tracking(app):
+    """Track every request of the Flask app as one unit of work, named after its url rule."""
+    from flask import g, request
+
+    if not _tracking_config().ENABLED:
+        return
+
+    @app.before_request
+    def _start_query_tracking():
+        rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        g._query_tracker, g._query_tracker_token = open_tracker(f'{request.method} {rule}')
+
+    @app.teardown_request
+    def _finish_query_tracking(exc):
+        tracker = g.pop('_query_tracker', None)
+        token = g.pop('_query_tracker_token', None)
+        if tracker is not None:
+            try:
+                close_tracker(tracker, token)
+            except ValueError:
+                pass  # token created in a different context
+
+
+# --- Test helpers ---
+
+@contextmanager
+def assert_max_queries(max_queries: int, max_per_statement: Optional[int] = None):
+    """
+    Fail (AssertionError) if the enclosed block runs more than max_queries statements, or any
+    single fingerprint more than max_per_statement times:
+
+        with assert_max_queries(5, max_per_statement=1):
+            client.get('/api/bills')
+    """
+    tracker, token = open_tracker('assert_max_queries')
+    try:
+        yield tracker
+    finally:
+        _tracker.reset(token)
+    problems = []
+    if tracker.total_queries > max_queries:
+        problems.append(f"{tracker.total_queries} queries (max {max_queries})")
+    if max_per_statement is not None:
+        for fp, count, _ in tracker.repeated(max_per_statement):
+            problems.append(f"{count}x (max {max_per_statement}): {fp[:200]}")
+    if problems:
+        top = '\n'.join(f"  {count}x {seconds * 1000:.1f}ms {fp[:200]}" for fp, count, seconds in tracker.top())
+        raise AssertionError('; '.join(problems) + f"\nMost executed:\n{top}")
+
+
+def assert_endpoint_max_queries(client, method: str, path: str, max_queries: int,
+                                max_per_statement: Optional[int] = None, **request_kwargs):
+    """Call an endpoint with a Flask test client and assert its query budget; returns the response."""
+    with assert_max_queries(max_queries, max_per_statement):
+        response = client.open(path, method=method.upper(), **request_kwargs)
+    return response
@@ -1,6 +1,11 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
 def ingest_emails():
-    print("[DEBUG] Ingesting emails from inbox")
-    print("[DEBUG] Parsing attachments and matching to DB")
+    logger.debug("Ingesting emails from inbox")
+    logger.debug("Parsing attachments and matching to DB")
     return [
         {
             "filename": "payment_receipt_ABC123.pdf",
@@ -0,0 +1,163 @@
+"""
+Email Outbox for IQSTrade
+Outbound email queue (migrations/20250808_create_email_outbox.sql):
+- enqueue() adds messages on the caller's cursor, so they commit or roll back with the work that
+  produced them (a payment marked paid, ...); nothing talks SMTP inside a request
+- drain_outbox() sends pending messages in batches of OUTBOX_BATCH_SIZE, locking them with
+  FOR UPDATE SKIP LOCKED so the scheduler and a request-triggered drain never send one twice
+- A failed send is retried after RETRY_BASE_SECONDS * 2^(attempts-1) and marked 'failed' after
+  MAX_ATTEMPTS; last_error keeps the reason
+Drained every minute by email_scheduler.py, right after a request that queued mail
+(drain_in_background), or by hand:
+    python -m utils.email_outbox drain
+"""
+
+import sys
+import logging
+import threading
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from config import OutboxConfig, get_db_conn
+from utils.security import decrypt_sensitive_data
+
+logger = logging.getLogger(__name__)
+
+
+def _payment_confirmation(recipient: str, payload: Dict) -> bool:
+    from email_utils import send_payment_confirmation_email
+
+    return send_payment_confirmation_email(recipient, payload.get('customer_name'), payload.get('bl_number'))
+
+
+def _allinpay_deposit_confirmation(recipient: str, payload: Dict) -> bool:
+    from email_utils import send_unique_number_email
+
+    subject = "Payment Confirmation - 85% Received"
+    body = f"""
+Dear Customer,
+
+Thank you for your payment!
+
+Transaction Details:
+- Transaction ID: {payload.get('transaction_id')}
+- Your CTN Number: {payload.get('unique_number')}  <!-- Highlighted as the most important -->
+- Total Invoice Amount: {payload.get('invoice_total')} {payload.get('currency')}
+
+If you have any questions, please contact support.
+
+Best regards,
+Terry Ray Logistics
+"""
+    return send_unique_number_email(recipient, subject, body)
+
+
+# template -> sender(recipient, payload) returning True once the message is sent
+TEMPLATES = {
+    'payment_confirmation': _payment_confirmation,
+    'allinpay_deposit_confirmation': _allinpay_deposit_confirmation,
+}
+
+
+def enqueue(cur, template: str, recipient: str, payload: Optional[Dict] = None):
+    enqueue_many(cur, [(template, recipient, payload or {})])
+
+
+def enqueue_many(cur, messages: Iterable[Tuple[str, str, Dict]]) -> int:
+    """Queue (template, recipient, payload) messages with one INSERT; rows without a recipient are skipped."""
+    from psycopg2.extras import Json, execute_values
+
+    rows = []
+    for template, recipient, payload in messages:
+        if template not in TEMPLATES:
+            raise ValueError(f"Unknown email template: {template}")
+        if recipient:
+            rows.append((template, recipient, Json(payload)))
+    if rows:
+        execute_values(cur, "INSERT INTO email_outbox (template, recipient, payload) VALUES %s", rows)
+    return len(rows)
+
+
+def drain_batch(conn) -> Tuple[int, int]:
+    """Send up to BATCH_SIZE due messages in one transaction; returns (claimed, sent)."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT id, template, recipient, payload, attempts
+            FROM email_outbox
+            WHERE status = 'pending' AND next_attempt_at <= NOW()
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (OutboxConfig.BATCH_SIZE,))
+        rows = cur.fetchall()
+        sent = 0
+        for message_id, template, recipient, payload, attempts in rows:
+            try:
+                ok = TEMPLATES[template](decrypt_sensitive_data(recipient), payload or {})
+                error = None if ok else 'send returned False'
+            except Exception as e:
+                error = str(e)
+            if error is None:
+                sent += 1
+                cur.execute("UPDATE email_outbox SET status = 'sent', attempts = attempts + 1, sent_at = NOW(), "
+                            "last_error = NULL WHERE id = %s", (message_id,))
+                continue
+            attempts += 1
+            status = 'failed' if attempts >= OutboxConfig.MAX_ATTEMPTS else 'pending'
+            retry_in = timedelta(seconds=OutboxConfig.RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+            cur.execute("UPDATE email_outbox SET status = %s, attempts = %s, last_error = %s, "
+                        "next_attempt_at = NOW() + %s WHERE id = %s",
+                        (status, attempts, error[:1000], retry_in, message_id))
+            logger.warning(f"Outbox message {message_id} ({template}) failed (attempt {attempts}, {status}): {error}")
+        conn.commit()
+        return len(rows), sent
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def drain_outbox(max_batches: Optional[int] = None) -> int:
+    """Send every due message, batch by batch. Returns the number sent."""
+    conn = get_db_conn()
+    if conn is None:
+        logger.error("Email outbox: database unavailable")
+        return 0
+    total = batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            claimed, sent = drain_batch(conn)
+            total += sent
+            batches += 1
+            if claimed < OutboxConfig.BATCH_SIZE:
+                break
+    finally:
+        conn.close()
+    if total:
+        logger.info(f"Email outbox: sent {total} messages")
+    return total
+
+
+def drain_in_background():
+    """Start a drain now instead of waiting for the scheduler (after a request queued mail)."""
+    def run():
+        try:
+            drain_outbox()
+        except Exception as e:
+            logger.error(f"Email outbox drain failed: {e}")
+
+    threading.Thread(target=run, name='email-outbox-drain', daemon=True).start()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv != ['drain']:
+        raise SystemExit("usage: python -m utils.email_outbox drain")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    print(f"sent: {drain_outbox()}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
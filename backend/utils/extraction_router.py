@@ -0,0 +1,371 @@
+"""
+Extraction Router for IQSTrade
+Picks which provider extracts bill fields from a PDF (Google Vision or OpenAI)
+based on configuration (see ExtractionConfig), and protects the request thread:
+- Each provider call has a timeout and a retry budget.
+- A circuit breaker skips a provider that keeps failing.
+- Optional hedging fires the next provider once the current one exceeds its p95 latency.
+- A call that times out keeps running on the pool; each provider may leave only MAX_ABANDONED_CALLS
+  of them behind (the pool is sized for them) and is skipped at the limit, so hung calls cannot
+  starve the pool. A call that timed out still queued is cancelled and does not count as a failure.
+- Per-provider latency histograms are kept for the admin stats endpoint.
+"""
+
+import json
+import time
+import bisect
+import logging
+import threading
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Optional
+
+from config import ExtractionConfig
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = [0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30]
+
+
+class CircuitBreaker:
+    """
+    closed -> open after failure_threshold consecutive failures;
+    open -> half_open after reset_seconds (one trial call); success closes it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class LatencyHistogram:
+    """Cumulative bucket counts plus a window of recent samples for percentiles."""
+
+    def __init__(self, buckets: List[float] = None, window: int = 500):
+        self.buckets = buckets or LATENCY_BUCKETS
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._recent = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self._sum += seconds
+            self._recent.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._recent)
+        if not samples:
+            return None
+        idx = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[idx]
+
+    def sample_count(self) -> int:
+        with self._lock:
+            return len(self._recent)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counts = list(self._counts)
+            total = sum(counts)
+            total_sum = self._sum
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + [float('inf')], counts):
+            cumulative += count
+            buckets['+Inf' if bound == float('inf') else str(bound)] = cumulative
+        return {
+            'count': total,
+            'sum': round(total_sum, 3),
+            'buckets': buckets,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+# Keys that are always filled in and say nothing about whether extraction worked
+METADATA_FIELDS = {'raw_text', 'document_type', 'extraction_tier', 'extraction_provider'}
+
+
+def is_usable(fields) -> bool:
+    """A provider result counts as a success only if it is a dict with at least one extracted field."""
+    if not isinstance(fields, dict) or not fields or fields.get('error'):
+        return False
+    return any(v not in (None, '', [], {}) for k, v in fields.items() if k not in METADATA_FIELDS)
+
+
+class ExtractionProvider:
+    """One extraction backend: a callable taking a PDF path and returning a fields dict."""
+
+    def __init__(self, name: str, func: Callable[[str], Dict], timeout: float, retries: int):
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+        self.retries = retries
+        self.breaker = CircuitBreaker(ExtractionConfig.BREAKER_FAILURE_THRESHOLD, ExtractionConfig.BREAKER_RESET_SECONDS)
+        self.latency = LatencyHistogram()
+        self.counters = Counter()
+        self._lock = threading.Lock()
+        self._abandoned = 0
+
+    def count(self, event: str):
+        with self._lock:
+            self.counters[event] += 1
+
+    def abandon(self, future):
+        """Track a timed-out call still running on the pool until it finishes."""
+        with self._lock:
+            self._abandoned += 1
+        future.add_done_callback(self._finished_abandoned)
+
+    def _finished_abandoned(self, future):
+        with self._lock:
+            self._abandoned -= 1
+
+    @property
+    def abandoned(self) -> int:
+        with self._lock:
+            return self._abandoned
+
+    def saturated(self) -> bool:
+        return self.abandoned >= ExtractionConfig.MAX_ABANDONED_CALLS
+
+    def run(self, pdf_path: str) -> Dict:
+        """Call the provider once; raises on error or unusable output. Runs on a pool thread."""
+        start = time.monotonic()
+        try:
+            fields = self.func(pdf_path)
+        finally:
+            self.latency.observe(time.monotonic() - start)
+        if not is_usable(fields):
+            raise ValueError(f"{self.name} returned no usable fields")
+        return fields
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None if we do not have enough samples yet."""
+        if self.latency.sample_count() < ExtractionConfig.HEDGE_MIN_SAMPLES:
+            return None
+        return self.latency.percentile(95)
+
+
+def _openai_provider(pdf_path: str) -> Dict:
+    from ocr_processor import extract_fields_openai
+    return extract_fields_openai(pdf_path)
+
+
+def _vision_provider(pdf_path: str) -> Dict:
+    from extract_fields import extract_fields
+    return extract_fields(pdf_path)
+
+
+class ExtractionRouter:
+    """
+    Routes field extraction through the configured provider chain.
+    """
+
+    def __init__(self, max_workers: int = None):
+        self.providers: Dict[str, ExtractionProvider] = {}
+        self.register('openai', _openai_provider, ExtractionConfig.OPENAI_TIMEOUT)
+        self.register('vision', _vision_provider, ExtractionConfig.VISION_TIMEOUT)
+        # Provider calls run on this pool so a hung call never holds the request thread past its timeout;
+        # the extra threads are for the timed-out calls each provider may leave running
+        self._executor = ThreadPoolExecutor(
+            max_workers=(max_workers or ExtractionConfig.MAX_WORKERS)
+            + ExtractionConfig.MAX_ABANDONED_CALLS * len(self.providers),
+            thread_name_prefix='extraction'
+        )
+        self._user_policy = self._load_policy(ExtractionConfig.USER_POLICY)
+
+    def register(self, name: str, func: Callable[[str], Dict], timeout: float, retries: int = None):
+        """Add (or replace) a provider."""
+        self.providers[name] = ExtractionProvider(
+            name, func, timeout, ExtractionConfig.RETRIES if retries is None else retries
+        )
+
+    @staticmethod
+    def _parse_chain(value) -> List[str]:
+        if isinstance(value, str):
+            value = value.split(',')
+        return [p.strip() for p in value or [] if p and p.strip()]
+
+    def _load_policy(self, raw: str) -> Dict[str, List[str]]:
+        try:
+            policy = json.loads(raw) if raw else {}
+            return {user: self._parse_chain(chain) for user, chain in policy.items()}
+        except Exception as e:
+            logger.error(f"[Extraction Router] Invalid EXTRACTION_USER_POLICY {raw!r}: {e}")
+            return {}
+
+    def chain_for(self, username: Optional[str] = None) -> List[str]:
+        chain = self._user_policy.get(username) or self._parse_chain(ExtractionConfig.DEFAULT_PROVIDERS)
+        known = [name for name in chain if name in self.providers]
+        if len(known) != len(chain):
+            logger.warning(f"[Extraction Router] Unknown providers in chain {chain}, using {known}")
+        return known
+
+    def extract(self, pdf_path: str, username: Optional[str] = None) -> Dict:
+        """
+        Extract fields using the provider chain for this user.
+        Returns the first usable result (with 'extraction_provider' set), or {} if every provider failed.
+        """
+        deadline = time.monotonic() + ExtractionConfig.TOTAL_BUDGET
+        chain = self.chain_for(username)
+        logger.debug(f"[Extraction Router] chain for {username}: {chain}")
+        for idx, name in enumerate(chain):
+            provider = self.providers[name]
+            if not provider.breaker.allow():
+                provider.count('short_circuited')
+                logger.warning(f"[Extraction Router] {name} circuit open, skipping")
+                continue
+            if provider.saturated():
+                provider.count('saturated')
+                logger.warning(f"[Extraction Router] {name} has {provider.abandoned} timed-out calls still running, skipping")
+                continue
+            hedge = self._hedge_partner(chain[idx + 1:]) if ExtractionConfig.HEDGE_ENABLED else None
+            for attempt in range(provider.retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.error(f"[Extraction Router] Extraction budget exhausted for {pdf_path}")
+                    return {}
+                fields, winner = self._attempt(provider, pdf_path, min(provider.timeout, remaining), hedge)
+                if fields is not None:
+                    fields['extraction_provider'] = winner.name
+                    return fields
+                if provider.saturated() or not provider.breaker.allow():
+                    break
+                # Only hedge on the first attempt; the partner gets its own turn in the chain
+                hedge = None
+        logger.error(f"[Extraction Router] All providers failed for {pdf_path} (chain {chain})")
+        return {}
+
+    def _hedge_partner(self, rest: List[str]) -> Optional[ExtractionProvider]:
+        for name in rest:
+            provider = self.providers[name]
+            if provider.breaker.state == 'closed' and not provider.saturated():
+                return provider
+        return None
+
+    def _attempt(self, provider: ExtractionProvider, pdf_path: str, timeout: float,
+                 hedge: Optional[ExtractionProvider]):
+        """One attempt (possibly hedged). Returns (fields, provider) or (None, None)."""
+        provider.count('calls')
+        primary = self._executor.submit(provider.run, pdf_path)
+        futures = {primary: provider}
+        start = time.monotonic()
+
+        hedge_delay = provider.hedge_delay() if hedge else None
+        if hedge_delay is not None and hedge_delay < timeout:
+            done, _ = wait([primary], timeout=hedge_delay)
+            if not done and hedge.breaker.allow():
+                logger.info(f"[Extraction Router] {provider.name} past p95 ({hedge_delay:.2f}s), hedging with {hedge.name}")
+                provider.count('hedged')
+                hedge.count('hedge_calls')
+                futures[self._executor.submit(hedge.run, pdf_path)] = hedge
+
+        pending = set(futures)
+        while pending:
+            remaining = timeout - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                owner = futures[future]
+                try:
+                    fields = future.result()
+                except Exception as e:
+                    owner.count('failures')
+                    owner.breaker.record_failure()
+                    logger.warning(f"[Extraction Router] {owner.name} failed: {e}")
+                    continue
+                owner.count('successes')
+                owner.breaker.record_success()
+                return fields, owner
+
+        # Whatever is still running has timed out; the pool thread finishes in the background
+        for future in pending:
+            owner = futures[future]
+            if future.cancel():
+                # Never started: the pool was busy, which says nothing about the provider
+                owner.count('queue_timeouts')
+                logger.warning(f"[Extraction Router] {owner.name} call still queued after {timeout:.1f}s, cancelled")
+                continue
+            owner.count('timeouts')
+            owner.breaker.record_failure()
+            owner.abandon(future)
+            logger.warning(f"[Extraction Router] {owner.name} timed out after {timeout:.1f}s")
+        return None, None
+
+    def stats(self) -> Dict:
+        return {
+            name: {
+                'circuit': provider.breaker.state,
+                'timeout': provider.timeout,
+                'retries': provider.retries,
+                'abandoned_calls': provider.abandoned,
+                'counters': dict(provider.counters),
+                'latency_seconds': provider.latency.snapshot(),
+            }
+            for name, provider in self.providers.items()
+        }
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_extraction_router() -> ExtractionRouter:
+    """Get the global extraction router (created on first use)."""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ExtractionRouter()
+    return _router
+
+
+def extract_bill_fields(pdf_path: str, username: Optional[str] = None) -> Dict:
+    """Convenience wrapper used by the upload routes."""
+    return get_extraction_router().extract(pdf_path, username)
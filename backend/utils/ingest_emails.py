@@ -1,25 +1,24 @@
 import os
-import imaplib
 import email
 from email.header import decode_header
+from email.utils import parseaddr
 import tempfile
-import fitz  # PyMuPDF
 # import openai
 import requests
 import re
 import logging
-from PIL import Image
-from google.cloud import vision
 from config import get_db_conn
+from utils.bill_identifiers import find_references
+from utils.bl_matcher import resolve_bills
+from utils.reconciliation import FINAL, ReceivablesIndex, accepted, describe, reconcile
+from utils.mail_clients import TimedIMAP4_SSL
+from vision_utils import ocr_images
 from cloudinary_utils import upload_filepath_to_cloudinary
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
 import datetime
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 import pytz
 from email_ingestor import handle_email_via_openai, save_draft_reply
-from reportlab.lib.utils import simpleSplit
 from invoice_utils import generate_pdf_from_text
 
 bp_ingest = Blueprint("bp_ingest", __name__)
@@ -27,11 +26,7 @@ bp_ingest = Blueprint("bp_ingest", __name__)
 # ...rest of your code...
 
 
-def debug(msg):
-    print(f"[DEBUG] {msg}")
-
-def warn(msg):
-    print(f"[WARNING] {msg}")
+logger = logging.getLogger(__name__)
 
 def get_env(var, default=None):
     val = os.environ.get(var, default)
@@ -45,14 +40,14 @@ def connect_imap():
     port = int(get_env('EMAIL_PORT', '993'))
     user = get_env('EMAIL_USERNAME')
     password = get_env('EMAIL_PASSWORD')
-    debug(f"Connecting to IMAP: {user}@{host} on port {port}")
+    logger.debug(f"Connecting to IMAP: {user}@{host} on port {port}")
     try:
-        mail = imaplib.IMAP4_SSL(host, port)
+        mail = TimedIMAP4_SSL(host, port)
         mail.login(user, password)
-        debug("Logged in successfully")
+        logger.debug("Logged in successfully")
         return mail
     except Exception as e:
-        warn(f"IMAP connection/login failed: {e}")
+        logger.warning(f"IMAP connection/login failed: {e}")
         return None
 
 # Fetch unread emails
@@ -60,7 +55,7 @@ def fetch_unread_emails(mail):
     mail.select('inbox')
     status, messages = mail.search(None, '(UNSEEN)')
     email_ids = messages[0].split()
-    debug(f"Fetched {len(email_ids)} new emails")
+    logger.debug(f"Fetched {len(email_ids)} new emails")
     return email_ids
 
 # Download attachments and body
@@ -83,11 +78,11 @@ def parse_email(mail, email_id):
             with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as tmp:
                 tmp.write(part.get_payload(decode=True))
                 attachments.append(tmp.name)
-                debug(f"Processing attachment: {filename}")
+                logger.debug(f"Processing attachment: {filename}")
         elif content_type == "text/plain":
             charset = part.get_content_charset() or 'utf-8'
             body_text += part.get_payload(decode=True).decode(charset, errors='ignore')
-            debug("Email body text detected")
+            logger.debug("Email body text detected")
     # Mark email as read
     mail.store(email_id, '+FLAGS', '\\Seen')
     return body_text, attachments, message_id
@@ -96,6 +91,7 @@ def parse_email(mail, email_id):
 def extract_text_from_file(filepath):
     ext = os.path.splitext(filepath)[1].lower()
     if ext == '.pdf':
+        import fitz  # PyMuPDF, imported on first use
         with fitz.open(filepath) as doc:
             text = ""
             for page in doc:
@@ -103,41 +99,26 @@ def extract_text_from_file(filepath):
                 if page_text.strip():
                     text += page_text
             if text.strip():
-                debug("Attachment type: PDF (text-based)")
+                logger.debug("Attachment type: PDF (text-based)")
                 return text
             else:
-                debug("Attachment type: PDF (image-based)")
+                logger.debug("Attachment type: PDF (image-based)")
                 images = []
                 for page in doc:
                     for img in page.get_images(full=True):
                         xref = img[0]
                         pix = fitz.Pixmap(doc, xref)
-                        if pix.n < 5:
-                            img_path = tempfile.mktemp(suffix='.png')
-                            pix.save(img_path)
-                            images.append(img_path)
-                            pix = None
-                ocr_text = ""
-                client = vision.ImageAnnotatorClient()
-                for img_path in images:
-                    with open(img_path, "rb") as image_file:
-                        content = image_file.read()
-                    image = vision.Image(content=content)
-                    response = client.text_detection(image=image)
-                    if response.text_annotations:
-                        ocr_text += response.text_annotations[0].description
-                    os.remove(img_path)
-                return ocr_text
+                        if pix.n - pix.alpha >= 4:
+                            # CMYK can't be written as PNG, convert to RGB first
+                            pix = fitz.Pixmap(fitz.csRGB, pix)
+                        images.append(pix.tobytes("png"))
+                        pix = None
+                return "".join(ocr_images(images))
     elif ext in ['.jpg', '.jpeg', '.png']:
-        debug("Attachment type: Image")
-        client = vision.ImageAnnotatorClient()
+        logger.debug("Attachment type: Image")
         with open(filepath, "rb") as image_file:
             content = image_file.read()
-        image = vision.Image(content=content)
-        response = client.text_detection(image=image)
-        if response.text_annotations:
-            return response.text_annotations[0].description
-        return ""
+        return ocr_images([content])[0]
     else:
         with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
             return f.read()
@@ -151,12 +132,8 @@ def extract_payment_data(all_text):
 
     bl_numbers = set()
 
-    # Flexible B/L number detection (like extract_fields)
-    # Match patterns like NYC22062889
-    bl_numbers.update(re.findall(r'\b[A-Z]{3}\d{6,}\b', all_text))
-
-    # Also pick up simpler BL12345 style
-    bl_numbers.update(re.findall(r'\bBL[ -]?[0-9]{4,}\b', all_text, re.IGNORECASE))
+    # Flexible B/L number detection: NYC22062889, NYC 22062889, BL12345 and container numbers
+    bl_numbers.update(find_references(all_text))
 
     # "B/L No: 123456" or "Bill of Lading: 123456"
     bl_numbers.update(re.findall(r'\b(?:B\/L|Bill of Lading)[^\d]{0,10}(\d{4,})', all_text, re.IGNORECASE))
@@ -168,7 +145,7 @@ def extract_payment_data(all_text):
         'reference_number': reference_number,
         'bl_numbers': bl_numbers
     }
-    debug(f"Parsed fields (placeholder): {parsed}")
+    logger.debug(f"Parsed fields (placeholder): {parsed}")
     return parsed
 
 # Match to DB
@@ -179,31 +156,38 @@ def match_payment_to_bls(payment_data):
     amount = float(payment_data.get('amount', 0))
     matched = []
     total_invoice = 0
+    bills_by_reference = resolve_bills(cursor, bls, columns=('id', 'ctn_fee', 'service_fee', 'status'))
+    cursor.close()
+    conn.close()
     for bl in bls:
-        cursor.execute("SELECT id, ctn_fee, service_fee, status FROM bill_of_lading WHERE bl_number = %s", (bl,))
-        row = cursor.fetchone()
-        if row:
+        bill = bills_by_reference.get(bl, [None])[0]
+        # A BL and one of its containers (or 'NYC22062889' and '22062889') name the same bill
+        if bill and all(row[0] != bill['id'] for row in matched):
+            row = (bill['id'], bill['ctn_fee'], bill['service_fee'], bill['status'])
             matched.append(row)
             ctn_fee = float(row[1]) if row[1] else 0
             service_fee = float(row[2]) if row[2] else 0
             total_invoice += ctn_fee + service_fee
-            debug(f"Matched BL number: {bl} | ctn_fee: {ctn_fee} | service_fee: {service_fee}")
+            logger.debug(f"Matched BL number: {bl} | ctn_fee: {ctn_fee} | service_fee: {service_fee}")
     tolerance = 2.0
     if abs(total_invoice - amount) <= tolerance and matched:
-        debug(f"Receipt matches payment for BLs: {bls}")
+        logger.debug(f"Receipt matches payment for BLs: {bls}")
         return matched, True
     else:
-        warn(f"Payment amount mismatch for BLs: {bls}\nExpected: {total_invoice}, Received: {amount}")
+        logger.warning(f"Payment amount mismatch for BLs: {bls}\nExpected: {total_invoice}, Received: {amount}")
         return matched, False
 
-def process_payment_receipt_email(email_id, from_addr, subject, body_text, attachments, bl_numbers, paid_amount, conn=None):
+def process_payment_receipt_email(email_id, from_addr, subject, body_text, attachments, bl_numbers, paid_amount, conn=None,
+                                  receivables=None):
     """
     Centralized logic to process a payment receipt email.
     - Uses a provided list of BL numbers.
     - Uploads receipt (if any) to Cloudinary.
     - Updates the corresponding bill in bill_of_lading.
     - Mark the email as processed_for_payments = TRUE.
-    - Compares paid amount to total invoice amount before updating.
+    - Compares paid amount to total invoice amount before updating; a payment the reconciliation
+      engine allocates with confidence (several bills, an 85% / 15% instalment) is accepted as well.
+    - receivables: the run's ReceivablesIndex, shared across emails (loaded here when not given).
     """
     import re
     from cloudinary_utils import upload_filepath_to_cloudinary
@@ -219,7 +203,7 @@ def process_payment_receipt_email(email_id, from_addr, subject, body_text, attac
     cursor = conn.cursor()
     
     if not bl_numbers:
-        print(f"[WARN] No BL number was provided for email {email_id}. Marking as processed.")
+        logger.warning(f"No BL number was provided for email {email_id}. Marking as processed.")
         cursor.execute("UPDATE customer_emails SET processed_for_payments=TRUE WHERE id=%s", (email_id,))
         conn.commit()
         if close_conn:
@@ -227,22 +211,22 @@ def process_payment_receipt_email(email_id, from_addr, subject, body_text, attac
             conn.close()
         return False
 
-    print(f"[DEBUG] Processing payment for email {email_id} with BLs: {bl_numbers} and amount: {paid_amount}")
+    logger.debug(f"Processing payment for email {email_id} with BLs: {bl_numbers} and amount: {paid_amount}")
 
     # --- Amount Verification ---
     total_expected_amount = 0
     bill_ids_to_update = []
+    bills_by_reference = resolve_bills(cursor, bl_numbers, columns=('id', 'ctn_fee', 'service_fee'))
     for bl in bl_numbers:
-        cursor.execute("SELECT id, ctn_fee, service_fee FROM bill_of_lading WHERE bl_number = %s", (bl,))
-        bill_row = cursor.fetchone()
-        if bill_row:
-            bill_ids_to_update.append(bill_row[0])
-            ctn_fee = float(bill_row[1] or 0)
-            service_fee = float(bill_row[2] or 0)
+        bill = bills_by_reference.get(bl, [None])[0]
+        if bill and bill['id'] not in bill_ids_to_update:
+            bill_ids_to_update.append(bill['id'])
+            ctn_fee = float(bill['ctn_fee'] or 0)
+            service_fee = float(bill['service_fee'] or 0)
             total_expected_amount += ctn_fee + service_fee
     
     if paid_amount is None or not isinstance(paid_amount, (int, float)):
-        print(f"[WARN] No valid payment amount found in email {email_id}. Cannot verify payment. Flagging for manual review.")
+        logger.warning(f"No valid payment amount found in email {email_id}. Cannot verify payment. Flagging for manual review.")
         # Mark as processed to avoid re-running, but don't update bills
         cursor.execute("UPDATE customer_emails SET processed_for_payments=TRUE WHERE id=%s", (email_id,))
         conn.commit()
@@ -253,9 +237,24 @@ def process_payment_receipt_email(email_id, from_addr, subject, body_text, attac
         
     tolerance = 2.0 # Allow for small discrepancies
     paid_amount_f = float(paid_amount)
+    # Combined payments for several bills, or an Allinpay 85% / 15% instalment (utils/reconciliation.py)
+    if receivables is None:
+        receivables = ReceivablesIndex.load(cursor)
+    proposals = reconcile(receivables, paid_amount_f, bill_ids_to_update, emails=[parseaddr(from_addr or '')[1]])
+    best = accepted(proposals)
+    # Bills whose final 15% this pays: already 'Paid and CTN Valid', so they keep their status
+    final_bill_ids = set()
+    if best:
+        final_bill_ids = {item['bill_id'] for item in best['allocations'] if item['kind'] == FINAL}
+        if set(best['bill_ids']) != set(bill_ids_to_update):
+            logger.info(f"Payment in email {email_id} allocated as {describe(best)}")
+        bill_ids_to_update = best['bill_ids']
+        receivables.settle(bill_ids_to_update)
+    elif proposals:
+        logger.info(f"Payment in email {email_id} not allocated; best proposal: {describe(proposals[0])}")
     # If underpaid, flag for manual review. If overpaid, process as normal.
-    if paid_amount_f < total_expected_amount - tolerance:
-        print(f"[WARN] Underpayment for email {email_id}. Expected: {total_expected_amount}, Paid: {paid_amount_f}. Flagging for manual review.")
+    if not best and paid_amount_f < total_expected_amount - tolerance:
+        logger.warning(f"Underpayment for email {email_id}. Expected: {total_expected_amount}, Paid: {paid_amount_f}. Flagging for manual review.")
         cursor.execute("UPDATE customer_emails SET processed_for_payments=TRUE WHERE id=%s", (email_id,))
         conn.commit()
         if close_conn:
@@ -263,7 +262,7 @@ def process_payment_receipt_email(email_id, from_addr, subject, body_text, attac
             conn.close()
         return False
     # If exact or overpaid, proceed to process and upload receipt
-    print(f"[INFO] Payment amount verified (or overpaid) for email {email_id}. Proceeding to update bills.")
+    logger.info(f"Payment amount verified (or overpaid) for email {email_id}. Proceeding to update bills.")
 
     # --- Proceed with updating bills since amount is verified ---
     # 1. Look for a PDF attachment first
@@ -271,7 +270,7 @@ def process_payment_receipt_email(email_id, from_addr, subject, body_text, attac
     for att in attachments:
         if att.lower().endswith('.pdf'):
             receipt_url = upload_filepath_to_cloudinary(att, folder="receipts")
-            print(f"[INFO] Uploaded attached PDF as receipt for bills {bill_ids_to_update}")
+            logger.info(f"Uploaded attached PDF as receipt for bills {bill_ids_to_update}")
             break
     
     # 2. If no PDF, generate one from the email body
@@ -282,19 +281,27 @@ def process_payment_receipt_email(email_id, from_addr, subject, body_text, attac
             receipt_url = upload_filepath_to_cloudinary(temp_pdf_path, folder="receipts") # Use upload_filepath_to_cloudinary
             os.remove(temp_pdf_path) # Clean up the temporary file
         except Exception as e:
-            print(f"[ERROR] Failed to generate or upload PDF from email body: {e}")
+            logger.error(f"Failed to generate or upload PDF from email body: {e}")
 
     hk_now = datetime.datetime.now(datetime.timezone.utc).astimezone(pytz.timezone('Asia/Hong_Kong')).isoformat()
     if receipt_url:
         for bill_id in bill_ids_to_update:
+            if bill_id in final_bill_ids:
+                cursor.execute("""
+                    UPDATE bill_of_lading
+                    SET receipt_filename = %s, receipt_uploaded_at = %s
+                    WHERE id = %s
+                """, (receipt_url, hk_now, bill_id))
+                logger.info(f"Attached final instalment receipt from email {email_id} to bill {bill_id}")
+                continue
             cursor.execute("""
                 UPDATE bill_of_lading
                 SET receipt_filename = %s, status = 'Awaiting Bank In', receipt_uploaded_at = %s
                 WHERE id = %s
             """, (receipt_url, hk_now, bill_id))
-            print(f"[INFO] Updated bill {bill_id} with receipt from email {email_id}")
+            logger.info(f"Updated bill {bill_id} with receipt from email {email_id}")
     else:
-        print(f"[WARN] No receipt could be generated for email {email_id}. Bills not updated.")
+        logger.warning(f"No receipt could be generated for email {email_id}. Bills not updated.")
 
     # Mark email as processed
     cursor.execute("UPDATE customer_emails SET processed_for_payments=TRUE WHERE id=%s", (email_id,))
@@ -306,15 +313,16 @@ def process_payment_receipt_email(email_id, from_addr, subject, body_text, attac
 
 # Main
 def ingest_emails():
-    debug("Ingesting emails from inbox")
+    logger.debug("Ingesting emails from inbox")
     mail = connect_imap()
     if not mail:
-        warn("IMAP connection failed, aborting ingestion")
+        logger.warning("IMAP connection failed, aborting ingestion")
         return []
     email_ids = fetch_unread_emails(mail)
     results = []
     conn = get_db_conn()
     cursor = conn.cursor()
+    receivables = None  # open receivables, loaded at the first payment receipt of this run
     for eid in email_ids:
         body_text, attachments, message_id = parse_email(mail, eid)
         
@@ -338,13 +346,13 @@ def ingest_emails():
             )
             result = cursor.fetchone()
             if not result:
-                debug(f"Skipping duplicate email with Message-ID: {message_id}")
+                logger.debug(f"Skipping duplicate email with Message-ID: {message_id}")
                 continue # Skip if the email already existed
             email_id = result[0]
             conn.commit()
         except Exception as e:
             conn.rollback()
-            print(f"[ERROR] Failed to insert new email, skipping. Message-ID: {message_id}, Error: {e}")
+            logger.error(f"Failed to insert new email, skipping. Message-ID: {message_id}, Error: {e}")
             continue
 
         # === OpenAI classification and draft ===
@@ -356,9 +364,11 @@ def ingest_emails():
         # === Centralized payment receipt processing ===
         if classification == "payment_receipt":
             # Pass the BL numbers and paid amount from OpenAI to the processing function
+            if receivables is None:
+                receivables = ReceivablesIndex.load(cursor)
             process_payment_receipt_email(
                 email_id, from_addr, subject, body_text, attachments, 
-                bl_numbers_from_openai, paid_amount_from_openai, conn=conn
+                bl_numbers_from_openai, paid_amount_from_openai, conn=conn, receivables=receivables
             )
         
         # Note: Draft saving is now handled inside handle_email_via_openai
@@ -396,6 +406,7 @@ def process_unprocessed_payment_emails_route():
     cursor.execute("SELECT id, sender, subject, body, attachments FROM customer_emails WHERE processed_for_payments=FALSE")
     emails = cursor.fetchall()
     processed_count = 0
+    receivables = None
     for email_row in emails:
         email_id, sender, subject, body, attachments_json = email_row
         
@@ -405,7 +416,10 @@ def process_unprocessed_payment_emails_route():
         
         if action.get('classification') == 'payment_receipt':
             bl_list = action.get('bl_numbers', [])
-            process_payment_receipt_email(email_id, sender, subject, body, [], bl_list, 0.0, conn=conn) # Pass 0.0 for paid_amount
+            if receivables is None:
+                receivables = ReceivablesIndex.load(cursor)
+            process_payment_receipt_email(email_id, sender, subject, body, [], bl_list, 0.0, conn=conn,
+                                          receivables=receivables) # Pass 0.0 for paid_amount
             processed_count += 1
 
     cursor.close()
@@ -0,0 +1,117 @@
+"""
+JSON Responses for IQSTrade
+Faster serialization and smaller bodies for the listing endpoints (/bills, /account_bills_monthly,
+/management/overview, /admin/email/inbox):
+- OrjsonProvider replaces Flask's json-module provider when orjson is installed. It writes the
+  values psycopg2 returns exactly as before: datetime/date as HTTP dates, Decimal as a string,
+  plus memoryview/bytes (bytea) as base64. Keys are no longer sorted.
+- ?fields=a,b,c limits each row to the named columns (requested_fields/project); unknown names
+  answer 400. Listing routes also narrow their SELECT to the requested columns where they can.
+Compression of the serialized body is done separately (utils/compression.py).
+"""
+
+import base64
+import logging
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from flask import jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson  # optional: without it Flask's default provider stays in place
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return http_date(value)
+    if isinstance(value, time):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (memoryview, bytes, bytearray)):
+        return base64.b64encode(value).decode('ascii')
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson; falls back to the json module for what orjson rejects."""
+
+    default = staticmethod(_default)
+    sort_keys = False
+
+    def _options(self, indent: bool = False) -> int:
+        # Datetimes go through _default so they keep Flask's HTTP-date format instead of orjson's ISO 8601
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps_bytes(self, obj, indent: bool = False) -> bytes:
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._options(indent))
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits
+            return super().dumps(obj, indent=2 if indent else None).encode('utf-8')
+
+    def dumps(self, obj, **kwargs) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        # Straight to bytes: no str round trip for large bodies
+        return self._app.response_class(self.dumps_bytes(obj, indent) + b'\n', mimetype=self.mimetype)
+
+
+class FieldSelectionError(ValueError):
+    """?fields= names a column the endpoint does not return."""
+
+
+def requested_fields(allowed: Iterable[str]) -> Optional[List[str]]:
+    """Columns named by ?fields=a,b,c in request order, or None when the parameter is absent."""
+    raw = request.args.get('fields')
+    if not raw:
+        return None
+    fields = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    allowed = set(allowed)
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise FieldSelectionError(f"Unknown fields: {', '.join(unknown)}")
+    return fields or None
+
+
+def project(rows: List[Dict], fields: Optional[List[str]]) -> List[Dict]:
+    """Keep only the requested keys of each row (all of them when fields is None)."""
+    if fields is None:
+        return rows
+    return [{name: row[name] for name in fields if name in row} for row in rows]
+
+
+def init_json(app):
+    """Install OrjsonProvider (when orjson is available) and the 400 response for bad ?fields=."""
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
+    else:
+        logger.info("orjson is not installed: using Flask's default JSON provider")
+
+    @app.errorhandler(FieldSelectionError)
+    def _bad_fields(e):
+        return jsonify({'error': str(e)}), 400
@@ -0,0 +1,281 @@
+"""
+Rate-Limit Storage for IQSTrade
+Flask-Limiter storage backends shared by all gunicorn workers (the default memory:// storage is per
+process and starts from zero every time a worker is recycled by --max-requests):
+- iqs+postgres://  counters in the UNLOGGED table rate_limit_counters. Requests only touch a local
+  dict; a background thread upserts the accumulated increments every RATELIMIT_FLUSH_INTERVAL
+  seconds and reads back the totals of all workers. Limits can overshoot by what the other workers
+  counted since their last flush, which is fine for 100-per-hour style limits.
+- iqs+shm://<path>  counters in a SQLite file on tmpfs (/dev/shm), updated on every hit. Exact
+  across workers on one machine; not shared between machines.
+Both handle the fixed-window strategy (Flask-Limiter's default).
+Importing this module registers the schemes with the limits package.
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from limits.storage import Storage
+
+from config import LimiterConfig, get_db_conn
+from utils.timing import stage
+
+logger = logging.getLogger(__name__)
+
+
+class _Counter:
+    __slots__ = ('total', 'pending', 'expires_at')
+
+    def __init__(self, expires_at: float):
+        # total: this worker's view of all workers' hits (last flush plus local hits since)
+        self.total = 0
+        self.pending = 0
+        self.expires_at = expires_at
+
+
+class BatchedPostgresStorage(Storage):
+    """Fixed-window counters kept locally and flushed to Postgres in batches."""
+
+    STORAGE_SCHEME = ['iqs+postgres']
+
+    def __init__(self, uri: Optional[str] = None, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.flush_interval = float(options.get('flush_interval', LimiterConfig.FLUSH_INTERVAL))
+        self._init_process_state()
+        atexit.register(self.flush)
+
+    def _init_process_state(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, _Counter] = {}
+        self._thread = None
+        self._pid = os.getpid()
+        self._last_error_log = 0.0
+        self._flushes = 0
+
+    @property
+    def base_exceptions(self):
+        return (Exception,)
+
+    def _ensure_flusher(self):
+        if self._pid != os.getpid():
+            # Forked worker: the parent's counters and thread are not ours
+            self._init_process_state()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='ratelimit-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        now = time.time()
+        with self._lock:
+            self._ensure_flusher()
+            counter = self._counters.get(key)
+            if counter is None or counter.expires_at <= now:
+                counter = self._counters[key] = _Counter(now + expiry)
+            counter.total += amount
+            counter.pending += amount
+            return counter.total
+
+    def get(self, key: str) -> int:
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None or counter.expires_at <= time.time():
+                return 0
+            return counter.total
+
+    def get_expiry(self, key: str) -> float:
+        with self._lock:
+            counter = self._counters.get(key)
+            return counter.expires_at if counter is not None else time.time()
+
+    def flush(self):
+        """Push pending increments and pull the totals of all workers for those keys."""
+        now = time.time()
+        with self._lock:
+            batch = [(key, counter.pending, counter.expires_at)
+                     for key, counter in self._counters.items() if counter.pending]
+            for key, pending, _ in batch:
+                self._counters[key].pending = 0
+            expired = [key for key, counter in self._counters.items() if counter.expires_at <= now]
+            for key in expired:
+                del self._counters[key]
+        if not batch:
+            return
+        try:
+            with stage('limiter_flush'):
+                rows = self._upsert(batch)
+        except Exception as e:
+            with self._lock:
+                for key, pending, expires_at in batch:
+                    counter = self._counters.get(key)
+                    if counter is not None and counter.expires_at == expires_at:
+                        counter.pending += pending
+            if now - self._last_error_log > 60:
+                self._last_error_log = now
+                logger.warning(f"Rate-limit flush failed, keeping {len(batch)} counters local: {e}")
+            return
+        with self._lock:
+            for key, total, expires_at in rows:
+                counter = self._counters.get(key)
+                if counter is not None:
+                    counter.total = int(total) + counter.pending
+                    counter.expires_at = float(expires_at)
+
+    def _upsert(self, batch: List) -> List:
+        from psycopg2.extras import execute_values
+
+        conn = get_db_conn()
+        if conn is None:
+            raise RuntimeError('database unavailable')
+        try:
+            cur = conn.cursor()
+            rows = execute_values(
+                cur,
+                """
+                INSERT INTO rate_limit_counters (key, count, expires_at) VALUES %s
+                ON CONFLICT (key) DO UPDATE SET
+                    count = CASE WHEN rate_limit_counters.expires_at <= NOW() THEN EXCLUDED.count
+                                 ELSE rate_limit_counters.count + EXCLUDED.count END,
+                    expires_at = CASE WHEN rate_limit_counters.expires_at <= NOW() THEN EXCLUDED.expires_at
+                                      ELSE rate_limit_counters.expires_at END
+                RETURNING key, count, EXTRACT(EPOCH FROM expires_at)
+                """,
+                batch,
+                template='(%s, %s, to_timestamp(%s))',
+                fetch=True,
+            )
+            self._flushes += 1
+            if self._flushes % 300 == 0:
+                cur.execute("DELETE FROM rate_limit_counters WHERE expires_at < NOW() - INTERVAL '1 hour'")
+            conn.commit()
+            cur.close()
+            return rows
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def check(self) -> bool:
+        conn = get_db_conn()
+        if conn is None:
+            return False
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1 FROM rate_limit_counters LIMIT 1')
+            return True
+        except Exception:
+            return False
+        finally:
+            conn.close()
+
+    def reset(self) -> Optional[int]:
+        with self._lock:
+            cleared = len(self._counters)
+            self._counters.clear()
+        conn = get_db_conn()
+        if conn is not None:
+            try:
+                cur = conn.cursor()
+                cur.execute('DELETE FROM rate_limit_counters')
+                cleared = cur.rowcount
+                conn.commit()
+            finally:
+                conn.close()
+        return cleared
+
+    def clear(self, key: str) -> None:
+        with self._lock:
+            self._counters.pop(key, None)
+        conn = get_db_conn()
+        if conn is not None:
+            try:
+                cur = conn.cursor()
+                cur.execute('DELETE FROM rate_limit_counters WHERE key = %s', (key,))
+                conn.commit()
+            finally:
+                conn.close()
+
+
+class SharedMemoryStorage(Storage):
+    """Fixed-window counters in a SQLite file on tmpfs, shared by the workers of one machine."""
+
+    STORAGE_SCHEME = ['iqs+shm']
+
+    def __init__(self, uri: Optional[str] = None, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        path = urlparse(uri).path if uri else ''
+        self.path = path or LimiterConfig.SHM_PATH
+        self._local = threading.local()
+        self._hits = 0
+
+    @property
+    def base_exceptions(self):
+        return (sqlite3.Error,)
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread and process (connections must not cross a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS counters '
+                         '(key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT INTO counters (key, count, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET '
+                'count = CASE WHEN expires_at <= ? THEN excluded.count ELSE count + excluded.count END, '
+                'expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END',
+                (key, amount, now + expiry, now, now)
+            )
+            count = conn.execute('SELECT count FROM counters WHERE key = ?', (key,)).fetchone()[0]
+            self._hits += 1
+            if self._hits % 1000 == 0:
+                conn.execute('DELETE FROM counters WHERE expires_at <= ?', (now,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return count
+
+    def get(self, key: str) -> int:
+        row = self._conn().execute('SELECT count FROM counters WHERE key = ? AND expires_at > ?',
+                                   (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        row = self._conn().execute('SELECT expires_at FROM counters WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self) -> bool:
+        try:
+            self._conn().execute('SELECT 1')
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        return self._conn().execute('DELETE FROM counters').rowcount
+
+    def clear(self, key: str) -> None:
+        self._conn().execute('DELETE FROM counters WHERE key = ?', (key,))
@@ -0,0 +1,248 @@
+"""
+LLM Client for IQSTrade OpenAI calls
+Typed wrapper around openai.chat.completions that:
+- Requests JSON-schema structured output (strict mode) so replies parse first time.
+- Validates the reply against the schema and re-asks only for the malformed fields.
+- Keeps the old regex JSON extraction as a last resort.
+- Counts how often each fallback path is taken (see get_llm_stats()).
+"""
+
+import re
+import json
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from utils.services import get_openai_client
+from utils.timing import stage, add_count
+
+logger = logging.getLogger(__name__)
+
+_JSON_TYPES = {
+    'string': str,
+    'array': list,
+    'object': dict,
+    'boolean': bool,
+    'number': (int, float),
+    'integer': int,
+}
+
+
+def object_schema(properties: Dict[str, Dict]) -> Dict:
+    """Build a strict-mode object schema: every property required, no extra keys."""
+    return {
+        'type': 'object',
+        'properties': properties,
+        'required': list(properties.keys()),
+        'additionalProperties': False,
+    }
+
+
+def _matches_type(value, schema: Dict) -> bool:
+    expected = schema.get('type')
+    if expected is None:
+        return True
+    types = expected if isinstance(expected, list) else [expected]
+    for t in types:
+        if t == 'null' and value is None:
+            return True
+        py_type = _JSON_TYPES.get(t)
+        # bool is a subclass of int, don't let True pass as a number
+        if py_type and isinstance(value, py_type) and not (t in ('number', 'integer') and isinstance(value, bool)):
+            return True
+    return False
+
+
+def invalid_fields(data: Dict, schema: Dict) -> List[str]:
+    """Return the top-level fields of data that are missing or do not match the schema."""
+    bad = []
+    properties = schema.get('properties', {})
+    for field in schema.get('required', []):
+        if field not in data or not _matches_type(data[field], properties.get(field, {})):
+            bad.append(field)
+            continue
+        sub_schema = properties.get(field, {})
+        if sub_schema.get('type') == 'object' and invalid_fields(data[field], sub_schema):
+            bad.append(field)
+        elif sub_schema.get('type') == 'array' and 'items' in sub_schema:
+            if not all(_matches_type(item, sub_schema['items']) for item in data[field]):
+                bad.append(field)
+    return bad
+
+
+def default_for(schema: Dict):
+    """Empty value for a schema (used when a field still cannot be recovered)."""
+    t = schema.get('type')
+    if isinstance(t, list):
+        t = next((x for x in t if x != 'null'), None)
+    if t == 'object':
+        return {k: default_for(v) for k, v in schema.get('properties', {}).items()}
+    if t == 'array':
+        return []
+    if t in ('number', 'integer'):
+        return 0
+    if t == 'boolean':
+        return False
+    return ''
+
+
+def _parse_json(content: Optional[str]) -> Optional[Dict]:
+    if not content:
+        return None
+    try:
+        data = json.loads(content)
+        return data if isinstance(data, dict) else None
+    except Exception:
+        return None
+
+
+def _regex_json(content: Optional[str]) -> Optional[Dict]:
+    if not content:
+        return None
+    match = re.search(r'\{.*\}', content, re.DOTALL)
+    return _parse_json(match.group(0)) if match else None
+
+
+class LLMClient:
+    """
+    Structured-output client. One instance is shared by the whole process.
+    """
+
+    def __init__(self, model: str = "gpt-4o", max_repair_attempts: int = 1):
+        self.model = model
+        self.max_repair_attempts = max_repair_attempts
+        self._stats = Counter()
+        self._lock = threading.Lock()
+        # Set when the API rejects json_schema response_format (old model/SDK); we then use json_object
+        self._schema_supported = True
+
+    def record(self, event: str, count: int = 1):
+        with self._lock:
+            self._stats[event] += count
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _response_format(self, name: str, schema: Dict) -> Dict:
+        if self._schema_supported:
+            return {'type': 'json_schema', 'json_schema': {'name': name, 'schema': schema, 'strict': True}}
+        return {'type': 'json_object'}
+
+    def _create(self, name: str, schema: Dict, messages: List[Dict], **kwargs):
+        with stage('openai_call'):
+            response = self._create_raw(name, schema, messages, **kwargs)
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            add_count('openai_prompt_tokens', getattr(usage, 'prompt_tokens', 0) or 0)
+            add_count('openai_completion_tokens', getattr(usage, 'completion_tokens', 0) or 0)
+        return response
+
+    def _create_raw(self, name: str, schema: Dict, messages: List[Dict], **kwargs):
+        import openai
+        client = get_openai_client()
+        model = kwargs.pop('model', self.model)
+        self.record('api_calls')
+        add_count('openai_calls')
+        try:
+            return client.chat.completions.create(
+                model=model,
+                messages=messages,
+                response_format=self._response_format(name, schema),
+                **kwargs
+            )
+        except openai.BadRequestError as e:
+            if not self._schema_supported or 'response_format' not in str(e):
+                raise
+            logger.warning(f"[LLM Client] json_schema response_format rejected, using json_object: {e}")
+            self._schema_supported = False
+            self.record('schema_unsupported')
+            self.record('api_calls')
+            return client.chat.completions.create(
+                model=model,
+                messages=messages,
+                response_format=self._response_format(name, schema),
+                **kwargs
+            )
+
+    def complete_json(self, name: str, schema: Dict, messages: List[Dict], **kwargs) -> Optional[Dict]:
+        """
+        Ask for a JSON object matching schema.
+        Returns the validated dict (unrecoverable fields set to empty values),
+        or None if the reply contained no JSON at all.
+        """
+        self.record('requests')
+        response = self._create(name, schema, messages, **dict(kwargs))
+        message = response.choices[0].message
+        content = message.content
+
+        if getattr(message, 'refusal', None):
+            logger.warning(f"[LLM Client] {name}: model refused: {message.refusal}")
+            self.record('refusals')
+            return None
+
+        data = _parse_json(content)
+        if data is None:
+            data = _regex_json(content)
+            if data is None:
+                logger.error(f"[LLM Client] {name}: could not parse JSON from response: {content}")
+                self.record('parse_failures')
+                return None
+            self.record('regex_fallbacks')
+
+        bad = invalid_fields(data, schema)
+        attempts = 0
+        while bad and attempts < self.max_repair_attempts:
+            attempts += 1
+            self.record('repair_calls')
+            logger.info(f"[LLM Client] {name}: re-asking for malformed fields {bad}")
+            data.update(self._repair(name, schema, messages, content, bad, **dict(kwargs)))
+            bad = invalid_fields(data, schema)
+
+        if bad:
+            logger.warning(f"[LLM Client] {name}: fields still invalid after repair, using empty values: {bad}")
+            self.record('unrecovered_fields', len(bad))
+            properties = schema.get('properties', {})
+            for field in bad:
+                data[field] = default_for(properties.get(field, {}))
+        elif attempts == 0:
+            self.record('valid_first_try')
+
+        # Drop anything the schema does not know about
+        return {k: data[k] for k in schema.get('properties', {}) if k in data}
+
+    def _repair(self, name: str, schema: Dict, messages: List[Dict], previous: str,
+                fields: List[str], **kwargs) -> Dict:
+        """Ask only for the given fields, with a schema narrowed to them."""
+        properties = schema.get('properties', {})
+        sub_schema = object_schema({f: properties[f] for f in fields if f in properties})
+        repair_messages = list(messages) + [
+            {"role": "assistant", "content": previous or ""},
+            {"role": "user", "content": (
+                "The following fields in your reply were missing or had the wrong type: "
+                f"{', '.join(fields)}. Return a JSON object containing only these fields."
+            )},
+        ]
+        try:
+            response = self._create(f"{name}_repair", sub_schema, repair_messages, **kwargs)
+            content = response.choices[0].message.content
+            repaired = _parse_json(content) or _regex_json(content) or {}
+        except Exception as e:
+            logger.error(f"[LLM Client] {name}: repair call failed: {e}")
+            return {}
+        return {k: v for k, v in repaired.items() if k in fields}
+
+
+# Global instance for easy import
+llm_client = LLMClient()
+
+
+def get_llm_client() -> LLMClient:
+    """Get the global LLM client instance."""
+    return llm_client
+
+
+def get_llm_stats() -> Dict[str, int]:
+    """Counters for structured-output requests and every fallback path taken."""
+    return llm_client.stats()
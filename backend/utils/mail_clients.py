@@ -0,0 +1,46 @@
+"""
+Timed Mail Clients for IQSTrade
+smtplib/imaplib subclasses that report their network round trips to utils/timing:
+- TimedSMTP: connect, STARTTLS, login, send and quit recorded as stage 'smtp'
+- TimedIMAP4_SSL: connect and every IMAP command recorded as stage 'imap'
+Used wherever the app talks to a mail server, so SMTP/IMAP time shows up in Server-Timing and /metrics.
+"""
+
+import imaplib
+import smtplib
+
+from utils.timing import stage
+
+
+class TimedSMTP(smtplib.SMTP):
+    def connect(self, *args, **kwargs):
+        with stage('smtp'):
+            return super().connect(*args, **kwargs)
+
+    def starttls(self, *args, **kwargs):
+        with stage('smtp'):
+            return super().starttls(*args, **kwargs)
+
+    def login(self, *args, **kwargs):
+        with stage('smtp'):
+            return super().login(*args, **kwargs)
+
+    def sendmail(self, *args, **kwargs):
+        # send_message() goes through sendmail()
+        with stage('smtp'):
+            return super().sendmail(*args, **kwargs)
+
+    def quit(self):
+        with stage('smtp'):
+            return super().quit()
+
+
+class TimedIMAP4_SSL(imaplib.IMAP4_SSL):
+    def open(self, *args, **kwargs):
+        with stage('imap'):
+            return super().open(*args, **kwargs)
+
+    def _simple_command(self, name, *args):
+        # login, select, search, fetch, store, logout... all end up here
+        with stage('imap'):
+            return super()._simple_command(name, *args)
@@ -0,0 +1,362 @@
+"""
+Request Metrics for IQSTrade
+Per-request timing and a Prometheus /metrics endpoint:
+- Latency histogram per endpoint (url rule template, not the raw path), method and status
+- Database time and query count per request (utils/db_instrumentation.py)
+- Time spent in external calls (OpenAI, Vision, Cloudinary, SMTP, IMAP), in the rate limiter
+  (stages limiter and limiter_flush) and in response compression (compress) from utils/timing stages
+- Server-Timing header on every response, so the browser devtools show where the time went
+Each gunicorn worker keeps its own registry and writes it to METRICS_DIR/metrics_<pid>.json;
+/metrics merges the files of all workers, and folds files of workers that have exited into an
+archive so counters never go backwards. /metrics answers only scrapers presenting METRICS_TOKEN;
+without one configured it is closed.
+"""
+
+import os
+import hmac
+import json
+import time
+import atexit
+import logging
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from flask import Response, g, request
+
+from config import MetricsConfig
+from utils.timing import add_stage_observer, open_collector, close_collector
+
+try:
+    import fcntl
+except ImportError:  # Windows: archive folding is not locked
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+METRIC_HELP = {
+    'iqs_http_request_duration_seconds': ('histogram', 'Request latency by endpoint, method and status'),
+    'iqs_request_db_seconds': ('histogram', 'Time spent in database calls per request'),
+    'iqs_request_db_queries': ('histogram', 'Database statements per request'),
+    'iqs_stage_duration_seconds': ('histogram', 'Duration of timed stages (db, openai, vision, cloudinary, smtp, imap, ...)'),
+    'iqs_stage_errors_total': ('counter', 'Timed stages that raised'),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+def _format_bound(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class MetricsRegistry:
+    """Counters and histograms of this process. Thread-safe."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        # (name, labels) -> {'buckets': bucket bounds, 'counts': per-bucket counts, 'sum': s, 'count': n}
+        self.histograms: Dict[Tuple[str, Labels], Dict] = {}
+
+    def inc(self, name: str, labels: Dict[str, str], value: float = 1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, labels: Dict[str, str], value: float, buckets=LATENCY_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = {'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+                self.histograms[key] = hist
+            for i, bound in enumerate(hist['buckets']):
+                if value <= bound:
+                    hist['counts'][i] += 1
+                    break
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), dict(hist, counts=list(hist['counts']))]
+                               for (name, labels), hist in self.histograms.items()],
+            }
+
+
+registry = MetricsRegistry()
+
+
+# --- Multiprocess storage (one file per worker) ---
+
+def _metrics_dir() -> str:
+    os.makedirs(MetricsConfig.DIR, exist_ok=True)
+    return MetricsConfig.DIR
+
+
+def _write_json(path: str, data: Dict):
+    # Readers never see a half-written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_metrics_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def flush():
+    """Write this process's registry to its file."""
+    try:
+        path = os.path.join(_metrics_dir(), f'metrics_{os.getpid()}.json')
+        _write_json(path, registry.snapshot())
+    except Exception as e:
+        logger.warning(f"Could not write metrics file: {e}")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(into: Dict, snapshot: Dict):
+    for name, labels, value in snapshot.get('counters', []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        into['counters'][key] = into['counters'].get(key, 0) + value
+    for name, labels, hist in snapshot.get('histograms', []):
+        key = (name, tuple(tuple(pair) for pair in labels))
+        merged = into['histograms'].get(key)
+        if merged is None or merged['buckets'] != hist['buckets']:
+            # Bucket layout changed across a deploy: the newest layout wins
+            into['histograms'][key] = dict(hist, counts=list(hist['counts']))
+            continue
+        merged['counts'] = [a + b for a, b in zip(merged['counts'], hist['counts'])]
+        merged['sum'] += hist['sum']
+        merged['count'] += hist['count']
+
+
+def _to_snapshot(merged: Dict) -> Dict:
+    return {
+        'counters': [[name, list(labels), value] for (name, labels), value in merged['counters'].items()],
+        'histograms': [[name, list(labels), hist] for (name, labels), hist in merged['histograms'].items()],
+    }
+
+
+def _read_json(path: str) -> Dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _fold_dead_workers(directory: str, dead: List[str]):
+    """Add the files of exited workers to archive.json and remove them."""
+    lock_file = open(os.path.join(directory, 'archive.lock'), 'a')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        archive_path = os.path.join(directory, 'archive.json')
+        archive = {'counters': {}, 'histograms': {}}
+        _merge(archive, _read_json(archive_path))
+        folded = []
+        for path in dead:
+            if os.path.exists(path):  # another worker may have folded it already
+                _merge(archive, _read_json(path))
+                folded.append(path)
+        if folded:
+            _write_json(archive_path, _to_snapshot(archive))
+            for path in folded:
+                os.unlink(path)
+    finally:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+def collect_all() -> Dict:
+    """Merged counters/histograms of every worker, live or exited."""
+    flush()
+    directory = _metrics_dir()
+    live, dead = [], []
+    for filename in os.listdir(directory):
+        if not (filename.startswith('metrics_') and filename.endswith('.json')):
+            continue
+        try:
+            pid = int(filename[len('metrics_'):-len('.json')])
+        except ValueError:
+            continue
+        (live if _pid_alive(pid) else dead).append(os.path.join(directory, filename))
+    if dead:
+        try:
+            _fold_dead_workers(directory, dead)
+        except Exception as e:
+            logger.warning(f"Could not fold metrics of exited workers: {e}")
+    merged = {'counters': {}, 'histograms': {}}
+    for path in live + [os.path.join(directory, 'archive.json')]:
+        _merge(merged, _read_json(path))
+    return merged
+
+
+def render_prometheus(merged: Dict) -> str:
+    by_name: Dict[str, List[str]] = {}
+    for (name, labels), value in sorted(merged['counters'].items()):
+        by_name.setdefault(name, []).append(f'{name}{_format_labels(labels)} {value}')
+    for (name, labels), hist in sorted(merged['histograms'].items()):
+        lines = by_name.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(hist['buckets'], hist['counts']):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labels, ("le", _format_bound(bound)))} {cumulative}')
+        lines.append(f'{name}_bucket{_format_labels(labels, ("le", "+Inf"))} {hist["count"]}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {hist["sum"]}')
+        lines.append(f'{name}_count{_format_labels(labels)} {hist["count"]}')
+    out = []
+    for name in sorted(by_name):
+        kind, help_text = METRIC_HELP.get(name, ('untyped', name))
+        out.append(f'# HELP {name} {help_text}')
+        out.append(f'# TYPE {name} {kind}')
+        out.extend(by_name[name])
+    return '\n'.join(out) + '\n'
+
+
+# --- Background flushing ---
+
+class _Flusher:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def ensure_started(self):
+        # Threads do not survive fork, so every worker starts its own
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(MetricsConfig.FLUSH_INTERVAL)
+            flush()
+
+
+_flusher = _Flusher()
+
+
+def _reset_in_child():
+    # A forked worker starts from zero; the master's numbers stay in the master's file
+    global registry
+    registry = MetricsRegistry()
+    _flusher.lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_child)
+
+
+# --- Flask integration ---
+
+def _observe_stage(name: str, seconds: float, failed: bool):
+    registry.observe('iqs_stage_duration_seconds', {'stage': name}, seconds)
+    if failed:
+        registry.inc('iqs_stage_errors_total', {'stage': name})
+
+
+def _server_timing(summary: Dict, total: float) -> str:
+    parts = []
+    counts = summary['counts']
+    for name, values in summary['stages'].items():
+        entry = f'{name};dur={sum(values) * 1000:.1f}'
+        if name == 'db':
+            entry = f'db;desc="{int(counts.get("db_queries", 0))} queries";dur={sum(values) * 1000:.1f}'
+        parts.append(entry)
+    parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def metrics_view():
+    # Closed unless a scrape token is configured
+    if not MetricsConfig.TOKEN:
+        return Response('metrics disabled: METRICS_TOKEN is not set\n', status=403, mimetype='text/plain')
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {MetricsConfig.TOKEN}'):
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    body = render_prometheus(collect_all())
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_metrics(app):
+    """Install the timing hooks and the /metrics route. Call before other before_request hooks."""
+    if not MetricsConfig.ENABLED:
+        return
+    from limiter_instance import limiter
+
+    add_stage_observer(_observe_stage)
+    atexit.register(flush)
+
+    @app.before_request
+    def _start_request_timing():
+        if request.endpoint == 'metrics':
+            return
+        _flusher.ensure_started()
+        g._metrics_start = time.perf_counter()
+        g._metrics_collector, g._metrics_token = open_collector()
+
+    @app.after_request
+    def _record_request_timing(response):
+        start = g.pop('_metrics_start', None)
+        collector = g.get('_metrics_collector')
+        if start is None or collector is None:
+            return response
+        total = time.perf_counter() - start
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        summary = collector.summary()
+        db_seconds = sum(summary['stages'].get('db', []))
+        db_queries = summary['counts'].get('db_queries', 0)
+        registry.observe('iqs_http_request_duration_seconds',
+                         {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)}, total)
+        registry.observe('iqs_request_db_seconds', {'endpoint': endpoint}, db_seconds)
+        registry.observe('iqs_request_db_queries', {'endpoint': endpoint}, db_queries, buckets=QUERY_BUCKETS)
+        if MetricsConfig.SERVER_TIMING:
+            response.headers['Server-Timing'] = _server_timing(summary, total)
+        return response
+
+    @app.teardown_request
+    def _close_request_timing(exc):
+        token = g.pop('_metrics_token', None)
+        g.pop('_metrics_collector', None)
+        if token is not None:
+            try:
+                close_collector(token)
+            except ValueError:
+                pass  # token created in a different context
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view, methods=['GET'])
+    limiter.exempt(metrics_view)
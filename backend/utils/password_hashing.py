@@ -0,0 +1,201 @@
+"""
+Password Hashing for IQSTrade
+Password hashes are slow on purpose, so they run on a small dedicated pool instead of inline:
+- At most PASSWORD_HASH_WORKERS hashes run at once and PASSWORD_HASH_QUEUE more may wait; beyond
+  that (or after PASSWORD_HASH_TIMEOUT) callers get HashingOverloaded and the route answers 503
+  immediately, instead of every gunicorn thread sitting in a hash while other endpoints wait
+- Identical concurrent attempts (same username, password and stored hash) share one computation
+- Stored hashes are werkzeug (pbkdf2/scrypt) or bcrypt; both verify. After a successful login a
+  hash that is not bcrypt at PASSWORD_BCRYPT_ROUNDS is replaced in the background, so all users
+  converge on one scheme and cost
+"""
+
+import os
+import hmac
+import hashlib
+import logging
+import secrets
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Optional, Tuple
+
+import bcrypt
+from werkzeug.security import check_password_hash
+
+from config import PasswordHashingConfig, get_db_conn
+from utils.timing import in_current_context, stage
+
+logger = logging.getLogger(__name__)
+
+# Seconds clients are told to wait after a 503
+RETRY_AFTER_SECONDS = 2
+
+
+class HashingOverloaded(Exception):
+    """The hashing pool is full or too slow; answer 503 rather than queue further."""
+
+
+def hash_password(password: str, rounds: Optional[int] = None) -> str:
+    """bcrypt hash at the configured cost (runs on the calling thread)."""
+    salt = bcrypt.gensalt(rounds or PasswordHashingConfig.BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+def _is_bcrypt(stored_hash: str) -> bool:
+    return stored_hash.startswith(('$2a$', '$2b$', '$2y$'))
+
+
+def check_password(stored_hash: Optional[str], password: Optional[str]) -> bool:
+    """Verify against a bcrypt or werkzeug hash (runs on the calling thread)."""
+    if not stored_hash or password is None:
+        return False
+    if _is_bcrypt(stored_hash):
+        try:
+            return bcrypt.checkpw(password.encode('utf-8'), stored_hash.encode('utf-8'))
+        except ValueError:
+            return False
+    return check_password_hash(stored_hash, password)
+
+
+def needs_rehash(stored_hash: str) -> bool:
+    if not _is_bcrypt(stored_hash):
+        return True
+    try:
+        return int(stored_hash.split('$')[2]) != PasswordHashingConfig.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+def _make_executor(workers: int):
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            # gevent profile (gunicorn.conf.py): patched threads are greenlets and a hash would stall the
+            # hub, so use gevent's pool of real OS threads
+            from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+            return NativeThreadPoolExecutor(max_workers=workers)
+    except ImportError:
+        pass
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, queue_size: int, timeout: float):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._init_process_state()
+
+    def _init_process_state(self):
+        self._executor = _make_executor(self.workers)
+        # Running + waiting jobs
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        # Reentrant: a future that is already done runs its _forget callback inside verify()
+        self._lock = threading.RLock()
+        self._inflight: Dict[Tuple[str, str, str], Future] = {}
+        # Keyed digests of in-flight passwords, so plain passwords are never used as dict keys
+        self._key_secret = secrets.token_bytes(32)
+        self.shed = 0
+
+    def _submit(self, fn, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            self.shed += 1
+            raise HashingOverloaded()
+        try:
+            future = self._executor.submit(in_current_context(fn, *args))
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _wait(self, future: Future):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self.shed += 1
+            raise HashingOverloaded()
+
+    def verify(self, username: str, password: str, stored_hash: str) -> bool:
+        """check_password on the pool; concurrent identical attempts share one computation."""
+        digest = hmac.new(self._key_secret, (password or '').encode('utf-8'), hashlib.sha256).hexdigest()
+        key = (username or '', digest, stored_hash or '')
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._submit(self._timed_check, stored_hash, password)
+                self._inflight[key] = future
+                future.add_done_callback(lambda _: self._forget(key))
+        return self._wait(future)
+
+    def _forget(self, key):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    @staticmethod
+    def _timed_check(stored_hash: str, password: str) -> bool:
+        with stage('password_hash'):
+            return check_password(stored_hash, password)
+
+    def hash(self, password: str) -> str:
+        """hash_password on the pool."""
+        return self._wait(self._submit(self._timed_hash, password))
+
+    @staticmethod
+    def _timed_hash(password: str) -> str:
+        with stage('password_hash'):
+            return hash_password(password)
+
+    def rehash_later(self, user_id: int, password: str, stored_hash: str):
+        """Upgrade an outdated hash in the background; skipped (until the next login) when the pool is busy."""
+        if not needs_rehash(stored_hash):
+            return
+        try:
+            self._submit(_rehash, user_id, password, stored_hash)
+        except HashingOverloaded:
+            pass
+
+
+def _rehash(user_id: int, password: str, old_hash: str):
+    new_hash = hash_password(password)
+    conn = get_db_conn()
+    if conn is None:
+        return
+    try:
+        cur = conn.cursor()
+        # Only if nobody changed the password meanwhile
+        cur.execute("UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+                    (new_hash, user_id, old_hash))
+        conn.commit()
+        cur.close()
+        logger.info(f"Upgraded password hash for user {user_id}")
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"Could not upgrade password hash for user {user_id}: {e}")
+    finally:
+        conn.close()
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_password_hasher() -> PasswordHasher:
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = PasswordHasher(PasswordHashingConfig.WORKERS, PasswordHashingConfig.QUEUE_SIZE,
+                                         PasswordHashingConfig.TIMEOUT)
+    return _hasher
+
+
+def _reset_in_child():
+    # Executor threads do not survive a fork
+    global _hasher, _hasher_lock
+    _hasher = None
+    _hasher_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_child)
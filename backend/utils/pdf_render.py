@@ -0,0 +1,137 @@
+"""
+PDF Rendering for the OpenAI Vision fallback
+Turns a PDF into a single image payload with controllable cost/quality:
+- DPI and colour mode (grayscale, JPEG quality or PNG)
+- Cropping to the detected content (drops blank margins)
+- Heuristic page selection (first page plus the pages that look like they carry fields)
+- Tiling of several pages into one image (one page by default, each page capped at MAX_DIMENSION)
+Every render returns payload stats so the benchmark harness can compare settings.
+"""
+
+import io
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from config import RenderConfig
+from utils.prompt_builder import DOCUMENT_LABELS
+from utils.timing import stage, add_count
+
+logger = logging.getLogger(__name__)
+
+# Pixels lighter than this count as background when cropping
+_BACKGROUND_THRESHOLD = 235
+_CROP_MARGIN = 12
+
+
+class RenderSettings:
+    """Rendering knobs; defaults come from RenderConfig, any can be overridden per call."""
+
+    def __init__(self, dpi: int = None, grayscale: bool = None, image_format: str = None,
+                 jpeg_quality: int = None, crop: bool = None, max_pages: int = None,
+                 max_dimension: int = None):
+        self.dpi = dpi or RenderConfig.DPI
+        self.grayscale = RenderConfig.GRAYSCALE if grayscale is None else grayscale
+        self.image_format = (image_format or RenderConfig.IMAGE_FORMAT).lower()
+        self.jpeg_quality = jpeg_quality or RenderConfig.JPEG_QUALITY
+        self.crop = RenderConfig.CROP_TO_CONTENT if crop is None else crop
+        self.max_pages = max_pages or RenderConfig.MAX_PAGES
+        self.max_dimension = max_dimension or RenderConfig.MAX_DIMENSION
+
+    def as_dict(self) -> Dict:
+        return dict(self.__dict__)
+
+
+def select_pages(pdf, max_pages: int) -> List[int]:
+    """
+    Always page 1; then the pages whose text layer mentions the most field labels.
+    Pages without a text layer (scans) are ranked by position, so early pages win.
+    """
+    if len(pdf) == 0:
+        return []
+    scores = []
+    for idx in range(1, len(pdf)):
+        text = pdf[idx].get_text().lower()
+        hits = sum(1 for label in DOCUMENT_LABELS if label in text)
+        scores.append((hits, -idx))
+    scores.sort(reverse=True)
+    chosen = [0] + [-neg_idx for _, neg_idx in scores[:max(0, max_pages - 1)]]
+    return sorted(chosen)
+
+
+def _content_bbox(img: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box of non-background pixels, with a small margin."""
+    gray = img.convert('L')
+    mask = gray.point(lambda p: 255 if p < _BACKGROUND_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return None
+    left, top, right, bottom = bbox
+    return (max(0, left - _CROP_MARGIN), max(0, top - _CROP_MARGIN),
+            min(img.width, right + _CROP_MARGIN), min(img.height, bottom + _CROP_MARGIN))
+
+
+def render_page(page, settings: RenderSettings) -> Image.Image:
+    colorspace = fitz.csGRAY if settings.grayscale else fitz.csRGB
+    pix = page.get_pixmap(dpi=settings.dpi, colorspace=colorspace, alpha=False)
+    mode = 'L' if settings.grayscale else 'RGB'
+    img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+    if settings.crop:
+        bbox = _content_bbox(img)
+        if bbox:
+            img = img.crop(bbox)
+    return img
+
+
+def tile_images(images: List[Image.Image]) -> Image.Image:
+    """Stack pages vertically on a white background."""
+    if len(images) == 1:
+        return images[0]
+    width = max(img.width for img in images)
+    height = sum(img.height for img in images)
+    mode = 'L' if all(img.mode == 'L' for img in images) else 'RGB'
+    tiled = Image.new(mode, (width, height), 255 if mode == 'L' else (255, 255, 255))
+    y = 0
+    for img in images:
+        tiled.paste(img.convert(mode), (0, y))
+        y += img.height
+    return tiled
+
+
+def encode_image(img: Image.Image, settings: RenderSettings) -> Tuple[bytes, str]:
+    out = io.BytesIO()
+    if settings.image_format == 'png':
+        img.save(out, format='PNG', optimize=True)
+        return out.getvalue(), 'image/png'
+    img.save(out, format='JPEG', quality=settings.jpeg_quality, optimize=True)
+    return out.getvalue(), 'image/jpeg'
+
+
+def render_for_vision(pdf, settings: RenderSettings = None) -> Tuple[bytes, str, Dict]:
+    """
+    Render the selected pages of an open PyMuPDF document into one image.
+    Returns (image_bytes, mime_type, stats).
+    """
+    settings = settings or RenderSettings()
+    with stage('rasterize'):
+        pages = select_pages(pdf, settings.max_pages)
+        images = [render_page(pdf[idx], settings) for idx in pages]
+        # Cap each page rather than the sheet, so a second page does not halve the first one's resolution
+        for page_img in images:
+            if max(page_img.size) > settings.max_dimension:
+                page_img.thumbnail((settings.max_dimension, settings.max_dimension), Image.LANCZOS)
+        img = tile_images(images)
+        content, mime_type = encode_image(img, settings)
+    add_count('openai_image_bytes', len(content))
+    stats = {
+        'pages': [idx + 1 for idx in pages],
+        'width': img.width,
+        'height': img.height,
+        'bytes': len(content),
+        'mime_type': mime_type,
+        'settings': settings.as_dict(),
+    }
+    logger.info(f"[PDF Render] Vision payload: pages {stats['pages']}, {img.width}x{img.height}, {len(content)} bytes")
+    return content, mime_type, stats
@@ -0,0 +1,222 @@
+"""
+Prompt Builder for IQSTrade OpenAI calls
+Keeps prompts small by only sending the context a request actually needs:
+- Canned responses are loaded and indexed once (BM25), reloaded when the file changes,
+  and only the top-k relevant entries are inlined into the email prompt.
+- PDF text is reduced to the first page plus labelled blocks under a token budget.
+"""
+
+import os
+import re
+import json
+import math
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from config import PromptConfig
+
+logger = logging.getLogger(__name__)
+
+NO_CANNED_RESPONSES = "No canned responses available."
+
+# Labels that mark the blocks our field extraction cares about (see extract_fields.py)
+DOCUMENT_LABELS = [
+    'shipper', 'exporter', 'consignee', 'consigned to', 'notify party',
+    'port of loading', 'port of discharge', 'port of export', 'place of receipt',
+    'place of delivery', 'foreign port of unloading', 'vessel', 'voyage', 'exporting carrier',
+    'b/l no', 'bl no', 'bill of lading', 'waybill no', 'document no', 'container',
+    'description of goods', 'description of commodities', 'nature and quantity',
+    'airport of departure', 'airport of destination', 'requested flight', 'flight',
+    'amount', 'total', 'paid', 'usd',
+]
+
+_STOPWORDS = {
+    'a', 'an', 'the', 'and', 'or', 'of', 'to', 'in', 'on', 'for', 'is', 'are', 'was', 'be',
+    'i', 'you', 'we', 'my', 'your', 'our', 'it', 'this', 'that', 'with', 'can', 'do', 'does',
+    'please', 'dear', 'hi', 'hello', 'thank', 'thanks', 'regards', 'customer',
+}
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens plus CJK bigrams (Chinese emails have no spaces)."""
+    if not text:
+        return []
+    text = text.lower()
+    tokens = [t for t in _WORD_RE.findall(text) if t not in _STOPWORDS]
+    for run in _CJK_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: ~4 ASCII chars per token, one token per non-ASCII char."""
+    if not text:
+        return 0
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return int(math.ceil((len(text) - non_ascii) / 4.0)) + non_ascii
+
+
+class CannedResponseIndex:
+    """
+    BM25 index over canned_responses.json.
+    The file is read once and re-read only when its mtime changes.
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._entries: List[Dict] = []
+        self._doc_tokens: List[Counter] = []
+        self._doc_lengths: List[int] = []
+        self._idf: Dict[str, float] = {}
+        self._avg_length = 0.0
+
+    def _build(self, entries: List[Dict]):
+        doc_tokens = []
+        for entry in entries:
+            # Titles are the question being answered, so weight them twice
+            title_tokens = tokenize(entry.get('title', ''))
+            doc_tokens.append(Counter(title_tokens * 2 + tokenize(entry.get('body', ''))))
+        doc_lengths = [sum(c.values()) for c in doc_tokens]
+        n_docs = len(entries)
+        doc_freq = Counter()
+        for counts in doc_tokens:
+            doc_freq.update(counts.keys())
+        self._entries = entries
+        self._doc_tokens = doc_tokens
+        self._doc_lengths = doc_lengths
+        self._avg_length = (sum(doc_lengths) / n_docs) if n_docs else 0.0
+        self._idf = {
+            term: math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for term, df in doc_freq.items()
+        }
+
+    def _ensure_loaded(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            if self._mtime is None:
+                logger.error(f"[Prompt Builder] Could not stat {self.path}: {e}")
+            return
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    entries = json.load(f)
+                self._build([e for e in entries if isinstance(e, dict)])
+                self._mtime = mtime
+                logger.info(f"[Prompt Builder] Indexed {len(self._entries)} canned responses from {self.path}")
+            except Exception as e:
+                logger.error(f"[Prompt Builder] Could not load {self.path}: {e}")
+
+    def entries(self) -> List[Dict]:
+        self._ensure_loaded()
+        return list(self._entries)
+
+    def top_k(self, query: str, k: Optional[int] = None) -> List[Dict]:
+        """Return up to k canned responses ranked by BM25 score (only entries that score > 0)."""
+        self._ensure_loaded()
+        k = PromptConfig.CANNED_RESPONSES_TOP_K if k is None else k
+        query_terms = set(tokenize(query))
+        if not query_terms or not self._entries:
+            return []
+        scored = []
+        for idx, counts in enumerate(self._doc_tokens):
+            length_norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[idx] / (self._avg_length or 1))
+            score = 0.0
+            for term in query_terms:
+                tf = counts.get(term)
+                if tf:
+                    score += self._idf[term] * tf * (self.k1 + 1) / (tf + length_norm)
+            if score > 0:
+                scored.append((score, idx))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [self._entries[idx] for _, idx in scored[:k]]
+
+
+def build_canned_responses_context(query: str, k: Optional[int] = None) -> str:
+    """Format the top-k canned responses for the email prompt."""
+    matches = canned_response_index.top_k(query, k)
+    if not matches:
+        return NO_CANNED_RESPONSES
+    return "\n\n".join(f"Q: {r.get('title', '')}\nA: {r.get('body', '')}" for r in matches)
+
+
+def _labelled_blocks(page_text: str, context_lines: int = 4) -> List[str]:
+    """Return each labelled line together with the lines that follow it (where the value usually sits)."""
+    lines = [line.strip() for line in page_text.splitlines() if line.strip()]
+    blocks = []
+    i = 0
+    while i < len(lines):
+        lower = lines[i].lower()
+        if any(label in lower for label in DOCUMENT_LABELS):
+            end = min(i + 1 + context_lines, len(lines))
+            blocks.append("\n".join(lines[i:end]))
+            i = end
+        else:
+            i += 1
+    return blocks
+
+
+def _truncate_to_budget(text: str, budget: int) -> str:
+    if estimate_tokens(text) <= budget:
+        return text
+    lines = []
+    used = 0
+    for line in text.splitlines():
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(lines)
+
+
+def select_pdf_sections(pages: List[str], token_budget: Optional[int] = None) -> str:
+    """
+    Reduce the text of a (possibly long) PDF to what field extraction needs:
+    the whole first page, then labelled blocks from later pages, until the token budget is used.
+    """
+    budget = PromptConfig.PDF_PROMPT_TOKEN_BUDGET if token_budget is None else token_budget
+    pages = [p for p in pages if p and p.strip()]
+    if not pages:
+        return ""
+
+    first_page = _truncate_to_budget(pages[0].strip(), budget)
+    sections = [f"--- Page 1 ---\n{first_page}"]
+    used = estimate_tokens(sections[0])
+
+    seen = set()
+    for page_no, page_text in enumerate(pages[1:], start=2):
+        page_header_added = False
+        for block in _labelled_blocks(page_text):
+            if block in seen:
+                continue
+            piece = block if page_header_added else f"--- Page {page_no} ---\n{block}"
+            cost = estimate_tokens(piece)
+            if used + cost > budget:
+                logger.info(f"[Prompt Builder] Token budget {budget} reached at page {page_no}")
+                return "\n\n".join(sections)
+            seen.add(block)
+            sections.append(piece)
+            page_header_added = True
+            used += cost
+    return "\n\n".join(sections)
+
+
+# Global instance for easy import
+canned_response_index = CannedResponseIndex(PromptConfig.CANNED_RESPONSES_PATH)
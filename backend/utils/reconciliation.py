@@ -0,0 +1,300 @@
+"""
+Payment Reconciliation for IQSTrade
+Allocates one incoming payment to the open receivables it most likely pays:
+- ReceivablesIndex holds every open receivable, grouped by bill and by customer, loaded with one
+  query per run (a bank statement import, an inbox pass, a webhook call). An unpaid bill is owed in
+  full or, when its payment_method is Allinpay or the payment announces a deposit, as an Allinpay
+  deposit (DEPOSIT_RATE of the total); a bill with an unsettled reserve owes its final instalment
+  (reserve_amount)
+- reconcile() looks for combinations of receivables whose sum is within TOLERANCE of the payment:
+  first among the referenced bills only, then among the customer's other open bills. The search is
+  meet-in-the-middle: each half of the candidate bills enumerates its subset sums (a bill counts at
+  most once, as one of its receivables), and the halves are joined by binary search on the sorted sums
+- Each solution becomes a proposal with a confidence score: amount difference, receivables the payment
+  did not reference, referenced bills it leaves out, partial instalments and a close runner-up all
+  lower it. Proposals at AUTO_APPLY_CONFIDENCE are applied by the callers (bank statement import,
+  payment receipt emails, the Allinpay webhook), each limited to the kinds it may apply unreviewed;
+  the rest are reported for review
+- apply_allocations() writes an accepted proposal with one UPDATE per receivable kind
+Amounts are handled in cents.
+"""
+
+import logging
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import ReconciliationConfig
+from utils.security import decrypt_sensitive_data
+
+logger = logging.getLogger(__name__)
+
+FULL, DEPOSIT, FINAL = 'full', 'deposit_85', 'final_15'
+
+# Open receivables: not paid yet, or paid 85% with the reserve still outstanding
+OPEN_RECEIVABLE_SQL = ("(b.status NOT IN ('Paid', 'Paid and CTN Valid') "
+                       "OR LOWER(TRIM(COALESCE(b.reserve_status, ''))) = 'unsettled')")
+
+LOAD_SQL = f"""
+    SELECT b.id, b.bl_number, COALESCE(NULLIF(TRIM(b.customer_username), ''), b.customer_name),
+           b.customer_email, b.ctn_fee, b.service_fee, b.reserve_amount, b.status,
+           LOWER(TRIM(COALESCE(b.payment_method, ''))) = 'allinpay'
+    FROM bill_of_lading b
+    WHERE {OPEN_RECEIVABLE_SQL}
+"""
+
+# Proposals kept per search before scoring
+MAX_SOLUTIONS = 200
+
+# Confidence deductions
+AMOUNT_DIFFERENCE_COST = 0.15   # at a difference of the full TOLERANCE, proportionally below
+UNREFERENCED_BILL_COST = 0.2    # per allocated bill the payment did not mention
+MISSED_REFERENCE_COST = 0.1     # per mentioned bill left out
+PARTIAL_COST = 0.05             # per deposit/final instalment the payment did not announce
+WRONG_PHASE_COST = 0.2          # per instalment contradicting the announced phase
+EXTRA_ITEM_COST = 0.02          # per receivable beyond the first
+NO_REFERENCE_COST = 0.1         # payment matched on its customer alone
+AMBIGUITY_COST = 0.15           # a different allocation scores nearly as well
+AMBIGUITY_MARGIN = 0.05
+
+# payment phase hint -> the receivable kind it announces
+PHASE_KINDS = {'initial': DEPOSIT, 'deposit': DEPOSIT, 'final': FINAL, 'full': FULL}
+
+
+def cents(value) -> int:
+    return int(round(float(value or 0) * 100))
+
+
+def _receivables(row) -> List[Dict]:
+    bill_id, bl_number, customer, customer_email, ctn_fee, service_fee, reserve_amount, status, allinpay = row
+    total = cents(ctn_fee) + cents(service_fee)
+    base = {'bill_id': bill_id, 'bl_number': bl_number, 'customer': (customer or '').strip().lower(),
+            'customer_email': customer_email}
+    if status in ('Paid', 'Paid and CTN Valid'):
+        remaining = cents(reserve_amount) if reserve_amount is not None else \
+            total - int(round(total * ReconciliationConfig.DEPOSIT_RATE))
+        return [dict(base, kind=FINAL, amount=remaining)] if remaining > 0 else []
+    if total <= 0:
+        return []
+    return [dict(base, kind=FULL, amount=total),
+            dict(base, kind=DEPOSIT, amount=int(round(total * ReconciliationConfig.DEPOSIT_RATE)),
+                 allinpay=bool(allinpay))]
+
+
+class ReceivablesIndex:
+    """Open receivables by bill and by customer, for the length of one run."""
+
+    def __init__(self, receivables: Iterable[Dict]):
+        self.by_bill: Dict[int, List[Dict]] = {}
+        self.by_customer: Dict[str, List[int]] = {}
+        self._by_email: Optional[Dict[str, List[int]]] = None
+        for receivable in receivables:
+            bill_id = receivable['bill_id']
+            if bill_id not in self.by_bill:
+                self.by_bill[bill_id] = []
+                if receivable['customer']:
+                    self.by_customer.setdefault(receivable['customer'], []).append(bill_id)
+            self.by_bill[bill_id].append(receivable)
+
+    @classmethod
+    def load(cls, cur, where: str = '', params: Sequence = ()) -> 'ReceivablesIndex':
+        """One query; where narrows it (bill_of_lading aliased as b), e.g. to one customer."""
+        cur.execute(LOAD_SQL + (f" AND ({where})" if where else ''), tuple(params))
+        rows = cur.fetchall()
+        index = cls(receivable for row in rows for receivable in _receivables(row))
+        logger.debug(f"Receivables index: {len(index.by_bill)} open bills, {len(index.by_customer)} customers")
+        return index
+
+    def customer_of(self, bill_id: int) -> Optional[str]:
+        receivables = self.by_bill.get(bill_id)
+        return receivables[0]['customer'] if receivables else None
+
+    def bills_for_email(self, email_address: str) -> List[int]:
+        """Open bills whose customer_email is this address (decrypted once per index, on first use)."""
+        if self._by_email is None:
+            self._by_email = {}
+            for bill_id, receivables in self.by_bill.items():
+                address = decrypt_sensitive_data(receivables[0]['customer_email'])
+                if address:
+                    self._by_email.setdefault(address.strip().lower(), []).append(bill_id)
+        return [bill_id for bill_id in self._by_email.get((email_address or '').strip().lower(), ())
+                if bill_id in self.by_bill]
+
+    def settle(self, bill_ids: Iterable[int]):
+        """Take allocated bills out, so later payments in the same run cannot claim them again."""
+        for bill_id in bill_ids:
+            self.by_bill.pop(bill_id, None)
+
+
+def _subset_sums(groups: List[List[Dict]], max_items: int) -> List[Tuple[int, Tuple[Dict, ...]]]:
+    """Every (sum, receivables) taking at most one receivable per group and at most max_items in all."""
+    sums = [(0, ())]
+    for group in groups:
+        sums += [(total + receivable['amount'], items + (receivable,))
+                 for total, items in sums if len(items) < max_items
+                 for receivable in group]
+    return sums
+
+
+def find_allocations(groups: List[List[Dict]], target: int, tolerance: int,
+                     max_items: int) -> List[Tuple[Dict, ...]]:
+    """Meet-in-the-middle subset sum: combinations of at most one receivable per group within tolerance of target."""
+    middle = len(groups) // 2
+    left = _subset_sums(groups[:middle], max_items)
+    right = sorted(_subset_sums(groups[middle:], max_items), key=lambda entry: entry[0])
+    right_sums = [total for total, _ in right]
+    solutions = []
+    for left_total, left_items in left:
+        low = bisect_left(right_sums, target - tolerance - left_total)
+        high = bisect_right(right_sums, target + tolerance - left_total)
+        for _, right_items in right[low:high]:
+            items = left_items + right_items
+            if items and len(items) <= max_items:
+                solutions.append(items)
+                if len(solutions) >= MAX_SOLUTIONS:
+                    return solutions
+    return solutions
+
+
+def _proposal(items: Tuple[Dict, ...], target: int, tolerance: int, referenced: List[int],
+              phase_kind: Optional[str]) -> Dict:
+    total = sum(receivable['amount'] for receivable in items)
+    bill_ids = [receivable['bill_id'] for receivable in items]
+    confidence = 1.0 - AMOUNT_DIFFERENCE_COST * abs(total - target) / max(tolerance, 1)
+    confidence -= UNREFERENCED_BILL_COST * sum(1 for bill_id in bill_ids if bill_id not in referenced)
+    confidence -= MISSED_REFERENCE_COST * sum(1 for bill_id in referenced if bill_id not in bill_ids)
+    confidence -= EXTRA_ITEM_COST * (len(items) - 1)
+    if not referenced:
+        confidence -= NO_REFERENCE_COST
+    for receivable in items:
+        if phase_kind and receivable['kind'] != phase_kind:
+            confidence -= WRONG_PHASE_COST
+        elif not phase_kind and receivable['kind'] != FULL:
+            confidence -= PARTIAL_COST
+    return {
+        'allocations': [{'bill_id': receivable['bill_id'], 'bl_number': receivable['bl_number'],
+                         'kind': receivable['kind'], 'amount': receivable['amount'] / 100} for receivable in items],
+        'bill_ids': bill_ids,
+        'total': total / 100,
+        'difference': (target - total) / 100,
+        'confidence': confidence,
+    }
+
+
+def _search(index: ReceivablesIndex, bill_ids: List[int], target: int, tolerance: int,
+            referenced: List[int], phase_kind: Optional[str], deposits: bool) -> List[Dict]:
+    # A deposit is only owed on an Allinpay bill, unless the payment itself says it is one
+    groups = [[receivable for receivable in index.by_bill[bill_id]
+               if receivable['kind'] != DEPOSIT or receivable['allinpay'] or deposits]
+              for bill_id in bill_ids]
+    solutions = find_allocations(groups, target, tolerance, ReconciliationConfig.MAX_ITEMS)
+    proposals = [_proposal(items, target, tolerance, referenced, phase_kind) for items in solutions]
+    proposals.sort(key=lambda proposal: (-proposal['confidence'], len(proposal['bill_ids'])))
+    if len(proposals) > 1 and set(proposals[1]['bill_ids']) != set(proposals[0]['bill_ids']) and \
+            proposals[0]['confidence'] - proposals[1]['confidence'] < AMBIGUITY_MARGIN:
+        for proposal in proposals:
+            if proposals[0]['confidence'] - proposal['confidence'] < AMBIGUITY_MARGIN:
+                proposal['confidence'] -= AMBIGUITY_COST
+                proposal['ambiguous'] = True
+        proposals.sort(key=lambda proposal: (-proposal['confidence'], len(proposal['bill_ids'])))
+    for proposal in proposals:
+        proposal['confidence'] = round(min(max(proposal['confidence'], 0.0), 1.0), 3)
+    return proposals
+
+
+def reconcile(index: ReceivablesIndex, amount, bill_ids: Iterable[int] = (), customers: Iterable[str] = (),
+              emails: Iterable[str] = (), phase: Optional[str] = None, allinpay: bool = False,
+              limit: int = 3) -> List[Dict]:
+    """
+    Proposed allocations of a payment, best first (at most limit).
+    bill_ids are the bills the payment refers to (resolved BL / container references); customers
+    (username or name) and emails widen the search to those customers' open bills. phase is the
+    payment's own claim ('initial', 'final'), when it makes one. allinpay marks a payment made
+    through Allinpay, which may be the deposit of any bill; other payments are only matched to the
+    deposit of bills already on Allinpay, or when phase announces a deposit.
+    """
+    target = cents(amount)
+    if target <= 0:
+        return []
+    tolerance = cents(ReconciliationConfig.TOLERANCE)
+    phase_kind = PHASE_KINDS.get((phase or '').strip().lower())
+    deposits = allinpay or phase_kind == DEPOSIT
+    referenced = [bill_id for bill_id in dict.fromkeys(bill_ids) if bill_id in index.by_bill]
+    max_bills = ReconciliationConfig.MAX_BILLS
+
+    proposals = []
+    if referenced:
+        proposals = _search(index, referenced[:max_bills], target, tolerance, referenced, phase_kind, deposits)
+        if proposals and proposals[0]['confidence'] >= ReconciliationConfig.AUTO_APPLY_CONFIDENCE:
+            return proposals[:limit]
+
+    # Widen to the customers' other open bills, closest amounts first
+    pool = {(customer or '').strip().lower() for customer in customers} | \
+        {index.customer_of(bill_id) for bill_id in referenced}
+    others = {bill_id for customer in pool if customer for bill_id in index.by_customer.get(customer, ())}
+    for address in emails:
+        others.update(index.bills_for_email(address))
+    others = [bill_id for bill_id in others if bill_id in index.by_bill and bill_id not in referenced]
+    if others and len(referenced) < max_bills:
+        others.sort(key=lambda bill_id: (min(abs(r['amount'] - target) for r in index.by_bill[bill_id]), -bill_id))
+        candidates = referenced[:max_bills] + others[:max_bills - len(referenced)]
+        proposals = _search(index, candidates, target, tolerance, referenced, phase_kind, deposits)
+    return proposals[:limit]
+
+
+def accepted(proposals: List[Dict], kinds: Iterable[str] = (FULL, DEPOSIT, FINAL)) -> Optional[Dict]:
+    """The best proposal if it is confident enough to apply without review and allocates only kinds."""
+    if proposals and proposals[0]['confidence'] >= ReconciliationConfig.AUTO_APPLY_CONFIDENCE and \
+            all(item['kind'] in kinds for item in proposals[0]['allocations']):
+        return proposals[0]
+    return None
+
+
+def describe(proposal: Dict) -> str:
+    """Short form for logs and review notes: 'NYC123 full + NYC456 deposit_85 = 1234.00 (confidence 0.78)'."""
+    parts = ' + '.join(f"{item['bl_number']} {item['kind']}" for item in proposal['allocations'])
+    return f"{parts} = {proposal['total']:.2f} (confidence {proposal['confidence']})"
+
+
+ALLOCATION_UPDATES = {
+    FULL: """
+        status = 'Paid and CTN Valid', payment_reference = v.reference, completed_at = v.at,
+        payment_method = COALESCE(v.method, b.payment_method)
+    """,
+    DEPOSIT: """
+        status = 'Paid and CTN Valid', payment_reference = v.reference, payment_status = 'Paid 85%%',
+        reserve_status = 'Unsettled', allinpay_85_received_at = v.at,
+        reserve_amount = COALESCE(b.ctn_fee, 0) + COALESCE(b.service_fee, 0)
+                         - ROUND((COALESCE(b.ctn_fee, 0) + COALESCE(b.service_fee, 0)) * v.rate, 2),
+        payment_method = COALESCE(v.method, 'Allinpay')
+    """,
+    FINAL: """
+        payment_reference = v.reference, payment_status = 'Paid 100%%', reserve_status = 'Reserve Settled',
+        completed_at = v.at, payment_method = COALESCE(v.method, b.payment_method)
+    """,
+}
+
+
+RETURNED_COLUMNS = ('id', 'customer_email', 'customer_name', 'bl_number', 'unique_number', 'invoice_total')
+
+
+def apply_allocations(cur, allocations: Iterable[Tuple[int, str, str]], at, method: Optional[str] = None) -> List[Dict]:
+    """
+    Record accepted allocations: (bill_id, kind, payment reference) each, with one UPDATE per kind.
+    Returns the updated bills as dicts of RETURNED_COLUMNS plus kind.
+    """
+    from psycopg2.extras import execute_values
+
+    by_kind: Dict[str, List[Tuple]] = {}
+    for bill_id, kind, reference in allocations:
+        by_kind.setdefault(kind, []).append((bill_id, reference, at, method, ReconciliationConfig.DEPOSIT_RATE))
+    updated = []
+    for kind, rows in by_kind.items():
+        returned = execute_values(cur, f"""
+            UPDATE bill_of_lading b SET {ALLOCATION_UPDATES[kind]}
+            FROM (VALUES %s) AS v (id, reference, at, method, rate)
+            WHERE b.id = v.id
+            RETURNING b.id, b.customer_email, b.customer_name, b.bl_number, b.unique_number,
+                      COALESCE(b.ctn_fee, 0) + COALESCE(b.service_fee, 0)
+        """, rows, template='(%s, %s, %s::timestamptz, %s::text, %s::numeric)', fetch=True)
+        updated += [dict(zip(RETURNED_COLUMNS, row), kind=kind) for row in returned]
+    return updated
@@ -1,9 +1,9 @@
 import pytz
 from datetime import datetime, timedelta
 from cryptography.fernet import Fernet
-from config import get_db_conn  # Updated import
+from utils.audit_log import record_audit_event
 import os
-import bcrypt
+from utils.password_hashing import hash_password as _bcrypt_hash_password
 
 # Load encryption key from environment or generate for dev
 ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY')
@@ -84,20 +84,9 @@ def reset_failed_attempts(cur, user_id):
     cur.execute("UPDATE users SET failed_attempts=0, lockout_until=NULL WHERE id=%s", (user_id,))
 
 def log_sensitive_operation(user_id, operation, details):
-    try:
-        conn = get_db_conn()
-        cur = conn.cursor()
-        hk_now = datetime.now(pytz.timezone('Asia/Hong_Kong'))
-        cur.execute(
-            'INSERT INTO audit_logs (user_id, operation, details, timestamp) VALUES (%s, %s, %s, %s)',
-            (user_id, operation, details, hk_now)
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
-    except Exception as e:
-        # print(f"Error logging operation: {str(e)}")
-        pass
+    # Queued and written in batches by a background thread (utils/audit_log.py)
+    record_audit_event(user_id, operation, details)
 
 def hash_password(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    # bcrypt at PASSWORD_BCRYPT_ROUNDS; routes use utils/password_hashing.get_password_hasher() to run it off the request thread
+    return _bcrypt_hash_password(password)
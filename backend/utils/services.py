@@ -0,0 +1,131 @@
+"""
+Service Registry for IQSTrade
+Lazy, shared SDK clients (OpenAI, Google Vision, Cloudinary):
+- Nothing heavy is imported or constructed until a client is first used,
+  so importing the app stays fast.
+- Each client is a thread-safe singleton (one per process).
+- Fork-safe: clients created in the gunicorn master under --preload are dropped in each worker
+  (os.register_at_fork + a pid check), because gRPC/HTTP connection pools must not cross a fork.
+"""
+
+import os
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceRegistry:
+    """
+    Name -> factory; get(name) builds the instance once per process.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._overrides: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        """Register (or replace) the factory for a service. Does not build it."""
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        if name in self._overrides:
+            return self._overrides[name]
+        if self._pid != os.getpid():
+            # Forked without the at-fork hook (or it was skipped): never reuse the parent's clients
+            self.reset()
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            instance = self._instances.get(name)
+            if instance is None:
+                if name not in self._factories:
+                    raise KeyError(f"Unknown service: {name}")
+                logger.info(f"[Services] Creating {name} client (pid {os.getpid()})")
+                instance = self._factories[name]()
+                self._instances[name] = instance
+        return instance
+
+    def reset(self):
+        """Forget all instances (they are rebuilt on next use). Called in forked children."""
+        # A fresh lock: the parent's may have been held by another thread at fork time
+        self._lock = threading.Lock()
+        self._instances = {}
+        self._pid = os.getpid()
+
+    @contextmanager
+    def override(self, name: str, instance: Any):
+        """Temporarily serve `instance` for `name` (benchmark replay, tests)."""
+        previous = self._overrides.get(name)
+        self._overrides[name] = instance
+        try:
+            yield instance
+        finally:
+            if previous is None:
+                self._overrides.pop(name, None)
+            else:
+                self._overrides[name] = previous
+
+
+def _make_openai_client():
+    import openai
+    return openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+
+
+def _make_vision_client():
+    from google.cloud import vision
+    endpoint = os.getenv('VISION_API_ENDPOINT')
+    if endpoint:
+        # Emulator / load-test stub (loadtest/stubs.py): plain REST, no Google credentials
+        from google.auth.credentials import AnonymousCredentials
+        return vision.ImageAnnotatorClient(
+            transport='rest',
+            client_options={'api_endpoint': endpoint},
+            credentials=AnonymousCredentials(),
+        )
+    return vision.ImageAnnotatorClient()
+
+
+def _make_cloudinary_uploader():
+    import cloudinary
+    import cloudinary.uploader
+    cloudinary.config(
+        cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME', 'your_cloud_name'),
+        api_key=os.getenv('CLOUDINARY_API_KEY', 'your_api_key'),
+        api_secret=os.getenv('CLOUDINARY_API_SECRET', 'your_api_secret'),
+        secure=True
+    )
+    return cloudinary.uploader
+
+
+# Global registry
+services = ServiceRegistry()
+services.register('openai', _make_openai_client)
+services.register('vision', _make_vision_client)
+services.register('cloudinary', _make_cloudinary_uploader)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=services.reset)
+
+
+def get_openai_client():
+    """Shared openai.OpenAI client."""
+    return services.get('openai')
+
+
+def get_vision_client():
+    """Shared google.cloud.vision.ImageAnnotatorClient."""
+    return services.get('vision')
+
+
+def get_cloudinary_uploader():
+    """cloudinary.uploader, configured from the environment on first use."""
+    return services.get('cloudinary')
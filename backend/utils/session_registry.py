@@ -0,0 +1,257 @@
+"""
+Session Registry for IQSTrade
+Tracks which identities are active so MAX_CONCURRENT_USERS holds across all gunicorn workers:
+- An identity counts as active while it has made a request within SESSION_TTL seconds
+- Backends: 'postgres' (UNLOGGED table active_sessions, shared by all workers) or 'memory'
+  (per process, for local runs and tests)
+- Each process remembers when it last refreshed an identity and only writes again after
+  SESSION_TOUCH_INTERVAL, so a request from an already active user costs no query
+- New identities are admitted under an advisory lock, so two workers cannot both take the last slot
+- CachingJWTManager verifies each JWT once per request; the registry hook and @jwt_required share it
+"""
+
+import os
+import time
+import logging
+import threading
+from hmac import compare_digest
+from typing import Dict, Optional
+
+from flask import abort, g, has_app_context, request
+from flask_jwt_extended import JWTManager
+from flask_jwt_extended.exceptions import CSRFError, JWTDecodeError
+
+from config import SessionConfig, get_db_conn
+
+logger = logging.getLogger(__name__)
+
+# Endpoints (without the blueprint prefix) that never count towards the limit
+UNTRACKED_ENDPOINTS = {'login', 'register', 'static', 'serve_static', 'serve_react', 'ping', 'health_check',
+                       'logout', 'metrics'}
+
+# Any constant works; it only has to be the same in every worker
+_ADMIT_LOCK_KEY = 0x1A5E55
+
+
+class MemorySessionRegistry:
+    """Active identities of this process only."""
+
+    def __init__(self, ttl: float, max_sessions: int):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._last_seen: Dict[str, float] = {}
+
+    def _expire(self, now: float):
+        cutoff = now - self.ttl
+        for identity in [i for i, seen in self._last_seen.items() if seen < cutoff]:
+            del self._last_seen[identity]
+
+    def touch(self, identity: str) -> bool:
+        """Mark identity active; False if it is new and the registry is full."""
+        now = time.monotonic()
+        with self._lock:
+            if identity not in self._last_seen or self._last_seen[identity] < now - self.ttl:
+                self._expire(now)
+                if len(self._last_seen) >= self.max_sessions:
+                    return False
+            self._last_seen[identity] = now
+            return True
+
+    def remove(self, identity: str):
+        with self._lock:
+            self._last_seen.pop(identity, None)
+
+    def count(self) -> int:
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._last_seen)
+
+
+class PostgresSessionRegistry:
+    """Active identities in an UNLOGGED table shared by every worker (see migrations/20250801_create_active_sessions.sql)."""
+
+    def __init__(self, ttl: float, max_sessions: int, touch_interval: float):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        # identity -> monotonic time of this process's last successful write
+        self._touched: Dict[str, float] = {}
+
+    def touch(self, identity: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            touched = self._touched.get(identity)
+        if touched is not None and now - touched < self.touch_interval:
+            return True
+
+        conn = get_db_conn()
+        if conn is None:
+            logger.warning("Session registry: database unavailable, admitting request")
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE active_sessions SET last_seen = NOW() "
+                "WHERE identity = %s AND last_seen > NOW() - make_interval(secs => %s)",
+                (identity, self.ttl)
+            )
+            admitted = cur.rowcount == 1
+            if not admitted:
+                # New (or expired) identity: count and insert under one lock across all workers
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (_ADMIT_LOCK_KEY,))
+                cur.execute("DELETE FROM active_sessions WHERE last_seen <= NOW() - make_interval(secs => %s)",
+                            (self.ttl,))
+                cur.execute("SELECT COUNT(*) FROM active_sessions WHERE identity <> %s", (identity,))
+                if cur.fetchone()[0] < self.max_sessions:
+                    cur.execute(
+                        "INSERT INTO active_sessions (identity, last_seen) VALUES (%s, NOW()) "
+                        "ON CONFLICT (identity) DO UPDATE SET last_seen = NOW()",
+                        (identity,)
+                    )
+                    admitted = True
+            conn.commit()
+            cur.close()
+        except Exception as e:
+            conn.rollback()
+            logger.warning(f"Session registry: touch failed, admitting request: {e}")
+            return True
+        finally:
+            conn.close()
+
+        if admitted:
+            with self._lock:
+                self._touched[identity] = now
+                if len(self._touched) > self.max_sessions * 4:
+                    cutoff = now - self.ttl
+                    self._touched = {i: t for i, t in self._touched.items() if t >= cutoff}
+        return admitted
+
+    def remove(self, identity: str):
+        with self._lock:
+            self._touched.pop(identity, None)
+        conn = get_db_conn()
+        if conn is None:
+            return
+        try:
+            cur = conn.cursor()
+            cur.execute("DELETE FROM active_sessions WHERE identity = %s", (identity,))
+            conn.commit()
+            cur.close()
+        except Exception as e:
+            conn.rollback()
+            logger.warning(f"Session registry: remove failed for {identity}: {e}")
+        finally:
+            conn.close()
+
+    def count(self) -> int:
+        conn = get_db_conn()
+        if conn is None:
+            return 0
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT COUNT(*) FROM active_sessions WHERE last_seen > NOW() - make_interval(secs => %s)",
+                        (self.ttl,))
+            return cur.fetchone()[0]
+        finally:
+            conn.close()
+
+
+def _create_registry():
+    backend = SessionConfig.BACKEND
+    if backend == 'memory':
+        return MemorySessionRegistry(SessionConfig.TTL, SessionConfig.MAX_CONCURRENT_USERS)
+    if backend != 'postgres':
+        logger.warning(f"Unknown SESSION_BACKEND '{backend}', using postgres")
+    return PostgresSessionRegistry(SessionConfig.TTL, SessionConfig.MAX_CONCURRENT_USERS,
+                                   SessionConfig.TOUCH_INTERVAL)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_session_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = _create_registry()
+    return _registry
+
+
+class CachingJWTManager(JWTManager):
+    """
+    JWTManager that verifies a token's signature once per request. The decoded claims are kept on
+    flask.g; the CSRF double-submit check still runs on every call, exactly as the library does it.
+    """
+
+    def _decode_jwt_from_config(self, encoded_token: str, csrf_value=None, allow_expired: bool = False) -> dict:
+        if not has_app_context():
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        cache = g.setdefault('_decoded_jwts', {})
+        key = (encoded_token, allow_expired)
+        decoded = cache.get(key)
+        if decoded is None:
+            decoded = super()._decode_jwt_from_config(encoded_token, None, allow_expired)
+            cache[key] = decoded
+        if csrf_value:
+            if 'csrf' not in decoded:
+                raise JWTDecodeError("Missing claim: csrf")
+            if not compare_digest(decoded['csrf'], csrf_value):
+                raise CSRFError("CSRF double submit tokens do not match")
+        return decoded
+
+
+def _endpoint_name() -> Optional[str]:
+    if not request.endpoint:
+        return None
+    return request.endpoint.rsplit('.', 1)[-1]
+
+
+def _cookie_identity() -> Optional[str]:
+    from flask_jwt_extended import decode_token
+
+    token = request.cookies.get('access_token_cookie')
+    if not token:
+        return None
+    try:
+        return decode_token(token)['sub']
+    except Exception:
+        return None
+
+
+def init_session_registry(app):
+    """Enforce MAX_CONCURRENT_USERS on authenticated requests and free the slot on logout."""
+
+    @app.before_request
+    def limit_concurrent_users():
+        endpoint = _endpoint_name()
+        if endpoint is None or endpoint in UNTRACKED_ENDPOINTS:
+            return
+        identity = _cookie_identity()
+        if identity is None:
+            return
+        if not get_session_registry().touch(identity):
+            abort(429, description='Maximum concurrent users reached. Please try again later.')
+        g.current_identity = identity
+
+    @app.after_request
+    def cleanup_sessions(response):
+        if _endpoint_name() == 'logout':
+            identity = _cookie_identity()
+            if identity is not None:
+                get_session_registry().remove(identity)
+        return response
+
+
+def _reset_in_child():
+    # Workers build their own registry (and lock) on first use
+    global _registry, _registry_lock
+    _registry = None
+    _registry_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_child)
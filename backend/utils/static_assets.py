@@ -0,0 +1,328 @@
+"""
+Static Asset Manifest for IQSTrade
+Serves the React build/ directory from memory:
+- The directory is scanned once at startup (names and sizes only). Each file is read, hashed and
+  compressed on its first request and then served from memory (except very large binary files,
+  which are streamed from disk with precomputed headers), so startup stays cheap and only
+  assets that are actually requested take memory.
+- gzip and brotli variants are chosen from Accept-Encoding. Pre-generated .gz/.br files
+  next to an asset are used as-is; otherwise the variants are built on that first request.
+- Hashed files under static/ are cached for a year (immutable); index.html is revalidated
+  with its ETag on every load so new deploys are picked up.
+
+Pre-generate the compressed variants at build time (max compression, no startup cost):
+    python -m utils.static_assets precompress [build_dir]
+"""
+
+import os
+import re
+import sys
+import gzip
+import time
+import hashlib
+import logging
+import mimetypes
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from config import StaticConfig
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli  # optional: without it only gzip variants are built at runtime
+except ImportError:
+    brotli = None
+
+mimetypes.add_type('text/javascript', '.mjs')
+mimetypes.add_type('application/json', '.map')
+mimetypes.add_type('application/manifest+json', '.webmanifest')
+
+# Encodings in server preference order, and the suffix of their pre-generated files
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+INDEX_CACHE_CONTROL = 'no-cache'
+INDEX_PATH = 'index.html'
+
+# CRA output: static/js/main.68489514.js, static/js/239.7c3e3c37.chunk.js, static/media/logo.6ce24c58.svg
+_HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{8,}\.')
+_COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/manifest+json',
+                       'application/xml', 'image/svg+xml')
+_MIN_COMPRESS_BYTES = 1024
+
+
+def is_compressible(content_type: str) -> bool:
+    return content_type.startswith(_COMPRESSIBLE_TYPES)
+
+
+def content_type_for(path: str) -> str:
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+        content_type += '; charset=utf-8'
+    return content_type
+
+
+def make_etag(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=10).hexdigest()
+
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> Optional[bytes]:
+    if encoding == 'gzip':
+        # mtime=0 so every worker and every deploy produces the same bytes
+        return gzip.compress(data, compresslevel=StaticConfig.GZIP_LEVEL if level is None else level, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(data, quality=StaticConfig.BROTLI_QUALITY if level is None else level)
+    return None
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """'gzip, deflate, br;q=0.9' -> {'gzip': 1.0, 'deflate': 1.0, 'br': 0.9}"""
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def etag_matches(if_none_match: Optional[str], etags: List[str]) -> bool:
+    """True if the If-None-Match header names any of the asset's ETags (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = set()
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        candidates.add(tag.strip('"'))
+    return any(etag in candidates for etag in etags)
+
+
+class Asset:
+    """One file of the build; its ETag, body and encoded variants are computed by load() on first use."""
+
+    __slots__ = ('path', 'disk_path', 'content_type', 'size', 'etag', 'cache_control', 'body', 'variants',
+                 'inline', 'pregenerated', 'loaded', '_lock')
+
+    def __init__(self, path: str, disk_path: str, content_type: str, size: int, cache_control: str,
+                 inline: bool, pregenerated: Dict[str, str]):
+        self.path = path
+        self.disk_path = disk_path
+        self.content_type = content_type
+        self.size = size
+        self.etag = None
+        self.cache_control = cache_control
+        self.inline = inline
+        self.pregenerated = pregenerated  # encoding -> disk path of a .gz/.br file
+        self.body = None  # stays None for streamed assets (served from disk_path)
+        self.variants: Dict[str, bytes] = {}
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def load(self) -> 'Asset':
+        """Read, hash and compress the file once; later calls return immediately."""
+        if self.loaded:
+            return self
+        with self._lock:
+            if self.loaded:
+                return self
+            with open(self.disk_path, 'rb') as f:
+                data = f.read()
+            self.etag = make_etag(data)
+            if self.inline:
+                self.body = data
+                if is_compressible(self.content_type) and self.size >= _MIN_COMPRESS_BYTES:
+                    self._load_variants(data)
+            self.loaded = True
+        return self
+
+    def _load_variants(self, data: bytes):
+        for encoding, _ in ENCODINGS:
+            if encoding in self.pregenerated:
+                with open(self.pregenerated[encoding], 'rb') as f:
+                    variant = f.read()
+            else:
+                variant = compress(data, encoding)
+            # Not worth a Vary split if it barely shrinks
+            if variant is not None and len(variant) < self.size * 0.9:
+                self.variants[encoding] = variant
+
+    def all_etags(self) -> List[str]:
+        return [self.etag] + [f"{self.etag}-{encoding}" for encoding in self.variants]
+
+    def negotiate(self, accept_encoding: Optional[str]) -> Tuple[Optional[str], Optional[bytes], str]:
+        """(content-encoding or None, body, etag) for the best variant the client accepts."""
+        if self.variants:
+            accepted = parse_accept_encoding(accept_encoding)
+            for encoding, _ in ENCODINGS:
+                if encoding in self.variants and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                    return encoding, self.variants[encoding], f"{self.etag}-{encoding}"
+        return None, self.body, self.etag
+
+
+class StaticAssetManifest:
+    """
+    Path -> Asset for every file under build_dir, loaded once.
+    """
+
+    def __init__(self, build_dir: str):
+        self.build_dir = os.path.abspath(build_dir)
+        self.assets: Dict[str, Asset] = {}
+        self.loaded = False
+
+    def cache_control_for(self, path: str) -> str:
+        if path == INDEX_PATH:
+            return INDEX_CACHE_CONTROL
+        if path.startswith('static/') and _HASHED_NAME_RE.search(os.path.basename(path)):
+            return IMMUTABLE_CACHE_CONTROL
+        return f'public, max-age={StaticConfig.DEFAULT_MAX_AGE}'
+
+    def load(self) -> 'StaticAssetManifest':
+        start = time.perf_counter()
+        assets = {}
+        if not os.path.isdir(self.build_dir):
+            logger.warning(f"[StaticAssets] Build directory not found: {self.build_dir}")
+            self.assets, self.loaded = assets, True
+            return self
+
+        disk_files = set()
+        for root, _, files in os.walk(self.build_dir):
+            for name in files:
+                disk_files.add(os.path.relpath(os.path.join(root, name), self.build_dir).replace(os.sep, '/'))
+
+        for path in sorted(disk_files):
+            # Pre-generated variants are attached to their asset, not served on their own
+            if any(path.endswith(suffix) and path[:-len(suffix)] in disk_files for _, suffix in ENCODINGS):
+                continue
+            assets[path] = self._index_asset(path, disk_files)
+
+        self.assets, self.loaded = assets, True
+        logger.info(f"[StaticAssets] Indexed {len(assets)} files from {self.build_dir} "
+                    f"(brotli={'yes' if brotli else 'no'}) in {time.perf_counter() - start:.2f}s")
+        return self
+
+    def _index_asset(self, path: str, disk_files: set) -> Asset:
+        disk_path = os.path.join(self.build_dir, path)
+        content_type = content_type_for(path)
+        size = os.path.getsize(disk_path)
+        limit = StaticConfig.INLINE_MAX_BYTES if is_compressible(content_type) else StaticConfig.INLINE_BINARY_MAX_BYTES
+        pregenerated = {encoding: disk_path + suffix for encoding, suffix in ENCODINGS if path + suffix in disk_files}
+        return Asset(path, disk_path, content_type, size, self.cache_control_for(path), size <= limit, pregenerated)
+
+    def get(self, path: str) -> Optional[Asset]:
+        asset = self.assets.get(path.lstrip('/'))
+        return asset.load() if asset else None
+
+    def resolve(self, path: str) -> Optional[Asset]:
+        """
+        The asset for a request path. Relative asset URLs requested from a nested SPA route
+        (e.g. /reset-password/static/js/main.js) resolve to the top-level static/ file.
+        """
+        path = path.lstrip('/')
+        asset = self.assets.get(path)
+        if asset is None:
+            idx = path.find('/static/')
+            if idx != -1:
+                asset = self.assets.get(path[idx + 1:])
+        return asset.load() if asset else None
+
+    @property
+    def index(self) -> Optional[Asset]:
+        return self.get(INDEX_PATH)
+
+    def stats(self) -> Dict:
+        inline = [a for a in self.assets.values() if a.body is not None]
+        return {
+            'build_dir': self.build_dir,
+            'files': len(self.assets),
+            'loaded_files': sum(1 for a in self.assets.values() if a.loaded),
+            'inline_files': len(inline),
+            'inline_bytes': sum(a.size + sum(len(v) for v in a.variants.values()) for a in inline),
+            'br_variants': sum(1 for a in self.assets.values() if 'br' in a.variants),
+            'gzip_variants': sum(1 for a in self.assets.values() if 'gzip' in a.variants),
+            'immutable': sum(1 for a in self.assets.values() if a.cache_control == IMMUTABLE_CACHE_CONTROL),
+        }
+
+
+def serve_asset(asset: Asset):
+    """Flask response for an asset: 304 on a matching ETag, else the negotiated variant."""
+    from flask import request, Response, send_file
+
+    encoding, body, etag = asset.load().negotiate(request.headers.get('Accept-Encoding'))
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': asset.cache_control,
+    }
+    if asset.variants:
+        headers['Vary'] = 'Accept-Encoding'
+
+    if etag_matches(request.headers.get('If-None-Match'), asset.all_etags()):
+        return Response(status=304, headers=headers)
+
+    if body is None:
+        response = send_file(asset.disk_path, mimetype=asset.content_type.split(';')[0],
+                             conditional=False, etag=False, max_age=None)
+        response.headers.update(headers)
+        response.headers['Content-Type'] = asset.content_type
+        return response
+
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    response = Response(body, status=200, headers=headers, content_type=asset.content_type)
+    response.content_length = len(body)
+    return response
+
+
+_manifest: Optional[StaticAssetManifest] = None
+
+
+def get_static_manifest() -> StaticAssetManifest:
+    """The process-wide manifest; indexed on first call (at app import), files loaded as requested."""
+    global _manifest
+    if _manifest is None:
+        _manifest = StaticAssetManifest(StaticConfig.BUILD_DIR).load()
+    return _manifest
+
+
+def precompress(build_dir: str) -> int:
+    """Write max-compression .gz/.br files next to every compressible asset. Returns files written."""
+    written = 0
+    for root, _, files in os.walk(build_dir):
+        for name in files:
+            if name.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+                continue
+            path = os.path.join(root, name)
+            if not is_compressible(content_type_for(path)) or os.path.getsize(path) < _MIN_COMPRESS_BYTES:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            for encoding, suffix in ENCODINGS:
+                variant = compress(data, encoding, level=9 if encoding == 'gzip' else 11)
+                if variant is None:
+                    continue
+                with open(path + suffix, 'wb') as f:
+                    f.write(variant)
+                written += 1
+    if brotli is None:
+        print("[StaticAssets] brotli is not installed: only .gz files were written")
+    return written
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'precompress':
+        print("Usage: python -m utils.static_assets precompress [build_dir]")
+        sys.exit(2)
+    target = sys.argv[2] if len(sys.argv) > 2 else StaticConfig.BUILD_DIR
+    print(f"[StaticAssets] Wrote {precompress(target)} compressed files under {target}")
@@ -0,0 +1,119 @@
+"""
+Stage Timing for IQSTrade extraction
+Lightweight per-stage timers and counters (latency, tokens, bytes) for the extraction pipeline.
+Nothing is recorded unless a caller opens a collector or registers an observer, so production
+code pays ~nothing otherwise:
+
+    with collect() as timings:
+        extract_fields(path)
+    timings.summary()   # {'stages': {'pymupdf_parse': [...], ...}, 'counts': {...}}
+
+The web app opens one collector per request and registers an observer that feeds the
+process-wide stage histograms (see utils/metrics.py).
+"""
+
+import time
+import threading
+import contextvars
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+_current = contextvars.ContextVar('iqs_timing_collector', default=None)
+# Called as observer(stage_name, seconds, failed) for every stage, with or without a collector
+_observers: List[Callable[[str, float, bool], None]] = []
+
+
+class StageCollector:
+    """Stage durations (seconds) and counters for one unit of work. Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, List[float]] = defaultdict(list)
+        self.counts = Counter()
+
+    def add_stage(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name].append(seconds)
+
+    def add_count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counts[name] += value
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {
+                'stages': {name: list(values) for name, values in self.stages.items()},
+                'counts': dict(self.counts),
+            }
+
+
+def current_collector() -> Optional[StageCollector]:
+    return _current.get()
+
+
+def open_collector():
+    """Start collecting for the current context; returns (collector, token) for close_collector."""
+    collector = StageCollector()
+    return collector, _current.set(collector)
+
+
+def close_collector(token):
+    _current.reset(token)
+
+
+@contextmanager
+def collect():
+    """Open a collector for the enclosed block (nested blocks get their own)."""
+    collector, token = open_collector()
+    try:
+        yield collector
+    finally:
+        close_collector(token)
+
+
+def add_stage_observer(observer: Callable[[str, float, bool], None]):
+    if observer not in _observers:
+        _observers.append(observer)
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as stage `name` (no-op when no collector or observer is active)."""
+    collector = _current.get()
+    if collector is None and not _observers:
+        yield
+        return
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        if collector is not None:
+            collector.add_stage(name, seconds)
+        for observer in _observers:
+            try:
+                observer(name, seconds, failed)
+            except Exception:
+                pass
+
+
+def add_count(name: str, value: float = 1):
+    """Add to counter `name` (tokens, bytes, calls) on the open collector, if any."""
+    collector = _current.get()
+    if collector is not None:
+        collector.add_count(name, value)
+
+
+def in_current_context(func, *args, **kwargs):
+    """
+    Return a zero-argument callable running func(*args, **kwargs) in a copy of the caller's
+    context, so work submitted to a thread pool still records into the caller's collector.
+    Create one per submitted task (a context can only be entered by one thread at a time).
+    """
+    ctx = contextvars.copy_context()
+    return lambda: ctx.run(func, *args, **kwargs)
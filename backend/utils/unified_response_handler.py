@@ -37,7 +37,7 @@ class UnifiedResponseHandler:
         try:
             conn = self.db_connector()
             cur = conn.cursor()
-            cur.execute('SELECT customer_invoice FROM bill_of_lading WHERE bl_number = %s', (bl_number,))
+            cur.execute('SELECT customer_invoice FROM bill_of_lading_all WHERE bl_number = %s', (bl_number,))
             row = cur.fetchone()
             cur.close()
             conn.close()
@@ -54,7 +54,7 @@ class UnifiedResponseHandler:
         try:
             conn = self.db_connector()
             cur = conn.cursor()
-            cur.execute('SELECT unique_number FROM bill_of_lading WHERE bl_number = %s', (bl_number,))
+            cur.execute('SELECT unique_number FROM bill_of_lading_all WHERE bl_number = %s', (bl_number,))
             row = cur.fetchone()
             cur.close()
             conn.close()
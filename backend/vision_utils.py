@@ -0,0 +1,107 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from config import OCRConfig
+from utils.services import get_vision_client
+from utils.timing import stage, add_count, in_current_context
+
+logger = logging.getLogger(__name__)
+
+def prepare_image(content: bytes, max_dimension: int = None) -> bytes:
+    """
+    Downscale an image whose longest side exceeds max_dimension.
+    Returns the original bytes when no resize is needed (or the image can't be read).
+    """
+    from PIL import Image
+    max_dimension = max_dimension or OCRConfig.VISION_MAX_DIMENSION
+    try:
+        with Image.open(io.BytesIO(content)) as img:
+            if max(img.size) <= max_dimension:
+                return content
+            original_size = img.size
+            fmt = 'JPEG' if img.format == 'JPEG' else 'PNG'
+            img = img.convert('RGB') if fmt == 'JPEG' or img.mode not in ('RGB', 'L', 'RGBA', 'LA') else img
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            out = io.BytesIO()
+            if fmt == 'JPEG':
+                img.save(out, format='JPEG', quality=90)
+            else:
+                img.save(out, format='PNG', optimize=True)
+            resized = out.getvalue()
+        logger.debug(f"downscaled {original_size} -> {img.size}, {len(content)} -> {len(resized)} bytes")
+        return resized
+    except Exception as e:
+        logger.warning(f"[Vision] Could not inspect image for downscaling: {e}")
+        return content
+
+
+def _chunk(images: List[bytes]) -> List[List[int]]:
+    """Group image indexes into batches bounded by count and total bytes."""
+    chunks, current, current_bytes = [], [], 0
+    for idx, content in enumerate(images):
+        if current and (len(current) >= OCRConfig.VISION_BATCH_SIZE
+                        or current_bytes + len(content) > OCRConfig.VISION_BATCH_MAX_BYTES):
+            chunks.append(current)
+            current, current_bytes = [], 0
+        current.append(idx)
+        current_bytes += len(content)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _annotate_chunk(images: List[bytes], feature_type) -> List[str]:
+    from google.cloud import vision
+    feature = vision.Feature(type_=feature_type)
+    requests = [
+        vision.AnnotateImageRequest(image=vision.Image(content=content), features=[feature])
+        for content in images
+    ]
+    add_count('vision_images', len(images))
+    add_count('vision_bytes', sum(len(content) for content in images))
+    with stage('vision_call'):
+        response = get_vision_client().batch_annotate_images(requests=requests)
+    texts = []
+    for image_response in response.responses:
+        if image_response.error.message:
+            logger.error(f"[Vision] Image error: {image_response.error.message}")
+        if image_response.full_text_annotation and image_response.full_text_annotation.text:
+            texts.append(image_response.full_text_annotation.text)
+        elif image_response.text_annotations:
+            texts.append(image_response.text_annotations[0].description)
+        else:
+            texts.append("")
+    return texts
+
+
+def ocr_images(images: List[bytes], feature_type=None, max_workers: int = None) -> List[str]:
+    """
+    OCR a list of in-memory images with batch_annotate_images.
+    Images are downscaled if oversized, grouped into batches, and the batches run concurrently.
+    Returns one text per image, in input order.
+    """
+    if not images:
+        return []
+    if feature_type is None:
+        from google.cloud import vision
+        feature_type = vision.Feature.Type.TEXT_DETECTION
+    images = [prepare_image(content) for content in images]
+    chunks = _chunk(images)
+    logger.debug(f"OCR {len(images)} image(s) in {len(chunks)} batch(es)")
+    texts = [""] * len(images)
+    workers = min(len(chunks), max_workers or OCRConfig.VISION_MAX_WORKERS)
+    if workers <= 1:
+        results = [_annotate_chunk([images[i] for i in chunk], feature_type) for chunk in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(in_current_context(_annotate_chunk, [images[i] for i in chunk], feature_type))
+                for chunk in chunks
+            ]
+            results = [future.result() for future in futures]
+    for chunk, chunk_texts in zip(chunks, results):
+        for idx, text in zip(chunk, chunk_texts):
+            texts[idx] = text
+    return texts